@@ -1,12 +1,17 @@
 import os
 import re
-import json
 import math
 import base64
 import traceback
 import time
 import asyncio
-from typing import List, Any, Dict, Tuple, Optional
+import shutil
+import tempfile
+import threading
+import heapq
+import uuid
+from collections import OrderedDict
+from typing import List, Any, Dict, Tuple, Optional, Callable, Awaitable, Iterable, Union
 from PIL import Image, ImageEnhance, ImageOps, ImageFilter
 import io
 import numpy as np
@@ -20,16 +25,16 @@ except ImportError:
     cv2 = None  # Placeholder
 
 import fitz  # PyMuPDF
-import httpx, certifi
 from dotenv import load_dotenv
 
 # Import fallback PDF libraries
 try:
-    from pdf2image import convert_from_bytes
+    from pdf2image import convert_from_bytes, pdfinfo_from_bytes
     PDF2IMAGE_AVAILABLE = True
 except ImportError:
     PDF2IMAGE_AVAILABLE = False
     convert_from_bytes = None
+    pdfinfo_from_bytes = None
 
 try:
     from pypdf import PdfReader
@@ -43,8 +48,26 @@ from fastapi import HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import JSONResponse, StreamingResponse
-from openai import OpenAI
 from system_matcher import match_system_fullname, ensure_embeddings_exist
+# Cliente OpenAI assíncrono único do processo (pool HTTP compartilhado com o system_matcher)
+from llm_client import (
+    get_client, run_llm, run_llm_sync, is_ssl_error, disable_ssl_verification,
+    pool_info, shutdown_client
+)
+# Fila global de requisições ao LLM (limites por modelo, concorrência, fila justa entre jobs)
+from llm_scheduler import scheduler, current_job_id, estimate_request_tokens, is_transient_error
+from llm_health import model_breakers
+from llm_hedge import hedge_policy, hedge_race
+from llm_cache import llm_cache, cache_key
+from llm_usage import usage_ledger, current_page
+from json_stream import JsonArrayStreamParser
+from json_extract import json_list, has_complete_json, scan_json_values
+from spatial_index import UniformGrid
+from electrical_merge import box_array, nms_indices, centroid_clusters, same_tag_groups, dedup_paths
+from connection_graph import ConnectionGraph
+from prompt_compiler import CompiledPrompt, prompt_registry
+import keyword_classifier as kwc
+from openai.types.chat import ChatCompletion
 
 # Load environment variables from .env file
 load_dotenv()
@@ -85,24 +108,16 @@ def _path_sim(a:List[Tuple[float,float]], b:List[Tuple[float,float]])->float:
         s += max(0.0, 1.0 - min(_pt_dist(a[i], b[i])/20.0, 1.0))
     return s/n
 
+def _boxes(eqs: List[Equip]) -> np.ndarray:
+    return box_array([(e.bbox.x, e.bbox.y, e.bbox.w, e.bbox.h) for e in eqs])
+
 def _nms(eqs: List[Equip], iou_thr: float=0.55)->List[Equip]:
     eqs=sorted(eqs, key=lambda e:e.confidence, reverse=True)
-    kept=[]
-    for e in eqs:
-        if all(e.bbox.iou(k.bbox)<=iou_thr for k in kept): kept.append(e)
-    return kept
+    return [eqs[i] for i in nms_indices(_boxes(eqs), iou_thr)]
 
 def _cluster_centroid(eqs: List[Equip], eps: float=10.0)->List[List[Equip]]:
-    groups=[]
-    for e in eqs:
-        cx=e.bbox.x+e.bbox.w/2; cy=e.bbox.y+e.bbox.h/2
-        placed=False
-        for g in groups:
-            gx=sum(x.bbox.x+x.bbox.w/2 for x in g)/len(g)
-            gy=sum(x.bbox.y+x.bbox.h/2 for x in g)/len(g)
-            if (cx-gx)**2+(cy-gy)**2 <= eps**2: g.append(e); placed=True; break
-        if not placed: groups.append([e])
-    return groups
+    centers=[(e.bbox.x+e.bbox.w/2, e.bbox.y+e.bbox.h/2) for e in eqs]
+    return [[eqs[i] for i in g] for g in centroid_clusters(centers, eps)]
 # === END ADD ===
 
 # =================================================
@@ -121,20 +136,8 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 PRIMARY_MODEL = os.getenv("PRIMARY_MODEL", "gpt-5")
 FALLBACK_MODEL = os.getenv("FALLBACK_MODEL", "gpt-4o")
 OPENAI_REQUEST_TIMEOUT = int(os.getenv("OPENAI_REQUEST_TIMEOUT", "600"))
-
-
-def make_client(verify_ssl: bool = True) -> OpenAI:
-    http_client = httpx.Client(
-        verify=certifi.where() if verify_ssl else False,
-        timeout=OPENAI_REQUEST_TIMEOUT,
-    )
-    # Only create client if API key is set
-    if not OPENAI_API_KEY:
-        return None
-    return OpenAI(api_key=OPENAI_API_KEY, http_client=http_client)
-
-
-client = make_client(verify_ssl=True)
+# Quadrantes em streaming: conversão/matcher de cada item enquanto o modelo ainda gera
+LLM_STREAMING = os.getenv("LLM_STREAMING", "false").lower() in ("1", "true", "yes")
 
 # ============================================================
 # FASTAPI CONFIG
@@ -199,21 +202,28 @@ async def startup_event():
     ensure_embeddings_exist()
     
     try:
-        models = client.models.list()
+        models = await run_llm(get_client().models.list())
         ids = [m.id for m in models.data]
         log_to_front("✅ Conexão OpenAI OK. Modelos detectados: " + ", ".join(ids[:8]))
     except Exception as e:
         log_to_front(f"❌ Erro SSL verificado: {e!r}")
         try:
-            new_client = make_client(verify_ssl=False)
-            models = new_client.models.list()
+            # Troca o cliente compartilhado (uma única vez) para conexão sem verificação SSL
+            disable_ssl_verification()
+            models = await run_llm(get_client().models.list())
             ids = [m.id for m in models.data]
             log_to_front("⚠️ Conexão sem SSL. Modelos: " + ", ".join(ids[:8]))
-            globals()["client"] = new_client
         except Exception as e2:
             log_to_front(f"❌ Falha também sem SSL: {e2!r}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    shutdown_client()
+    llm_cache.close()
+    usage_ledger.close()
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
@@ -226,9 +236,21 @@ def ping():
         "primary_model": PRIMARY_MODEL,
         "fallback_model": FALLBACK_MODEL,
         "timeout_s": OPENAI_REQUEST_TIMEOUT,
+        "http_pool": pool_info(),
+        "scheduler": run_llm_sync(_scheduler_snapshot()),
+        "llm_cache": llm_cache.stats(),
+        "model_health": model_breakers.snapshot(),
+        "hedging": hedge_policy.stats(),
+        "prompts": prompt_registry.stats(),
+        "usage": usage_ledger.stats(),
     }
 
 
+async def _scheduler_snapshot():
+    # Lido no loop de I/O, onde o scheduler é atualizado
+    return scheduler.stats()
+
+
 # ============================================================
 # PDF WRAPPER - Suporte a múltiplas bibliotecas com fallback
 # ============================================================
@@ -237,31 +259,84 @@ class PDFPage:
     """
     Wrapper unificado para páginas PDF que funciona com PyMuPDF ou pdf2image.
     Fornece interface consistente independente da biblioteca usada.
+
+    A renderização é sob demanda: nada é rasterizado na abertura do documento.
+    - PyMuPDF: mantém um fitz.DisplayList em cache e renderiza apenas o recorte
+      (clip) pedido, no DPI pedido, direto da fonte vetorial.
+    - pdf2image: a página é rasterizada pelo Poppler só quando um pixmap é pedido
+      (ver PDFDocument._render_fallback_page).
     """
-    def __init__(self, page_image: Image.Image, page_num: int, width_mm: float, height_mm: float, source: str = "fallback"):
-        self.page_num = page_num
+    def __init__(self, doc: "PDFDocument", index: int, width_mm: float, height_mm: float,
+                 source: str = "fallback", fitz_page: Optional["fitz.Page"] = None):
+        self.page_num = index + 1
         self.width_mm = width_mm
         self.height_mm = height_mm
         self.source = source
-        self._image = page_image
-        
-        # Cria um rect compatível com PyMuPDF
-        self.rect = type('Rect', (), {
-            'width': width_mm / PT_TO_MM,  # Converte de volta para pontos
-            'height': height_mm / PT_TO_MM
-        })()
-    
-    def get_pixmap(self, dpi: int = 300) -> 'FallbackPixmap':
-        """Retorna pixmap da página renderizada"""
-        # Se já temos a imagem, redimensiona se necessário
-        target_width = int(self.width_mm / 25.4 * dpi)
-        target_height = int(self.height_mm / 25.4 * dpi)
-        
-        img_resized = self._image.resize((target_width, target_height), Image.Resampling.LANCZOS)
-        return FallbackPixmap(img_resized)
-    
+        self._doc = doc
+        self._index = index
+        self._fitz_page = fitz_page
+        self._displaylist = None
+
+        if fitz_page is not None:
+            self.rect = fitz_page.rect
+            self.rotation = fitz_page.rotation
+        else:
+            # Retângulo em pontos, compatível com PyMuPDF
+            self.rect = fitz.Rect(0, 0, width_mm / PT_TO_MM, height_mm / PT_TO_MM)
+            self.rotation = 0
+
+    def _get_displaylist(self) -> "fitz.DisplayList":
+        """DisplayList da página (criado uma única vez e reutilizado em todas as renderizações)"""
+        if self._displaylist is None:
+            self._displaylist = self._fitz_page.get_displaylist()
+        return self._displaylist
+
+    def get_pixmap(self, dpi: int = 300, clip=None, colorspace=None):
+        """
+        Retorna pixmap da página (ou apenas do recorte `clip`, em pontos) no DPI pedido.
+
+        Para PyMuPDF retorna um fitz.Pixmap renderizado do DisplayList em cache;
+        para pdf2image retorna um FallbackPixmap.
+        """
+        if self._fitz_page is not None:
+            zoom = dpi / 72
+            pix = self._get_displaylist().get_pixmap(
+                matrix=fitz.Matrix(zoom, zoom),
+                colorspace=colorspace or fitz.csRGB,
+                alpha=False,
+                clip=fitz.Rect(clip) if clip is not None else None,
+            )
+            pix.set_dpi(dpi, dpi)
+            return pix
+
+        img = self._doc._render_fallback_page(self._index, dpi)
+        if clip is not None:
+            # Recorte proporcional (as dimensões em mm do fallback são estimadas)
+            clip = fitz.Rect(clip)
+            img_width, img_height = img.size
+            box = (
+                int(clip.x0 / self.rect.width * img_width),
+                int(clip.y0 / self.rect.height * img_height),
+                int(clip.x1 / self.rect.width * img_width),
+                int(clip.y1 / self.rect.height * img_height),
+            )
+            img = img.crop(box)
+        return FallbackPixmap(img)
+
+    def get_raster(self, dpi: int, clip=None, colorspace: str = "gray") -> np.ndarray:
+        """
+        Retorna a página (ou o recorte `clip`, em pontos) como array numpy,
+        servido pelo cache de raster do documento (view sem cópia, somente leitura).
+        """
+        return self._doc.raster_cache.crop(self._index, dpi, clip, colorspace)
+
     def get_text(self) -> str:
-        """Retorna string vazia - PDFPage não suporta extração de texto"""
+        """Retorna o texto nativo da página (vazio no fallback pdf2image)"""
+        if self._fitz_page is not None:
+            try:
+                return self._fitz_page.get_text()
+            except Exception:
+                return ""
         return ""
 
 
@@ -269,7 +344,8 @@ class FallbackPixmap:
     """Wrapper para pixmap que funciona como fitz.Pixmap"""
     def __init__(self, image: Image.Image):
         self._image = image
-    
+        self.width, self.height = image.size
+
     def tobytes(self, output_format: str = "png") -> bytes:
         """Converte para bytes no formato especificado"""
         buffer = io.BytesIO()
@@ -281,31 +357,309 @@ class PDFDocument:
     """
     Wrapper unificado para documentos PDF.
     Tenta usar PyMuPDF primeiro, fallback para pdf2image se falhar.
+
+    O documento permanece aberto enquanto for usado; chame close() ao final
+    (ou use como context manager) para liberar o fitz.Document.
     """
-    def __init__(self, pages: List[PDFPage], source: str = "fallback"):
-        self._pages = pages
+    def __init__(self, source: str = "fallback", fitz_doc: Optional["fitz.Document"] = None,
+                 data: Optional[bytes] = None):
+        self._pages: List[PDFPage] = []
         self.source = source
-    
+        self._fitz_doc = fitz_doc
+        self._data = data
+        # Fallback pdf2image: apenas a última página rasterizada fica em memória
+        self._fallback_render: Optional[Tuple[int, int, Image.Image]] = None
+        self._raster_cache: Optional["PageRasterCache"] = None
+
+    @property
+    def raster_cache(self) -> "PageRasterCache":
+        """Cache de raster compartilhado por todas as etapas deste documento"""
+        if self._raster_cache is None:
+            self._raster_cache = PageRasterCache(self)
+        return self._raster_cache
+
+    def _render_fallback_page(self, index: int, dpi: int) -> Image.Image:
+        """Rasteriza uma única página com Poppler, no tamanho equivalente ao DPI pedido"""
+        cached = self._fallback_render
+        if cached is not None and cached[0] == index and cached[1] == dpi:
+            return cached[2]
+
+        page = self._pages[index]
+        target_size = page_pixel_size(page, dpi)
+        images = convert_from_bytes(
+            self._data,
+            first_page=index + 1,
+            last_page=index + 1,
+            fmt='png',
+            size=target_size,
+        )
+        if not images:
+            raise Exception(f"Poppler não renderizou a página {index + 1}")
+        img = images[0].convert("RGB")
+        self._fallback_render = (index, dpi, img)
+        return img
+
+    def close(self):
+        if self._raster_cache is not None:
+            self._raster_cache.close()
+            self._raster_cache = None
+        self._fallback_render = None
+        for page in self._pages:
+            page._displaylist = None
+        if self._fitz_doc is not None:
+            self._fitz_doc.close()
+            self._fitz_doc = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
     def __len__(self):
         return len(self._pages)
-    
+
     def __getitem__(self, index):
         return self._pages[index]
-    
+
     def __iter__(self):
         return iter(self._pages)
 
 
+# ============================================================
+# CACHE DE RASTER POR PÁGINA (pirâmide de resoluções)
+# ============================================================
+# Orçamento total (em MB) dos níveis mantidos por documento
+RASTER_CACHE_MAX_BYTES = int(float(os.getenv("RASTER_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+# Diretório dos arquivos memory-mapped (padrão: diretório temporário do sistema)
+RASTER_CACHE_DIR = os.getenv("RASTER_CACHE_DIR") or None
+# Altura das faixas renderizadas por vez ao preencher um nível
+RASTER_BAND_PX = 1024
+
+_RASTER_COLORSPACES = {"gray": 1, "rgb": 3}
+
+
+def pixmap_to_array(pix) -> np.ndarray:
+    """
+    View numpy (H, W) ou (H, W, n) sobre fitz.Pixmap.samples, sem cópia.
+    O array só é válido enquanto o pixmap existir.
+    """
+    rows = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)
+    arr = rows[:, :pix.width * pix.n].reshape(pix.height, pix.width, pix.n)
+    return arr[:, :, 0] if pix.n == 1 else arr
+
+
+def clip_to_pixels(clip, dpi: int, shape: Optional[Tuple[int, ...]] = None) -> Tuple[int, int, int, int]:
+    """Converte um retângulo em pontos para a caixa de pixels (x0, y0, x1, y1) no DPI dado"""
+    zoom = dpi / 72
+    x0 = int(math.floor(clip.x0 * zoom))
+    y0 = int(math.floor(clip.y0 * zoom))
+    x1 = int(math.ceil(clip.x1 * zoom))
+    y1 = int(math.ceil(clip.y1 * zoom))
+    if shape is not None:
+        H, W = shape[0], shape[1]
+        x0, x1 = max(0, min(W, x0)), max(0, min(W, x1))
+        y0, y1 = max(0, min(H, y0)), max(0, min(H, y1))
+    return x0, y0, x1, y1
+
+
+def page_raster(page, dpi: int, clip=None, colorspace: str = "gray") -> np.ndarray:
+    """
+    Raster de uma página (ou recorte) como array numpy.
+    PDFPage usa o cache compartilhado do documento; fitz.Page renderiza diretamente.
+    """
+    if isinstance(page, PDFPage):
+        return page.get_raster(dpi, clip=clip, colorspace=colorspace)
+
+    cs = fitz.csGRAY if colorspace == "gray" else fitz.csRGB
+    if clip is not None:
+        # Alinha o recorte à mesma grade de pixels usada pelo cache
+        x0, y0, x1, y1 = clip_to_pixels(fitz.Rect(clip), dpi)
+        zoom = dpi / 72
+        clip = fitz.Rect(x0 / zoom, y0 / zoom, x1 / zoom, y1 / zoom)
+    pix = page.get_pixmap(dpi=dpi, clip=clip, colorspace=cs)
+    return pixmap_to_array(pix).copy()
+
+
+def array_to_png(arr: np.ndarray) -> bytes:
+    """Codifica um array uint8 (cinza ou RGB) como PNG"""
+    buffer = io.BytesIO()
+    Image.fromarray(np.ascontiguousarray(arr)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class PageRasterCache:
+    """
+    Cache de rasters de um documento, indexado por (página, dpi, colorspace).
+
+    Cada nível da pirâmide é rasterizado uma única vez por job para um np.memmap
+    em disco (renderizado em faixas, sem manter o bitmap inteiro em RAM) e
+    reaberto somente leitura. Quadrantes, tiles, OCR e refinamento recebem
+    recortes como views desse memmap, sem cópia. Os níveis respeitam um
+    orçamento em bytes com despejo LRU.
+    """
+    def __init__(self, doc: "PDFDocument", max_bytes: int = RASTER_CACHE_MAX_BYTES,
+                 cache_dir: Optional[str] = RASTER_CACHE_DIR):
+        self._doc = doc
+        self.max_bytes = max_bytes
+        self._cache_dir = cache_dir
+        self._dir: Optional[str] = None
+        self._levels: "OrderedDict[Tuple[int, int, str], Tuple[np.memmap, str]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, page_index: int, dpi: int, colorspace: str = "gray") -> np.ndarray:
+        """Retorna o nível completo (página inteira) como memmap somente leitura"""
+        if colorspace not in _RASTER_COLORSPACES:
+            raise ValueError(f"Colorspace não suportado: {colorspace}")
+        key = (page_index, int(dpi), colorspace)
+        with self._lock:
+            level = self._levels.get(key)
+            if level is not None:
+                self._levels.move_to_end(key)
+                self.hits += 1
+                return level[0]
+
+            self.misses += 1
+            arr, path = self._render_level(*key)
+            self._evict_for(arr.nbytes)
+            self._levels[key] = (arr, path)
+            self.bytes_used += arr.nbytes
+            return arr
+
+    def crop(self, page_index: int, dpi: int, clip=None, colorspace: str = "gray") -> np.ndarray:
+        """Recorte (em pontos) do nível, como view sem cópia"""
+        level = self.get(page_index, dpi, colorspace)
+        if clip is None:
+            return level
+        x0, y0, x1, y1 = clip_to_pixels(fitz.Rect(clip), dpi, level.shape)
+        return level[y0:y1, x0:x1]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "levels": len(self._levels),
+            "bytes_used": self.bytes_used,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            for _, path in self._levels.values():
+                self._discard(path)
+            self._levels.clear()
+            self.bytes_used = 0
+            if self._dir is not None:
+                shutil.rmtree(self._dir, ignore_errors=True)
+                self._dir = None
+
+    def _evict_for(self, nbytes: int):
+        while self._levels and self.bytes_used + nbytes > self.max_bytes:
+            _, (arr, path) = self._levels.popitem(last=False)
+            self.bytes_used -= arr.nbytes
+            self.evictions += 1
+            self._discard(path)
+
+    @staticmethod
+    def _discard(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            # Windows não remove arquivos ainda mapeados; o diretório é limpo no close()
+            pass
+
+    def _new_path(self, page_index: int, dpi: int, colorspace: str) -> str:
+        if self._dir is None:
+            self._dir = tempfile.mkdtemp(prefix="pid_raster_", dir=self._cache_dir)
+        return os.path.join(self._dir, f"p{page_index + 1}_{dpi}dpi_{colorspace}.raw")
+
+    def _render_level(self, page_index: int, dpi: int, colorspace: str) -> Tuple[np.memmap, str]:
+        page = self._doc[page_index]
+        n = _RASTER_COLORSPACES[colorspace]
+        path = self._new_path(page_index, dpi, colorspace)
+
+        if page._fitz_page is not None:
+            dl = page._get_displaylist()
+            mat = fitz.Matrix(dpi / 72, dpi / 72)
+            irect = (fitz.Rect(dl.rect) * mat).irect
+            W, H = irect.width, irect.height
+            shape = (H, W) if n == 1 else (H, W, n)
+            out = np.memmap(path, dtype=np.uint8, mode="w+", shape=shape)
+            cs = fitz.csGRAY if n == 1 else fitz.csRGB
+            inv = ~mat
+            for y0 in range(0, H, RASTER_BAND_PX):
+                y1 = min(H, y0 + RASTER_BAND_PX)
+                band_rect = fitz.Rect(irect.x0, irect.y0 + y0, irect.x1, irect.y0 + y1) * inv
+                band = dl.get_pixmap(matrix=mat, colorspace=cs, alpha=False, clip=band_rect)
+                rows = pixmap_to_array(band)
+                # A faixa renderizada pode começar alguns pixels antes do pedido
+                off_y = irect.y0 + y0 - band.y
+                off_x = irect.x0 - band.x
+                chunk = rows[off_y:off_y + (y1 - y0), off_x:off_x + W]
+                out[y0:y0 + chunk.shape[0], :chunk.shape[1]] = chunk
+                del rows, band
+        else:
+            img = self._doc._render_fallback_page(page_index, dpi)
+            img = img.convert("L" if n == 1 else "RGB")
+            data = np.asarray(img)
+            out = np.memmap(path, dtype=np.uint8, mode="w+", shape=data.shape)
+            out[:] = data
+            shape = data.shape
+
+        out.flush()
+        del out
+        return np.memmap(path, dtype=np.uint8, mode="r", shape=shape), path
+
+
+def _estimate_fallback_page_mm(width: float, height: float) -> Tuple[float, float]:
+    """
+    Estima as dimensões (mm) de uma página aberta via pdf2image a partir da proporção.
+    Assume A0 como padrão para P&IDs (A4 = 210x297mm e A0 = 841x1189mm têm ratio ~0.707).
+    """
+    if width / height > 1.0:
+        # Paisagem (landscape)
+        return 1189.0, 841.0
+    # Retrato (portrait)
+    return 841.0, 1189.0
+
+
+def _fallback_page_sizes(data: bytes) -> List[Tuple[float, float]]:
+    """
+    Obtém (largura, altura) de cada página sem rasterizar em alta resolução.
+    Usa pdfinfo do Poppler; se não for possível, renderiza miniaturas de baixa resolução.
+    """
+    try:
+        info = pdfinfo_from_bytes(data)
+        num_pages = int(info["Pages"])
+        info = pdfinfo_from_bytes(data, first_page=1, last_page=num_pages)
+        sizes = []
+        for n in range(1, num_pages + 1):
+            size_str = info.get(f"Page {n:4d} size") or info.get(f"Page {n} size") or info["Page size"]
+            m = re.match(r"\s*([\d.]+)\s*x\s*([\d.]+)", size_str)
+            sizes.append((float(m.group(1)), float(m.group(2))))
+        return sizes
+    except Exception:
+        thumbs = convert_from_bytes(data, dpi=18, fmt='png')
+        return [img.size for img in thumbs]
+
+
 def open_pdf_with_fallback(data: bytes, filename: str = "document.pdf", dpi: int = 300) -> PDFDocument:
     """
     Abre um PDF usando PyMuPDF primeiro, com fallback automático para pdf2image.
     
     GARANTE que o PDF será aberto, mesmo se estiver corrompido.
+    Nenhuma página é renderizada aqui: cada consumidor renderiza sob demanda
+    o recorte e o DPI de que precisa (ver PDFPage.get_pixmap).
     
     Args:
         data: Bytes do arquivo PDF
         filename: Nome do arquivo (para logs)
-        dpi: DPI para renderização (usado no fallback)
+        dpi: Mantido por compatibilidade (o DPI agora é escolhido em cada renderização)
         
     Returns:
         PDFDocument: Documento PDF que funciona independente da biblioteca
@@ -322,21 +676,14 @@ def open_pdf_with_fallback(data: bytes, filename: str = "document.pdf", dpi: int
             _ = doc[0].rect
             log_to_front(f"✅ PDF aberto com PyMuPDF: {filename} ({len(doc)} páginas)")
             
-            # Converte para nosso wrapper
-            pages = []
+            # Converte para nosso wrapper (o fitz.Document permanece aberto)
+            pdf_doc = PDFDocument(source="pymupdf", fitz_doc=doc)
             for i, page in enumerate(doc):
                 W_mm = points_to_mm(page.rect.width)
                 H_mm = points_to_mm(page.rect.height)
-                
-                # Renderiza a página
-                pix = page.get_pixmap(dpi=dpi)
-                img_bytes = pix.tobytes("png")
-                img = Image.open(io.BytesIO(img_bytes))
-                
-                pages.append(PDFPage(img, i + 1, W_mm, H_mm, source="pymupdf"))
+                pdf_doc._pages.append(PDFPage(pdf_doc, i, W_mm, H_mm, source="pymupdf", fitz_page=page))
             
-            doc.close()
-            return PDFDocument(pages, source="pymupdf")
+            return pdf_doc
         else:
             raise Exception("PDF vazio")
             
@@ -354,43 +701,22 @@ def open_pdf_with_fallback(data: bytes, filename: str = "document.pdf", dpi: int
             try:
                 log_to_front(f"🔄 Tentando fallback com pdf2image (Poppler)...")
                 
-                # Converte PDF para imagens usando Poppler
-                # Poppler é MUITO mais tolerante a PDFs corrompidos
-                images = convert_from_bytes(
-                    data,
-                    dpi=dpi,
-                    fmt='png',
-                    thread_count=4
-                )
+                # Poppler é MUITO mais tolerante a PDFs corrompidos.
+                # Aqui só lemos número e proporção das páginas; a rasterização
+                # acontece página a página quando um pixmap for pedido.
+                sizes = _fallback_page_sizes(data)
                 
-                if not images:
+                if not sizes:
                     raise Exception("Nenhuma página renderizada")
                 
-                log_to_front(f"✅ PDF aberto com pdf2image: {filename} ({len(images)} páginas)")
+                log_to_front(f"✅ PDF aberto com pdf2image: {filename} ({len(sizes)} páginas)")
                 
-                # Precisamos estimar dimensões - usa proporções da imagem
-                # Assume A4 ou A0 baseado nas proporções
-                pages = []
-                for i, img in enumerate(images):
-                    img_width, img_height = img.size
-                    aspect_ratio = img_width / img_height
-                    
-                    # Estima dimensões baseado na proporção
-                    # A4 = 210x297mm (ratio ~0.707)
-                    # A0 = 841x1189mm (ratio ~0.707)
-                    # Vamos usar A0 como padrão para P&IDs
-                    if aspect_ratio > 1.0:
-                        # Paisagem (landscape)
-                        W_mm = 1189.0
-                        H_mm = 841.0
-                    else:
-                        # Retrato (portrait)
-                        W_mm = 841.0
-                        H_mm = 1189.0
-                    
-                    pages.append(PDFPage(img, i + 1, W_mm, H_mm, source="pdf2image"))
+                pdf_doc = PDFDocument(source="pdf2image", data=data)
+                for i, (w, h) in enumerate(sizes):
+                    W_mm, H_mm = _estimate_fallback_page_mm(w, h)
+                    pdf_doc._pages.append(PDFPage(pdf_doc, i, W_mm, H_mm, source="pdf2image"))
                 
-                return PDFDocument(pages, source="pdf2image")
+                return pdf_doc
                 
             except Exception as e2:
                 log_to_front(f"❌ pdf2image também falhou: {e2!r}")
@@ -453,64 +779,57 @@ def open_pdf_with_fallback(data: bytes, filename: str = "document.pdf", dpi: int
 open_pdf_safely = open_pdf_with_fallback
 
 
-def render_quadrant_from_page(page, rect, dpi: int = 400) -> bytes:
+def render_quadrant_from_page(page, rect, dpi: int = 400, preprocess: Optional[bool] = None) -> bytes:
     """
     Renderiza um quadrante de uma página PDF (compatível com ambas as implementações).
-    
+
+    Pipeline sem PNG intermediário: raster em cinza (array numpy) → pré-processamento
+    opcional → uma única codificação PNG final.
+
     Args:
         page: PDFPage ou fitz.Page
         rect: Retângulo do quadrante (pode ser fitz.Rect ou coordenadas)
         dpi: Resolução
-        
+        preprocess: Aplica preprocess_array (padrão: QUADRANT_PREPROCESS)
+
     Returns:
-        PNG bytes preprocessados
+        PNG bytes (preprocessados quando habilitado)
+    """
+    return array_to_png(render_quadrant_array(page, rect, dpi, preprocess))
+
+
+def render_quadrant_array(page, rect, dpi: int = 400, preprocess: Optional[bool] = None,
+                          upscale: bool = True) -> np.ndarray:
     """
+    Renderiza um quadrante como array uint8 em cinza (sem codificação).
+    Mesmos argumentos de render_quadrant_from_page; upscale é repassado a preprocess_array.
+    """
+    if preprocess is None:
+        preprocess = QUADRANT_PREPROCESS
     try:
-        # Se é um PDFPage (nossa implementação fallback)
+        # Converte o retângulo para fitz.Rect (pontos)
+        if hasattr(rect, 'x0'):  # fitz.Rect ou retângulo compatível
+            clip = fitz.Rect(rect.x0, rect.y0, rect.x1, rect.y1)
+        else:
+            # Assume que é uma tuple com coordenadas em mm
+            x0_mm, y0_mm, x1_mm, y1_mm = rect
+            clip = fitz.Rect(mm_to_points(x0_mm), mm_to_points(y0_mm),
+                             mm_to_points(x1_mm), mm_to_points(y1_mm))
+
+        # Se é um PDFPage, recorta do cache de raster do documento (view sem cópia)
         if isinstance(page, PDFPage):
-            # Extrai a região do quadrante da imagem completa
-            if hasattr(rect, 'x0'):  # fitz.Rect
-                x0_mm = points_to_mm(rect.x0)
-                y0_mm = points_to_mm(rect.y0)
-                x1_mm = points_to_mm(rect.x1)
-                y1_mm = points_to_mm(rect.y1)
-            else:
-                # Assume que é um dict ou tuple com coordenadas
-                x0_mm, y0_mm, x1_mm, y1_mm = rect
-            
-            # Converte coordenadas mm para pixels na imagem
-            img_width, img_height = page._image.size
-            x0_px = int(x0_mm / page.width_mm * img_width)
-            y0_px = int(y0_mm / page.height_mm * img_height)
-            x1_px = int(x1_mm / page.width_mm * img_width)
-            y1_px = int(y1_mm / page.height_mm * img_height)
-            
-            # Crop da região
-            cropped = page._image.crop((x0_px, y0_px, x1_px, y1_px))
-            
-            # Converte para bytes PNG
-            buffer = io.BytesIO()
-            cropped.save(buffer, format='PNG')
-            raw_bytes = buffer.getvalue()
-            
-            # Preprocessa
-            processed_bytes = preprocess_image(raw_bytes)
-            return processed_bytes
-        
-        # Se é um fitz.Page (PyMuPDF original)
+            gray = page.get_raster(dpi, clip=clip, colorspace="gray")
+
+        # Se é um fitz.Page (PyMuPDF original): amostras do pixmap em cinza
+        # (get_pixmap já renderiza na orientação exibida da página)
         else:
-            rotation = page.rotation if hasattr(page, 'rotation') else 0
-            
-            if rotation != 0:
-                mat = fitz.Matrix(1, 1).prerotate(rotation)
-                pix = page.get_pixmap(dpi=dpi, clip=rect, matrix=mat)
-            else:
-                pix = page.get_pixmap(dpi=dpi, clip=rect)
-            
-            raw_bytes = pix.tobytes("png")
-            processed_bytes = preprocess_image(raw_bytes)
-            return processed_bytes
-            
+            pix = page.get_pixmap(dpi=dpi, clip=clip, colorspace=fitz.csGRAY)
+            gray = pixmap_to_array(pix).copy()  # cópia: o pixmap sai de escopo
+
+        if preprocess:
+            gray = preprocess_array(gray, upscale=upscale)
+        return gray
+
     except Exception as e:
         log_to_front(f"   ⚠️ Erro ao renderizar quadrante: {type(e).__name__}: {e!r}")
         traceback.print_exc()
@@ -518,25 +837,207 @@ def render_quadrant_from_page(page, rect, dpi: int = 400) -> bytes:
 
 
 # === BEGIN ADD: tiler with overlap ===
-def calculate_tile_count(page, tile_px: int=1024, overlap_ratio: float=0.37, dpi:int=400):
-    """Calculate the total number of tiles that will be generated for a page."""
-    pix = page.get_pixmap(dpi=dpi)
-    img = Image.open(io.BytesIO(pix.tobytes("png"))).convert("L")
-    W, H = img.size
-    step = int(tile_px*(1.0-overlap_ratio)) or tile_px
-    y_count = len(list(range(0, max(1, H-tile_px+1), step)))
-    x_count = len(list(range(0, max(1, W-tile_px+1), step)))
-    return x_count * y_count
-
-def iter_tiles_with_overlap(page, tile_px: int=1024, overlap_ratio: float=0.37, dpi:int=400):
-    pix = page.get_pixmap(dpi=dpi)
-    img = Image.open(io.BytesIO(pix.tobytes("png"))).convert("L")
-    W,H = img.size
+def page_pixel_size(page, dpi: int) -> Tuple[int, int]:
+    """
+    (largura, altura) em pixels da página renderizada no DPI dado, calculada
+    apenas a partir de page.rect (mesma grade usada pelo cache de raster).
+    """
+    zoom = dpi / 72
+    irect = (fitz.Rect(page.rect) * fitz.Matrix(zoom, zoom)).irect
+    return irect.width, irect.height
+
+
+@dataclass
+class Tile:
+    index: int
+    x: int; y: int; w: int; h: int
+    # Região "core" (x0, y0, x1, y1): parte do tile que não é dividida com vizinhos
+    # além da metade da sobreposição; cada pixel coberto pertence ao core de um único tile
+    core: Tuple[int, int, int, int]
+
+    def overlap_regions(self) -> List[Tuple[int, int, int, int]]:
+        """Faixas do tile fora do core (compartilhadas com tiles vizinhos)"""
+        cx0, cy0, cx1, cy1 = self.core
+        x1, y1 = self.x + self.w, self.y + self.h
+        regions = [
+            (self.x, self.y, x1, cy0),   # topo
+            (self.x, cy1, x1, y1),       # base
+            (self.x, cy0, cx0, cy1),     # esquerda
+            (cx1, cy0, x1, cy1),         # direita
+        ]
+        return [r for r in regions if r[2] > r[0] and r[3] > r[1]]
+
+    def in_core(self, px: float, py: float) -> bool:
+        cx0, cy0, cx1, cy1 = self.core
+        return cx0 <= px < cx1 and cy0 <= py < cy1
+
+
+@dataclass
+class TilePlan:
+    """
+    Plano de tiles de uma página, calculado analiticamente a partir de page.rect
+    e do DPI (sem renderizar nada). Fornece a contagem exata de chamadas ao LLM
+    antes de qualquer renderização.
+    """
+    dpi: int
+    page_w_px: int
+    page_h_px: int
+    tile_px: int
+    overlap_ratio: float
+    step: int
+    tiles: List[Tile]
+
+    @property
+    def count(self) -> int:
+        return len(self.tiles)
+
+    @property
+    def overlap_px(self) -> int:
+        return max(0, self.tile_px - self.step)
+
+    def owner(self, px: float, py: float) -> Optional[Tile]:
+        """Tile cujo core contém o ponto (em pixels da página)"""
+        for tile in self.tiles:
+            if tile.in_core(px, py):
+                return tile
+        return None
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def __iter__(self):
+        return iter(self.tiles)
+
+
+def _tile_axis(size: int, tile_px: int, step: int) -> List[Tuple[int, int, int, int]]:
+    """Origens ao longo de um eixo: (origem, tamanho, core_inicio, core_fim)"""
+    origins = list(range(0, max(1, size-tile_px+1), step))
+    axis = []
+    for i, o in enumerate(origins):
+        length = min(tile_px, size - o)
+        core_start = o if i == 0 else (o + origins[i-1] + tile_px) // 2
+        core_end = o + length if i == len(origins) - 1 else (origins[i+1] + o + tile_px) // 2
+        axis.append((o, length, core_start, min(core_end, o + length)))
+    return axis
+
+
+def plan_tiles(page, tile_px: int=1024, overlap_ratio: float=0.37, dpi:int=400) -> TilePlan:
+    """Calcula o TilePlan de uma página a partir de page.rect e DPI."""
+    W, H = page_pixel_size(page, dpi)
     step = int(tile_px*(1.0-overlap_ratio)) or tile_px
-    for y in range(0, max(1,H-tile_px+1), step):
-        for x in range(0, max(1,W-tile_px+1), step):
-            crop = img.crop((x,y,x+tile_px,y+tile_px))
-            yield crop, (x,y), (W,H), dpi
+    tiles = []
+    for y, h, cy0, cy1 in _tile_axis(H, tile_px, step):
+        for x, w, cx0, cx1 in _tile_axis(W, tile_px, step):
+            tiles.append(Tile(len(tiles), x, y, w, h, (cx0, cy0, cx1, cy1)))
+    return TilePlan(dpi, W, H, tile_px, overlap_ratio, step, tiles)
+
+
+def calculate_tile_count(page, tile_px: int=1024, overlap_ratio: float=0.37, dpi:int=400):
+    """Calculate the total number of tiles that will be generated for a page (no rendering)."""
+    return plan_tiles(page, tile_px=tile_px, overlap_ratio=overlap_ratio, dpi=dpi).count
+
+def iter_tiles_with_overlap(page, tile_px: int=1024, overlap_ratio: float=0.37, dpi:int=400,
+                            plan: Optional[TilePlan]=None):
+    if plan is None:
+        plan = plan_tiles(page, tile_px=tile_px, overlap_ratio=overlap_ratio, dpi=dpi)
+    raster = page_raster(page, plan.dpi, colorspace="gray")
+    W,H = plan.page_w_px, plan.page_h_px
+    for t in plan:
+        crop = Image.fromarray(np.ascontiguousarray(raster[t.y:t.y+t.h, t.x:t.x+t.w]))
+        yield crop, (t.x,t.y), (W,H), plan.dpi
+# === END ADD ===
+
+# === BEGIN ADD: pré-filtro de tinta (tiles/quadrantes vazios) ===
+# Descarta tiles, quadrantes e páginas sem conteúdo antes de qualquer chamada ao LLM
+INK_SKIP_ENABLED = os.getenv("INK_SKIP_ENABLED", "true").lower() in ("1", "true", "yes")
+INK_DARK_LEVEL = int(os.getenv("INK_DARK_LEVEL", "200"))            # cinza < nível conta como tinta
+INK_MIN_RATIO = float(os.getenv("INK_MIN_RATIO", "0.001"))          # fração mínima de pixels com tinta
+INK_MIN_COMPONENTS = int(os.getenv("INK_MIN_COMPONENTS", "3"))      # componentes conectados mínimos
+INK_MIN_COMPONENT_PX = int(os.getenv("INK_MIN_COMPONENT_PX", "4"))  # componentes menores são ruído
+INK_PAGE_SCREEN_DPI = int(os.getenv("INK_PAGE_SCREEN_DPI", "72"))   # DPI do teste de página vazia
+INK_PAGE_DARK_LEVEL = 240  # em baixa resolução traços finos ficam cinza claro
+
+
+@dataclass
+class InkScreen:
+    skip: bool
+    reason: str  # "ink" (mantido), "blank", "low_ink" ou "few_components"
+    ink_ratio: float
+    components: int
+
+
+def screen_ink(gray, min_ratio: float = INK_MIN_RATIO, min_components: int = INK_MIN_COMPONENTS,
+               dark_level: int = INK_DARK_LEVEL) -> InkScreen:
+    """
+    Avalia se um raster em tons de cinza (numpy HxW ou PIL) tem conteúdo suficiente
+    para justificar uma chamada ao LLM: densidade de tinta + componentes conectados.
+    """
+    arr = np.asarray(gray)
+    if arr.ndim == 3:
+        arr = arr.mean(axis=2)
+    if arr.size == 0:
+        return InkScreen(True, "blank", 0.0, 0)
+
+    mask = arr < dark_level
+    ink = int(np.count_nonzero(mask))
+    ratio = ink / arr.size
+    if ink == 0:
+        return InkScreen(True, "blank", 0.0, 0)
+    if ratio < min_ratio:
+        return InkScreen(True, "low_ink", ratio, 0)
+
+    # Sem OpenCV, decide apenas pela densidade
+    if not CV2_AVAILABLE or min_components <= 0:
+        return InkScreen(False, "ink", ratio, -1)
+
+    n, _, stats, _ = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=8)
+    components = int(np.count_nonzero(stats[1:, cv2.CC_STAT_AREA] >= INK_MIN_COMPONENT_PX))
+    if components < min_components:
+        return InkScreen(True, "few_components", ratio, components)
+    return InkScreen(False, "ink", ratio, components)
+
+
+def screen_page_ink(page) -> InkScreen:
+    """Teste de página vazia em baixa resolução (nível próprio no cache de raster)"""
+    return screen_ink(page_raster(page, INK_PAGE_SCREEN_DPI, colorspace="gray"),
+                      dark_level=INK_PAGE_DARK_LEVEL)
+
+
+class InkScreenMetrics:
+    """Registro das decisões do pré-filtro de tinta de um job, reportado por página"""
+
+    def __init__(self):
+        self.decisions: List[Dict[str, Any]] = []
+
+    def record(self, page_num: int, scope: str, label: str, screen: InkScreen) -> bool:
+        self.decisions.append({
+            "pagina": page_num,
+            "scope": scope,
+            "label": label,
+            "skipped": screen.skip,
+            "reason": screen.reason,
+            "ink_ratio": round(screen.ink_ratio, 5),
+            "components": screen.components,
+        })
+        if screen.skip:
+            log_to_front(f"   ⏭️ {scope} {label} ignorado ({screen.reason}, tinta={screen.ink_ratio:.4%})")
+        return screen.skip
+
+    def summary(self, page_num: Optional[int] = None) -> Dict[str, Any]:
+        decisions = [d for d in self.decisions if page_num is None or d["pagina"] == page_num]
+        skipped = [d for d in decisions if d["skipped"]]
+        by_reason: Dict[str, int] = {}
+        for d in skipped:
+            by_reason[d["reason"]] = by_reason.get(d["reason"], 0) + 1
+        return {
+            "enabled": INK_SKIP_ENABLED,
+            "screened": len(decisions),
+            "skipped": len(skipped),
+            "kept": len(decisions) - len(skipped),
+            "skip_rate": round(len(skipped) / len(decisions), 3) if decisions else 0.0,
+            "by_reason": by_reason,
+            "decisions": decisions,
+        }
 # === END ADD ===
 
 
@@ -622,33 +1123,17 @@ def detect_electrical_diagram_subtype(items: List[Dict[str, Any]], description:
     Returns:
         "unipolar" or "multifilar"
     """
-    # Keywords that suggest multifilar (detailed, multi-conductor)
-    multifilar_keywords = [
-        "multifilar", "multi-filar", "três fases", "three phase", "trifásico", 
-        "three-phase", "l1", "l2", "l3", "r", "s", "t", "u", "v", "w",
-        "cabo", "condutor", "wire", "conductor", "phase"
-    ]
-    
-    # Keywords that suggest unipolar (single-line, simplified)
-    unipolar_keywords = [
-        "unipolar", "uni-polar", "unifilar", "uni-filar", "single line",
-        "single-line", "diagrama simplificado", "simplified"
-    ]
-    
-    # Check description
+    # Palavras-chave (kwc.MULTIFILAR_KEYWORDS / UNIPOLAR_KEYWORDS) via matcher compilado
     desc_lower = description.lower()
+    multifilar_count = kwc.count_keywords(desc_lower, kwc.MULTIFILAR_SET)
+    unipolar_count = kwc.count_keywords(desc_lower, kwc.UNIPOLAR_SET)
     
-    # Count keyword occurrences
-    multifilar_count = sum(1 for keyword in multifilar_keywords if keyword in desc_lower)
-    unipolar_count = sum(1 for keyword in unipolar_keywords if keyword in desc_lower)
-    
-    # Check equipment tags and descriptions
+    # Check equipment tags and descriptions (palavra conta uma vez se estiver na TAG ou na descrição)
     for item in items:
-        tag = str(item.get("tag", "")).lower()
-        item_desc = str(item.get("descricao", "")).lower()
-        
-        multifilar_count += sum(1 for keyword in multifilar_keywords if keyword in tag or keyword in item_desc)
-        unipolar_count += sum(1 for keyword in unipolar_keywords if keyword in tag or keyword in item_desc)
+        found = (kwc.classify_description(str(item.get("tag", "")).lower()).keys()
+                 | kwc.classify_description(str(item.get("descricao", "")).lower()).keys())
+        multifilar_count += len(kwc.MULTIFILAR_SET & found)
+        unipolar_count += len(kwc.UNIPOLAR_SET & found)
     
     # Decide based on counts
     if multifilar_count > unipolar_count:
@@ -660,47 +1145,13 @@ def detect_electrical_diagram_subtype(items: List[Dict[str, Any]], description:
         return "multifilar"
 
 
-def clean_markdown_fences(text: str) -> str:
-    if not text:
-        return ""
-    cleaned = text.strip()
-    if cleaned.startswith("```") and cleaned.endswith("```"):
-        cleaned = cleaned.strip("`")
-        if cleaned[:4].lower() == "json":
-            cleaned = cleaned[4:].strip()
-    return cleaned
-
-
-def extract_first_json_array(text: str) -> str:
-    pattern = re.compile(r"\[\s*(?:\{.*?\}\s*,\s*)*\{.*?\}\s*\]|\[\s*\]", re.DOTALL)
-    m = pattern.search(text)
-    if not m:
-        raise ValueError("Nenhum JSON array encontrado.")
-    return m.group(0)
-
-
 def ensure_json_list(content: str) -> List[Any]:
-    if not content:
-        return []
-    cleaned = clean_markdown_fences(content)
-    try:
-        obj = json.loads(cleaned)
-        if isinstance(obj, list):
-            return obj
-        if isinstance(obj, dict):
-            for v in obj.values():
-                if isinstance(v, list):
-                    return v
-    except Exception:
-        pass
-    try:
-        arr = extract_first_json_array(cleaned)
-        obj = json.loads(arr)
-        if isinstance(obj, list):
-            return obj
-    except Exception:
-        pass
-    return []
+    """
+    Itens da resposta do LLM: array JSON (cercas markdown/texto ignorados), lista
+    dentro de um objeto ({"equipments": [...]}), vários arrays concatenados ou
+    elementos completos de um array truncado. Passada única (json_extract).
+    """
+    return json_list(content) if content else []
 
 
 def sanitize_for_json(obj: Any) -> Any:
@@ -728,46 +1179,6 @@ def assign_no_tag_identifiers(items: List[Dict[str, Any]]) -> List[Dict[str, Any
     - PI-notag1, PI-notag2 for Indicador de Pressão
     - etc.
     """
-    # Mapping from description keywords to instrument prefixes
-    instrument_type_mapping = {
-        # Pressure instruments
-        "transmissor de pressão": "PT",
-        "pressure transmitter": "PT",
-        "indicador de pressão": "PI",
-        "pressure indicator": "PI",
-        "chave de pressão alta": "PSH",
-        "pressure switch high": "PSH",
-        "chave de pressão baixa": "PSL",
-        "pressure switch low": "PSL",
-        
-        # Temperature instruments
-        "controlador indicativo de temperatura": "TIC",
-        "temperature indicating controller": "TIC",
-        "indicador de temperatura": "TI",
-        "temperature indicator": "TI",
-        "transmissor de temperatura": "TT",
-        "temperature transmitter": "TT",
-        
-        # Level instruments
-        "transmissor de nível": "LT",
-        "level transmitter": "LT",
-        "controlador indicação de nível": "LIC",
-        "controlador de nível": "LIC",
-        "level indicating controller": "LIC",
-        "level controller": "LIC",
-        
-        # Flow instruments
-        "indicador de vazão": "FI",
-        "flow indicator": "FI",
-        "transmissor de vazão": "FT",
-        "flow transmitter": "FT",
-        "controlador de vazão": "FIC",
-        "flow indicating controller": "FIC",
-        "flow controller": "FIC",
-        "válvula de controle de vazão": "FV",
-        "flow control valve": "FV",
-    }
-    
     # Track counters for each instrument prefix
     prefix_counters = {}
     
@@ -775,12 +1186,9 @@ def assign_no_tag_identifiers(items: List[Dict[str, Any]]) -> List[Dict[str, Any
         if item.get("tag") == "N/A":
             descricao = item.get("descricao", "").lower()
             
-            # Detect instrument type from description
-            prefix = None
-            for keyword, instrument_prefix in instrument_type_mapping.items():
-                if keyword in descricao:
-                    prefix = instrument_prefix
-                    break
+            # Detect instrument type from description (kwc.NO_TAG_INSTRUMENT_PREFIXES, na ordem da tabela)
+            keyword = kwc.first_keyword(descricao, kwc.NO_TAG_INSTRUMENT_PREFIXES)
+            prefix = kwc.NO_TAG_INSTRUMENT_PREFIXES[keyword] if keyword else None
             
             # If no specific instrument type is detected, use generic NO-TAG
             if prefix is None:
@@ -810,39 +1218,19 @@ def estimate_symbol_size(tag: str, descricao: str) -> float:
         Estimated symbol size in mm (for tolerance calculation)
     """
     tag_upper = tag.upper()
-    desc_lower = descricao.lower()
+    hits = kwc.classify_description(descricao.lower())
     
     # Large equipment - bigger symbols, larger tolerance
-    large_equipment_keywords = [
-        "tank", "tanque", "vessel", "vaso", "tower", "torre", "column", "coluna",
-        "reactor", "reator", "furnace", "forno", "boiler", "caldeira", "heat exchanger",
-        "trocador", "exchanger", "compressor", "compressor"
-    ]
+    if not kwc.SYMBOL_SIZE_LARGE_SET.isdisjoint(hits):
+        return 50.0
     
-    # Medium equipment
-    medium_equipment_keywords = [
-        "pump", "bomba", "filter", "filtro", "separator", "separador",
-        "drum", "tambor", "accumulator", "acumulador"
-    ]
-    
-    # Small instruments and valves
-    small_instrument_prefixes = ["PT", "TT", "FT", "LT", "PI", "TI", "FI", "LI", 
-                                  "PSV", "PCV", "FCV", "TCV", "LCV", "VALVE", "VÁLVULA"]
-    
-    # Check for large equipment
-    for keyword in large_equipment_keywords:
-        if keyword in desc_lower:
-            return 50.0  # Large symbols, use larger tolerance
+    # Small instruments and valves (prefixo da TAG ou menção na descrição)
+    if kwc.has_small_instrument_prefix(tag_upper) or not kwc.SMALL_INSTRUMENT_DESC_SET.isdisjoint(hits):
+        return 10.0
     
-    # Check for small instruments
-    for prefix in small_instrument_prefixes:
-        if tag_upper.startswith(prefix) or prefix.lower() in desc_lower:
-            return 10.0  # Small symbols, use smaller tolerance
-    
-    # Check for medium equipment
-    for keyword in medium_equipment_keywords:
-        if keyword in desc_lower:
-            return 25.0
+    # Medium equipment
+    if not kwc.SYMBOL_SIZE_MEDIUM_SET.isdisjoint(hits):
+        return 25.0
     
     # Default medium size
     return 20.0
@@ -903,6 +1291,9 @@ def dedup_items(items: List[Dict[str, Any]], page_num: int, tol_mm: float = 10.0
        - Mesmo TAG E coordenadas muito próximas (dentro de tol_mm)
     3. Se já existe, descarta o novo item (mantém o primeiro)
     4. Se não existe, mantém o item
+
+    A busca por vizinhos usa uma grade uniforme por página (spatial_index.UniformGrid),
+    então o custo cresce ~linearmente com o número de itens em vez de quadraticamente.
     
     IMPORTANTE: Itens com TAGs diferentes NÃO são considerados duplicatas,
     mesmo se estiverem próximos espacialmente.
@@ -924,73 +1315,58 @@ def dedup_items(items: List[Dict[str, Any]], page_num: int, tol_mm: float = 10.0
         if not isinstance(it.get("descricao", ""), str):
             it["descricao"] = "Equipamento"
     
+    # Tolerância depende só de (tag, descrição): calcula uma vez por combinação
+    tolerance_cache: Dict[Tuple[Any, Any], float] = {}
+    tolerances: List[float] = []
+    for it in items:
+        if use_dynamic_tolerance:
+            key = (it.get("tag", "N/A"), it.get("descricao", ""))
+            if key not in tolerance_cache:
+                tolerance_cache[key] = calculate_dynamic_tolerance(it, tol_mm)
+            tolerances.append(tolerance_cache[key])
+        else:
+            tolerances.append(tol_mm)
+
+    # Índice espacial (grade uniforme por página) dos itens mantidos: cada consulta visita só as
+    # células vizinhas em vez de todos os itens anteriores. Célula ~ tolerância típica.
+    finite_tols = sorted(t for t in tolerances if math.isfinite(t) and t > 0)
+    cell_size = finite_tols[len(finite_tols) // 2] if finite_tols else 1.0
+    grids: Dict[int, UniformGrid] = {}
+
     final: List[Dict[str, Any]] = []
-    seen_tags = {}  # Maps (tag, page) -> list of positions
     dedup_metadata = []  # Track deduplication decisions
     
-    for it in items:
+    for it, item_tolerance in zip(items, tolerances):
         tag = it.get("tag", "").strip().upper()
         pos = (it["x_mm"], it["y_mm"])
         page = it["pagina"]
-        
-        # Calculate dynamic tolerance for this item
-        if use_dynamic_tolerance:
-            item_tolerance = calculate_dynamic_tolerance(it, tol_mm)
-        else:
-            item_tolerance = tol_mm
-        
-        is_duplicate = False
+        has_tag = bool(tag) and tag != "N/A"
+        grid = grids.get(page)
+        
+        # Mantém o primeiro: entre os itens mantidos dentro da tolerância, vale o de menor índice
+        # (mesma TAG para itens com TAG; qualquer item para itens sem TAG)
+        match = None
+        if grid is not None:
+            for distance, (kept_idx, kept_tag, existing) in grid.within(pos[0], pos[1], item_tolerance):
+                if has_tag and kept_tag != tag:
+                    continue
+                if match is None or kept_idx < match[0]:
+                    match = (kept_idx, distance, existing)
+        
+        is_duplicate = match is not None
         duplicate_reason = None
-        
-        # Para itens com TAG válida (não N/A)
-        if tag and tag != "N/A":
-            tag_key = (tag, page)
-            
-            # Verifica se já existe esse mesmo TAG
-            if tag_key in seen_tags:
-                # Verifica se está próximo de alguma posição existente com MESMO TAG
-                for existing_pos in seen_tags[tag_key]:
-                    distance = dist_mm(pos, existing_pos)
-                    
-                    # Para diagramas elétricos, usa lógica mais rigorosa
-                    if is_electrical:
-                        # Coordenadas exatas (arredondadas para múltiplos de 4mm) = duplicata
-                        if distance == 0.0:
-                            is_duplicate = True
-                            duplicate_reason = f"Electrical: Same tag '{tag}' at exact same position (0.0mm)"
-                            break
-                        # Também considera muito próximo (dentro de tolerância)
-                        elif distance <= item_tolerance:
-                            is_duplicate = True
-                            duplicate_reason = f"Electrical: Same tag '{tag}' within {distance:.1f}mm (tol={item_tolerance:.1f}mm)"
-                            break
-                    else:
-                        # Lógica normal para P&ID
-                        if distance <= item_tolerance:
-                            is_duplicate = True
-                            duplicate_reason = f"Same tag '{tag}' within {distance:.1f}mm (tol={item_tolerance:.1f}mm)"
-                            break
-                
-                # Se não está próximo de nenhuma posição existente com mesmo TAG,
-                # pode ser uma segunda ocorrência do mesmo equipamento (ex: P-101A e P-101B)
-                # Neste caso, não é duplicata
-                if not is_duplicate:
-                    seen_tags[tag_key].append(pos)
+        if match is not None:
+            _, distance, existing = match
+            if not has_tag:
+                # Item sem TAG muito próximo de outro item - provavelmente duplicata
+                duplicate_reason = f"No tag, within {distance:.1f}mm of {existing.get('tag', 'N/A')} (tol={item_tolerance:.1f}mm)"
+            elif is_electrical and distance == 0.0:
+                # Coordenadas exatas (arredondadas para múltiplos de 4mm) = duplicata
+                duplicate_reason = f"Electrical: Same tag '{tag}' at exact same position (0.0mm)"
+            elif is_electrical:
+                duplicate_reason = f"Electrical: Same tag '{tag}' within {distance:.1f}mm (tol={item_tolerance:.1f}mm)"
             else:
-                # Primeira ocorrência deste TAG
-                seen_tags[tag_key] = [pos]
-        
-        # Para itens sem TAG (N/A), verifica proximidade com QUALQUER item existente
-        else:
-            for existing in final:
-                if existing["pagina"] == page:
-                    existing_pos = (existing["x_mm"], existing["y_mm"])
-                    distance = dist_mm(pos, existing_pos)
-                    if distance <= item_tolerance:
-                        # Item sem TAG muito próximo de outro item - provavelmente duplicata
-                        is_duplicate = True
-                        duplicate_reason = f"No tag, within {distance:.1f}mm of {existing.get('tag', 'N/A')} (tol={item_tolerance:.1f}mm)"
-                        break
+                duplicate_reason = f"Same tag '{tag}' within {distance:.1f}mm (tol={item_tolerance:.1f}mm)"
         
         # Log metadata if requested
         if log_metadata:
@@ -1004,10 +1380,14 @@ def dedup_items(items: List[Dict[str, Any]], page_num: int, tol_mm: float = 10.0
             })
         
         # Se não é duplicata, adiciona à lista final
+        # (mesma TAG longe das posições existentes = outra ocorrência, ex: P-101A e P-101B)
         if not is_duplicate:
             # Add deduplication metadata to item
             if log_metadata:
                 it["_dedup_tolerance"] = item_tolerance
+            if grid is None:
+                grid = grids[page] = UniformGrid(cell_size)
+            grid.insert(pos[0], pos[1], (len(final), tag if has_tag else None, it))
             final.append(it)
     
     return final
@@ -1031,19 +1411,11 @@ def page_quadrants_with_overlap(page, grid_x: int = 3, grid_y: int = 3,
     Returns:
         List of (gx, gy, rect, label) tuples
     """
-    # Obtém dimensões da página
-    if isinstance(page, PDFPage):
-        # Nossa implementação fallback
-        W = page.rect.width
-        H = page.rect.height
-        rect_x0, rect_y0 = 0, 0
-        rect_x1, rect_y1 = W, H
-    else:
-        # fitz.Page
-        rect = page.rect
-        W, H = rect.width, rect.height
-        rect_x0, rect_y0 = rect.x0, rect.y0
-        rect_x1, rect_y1 = rect.x1, rect.y1
+    # Obtém dimensões da página (PDFPage.rect e fitz.Page.rect são fitz.Rect)
+    rect = page.rect
+    W, H = rect.width, rect.height
+    rect_x0, rect_y0 = rect.x0, rect.y0
+    rect_x1, rect_y1 = rect.x1, rect.y1
     
     quads = []
     
@@ -1055,26 +1427,12 @@ def page_quadrants_with_overlap(page, grid_x: int = 3, grid_y: int = 3,
             x1 = x0 + (W / grid_x)
             y1 = y0 + (H / grid_y)
             
-            # Cria retângulo (compatível com ambos)
-            if isinstance(page, PDFPage):
-                # Para PDFPage, usamos coordenadas simples
-                quad_rect = type('Rect', (), {
-                    'x0': max(rect_x0, x0),
-                    'y0': max(rect_y0, y0),
-                    'x1': min(rect_x1, x1),
-                    'y1': min(rect_y1, y1),
-                    'width': min(rect_x1, x1) - max(rect_x0, x0),
-                    'height': min(rect_y1, y1) - max(rect_y0, y0)
-                })()
-            else:
-                # Para fitz.Page
-                quad_rect = fitz.Rect(x0, y0, x1, y1)
-                quad_rect = fitz.Rect(
-                    max(rect_x0, quad_rect.x0),
-                    max(rect_y0, quad_rect.y0),
-                    min(rect_x1, quad_rect.x1),
-                    min(rect_y1, quad_rect.y1),
-                )
+            quad_rect = fitz.Rect(
+                max(rect_x0, x0),
+                max(rect_y0, y0),
+                min(rect_x1, x1),
+                min(rect_y1, y1),
+            )
             
             if quad_rect.width > 0 and quad_rect.height > 0:
                 label = f"{gy+1}-{gx+1}"
@@ -1092,24 +1450,12 @@ def page_quadrants_with_overlap(page, grid_x: int = 3, grid_y: int = 3,
                 x1 = x0 + (W / grid_x)
                 y1 = y0 + (H / grid_y)
                 
-                # Cria retângulo (compatível com ambos)
-                if isinstance(page, PDFPage):
-                    quad_rect = type('Rect', (), {
-                        'x0': max(rect_x0, x0),
-                        'y0': max(rect_y0, y0),
-                        'x1': min(rect_x1, x1),
-                        'y1': min(rect_y1, y1),
-                        'width': min(rect_x1, x1) - max(rect_x0, x0),
-                        'height': min(rect_y1, y1) - max(rect_y0, y0)
-                    })()
-                else:
-                    quad_rect = fitz.Rect(x0, y0, x1, y1)
-                    quad_rect = fitz.Rect(
-                        max(rect_x0, quad_rect.x0),
-                        max(rect_y0, quad_rect.y0),
-                        min(rect_x1, quad_rect.x1),
-                        min(rect_y1, quad_rect.y1),
-                    )
+                quad_rect = fitz.Rect(
+                    max(rect_x0, x0),
+                    max(rect_y0, y0),
+                    min(rect_x1, x1),
+                    min(rect_y1, y1),
+                )
                 
                 if quad_rect.width > 0 and quad_rect.height > 0:
                     label = f"{gy+1}-{gx+1}-overlap"
@@ -1118,6 +1464,98 @@ def page_quadrants_with_overlap(page, grid_x: int = 3, grid_y: int = 3,
     return quads
 
 
+# Subdivisão adaptativa (grid=auto): quadtree guiada pela densidade de tinta
+AUTO_GRID_MAX_CALLS = int(os.getenv("AUTO_GRID_MAX_CALLS", "16"))          # quadrantes por página
+AUTO_GRID_SPLIT_RATIO = float(os.getenv("AUTO_GRID_SPLIT_RATIO", "0.03"))  # densidade mínima para subdividir
+AUTO_GRID_MIN_CELL_MM = float(os.getenv("AUTO_GRID_MIN_CELL_MM", "70"))    # lado mínimo de uma célula
+AUTO_GRID_MAX_DEPTH = int(os.getenv("AUTO_GRID_MAX_DEPTH", "4"))
+
+
+def page_quadrants_adaptive(page, max_calls: int = AUTO_GRID_MAX_CALLS,
+                            split_ratio: float = AUTO_GRID_SPLIT_RATIO,
+                            min_cell_mm: float = AUTO_GRID_MIN_CELL_MM,
+                            max_depth: int = AUTO_GRID_MAX_DEPTH,
+                            overlap_percent: float = 0.0) -> List[Tuple[int, int, Any, str]]:
+    """
+    Generate quadrants by recursive (quadtree) subdivision driven by ink density.
+    Compatível com fitz.Page e PDFPage.
+
+    The densest cell (most ink) is split into 4 first, as long as its ink ratio
+    reaches split_ratio, its children stay above min_cell_mm and the number of
+    non-empty leaves fits max_calls. Leaves without any ink are dropped. A page
+    whose root is not split returns [] (the global pass already covers it).
+
+    Args:
+        page: PyMuPDF page object ou PDFPage
+        max_calls: Maximum number of quadrants (LLM calls) for the page
+        split_ratio: Minimum ink ratio for a cell to be subdivided
+        min_cell_mm: Minimum cell side in mm
+        max_depth: Maximum quadtree depth
+        overlap_percent: Margin added around each leaf (fraction of its size)
+
+    Returns:
+        List of (gx, gy, rect, label) tuples; gx/gy are cell indices at the leaf depth
+        and label is the quadtree path (e.g. "2-1-4")
+    """
+    rect = fitz.Rect(page.rect)
+    # Densidade medida no mesmo nível de baixa resolução do teste de página vazia
+    gray = page_raster(page, INK_PAGE_SCREEN_DPI, colorspace="gray")
+    Hs, Ws = gray.shape[:2]
+    integral = np.zeros((Hs + 1, Ws + 1), dtype=np.int64)
+    integral[1:, 1:] = (gray < INK_PAGE_DARK_LEVEL).cumsum(0).cumsum(1)
+    sx, sy = Ws / rect.width, Hs / rect.height
+
+    def ink_of(r) -> Tuple[int, float]:
+        x0, x1 = int((r.x0 - rect.x0) * sx), int(math.ceil((r.x1 - rect.x0) * sx))
+        y0, y1 = int((r.y0 - rect.y0) * sy), int(math.ceil((r.y1 - rect.y0) * sy))
+        x0, y0 = max(0, x0), max(0, y0)
+        x1, y1 = min(Ws, max(x1, x0 + 1)), min(Hs, max(y1, y0 + 1))
+        ink = int(integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0])
+        return ink, ink / max(1, (x1 - x0) * (y1 - y0))
+
+    min_cell_pts = min_cell_mm / PT_TO_MM
+
+    def children_of(node):
+        _, _, depth, gx, gy, path, r = node
+        mx, my = (r.x0 + r.x1) / 2, (r.y0 + r.y1) / 2
+        quads = [fitz.Rect(r.x0, r.y0, mx, my), fitz.Rect(mx, r.y0, r.x1, my),
+                 fitz.Rect(r.x0, my, mx, r.y1), fitz.Rect(mx, my, r.x1, r.y1)]
+        kids = []
+        for i, q in enumerate(quads):
+            ink, ratio = ink_of(q)
+            if ink > 0:
+                kids.append((-ink, ratio, depth + 1, gx * 2 + i % 2, gy * 2 + i // 2, path + (i + 1,), q))
+        return kids
+
+    root_ink, root_ratio = ink_of(rect)
+    heap = [(-root_ink, root_ratio, 0, 0, 0, (), rect)]
+    leaves = []
+    count = 1 if root_ink > 0 else 0
+    while heap:
+        node = heapq.heappop(heap)
+        neg_ink, ratio, depth, _, _, _, r = node
+        can_split = (depth < max_depth and ratio >= split_ratio
+                     and min(r.width, r.height) / 2 >= min_cell_pts)
+        kids = children_of(node) if can_split else []
+        if kids and count - 1 + len(kids) <= max_calls:
+            count += len(kids) - 1
+            for kid in kids:
+                heapq.heappush(heap, kid)
+        elif neg_ink < 0:
+            leaves.append(node)
+
+    if len(leaves) == 1 and leaves[0][2] == 0:
+        return []
+
+    quads = []
+    for _, _, depth, gx, gy, path, r in sorted(leaves, key=lambda n: n[5]):
+        if overlap_percent > 0:
+            mx, my = r.width * overlap_percent, r.height * overlap_percent
+            r = fitz.Rect(r.x0 - mx, r.y0 - my, r.x1 + mx, r.y1 + my) & rect
+        quads.append((gx, gy, r, "-".join(str(i) for i in path)))
+    return quads
+
+
 def page_quadrants(page, grid_x: int = 3, grid_y: int = 3):
     """Legacy quadrant generation - kept for backward compatibility"""
     quads_with_labels = page_quadrants_with_overlap(page, grid_x, grid_y, overlap_percent=0.0)
@@ -1126,98 +1564,120 @@ def page_quadrants(page, grid_x: int = 3, grid_y: int = 3):
     return quads
 
 
-def preprocess_image_adaptive(img_bytes: bytes, method: str = "hybrid") -> bytes:
+QUADRANT_PREPROCESS = os.getenv("QUADRANT_PREPROCESS", "true").lower() in ("1", "true", "yes")
+PREPROCESS_MIN_WIDTH = 2000  # largura mínima (px) antes do threshold
+
+
+def _resize_array(arr: np.ndarray, width: int, height: int) -> np.ndarray:
+    """Redimensiona (Lanczos) um array uint8 sem passar por PNG"""
+    if CV2_AVAILABLE:
+        return cv2.resize(arr, (width, height), interpolation=cv2.INTER_LANCZOS4)
+    return np.asarray(Image.fromarray(arr).resize((width, height), Image.LANCZOS))
+
+
+def _enhance_contrast(arr: np.ndarray, factor: float) -> np.ndarray:
+    """Equivalente numpy de ImageEnhance.Contrast para imagens em cinza"""
+    mean = int(arr.mean() + 0.5)
+    out = mean + factor * (arr.astype(np.float32) - mean)
+    return np.clip(out + 0.5, 0, 255).astype(np.uint8)
+
+
+def _enhance_sharpness(arr: np.ndarray, factor: float) -> np.ndarray:
+    return np.asarray(ImageEnhance.Sharpness(Image.fromarray(arr)).enhance(factor))
+
+
+def preprocess_array(gray: np.ndarray, method: str = "hybrid", upscale: bool = True) -> np.ndarray:
     """
-    Adaptive image preprocessing with multiple methods.
-    
+    Adaptive preprocessing on a grayscale uint8 array (no intermediate encodes).
+
     Args:
-        img_bytes: Raw image bytes
-        method: Preprocessing method - "hybrid" (grayscale + enhanced + adaptive), 
+        gray: HxW uint8 array (e.g. a read-only view from the raster cache; never modified)
+        method: Preprocessing method - "hybrid" (grayscale + enhanced + adaptive),
                 "binary" (old fixed threshold), "grayscale" (contrast enhanced only)
-    
+        upscale: Apply the final 2x upscale (skip when the payload encoder sets the size)
+
     Returns:
-        Preprocessed image bytes
+        New preprocessed HxW uint8 array
     """
-    img = Image.open(io.BytesIO(img_bytes)).convert("L")
-    
+    img = np.asarray(gray)
+    if img.ndim == 3:
+        img = np.asarray(Image.fromarray(np.ascontiguousarray(img)).convert("L"))
+    h, w = img.shape[:2]
+
     # Normalize scale before upscaling for consistency
     # Target standard DPI equivalent
-    target_width = max(img.width, 2000)
-    if img.width < target_width:
-        scale_factor = target_width / img.width
-        new_size = (int(img.width * scale_factor), int(img.height * scale_factor))
-        img = img.resize(new_size, Image.LANCZOS)
-    
+    if w < PREPROCESS_MIN_WIDTH:
+        scale_factor = PREPROCESS_MIN_WIDTH / w
+        img = _resize_array(np.ascontiguousarray(img), PREPROCESS_MIN_WIDTH, int(round(h * scale_factor)))
+
     if method == "binary":
         # Old fixed threshold method (for backward compatibility)
-        img = ImageEnhance.Contrast(img).enhance(2.0)
-        img = img.point(lambda p: 255 if p > 180 else 0)
-        if img.getpixel((0, 0)) < 128:
-            img = ImageOps.invert(img)
-            
+        img = _enhance_contrast(img, 2.0)
+        img = np.where(img > 180, 255, 0).astype(np.uint8)
+        if img[0, 0] < 128:
+            img = 255 - img
+
     elif method == "grayscale":
         # Enhanced grayscale only
-        img = ImageEnhance.Contrast(img).enhance(1.5)
-        img = ImageEnhance.Sharpness(img).enhance(1.2)
-        
+        img = _enhance_sharpness(_enhance_contrast(img, 1.5), 1.2)
+
     elif method == "hybrid":
         # Hybrid approach: adaptive thresholding with morphology
         if not CV2_AVAILABLE:
             # Fallback to grayscale if OpenCV not available
             log_to_front("⚠️ OpenCV not available, falling back to grayscale preprocessing")
-            img = ImageEnhance.Contrast(img).enhance(1.5)
-            img = ImageEnhance.Sharpness(img).enhance(1.2)
+            img = _enhance_sharpness(_enhance_contrast(img, 1.5), 1.2)
         else:
-            # Convert to numpy for OpenCV operations
-            img_np = np.array(img)
-            
             # Enhance contrast
-            img_enhanced = ImageEnhance.Contrast(img).enhance(1.5)
-            img_np = np.array(img_enhanced)
-            
+            img_np = _enhance_contrast(img, 1.5)
+
             # Apply adaptive thresholding (block-based)
             # Use Gaussian adaptive threshold for better handling of varying lighting
             binary = cv2.adaptiveThreshold(
-                img_np, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                img_np, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
                 cv2.THRESH_BINARY, 15, 2
             )
-            
+
             # Light morphological operations to preserve thin lines
             # Use smaller kernel to avoid losing small symbols
             kernel = np.ones((2, 2), np.uint8)
-            
+
             # Opening to remove small noise
             opened = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel, iterations=1)
-            
+
             # Closing to connect nearby components (only if it helps)
             # Use very conservative closing to avoid merging separate symbols
             kernel_close = np.ones((2, 2), np.uint8)
             closed = cv2.morphologyEx(opened, cv2.MORPH_CLOSE, kernel_close, iterations=1)
-            
+
             # Check if background is dark (invert if needed)
             if np.mean(closed) < 128:
                 closed = cv2.bitwise_not(closed)
-            
-            # Convert back to PIL
-            img = Image.fromarray(closed)
-    
+            img = closed
+
     else:
         raise ValueError(f"Unknown preprocessing method: {method}")
-    
+
+    if not upscale:
+        return img
     # Final upscale to 2x for better detail
-    img = img.resize((img.width * 2, img.height * 2), Image.LANCZOS)
-    
-    out = io.BytesIO()
-    img.save(out, format="PNG", optimize=False)
-    result = out.getvalue()
-    
-    # Validate the PNG can be read back
-    try:
-        Image.open(io.BytesIO(result))
-    except Exception as e:
-        raise ValueError(f"Generated invalid PNG: {e}")
-    
-    return result
+    h, w = img.shape[:2]
+    return _resize_array(np.ascontiguousarray(img), w * 2, h * 2)
+
+
+def preprocess_image_adaptive(img_bytes: bytes, method: str = "hybrid") -> bytes:
+    """
+    Adaptive image preprocessing with multiple methods (bytes in, PNG out).
+
+    Args:
+        img_bytes: Raw image bytes
+        method: Preprocessing method - see preprocess_array
+
+    Returns:
+        Preprocessed PNG bytes
+    """
+    gray = np.asarray(Image.open(io.BytesIO(img_bytes)).convert("L"))
+    return array_to_png(preprocess_array(gray, method))
 
 
 def preprocess_image(img_bytes: bytes) -> bytes:
@@ -1225,6 +1685,137 @@ def preprocess_image(img_bytes: bytes) -> bytes:
     return preprocess_image_adaptive(img_bytes, method="hybrid")
 
 
+# ============================================================
+# PAYLOAD DE IMAGEM - formato e resolução sob orçamento de bytes/tokens
+# ============================================================
+IMAGE_PAYLOAD_MAX_BYTES = int(float(os.getenv("IMAGE_PAYLOAD_MAX_KB", "1536")) * 1024)
+IMAGE_PAYLOAD_MAX_TOKENS = int(os.getenv("IMAGE_PAYLOAD_MAX_TOKENS", "0"))  # 0 = sem limite além do tamanho efetivo
+VISION_MAX_SIDE_PX = 2048   # o provedor reduz a imagem para caber em 2048x2048...
+VISION_SHORT_SIDE_PX = 768  # ...e depois o menor lado para 768 px (detail=high)
+VISION_TILE_PX = 512
+
+try:
+    from PIL import features as _pil_features
+    _WEBP_AVAILABLE = bool(_pil_features.check("webp"))
+except Exception:
+    _WEBP_AVAILABLE = False
+
+
+@dataclass
+class ImagePayload:
+    data: bytes
+    mime: str
+    fmt: str  # "png1", "png", "webp" ou "jpeg"
+    width: int
+    height: int
+    tokens: int
+
+    @property
+    def b64(self) -> str:
+        return base64.b64encode(self.data).decode("utf-8")
+
+
+def vision_effective_size(width: int, height: int) -> Tuple[int, int]:
+    """Dimensões que o modelo efetivamente vê após o redimensionamento do provedor"""
+    scale = min(1.0, VISION_MAX_SIDE_PX / max(width, height))
+    scale *= min(1.0, VISION_SHORT_SIDE_PX / max(1.0, min(width, height) * scale))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """Estimativa de tokens de imagem (detail=high): 85 + 170 por tile de 512 px"""
+    w, h = vision_effective_size(width, height)
+    return 85 + 170 * math.ceil(w / VISION_TILE_PX) * math.ceil(h / VISION_TILE_PX)
+
+
+def _is_bilevel(arr: np.ndarray) -> bool:
+    """Imagem praticamente preto-e-branco (ex.: saída do threshold adaptativo)"""
+    if arr.ndim != 2:
+        return False
+    mid = np.count_nonzero((arr > 32) & (arr < 224))
+    return mid <= arr.size * 0.01
+
+
+def _downscale_array(arr: np.ndarray, width: int, height: int, bilevel: bool) -> np.ndarray:
+    if CV2_AVAILABLE:
+        out = cv2.resize(np.ascontiguousarray(arr), (width, height), interpolation=cv2.INTER_AREA)
+    else:
+        out = np.asarray(Image.fromarray(np.ascontiguousarray(arr)).resize((width, height), Image.BOX))
+    if bilevel:
+        # limiar alto preserva traços finos que ficam cinza após a redução
+        out = np.where(out < 192, 0, 255).astype(np.uint8)
+    return out
+
+
+def _encode_image(arr: np.ndarray, fmt: str, quality: int = 85) -> bytes:
+    img = Image.fromarray(np.ascontiguousarray(arr))
+    buffer = io.BytesIO()
+    if fmt == "png1":
+        img.convert("1", dither=Image.NONE).save(buffer, format="PNG")
+    elif fmt == "png":
+        img.save(buffer, format="PNG")
+    elif fmt == "webp":
+        img.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+_IMAGE_MIME = {"png1": "image/png", "png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+
+def encode_image_payload(arr: np.ndarray, max_bytes: int = IMAGE_PAYLOAD_MAX_BYTES,
+                         max_tokens: int = IMAGE_PAYLOAD_MAX_TOKENS, allow_resize: bool = True,
+                         label: str = "") -> ImagePayload:
+    """
+    Escolhe representação e dimensões da imagem enviada ao LLM dentro do orçamento.
+
+    - Imagens binarizadas viram PNG de 1 bit; as demais tentam PNG (sem perdas),
+      depois WebP e JPEG com qualidade decrescente.
+    - Com allow_resize, a imagem é reduzida ao tamanho que o modelo efetivamente vê
+      (enviar mais pixels só aumenta o upload), depois até caber em max_tokens e,
+      se nenhum formato couber em max_bytes, em passos de 20%.
+    - Sem allow_resize (prompts que citam dimensões em pixels), só o formato muda.
+    """
+    arr = np.asarray(arr)
+    h, w = arr.shape[:2]
+    bilevel = _is_bilevel(arr)
+
+    tw, th = (w, h)
+    if allow_resize:
+        tw, th = vision_effective_size(w, h)
+        while max_tokens and estimate_image_tokens(tw, th) > max_tokens and min(tw, th) > 64:
+            tw, th = int(tw * 0.9), int(th * 0.9)
+
+    if bilevel:
+        candidates = [("png1", 0)]
+    else:
+        candidates = [("png", 0), ("webp", 90), ("jpeg", 85), ("webp", 75), ("jpeg", 65)]
+        if not _WEBP_AVAILABLE:
+            candidates = [c for c in candidates if c[0] != "webp"]
+
+    best: Optional[ImagePayload] = None
+    while True:
+        img = arr if (tw, th) == (w, h) else _downscale_array(arr, tw, th, bilevel)
+        for fmt, quality in candidates:
+            data = _encode_image(img, fmt, quality)
+            payload = ImagePayload(data, _IMAGE_MIME[fmt], fmt, tw, th, estimate_image_tokens(tw, th))
+            if best is None or len(data) < len(best.data):
+                best = payload
+            if len(data) <= max_bytes:
+                best = payload
+                break
+        if len(best.data) <= max_bytes or not allow_resize or min(tw, th) <= 256:
+            break
+        tw, th = int(tw * 0.8), int(th * 0.8)
+
+    if len(best.data) > max_bytes:
+        log_to_front(f"   ⚠️ Payload {label} acima do orçamento ({len(best.data)/1024:.0f} KB > {max_bytes/1024:.0f} KB)")
+    log_to_front(f"   📦 Payload {label}: {best.fmt} {best.width}x{best.height} | "
+                 f"{len(best.data)/1024:.0f} KB | ≈{best.tokens} tokens de imagem")
+    return best
+
+
 def render_quadrant_png(page, rect, dpi: int = 400, 
                         handle_rotation: bool = True) -> bytes:
     """
@@ -1280,12 +1871,8 @@ def validate_tag_with_ocr(page: fitz.Page, item: Dict[str, Any], dpi: int = 300,
         # Clip to page bounds
         rect = rect & page.rect
         
-        # Render region
-        pix = page.get_pixmap(dpi=dpi, clip=rect)
-        img_bytes = pix.tobytes("png")
-        
-        # Convert to PIL Image
-        img = Image.open(io.BytesIO(img_bytes))
+        # Render region (recorte do cache de raster quando disponível)
+        img = Image.fromarray(np.ascontiguousarray(page_raster(page, dpi, clip=rect, colorspace="gray")))
         
         # Perform OCR
         ocr_text = pytesseract.image_to_string(img, config='--psm 6')
@@ -1350,44 +1937,9 @@ def validate_symbol_type(item: Dict[str, Any], description: str) -> Dict[str, An
         Validation result with matched type and confidence
     """
     tag = str(item.get("tag", "")).strip().upper()
-    desc_lower = description.lower()
-    
-    # ISA S5.1 standard instrument tags
-    instrument_types = {
-        "PT": ["pressure", "transmitter", "transmissor de pressão", "pressão"],
-        "TT": ["temperature", "transmitter", "transmissor de temperatura", "temperatura"],
-        "FT": ["flow", "transmitter", "transmissor de vazão", "vazão"],
-        "LT": ["level", "transmitter", "transmissor de nível", "nível"],
-        "PI": ["pressure", "indicator", "indicador de pressão"],
-        "TI": ["temperature", "indicator", "indicador de temperatura"],
-        "FI": ["flow", "indicator", "indicador de vazão"],
-        "LI": ["level", "indicator", "indicador de nível"],
-        "PSV": ["pressure", "safety", "valve", "válvula de segurança", "alívio"],
-        "FCV": ["flow", "control", "valve", "válvula de controle de vazão"],
-        "PCV": ["pressure", "control", "valve", "válvula de controle de pressão"],
-        "TCV": ["temperature", "control", "valve", "válvula de controle de temperatura"],
-        "LCV": ["level", "control", "valve", "válvula de controle de nível"],
-    }
     
-    # Equipment tags
-    equipment_types = {
-        "P": ["pump", "bomba"],
-        "T": ["tank", "tanque"],
-        "TK": ["tank", "tanque"],
-        "V": ["vessel", "vaso", "vasel"],
-        "E": ["exchanger", "heat", "trocador"],
-        "R": ["reactor", "reator"],
-        "C": ["compressor", "column", "tower", "compressor", "coluna", "torre"],
-        "K": ["compressor", "compressor"],
-        "F": ["furnace", "forno"],
-    }
-    
-    # Extract prefix from TAG
-    tag_prefix = ""
-    for prefix in sorted(list(instrument_types.keys()) + list(equipment_types.keys()), key=len, reverse=True):
-        if tag.startswith(prefix):
-            tag_prefix = prefix
-            break
+    # Extract prefix from TAG (mais longo entre kwc.INSTRUMENT_TYPES e kwc.EQUIPMENT_TYPES)
+    tag_prefix = kwc.tag_type_prefix(tag)
     
     if not tag_prefix:
         return {
@@ -1400,10 +1952,11 @@ def validate_symbol_type(item: Dict[str, Any], description: str) -> Dict[str, An
         }
     
     # Get expected keywords
-    expected_keywords = instrument_types.get(tag_prefix) or equipment_types.get(tag_prefix) or []
+    expected_keywords = list(kwc.INSTRUMENT_TYPES.get(tag_prefix) or kwc.EQUIPMENT_TYPES.get(tag_prefix) or [])
     
     # Check if any keyword appears in description
-    found_keywords = [kw for kw in expected_keywords if kw in desc_lower]
+    hits = kwc.classify_description(description.lower())
+    found_keywords = [kw for kw in expected_keywords if kw in hits]
     
     # Calculate confidence
     if found_keywords:
@@ -1459,13 +2012,10 @@ def refine_geometric_center(page: fitz.Page, item: Dict[str, Any],
         # Clip to page bounds
         rect = rect & page.rect
         
-        # Render region
-        pix = page.get_pixmap(dpi=dpi, clip=rect)
-        img_bytes = pix.tobytes("png")
-        
-        # Convert to numpy array
-        img = Image.open(io.BytesIO(img_bytes)).convert('L')
-        img_array = np.array(img)
+        # Render region (recorte do cache de raster quando disponível)
+        img_array = np.ascontiguousarray(page_raster(page, dpi, clip=rect, colorspace="gray"))
+        # Origem do recorte em pixels, na mesma grade usada pelo cache
+        px_x0, px_y0, _, _ = clip_to_pixels(rect, dpi)
         
         # Create binary mask using adaptive thresholding
         if not CV2_AVAILABLE:
@@ -1503,9 +2053,9 @@ def refine_geometric_center(page: fitz.Page, item: Dict[str, Any],
         centroid_y, centroid_x = largest_region.centroid
         
         # Convert centroid from image coordinates to global coordinates
-        # Image coordinates are relative to search rectangle
-        centroid_x_pts = rect.x0 + (centroid_x / img.width) * rect.width
-        centroid_y_pts = rect.y0 + (centroid_y / img.height) * rect.height
+        # Image coordinates are relative to the clipped pixel box
+        centroid_x_pts = (px_x0 + centroid_x) * 72 / dpi
+        centroid_y_pts = (px_y0 + centroid_y) * 72 / dpi
         
         # Convert to mm
         refined_x_mm = points_to_mm(centroid_x_pts)
@@ -1570,9 +2120,49 @@ def refine_geometric_center(page: fitz.Page, item: Dict[str, Any],
 # PROMPT BUILDER
 # ============================================================
 def build_prompt(width_mm: float, height_mm: float, scope: str = "global", origin=(0, 0), quad_label: str = "", diagram_type: str = "pid") -> str:
+    """
+    Prompt de extração = prefixo estático compilado por (diagram_type, scope), idêntico
+    byte a byte em todas as chamadas (cache de prefixo do provedor), + sufixo curto com
+    os valores desta chamada (dimensões e quadrante).
+    """
     if height_mm > width_mm:
         width_mm, height_mm = height_mm, width_mm
 
+    compiled = compile_extraction_prompt(diagram_type, scope)
+    if scope == "global":
+        suffix = f"""
+DIMENSÕES DESTA IMAGEM (página completa):
+- Dimensões da imagem: {width_mm} mm (largura X) x {height_mm} mm (altura Y)
+- X: 0.0 (extrema esquerda) até {width_mm} (extrema direita)
+- Y: 0.0 (topo da página) até {height_mm} (base da página)
+"""
+    else:  # quadrant
+        suffix = f"""
+DIMENSÕES DESTA IMAGEM (quadrante {quad_label}):
+- VOCÊ ESTÁ ANALISANDO APENAS O QUADRANTE {quad_label} DA PÁGINA COMPLETA
+- Dimensões DESTE QUADRANTE: {width_mm} mm (largura X) x {height_mm} mm (altura Y)
+- X: 0.0 (extrema esquerda do quadrante) até {width_mm} (extrema direita do quadrante)
+- Y: 0.0 (topo do quadrante) até {height_mm} (base do quadrante)
+"""
+    return compiled.render(suffix)
+
+
+def compile_extraction_prompt(diagram_type: str = "pid", scope: str = "global") -> CompiledPrompt:
+    """Prefixo do prompt de extração, compilado uma vez por (diagram_type, scope)"""
+    diagram_type = "electrical" if diagram_type.lower() == "electrical" else "pid"
+    scope = "global" if scope == "global" else "quadrant"
+    return prompt_registry.compile(("extraction", diagram_type, scope),
+                                   lambda: _build_prompt_prefix(diagram_type, scope), _log_compiled_prompt)
+
+
+def _log_compiled_prompt(compiled: CompiledPrompt) -> None:
+    label = "/".join(str(part) for part in compiled.key)
+    log_to_front(f"🧩 Prompt compilado ({label}): prefixo estático de {compiled.prefix_tokens} tokens"
+                 f"{'' if compiled.cacheable else ' (abaixo do mínimo do cache de prefixo)'}")
+
+
+def _build_prompt_prefix(diagram_type: str, scope: str) -> str:
+    """Instruções estáticas do prompt de extração (sem valores por chamada)"""
     # Determine the type of diagram we're analyzing
     is_electrical = diagram_type.lower() == "electrical"
     
@@ -1592,25 +2182,21 @@ Você é um engenheiro especialista em {diagram_description}.
 
 {analysis_type}"""
     
+    # Dimensões e limites de X/Y ficam no sufixo dinâmico (fim do prompt)
     if scope == "global":
-        base += f"""
-- Dimensões da imagem: {width_mm} mm (largura X) x {height_mm} mm (altura Y)
+        base += """
 - Sistema de coordenadas: ABSOLUTO da página completa
 - Origem: Topo superior esquerdo é o ponto (0, 0)
 - Orientação: X crescente da esquerda para direita, Y crescente de cima para baixo
-- X: 0.0 (extrema esquerda) até {width_mm} (extrema direita)
-- Y: 0.0 (topo da página) até {height_mm} (base da página)
+- Dimensões da imagem e limites de X/Y: informados em DIMENSÕES DESTA IMAGEM, ao final
 """
     else:  # quadrant
-        ox, oy = origin
-        base += f"""
-- VOCÊ ESTÁ ANALISANDO APENAS O QUADRANTE {quad_label} DA PÁGINA COMPLETA
-- Dimensões DESTE QUADRANTE: {width_mm} mm (largura X) x {height_mm} mm (altura Y)
+        base += """
+- VOCÊ ESTÁ ANALISANDO APENAS UM QUADRANTE DA PÁGINA COMPLETA
 - Sistema de coordenadas: LOCAL ao quadrante que você vê
 - Origem: Topo superior esquerdo é o ponto (0, 0) DO QUADRANTE
 - Orientação: X crescente da esquerda para direita, Y crescente de cima para baixo
-- X: 0.0 (extrema esquerda do quadrante) até {width_mm} (extrema direita do quadrante)
-- Y: 0.0 (topo do quadrante) até {height_mm} (base do quadrante)
+- Dimensões do quadrante e limites de X/Y: informados em DIMENSÕES DESTA IMAGEM, ao final
 - CRÍTICO: Retorne coordenadas LOCAIS (relativas ao quadrante), NÃO globais
 - O sistema converterá automaticamente para coordenadas globais da página completa
 """
@@ -1733,10 +2319,10 @@ REGRAS CRÍTICAS PARA EXTRAÇÃO:
    **ATENÇÃO ESPECIAL AO EIXO Y:**
    - O eixo Y NÃO está invertido - Y cresce de cima para baixo (padrão de imagem)
    - Y = 0.0 está no TOPO da imagem/quadrante
-   - Y = {height_mm} está na BASE da imagem/quadrante
+   - Y máximo (altura informada ao final) está na BASE da imagem/quadrante
    - NUNCA inverta coordenadas Y - use a posição visual direta
-   - Exemplo: Um equipamento no topo da imagem tem Y próximo de 0, não de {height_mm}
-   - Exemplo: Um equipamento na base da imagem tem Y próximo de {height_mm}, não de 0
+   - Exemplo: Um equipamento no topo da imagem tem Y próximo de 0, não da altura máxima
+   - Exemplo: Um equipamento na base da imagem tem Y próximo da altura máxima, não de 0
 
 2. VALIDAÇÃO DE COORDENADAS (OBRIGATÓRIA):
    - Antes de retornar coordenadas, SEMPRE verifique se fazem sentido visualmente
@@ -1867,22 +2453,22 @@ IMPORTANTE SOBRE COORDENADAS:
 - Exemplo: Para uma bomba centralizada em (234.5, 567.8), NÃO use (234, 567) ou (235, 568)
 
 [
-  {{
+  {
     "tag": "P-101",
     "descricao": "Bomba Centrífuga",
     "x_mm": 234.5,
     "y_mm": 567.8,
     "from": "T-101",
     "to": "E-201"
-  }},
-  {{
+  },
+  {
     "tag": "PI-9039",
     "descricao": "Indicador de Pressão",
     "x_mm": 245.2,
     "y_mm": 555.3,
     "from": "P-101",
     "to": "N/A"
-  }}
+  }
 ]
 
 RETORNE SOMENTE O ARRAY JSON. Não inclua texto adicional, markdown ou explicações."""
@@ -1927,89 +2513,296 @@ def build_prompt_electrical_tile(page_idx:int, ox:int, oy:int, tile_w_px:int, ti
 # ============================================================
 # LLM CALL
 # ============================================================
-def llm_call(image_b64: str, prompt: str, prefer_model: str = PRIMARY_MODEL):
-    global client
-    
-    if prefer_model == "gpt-5":
+async def _submit_with_usage(kind: str, model: str, call, est_tokens: int, image_tokens: int, job_id: str,
+                             stats: Optional[Dict[str, Any]] = None, on_dispatch: Optional[Callable[[], None]] = None):
+    """
+    scheduler.submit no loop de I/O + registro de tokens, latência e retentativas no job.
+    stats recebe queue_s/service_s do scheduler (saúde e hedge medem só o atendimento).
+    """
+    stats = stats if stats is not None else {}
+    started = time.perf_counter()
+    try:
+        resp = await run_llm(scheduler.submit(model, call, est_tokens, job_id, stats=stats, on_dispatch=on_dispatch))
+    except Exception:
+        usage_ledger.record(kind, model, latency_s=time.perf_counter() - started, retries=stats.get("retries", 0),
+                            image_tokens=image_tokens, error=True, job_id=job_id)
+        raise
+    usage_ledger.record(kind, model, resp, latency_s=time.perf_counter() - started, retries=stats.get("retries", 0),
+                        image_tokens=image_tokens, job_id=job_id)
+    return resp
+
+
+async def chat_completion(image_tokens: int = 0, kind: str = "vision", stats: Optional[Dict[str, Any]] = None,
+                          on_dispatch: Optional[Callable[[], None]] = None, **kwargs):
+    """
+    chat.completions.create no cliente compartilhado, passando pelo scheduler global
+    (fila justa por job, limite de concorrência, token buckets por modelo e headers
+    de rate limit). Em erro SSL, passa o cliente do processo para conexão sem
+    verificação (uma única vez) e tenta novamente. O uso (tokens, latência,
+    retentativas) é registrado no job atual como `kind`.
+    """
+    kwargs.setdefault("timeout", OPENAI_REQUEST_TIMEOUT)
+    est_tokens = estimate_request_tokens(kwargs.get("messages"), image_tokens)
+    job_id = current_job_id.get()
+
+    def call():
+        # Retentativas (429/5xx) ficam com o scheduler, que lê os headers de rate limit
+        return get_client().with_options(max_retries=0).chat.completions.with_raw_response.create(**kwargs)
+
+    try:
+        return await _submit_with_usage(kind, kwargs["model"], call, est_tokens, image_tokens, job_id, stats, on_dispatch)
+    except Exception as e:
+        if not is_ssl_error(e):
+            raise
+        log_to_front(f"⚠️ {kwargs.get('model')} falhou com erro SSL: {e!r}")
+        log_to_front("🔄 Tentando novamente sem verificação SSL...")
+        disable_ssl_verification()
+        return await _submit_with_usage(kind, kwargs["model"], call, est_tokens, image_tokens, job_id, stats, on_dispatch)
+
+
+class LLMStreamInterrupted(Exception):
+    """Stream interrompido depois de itens já entregues (não é repetido nem troca de modelo)"""
+
+    def __init__(self, cause: BaseException, emitted: int):
+        super().__init__(f"stream interrompido após {emitted} itens: {cause!r}")
+        self.cause = cause
+        self.emitted = emitted
+
+
+class _StreamedResponse:
+    """Resposta "raw" para o scheduler: headers do provedor + completion remontada do stream"""
+
+    def __init__(self, headers: Any, completion: ChatCompletion):
+        self.headers = headers
+        self._completion = completion
+
+    def parse(self) -> ChatCompletion:
+        return self._completion
+
+
+async def chat_completion_stream(on_item: Callable[[Any], None], image_tokens: int = 0,
+                                 stats: Optional[Dict[str, Any]] = None, on_dispatch: Optional[Callable[[], None]] = None,
+                                 **kwargs):
+    """
+    chat_completion com stream=True. O stream é consumido no loop de I/O (ocupando o
+    slot do scheduler até o fim) e cada elemento do array JSON é entregue a on_item no
+    event loop de quem chamou, assim que o objeto fecha. Retorna a ChatCompletion
+    remontada (conteúdo completo, finish_reason, usage), como chat_completion.
+    """
+    kwargs.setdefault("timeout", OPENAI_REQUEST_TIMEOUT)
+    est_tokens = estimate_request_tokens(kwargs.get("messages"), image_tokens)
+    job_id = current_job_id.get()
+    caller_loop = asyncio.get_running_loop()
+    emitted = 0
+
+    async def call():
+        nonlocal emitted
+        raw = await get_client().with_options(max_retries=0).chat.completions.with_raw_response.create(
+            stream=True, stream_options={"include_usage": True}, **kwargs
+        )
+        stream = await raw.parse()
+        parser = JsonArrayStreamParser()
+        parts: List[str] = []
+        meta: Dict[str, Any] = {}
+        finish_reason, usage = None, None
         try:
-            resp = client.chat.completions.create(
-                model="gpt-5",
-                messages=[{
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_b64}"}}
-                    ]
-                }],
-                timeout=OPENAI_REQUEST_TIMEOUT
-            )
-            return "gpt-5", resp
+            async for chunk in stream:
+                meta.setdefault("id", chunk.id)
+                meta.setdefault("created", chunk.created)
+                meta.setdefault("model", chunk.model)
+                if getattr(chunk, "usage", None) is not None:
+                    usage = chunk.usage.model_dump()
+                for choice in chunk.choices or []:
+                    delta = choice.delta.content if choice.delta else None
+                    if delta:
+                        parts.append(delta)
+                        for item in parser.feed(delta):
+                            emitted += 1
+                            caller_loop.call_soon_threadsafe(on_item, item)
+                    if choice.finish_reason:
+                        finish_reason = choice.finish_reason
         except Exception as e:
-            # Check if it's an SSL error and retry without SSL verification
-            if "SSL" in str(e) or "certificate" in str(e).lower():
-                log_to_front(f"⚠️ gpt-5 falhou com erro SSL: {e!r}")
-                log_to_front("🔄 Tentando novamente sem verificação SSL...")
-                client = make_client(verify_ssl=False)
-                try:
-                    resp = client.chat.completions.create(
-                        model="gpt-5",
-                        messages=[{
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": prompt},
-                                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_b64}"}}
-                            ]
-                        }],
-                        timeout=OPENAI_REQUEST_TIMEOUT
-                    )
-                    return "gpt-5", resp
-                except Exception as e2:
-                    log_to_front(f"⚠️ gpt-5 falhou novamente: {e2!r}")
-            else:
-                log_to_front(f"⚠️ gpt-5 falhou: {e!r}")
-    
+            # Itens já entregues: o scheduler não pode repetir a chamada
+            if emitted:
+                raise LLMStreamInterrupted(e, emitted) from e
+            raise
+        completion = ChatCompletion.model_validate({
+            "id": meta.get("id") or f"chatcmpl-stream-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": meta.get("created") or int(time.time()),
+            "model": meta.get("model") or kwargs["model"],
+            # Sem finish_reason o stream terminou antes da hora: "length" (não entra no cache)
+            "choices": [{"index": 0, "finish_reason": finish_reason or "length",
+                         "message": {"role": "assistant", "content": "".join(parts)}}],
+            "usage": usage,
+        })
+        return _StreamedResponse(raw.headers, completion)
+
     try:
-        resp = client.chat.completions.create(
-            model=FALLBACK_MODEL,
-            messages=[{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_b64}"}}
-                ]
-            }],
-            temperature=0,
-            timeout=OPENAI_REQUEST_TIMEOUT
-        )
-        return FALLBACK_MODEL, resp
+        return await _submit_with_usage("vision", kwargs["model"], call, est_tokens, image_tokens, job_id,
+                                        stats, on_dispatch)
     except Exception as e:
-        # Check if it's an SSL error and retry without SSL verification
-        if "SSL" in str(e) or "certificate" in str(e).lower():
-            log_to_front(f"❌ Fallback {FALLBACK_MODEL} falhou com erro SSL: {e!r}")
-            log_to_front("🔄 Tentando novamente sem verificação SSL...")
-            client = make_client(verify_ssl=False)
+        if emitted or not is_ssl_error(e):
+            raise
+        log_to_front(f"⚠️ {kwargs.get('model')} falhou com erro SSL: {e!r}")
+        log_to_front("🔄 Tentando novamente sem verificação SSL...")
+        disable_ssl_verification()
+        return await _submit_with_usage("vision", kwargs["model"], call, est_tokens, image_tokens, job_id,
+                                        stats, on_dispatch)
+
+
+def build_vision_messages(prompt: str, image_b64: str, mime: str = "image/png") -> List[Dict[str, Any]]:
+    """Mensagem única com prompt + imagem (data URL), usada nas chamadas diretas e no modo batch"""
+    return [{
+        "role": "user",
+        "content": [
+            {"type": "text", "text": prompt},
+            {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{image_b64}"}}
+        ]
+    }]
+
+
+async def llm_call(image_b64: str, prompt: str, prefer_model: str = PRIMARY_MODEL, mime: str = "image/png",
+                   image_tokens: int = 765, on_item: Optional[Callable[[Any], None]] = None):
+    """
+    Chamada de visão com cache, cascata de modelos (circuit breaker) e hedge opcional.
+    Com on_item, a resposta vem em streaming e cada elemento do array JSON é entregue
+    a on_item assim que fecha (sem hedge; em acerto de cache todos são entregues de uma
+    vez). Um stream interrompido depois do primeiro item não troca de modelo: os itens
+    já foram entregues e LLMStreamInterrupted é propagado para quem chamou.
+    """
+    messages = build_vision_messages(prompt, image_b64, mime)
+
+    # Cascata de modelos: (modelo, parâmetros de geração)
+    attempts = [("gpt-5", {})] if prefer_model == "gpt-5" else []
+    attempts.append((FALLBACK_MODEL, {"temperature": 0}))
+    keys = [cache_key(model, prompt, f"{mime};{image_b64}", params) for model, params in attempts]
+
+    # Mesma imagem + prompt + modelo + parâmetros: reutiliza a resposta salva
+    for (model, _), key in zip(attempts, keys):
+        cached = await asyncio.to_thread(llm_cache.get, key)
+        if cached is not None:
             try:
-                resp = client.chat.completions.create(
-                    model=FALLBACK_MODEL,
-                    messages=[{
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_b64}"}}
-                        ]
-                    }],
-                    temperature=0,
-                    timeout=OPENAI_REQUEST_TIMEOUT
-                )
-                return FALLBACK_MODEL, resp
-            except Exception as e2:
-                log_to_front(f"❌ Fallback {FALLBACK_MODEL} falhou novamente: {e2!r}")
-                traceback.print_exc()
-                raise
-        else:
-            log_to_front(f"❌ Fallback {FALLBACK_MODEL} falhou: {e!r}")
+                resp = ChatCompletion.model_validate_json(cached)
+            except ValueError as e:
+                log_to_front(f"⚠️ Entrada inválida no cache LLM ignorada: {e!r}")
+                continue
+            usage_ledger.record("vision", model, resp, image_tokens=image_tokens, cache_hit=True)
+            if on_item is not None:
+                for item in ensure_json_list(resp.choices[0].message.content if resp.choices else ""):
+                    on_item(item)
+            return model, resp
+
+    for i, ((model, params), key) in enumerate(zip(attempts, keys)):
+        is_last = i == len(attempts) - 1
+        # Disjuntor aberto: vai direto para o fallback (o último modelo é sempre tentado)
+        if not model_breakers.get(model).allow() and not is_last:
+            log_to_front(f"⏭️ {model} em cooldown (circuit breaker) - usando {attempts[i + 1][0]}")
+            continue
+        try:
+            if on_item is None:
+                model_used, resp = await _hedged_completion(model, params, image_tokens, messages)
+            else:
+                model_used, resp = model, await _timed_completion(model, params, image_tokens, messages, on_item)
+        except LLMStreamInterrupted as e:
+            log_to_front(f"❌ Stream de {model} interrompido após {e.emitted} itens: {e.cause!r}")
+            raise
+        except Exception as e:
+            if not is_last:
+                log_to_front(f"⚠️ {model} falhou: {e!r}")
+                continue
+            log_to_front(f"❌ Fallback {model} falhou: {e!r}")
             traceback.print_exc()
             raise
+        if model_used != model:
+            key = cache_key(model_used, prompt, f"{mime};{image_b64}", {"temperature": 0})
+        await _store_llm_response(key, model_used, resp)
+        return model_used, resp
+
+
+async def _timed_completion(model: str, params: Dict[str, Any], image_tokens: int, messages: List[Dict[str, Any]],
+                            on_item: Optional[Callable[[Any], None]] = None,
+                            on_dispatch: Optional[Callable[[], None]] = None):
+    """
+    chat_completion (ou chat_completion_stream) com registro de saúde (circuit breaker) e
+    latência do modelo. A latência é a do atendimento (scheduler: service_s), sem a espera
+    na fila, nos token buckets ou no backoff: fila longa não é sinal de modelo lento.
+    """
+    breaker = model_breakers.get(model)
+    stats: Dict[str, Any] = {}
+    started = time.perf_counter()
+    try:
+        if on_item is None:
+            resp = await chat_completion(image_tokens, stats=stats, on_dispatch=on_dispatch,
+                                         model=model, messages=messages, **params)
+        else:
+            resp = await chat_completion_stream(on_item, image_tokens, stats=stats, on_dispatch=on_dispatch,
+                                                model=model, messages=messages, **params)
+    except Exception as e:
+        if is_transient_error(e.cause if isinstance(e, LLMStreamInterrupted) else e):
+            breaker.record_failure()
+        else:
+            breaker.release()
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    latency = stats.get("service_s", time.perf_counter() - started)
+    breaker.record_success(latency)
+    hedge_policy.latency.record(model, latency)
+    return resp
+
+
+async def _hedged_completion(model: str, params: Dict[str, Any], image_tokens: int,
+                             messages: List[Dict[str, Any]]) -> Tuple[str, Any]:
+    """
+    Chamada com hedge opcional: passado o percentil de latência do modelo desde o despacho
+    pelo scheduler, envia uma cópia (mesmo modelo ou fallback); a primeira resposta com
+    JSON válido vence.
+    """
+    if hedge_policy.target == "fallback" and model != FALLBACK_MODEL:
+        hedge_model, hedge_params = FALLBACK_MODEL, {"temperature": 0}
+    else:
+        hedge_model, hedge_params = model, params
+    job_id = current_job_id.get()
+
+    def acquire() -> bool:
+        if not hedge_policy.try_acquire(job_id):
+            return False
+        log_to_front(f"🪝 {model} acima do p{int(hedge_policy.percentile * 100)} de latência - hedge para {hedge_model}")
+        return True
+
+    # O prazo do hedge conta a partir do despacho pelo scheduler (evento marcado do loop de I/O)
+    dispatched = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    resp, hedged = await hedge_race(
+        lambda: _timed_completion(model, params, image_tokens, messages,
+                                  on_dispatch=lambda: loop.call_soon_threadsafe(dispatched.set)),
+        lambda: _timed_completion(hedge_model, hedge_params, image_tokens, messages),
+        hedge_policy.delay_for(model), acquire, _has_valid_json, dispatched,
+    )
+    if hedged:
+        hedge_policy.record_win()
+        return hedge_model, resp
+    return model, resp
+
+
+def _has_valid_json(resp) -> bool:
+    """Resposta com conteúdo JSON utilizável (objeto/lista completo)"""
+    content = resp.choices[0].message.content if resp and resp.choices else ""
+    return bool(content) and has_complete_json(content)
+
+
+async def _store_llm_response(key: str, model: str, resp) -> None:
+    """Salva no cache apenas respostas completas (finish_reason=stop) com conteúdo"""
+    try:
+        choice = resp.choices[0] if resp and resp.choices else None
+        if choice is None or not choice.message.content or choice.finish_reason != "stop":
+            return
+        await asyncio.to_thread(llm_cache.put, key, model, resp.model_dump_json())
+    except Exception as e:
+        log_to_front(f"⚠️ Falha ao salvar resposta no cache LLM: {e!r}")
 
 
 # === BEGIN ADD: parsers ===
@@ -2085,13 +2878,19 @@ def parse_electrical_edges(resp: Dict[str, Any], page:int, ox:int=0, oy:int=0)->
     """
     cons=[]; eps=[]
     for c in (resp or {}).get("connections",[]) or []:
-        # Add tile offset to each point in the path
-        path=[(float(pt[0]) + ox, float(pt[1]) + oy) for pt in (c.get("path") or [])]
-        cons.append(Conn(c.get("from_tag"), c.get("to_tag"), path, str(c.get("direction","undirected")), float(c.get("confidence",0))))
+        try:
+            # Add tile offset to each point in the path
+            path=[(float(pt[0]) + ox, float(pt[1]) + oy) for pt in (c.get("path") or [])]
+            cons.append(Conn(c.get("from_tag"), c.get("to_tag"), path, str(c.get("direction","undirected")), float(c.get("confidence",0) or 0)))
+        except (AttributeError, TypeError, ValueError, IndexError, KeyError):
+            continue  # conexão malformada não derruba o tile
     for e in (resp or {}).get("unresolved_endpoints",[]) or []:
-        pt=e.get("point") or [0,0]
-        # Add tile offset to endpoint
-        eps.append(Endpoint(e.get("near"), (float(pt[0]) + ox, float(pt[1]) + oy), page+1))
+        try:
+            pt=e.get("point") or [0,0]
+            # Add tile offset to endpoint
+            eps.append(Endpoint(e.get("near"), (float(pt[0]) + ox, float(pt[1]) + oy), page+1))
+        except (AttributeError, TypeError, ValueError, IndexError, KeyError):
+            continue
     return cons, eps
 # === END ADD ===
 
@@ -2109,43 +2908,44 @@ def merge_electrical_equips(dets: List[Equip])->List[Equip]:
             merged.append(best)
     # fusão por tag (mesma tag, bbox próximo)
     tagged=[m for m in merged if m.tag]; untag=[m for m in merged if not m.tag]
-    final=[]; used=set()
-    for i,a in enumerate(tagged):
-        if i in used: continue
-        cand=[a]
-        for j,b in enumerate(tagged):
-            if j<=i or j in used: continue
-            if a.tag==b.tag and a.bbox.iou(b.bbox)>0.3:
-                cand.append(b); used.add(j)
-        final.append(max(cand, key=lambda x:x.confidence))
+    final=[]
+    for g in same_tag_groups([m.tag for m in tagged], _boxes(tagged), iou_thr=0.3):
+        final.append(max((tagged[i] for i in g), key=lambda x:x.confidence))
     final.extend(untag)
     return final
 
 def merge_electrical_conns(cons: List[Conn])->List[Conn]:
-    out=[]
-    for c in cons:
-        if not any((c.from_tag==d.from_tag and c.to_tag==d.to_tag and _path_sim(c.path,d.path)>0.8) for d in out):
-            out.append(c)
-    return out
+    # descarta conexão com mesmo from/to e caminho similar (>0.8) a uma já mantida
+    keep = dedup_paths([(c.from_tag, c.to_tag) for c in cons], [c.path for c in cons], _path_sim,
+                       scale=20.0, threshold=0.8)
+    return [cons[i] for i in keep]
 
 def dedup_endpoints(eps: List[Endpoint])->List[Endpoint]:
-    out=[]
+    # endpoint a menos de 5px (em x e em y) de outro já mantido na mesma página é duplicata
+    out=[]; grids: Dict[int, UniformGrid] = {}
     for e in eps:
-        if not any(abs(e.point[0]-d.point[0])<5 and abs(e.point[1]-d.point[1])<5 and e.page==d.page for d in out):
-            out.append(e)
+        grid = grids.get(e.page)
+        x, y = e.point
+        if grid is not None and any(abs(x-px)<5 and abs(y-py)<5 for _, (px, py) in grid.within(x, y, 7.5)):
+            continue
+        if grid is None:
+            grid = grids[e.page] = UniformGrid(5.0)
+        grid.insert(x, y, (x, y))
+        out.append(e)
     return out
 
 def snap_endpoints_to_tags(cons: List[Conn], eps: List[Endpoint], eqs: List[Equip], radius: float=25.0):
-    tags=[(e.tag,e) for e in eqs if e.tag]
+    # endpoint liga ao centro do equipamento com TAG mais próximo (empate: o primeiro) dentro do raio
+    index = UniformGrid(radius if radius > 0 and math.isfinite(radius) else 1.0)
+    for i, eq in enumerate(e for e in eqs if e.tag):
+        index.insert(eq.bbox.x+eq.bbox.w/2, eq.bbox.y+eq.bbox.h/2, (i, eq))
     added=[]; leftovers=[]
     for e in eps:
-        best=None; bestd=1e9
-        for tag, eq in tags:
-            cx=eq.bbox.x+eq.bbox.w/2; cy=eq.bbox.y+eq.bbox.h/2
-            d=_pt_dist(e.point, (cx,cy))
-            if d<bestd: bestd=d; best=eq
-        if best and bestd<=radius:
-            added.append(Conn(best.tag, None, [e.point, (best.bbox.x, best.bbox.y)], "undirected", 0.5))
+        best = min(((d, i, eq) for d, (i, eq) in index.within(e.point[0], e.point[1], radius) if d < 1e9),
+                   key=lambda c: (c[0], c[1]), default=None)
+        if best:
+            eq = best[2]
+            added.append(Conn(eq.tag, None, [e.point, (eq.bbox.x, eq.bbox.y)], "undirected", 0.5))
         else:
             leftovers.append(e)
     return cons+added, leftovers
@@ -2154,52 +2954,315 @@ def snap_endpoints_to_tags(cons: List[Conn], eps: List[Endpoint], eqs: List[Equi
 # ============================================================
 # PROCESSAMENTO QUADRANTE
 # ============================================================
-async def process_quadrant(gx, gy, rect, page, W_mm, H_mm, dpi, diagram_type="pid"):
-    label = f"{gy+1}-{gx+1}"
+def annotate_quadrant_items(items: List[Any], ox: float, oy: float, w_mm: float, h_mm: float) -> List[Any]:
+    """Anota a origem e o tamanho (mm) do quadrante em cada item para a conversão para coordenadas globais"""
+    for it in items:
+        if isinstance(it, dict):
+            it["_src"] = "quadrant"
+            it["_ox_mm"] = ox
+            it["_oy_mm"] = oy
+            it["_qw_mm"] = w_mm
+            it["_qh_mm"] = h_mm
+    return items
+
+
+async def process_quadrant(gx, gy, rect, page, W_mm, H_mm, dpi, diagram_type="pid", label=None):
+    label = label or f"{gy+1}-{gx+1}"
+    ox, oy = points_to_mm(rect.x0), points_to_mm(rect.y0)
+    rect_w_mm, rect_h_mm = points_to_mm(rect.width), points_to_mm(rect.height)
+
+    log_to_front(f"🔹 Quadrant {label} | origem ≈ ({ox:.1f}, {oy:.1f}) mm | dimensões ≈ ({rect_w_mm:.1f} x {rect_h_mm:.1f}) mm")
+    try:
+        # Render + pré-processamento + codificação fora do event loop (CPU)
+        # Sem upscale final: o encoder define as dimensões enviadas (prompt em mm)
+        quad_payload = await asyncio.to_thread(
+            lambda: encode_image_payload(render_quadrant_array(page, rect, dpi, upscale=False), label=f"quadrante {label}")
+        )
+        
+        # Validate image data exists
+        if not quad_payload.data:
+            raise ValueError(f"Failed to render quadrant {label}: empty image data")
+        
+        # Passa as dimensões CORRETAS do quadrante (não da página completa)
+        prompt_q = build_prompt(rect_w_mm, rect_h_mm, "quadrant", (ox, oy), label, diagram_type)
+        model_used, resp_q = await llm_call(quad_payload.b64, prompt_q, mime=quad_payload.mime, image_tokens=quad_payload.tokens)
+        raw_q = resp_q.choices[0].message.content if resp_q and resp_q.choices else ""
+        log_to_front(f"   🔍 RAW QUADRANT {label}: {raw_q[:500]}")
+        items_q = ensure_json_list(raw_q)
+
+        annotate_quadrant_items(items_q, ox, oy, rect_w_mm, rect_h_mm)
+
+        log_to_front(f"   └─ itens Quadrant {label}: {len(items_q)}")
+        return items_q
+    except Exception as e:
+        log_to_front(f"   ❌ Erro Quadrant {label}: {e!r}")
+        return []
+
+
+async def process_quadrant_streaming(gx, gy, rect, page, page_num, W_mm, H_mm, dpi, diagram_type="pid", label=None):
+    """
+    process_quadrant com a resposta em streaming (LLM_STREAMING): cada item é convertido
+    para coordenadas da página e passa pelo matcher (build_pid_item, em thread) assim que
+    seu objeto JSON fecha. Retorna itens já prontos para assemble_pid_page(prepared_items=...).
+    """
+    label = label or f"{gy+1}-{gx+1}"
     ox, oy = points_to_mm(rect.x0), points_to_mm(rect.y0)
     rect_w_mm, rect_h_mm = points_to_mm(rect.width), points_to_mm(rect.height)
+    streamed: List[Any] = []
+    pending: List[asyncio.Future] = []
+
+    def prepare(item) -> "asyncio.Future":
+        annotate_quadrant_items([item], ox, oy, rect_w_mm, rect_h_mm)
+        return asyncio.ensure_future(asyncio.to_thread(build_pid_item, item, page_num, W_mm, H_mm, diagram_type))
+
+    def on_item(item):
+        streamed.append(dict(item) if isinstance(item, dict) else item)  # cópia antes da anotação
+        if isinstance(item, dict):
+            pending.append(prepare(item))
+
+    log_to_front(f"🔹 Quadrant {label} (stream) | origem ≈ ({ox:.1f}, {oy:.1f}) mm | dimensões ≈ ({rect_w_mm:.1f} x {rect_h_mm:.1f}) mm")
+    try:
+        quad_payload = await asyncio.to_thread(
+            lambda: encode_image_payload(render_quadrant_array(page, rect, dpi, upscale=False), label=f"quadrante {label}")
+        )
+        if not quad_payload.data:
+            raise ValueError(f"Failed to render quadrant {label}: empty image data")
+        prompt_q = build_prompt(rect_w_mm, rect_h_mm, "quadrant", (ox, oy), label, diagram_type)
+        try:
+            _, resp_q = await llm_call(quad_payload.b64, prompt_q, mime=quad_payload.mime,
+                                       image_tokens=quad_payload.tokens, on_item=on_item)
+        except LLMStreamInterrupted:
+            # Itens parciais descartados: repete a chamada completa (com fallback de modelo)
+            log_to_front(f"   🔁 Quadrant {label}: repetindo sem streaming")
+            await asyncio.gather(*pending, return_exceptions=True)
+            streamed.clear(); pending.clear()
+            _, resp_q = await llm_call(quad_payload.b64, prompt_q, mime=quad_payload.mime, image_tokens=quad_payload.tokens)
+
+        raw_q = resp_q.choices[0].message.content if resp_q and resp_q.choices else ""
+        log_to_front(f"   🔍 RAW QUADRANT {label}: {raw_q[:500]}")
+        items_q = ensure_json_list(raw_q)
+        overlapped = len(pending)
+        if streamed != items_q:
+            # A resposta completa é a referência: se o parser incremental divergiu, refaz os itens
+            await asyncio.gather(*pending, return_exceptions=True)
+            overlapped = 0
+            pending = [prepare(it) for it in items_q if isinstance(it, dict)]
+        prepared = list(await asyncio.gather(*pending))
+        log_to_front(f"   └─ itens Quadrant {label}: {len(prepared)} ({overlapped} processados durante o stream)")
+        return prepared
+    except Exception as e:
+        await asyncio.gather(*pending, return_exceptions=True)
+        log_to_front(f"   ❌ Erro Quadrant {label}: {e!r}")
+        return []
+
+
+# === BEGIN ADD: fan-out produtor/consumidor ===
+# Páginas do /analyze processadas em paralelo (passada global + quadrantes de cada página também em paralelo)
+ANALYZE_PAGE_CONCURRENCY = int(os.getenv("ANALYZE_PAGE_CONCURRENCY", "3"))
+# Tiles elétricos: render/codificação em pipeline com chamadas LLM concorrentes e memória limitada
+ELECTRICAL_TILE_CONCURRENCY = int(os.getenv("ELECTRICAL_TILE_CONCURRENCY", "6"))  # chamadas simultâneas por página
+ELECTRICAL_TILE_QUEUE = int(os.getenv("ELECTRICAL_TILE_QUEUE", "4"))              # payloads prontos aguardando envio
+
+_PIPELINE_DONE = object()
+
+
+async def pipelined_map(source: Iterable[Any], prepare: Callable[[int, Any], Any],
+                        call: Callable[[int, Any], Awaitable[Any]],
+                        concurrency: int = ELECTRICAL_TILE_CONCURRENCY,
+                        queue_size: int = ELECTRICAL_TILE_QUEUE) -> List[Any]:
+    """
+    Produtor/consumidor limitado.
+
+    O produtor itera `source` e executa `prepare(idx, item)` em uma thread, um item por vez
+    (render/codificação nunca rodam em paralelo sobre o mesmo documento). `prepare` retorna
+    None para descartar o item. `concurrency` consumidores aguardam `call(idx, preparado)`.
+    A fila tem no máximo `queue_size` itens, então a memória fica limitada a
+    queue_size + concurrency payloads independentemente do número de tiles.
+
+    Retorna os resultados na ordem da fonte (None para itens descartados).
+    """
+    workers = max(1, concurrency)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+    results: Dict[int, Any] = {}
+    it = iter(source)
+
+    async def producer() -> int:
+        idx = 0
+        while True:
+            item = await asyncio.to_thread(next, it, _PIPELINE_DONE)
+            if item is _PIPELINE_DONE:
+                break
+            prepared = await asyncio.to_thread(prepare, idx, item)
+            if prepared is not None:
+                await queue.put((idx, prepared))
+            idx += 1
+        for _ in range(workers):
+            await queue.put(_PIPELINE_DONE)
+        return idx
+
+    async def consumer() -> None:
+        while True:
+            job = await queue.get()
+            if job is _PIPELINE_DONE:
+                return
+            idx, prepared = job
+            results[idx] = await call(idx, prepared)
+
+    tasks = [asyncio.ensure_future(producer())] + [asyncio.ensure_future(consumer()) for _ in range(workers)]
+    try:
+        total = (await asyncio.gather(*tasks))[0]
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return [results.get(i) for i in range(total)]
+# === END ADD ===
+
+
+# === BEGIN ADD: ElectricalAnalyzer ===
+TILE_RESPONSE_KEYS = {"equipments", "connections", "unresolved_endpoints"}
+
+
+def parse_electrical_tile_response(raw_tile: str, pidx: int, ox: int, oy: int) -> Tuple[List[Equip], List[Conn], List[Endpoint]]:
+    """Resposta de um tile → (equipamentos, conexões, endpoints) em pixels da página"""
+    # Objeto completo {equipments, connections, unresolved_endpoints} quando houver;
+    # senão (lista ou objeto truncado) só a lista de equipamentos
+    resp_norm = next((f.value for f in scan_json_values(raw_tile or "")
+                      if isinstance(f.value, dict) and TILE_RESPONSE_KEYS & f.value.keys()), None)
+    if resp_norm is None:
+        resp_norm = {"equipments": ensure_json_list(raw_tile)}
+    elif not isinstance(resp_norm.get("equipments", []), list):
+        resp_norm = {**resp_norm, "equipments": []}
+    # Pass tile offsets to add to coordinates
+    c, e = parse_electrical_edges(resp_norm, pidx, ox, oy)
+    return parse_electrical_equips(resp_norm, pidx, ox, oy), c, e
+
+
+def new_connection_graph(page: Optional[int] = None) -> ConnectionGraph:
+    """Grafo de conexões de uma página; inserção deduplica como merge_electrical_conns"""
+    return ConnectionGraph(page, similarity=_path_sim, scale=20.0, threshold=0.8)
+
+
+def assemble_electrical_page(eqs: List[Equip], conns: Union[List[Conn], ConnectionGraph], eps_all: List[Endpoint],
+                             W_mm: float, H_mm: float, W_px_at_tiles: Optional[int], H_px_at_tiles: Optional[int],
+                             dpi_tiles: int, raw_model: Optional[str],
+                             timings: Optional[Dict[str, float]] = None) -> Tuple[List[Dict[str, Any]], ConnectionGraph, List[Endpoint]]:
+    """
+    Consolida as detecções (global + tiles) de uma página elétrica: merge/NMS, snap de
+    conexões, conversão px→mm e matcher. Bloqueante - no pipeline roda em thread;
+    também usado pelo modo batch. `conns` é o grafo da página (já deduplicado na
+    inserção dos tiles) ou uma lista de conexões. Retorna (itens, grafo, endpoints).
+    Se `timings` for passado, recebe o tempo (ms) de cada etapa.
+    """
+    timings = timings if timings is not None else {}
+    started = time.perf_counter()
+
+    def lap(stage: str):
+        nonlocal started
+        now = time.perf_counter()
+        timings[stage] = round((now - started) * 1000, 2)
+        started = now
+
+    # Deduplicação e snap
+    n_eqs, n_eps = len(eqs), len(eps_all)
+    eqs = merge_electrical_equips(eqs)
+    lap("merge_equips")
+    if isinstance(conns, ConnectionGraph):
+        graph = conns
+    else:
+        graph = new_connection_graph(eqs[0].page if eqs else None)
+        graph.extend(conns)
+    n_cons = len(graph) + graph.rejected
+    lap("merge_conns")
+    eps_all = dedup_endpoints(eps_all)
+    lap("dedup_endpoints")
+    snapped, eps_all = snap_endpoints_to_tags([], eps_all, eqs)
+    graph.extend(snapped, dedup=False)
+    lap("snap_endpoints")
+
+    # Detect diagram subtype for better matching
+    all_descriptions = " ".join([e.descricao for e in eqs])
+    diagram_subtype = detect_electrical_diagram_subtype([{"descricao": e.descricao} for e in eqs], all_descriptions)
+    log_to_front(f"⚡ Tipo de diagrama elétrico detectado: {diagram_subtype.upper()}")
+
+    # Exporta em mm e aplica matcher para SystemFullName
+    page_items = []
+    for e in eqs:
+        # Convert px->mm using ACTUAL page dimensions (no scaling to A3)
+        # This matches P&ID behavior and keeps coordinates in actual diagram space
+        if W_px_at_tiles is not None and H_px_at_tiles is not None:
+            # Convert pixels to mm in actual page space
+            x_mm = ((e.bbox.x + e.bbox.w/2) / W_px_at_tiles) * W_mm
+            y_mm = ((e.bbox.y + e.bbox.h/2) / H_px_at_tiles) * H_mm
+        else:
+            # Fallback: Use DPI-based conversion
+            x_mm = ((e.bbox.x + e.bbox.w/2) / dpi_tiles) * 25.4
+            y_mm = ((e.bbox.y + e.bbox.h/2) / dpi_tiles) * 25.4
+
+        # Round coordinates to multiples of 4mm for electrical diagrams
+        # Coordinates are in actual page dimensions (not scaled to A3)
+        x_mm = round_to_multiple_of_4(x_mm)
+        y_mm = round_to_multiple_of_4(y_mm)
+        y_mm_cad = y_mm  # For electrical diagrams, y_mm_cad is same as y_mm (no flip)
+
+        # Build connections from/to for this equipment (adjacência do grafo: O(grau))
+        from_tags = graph.sources(e.tag)
+        to_tags = graph.targets(e.tag)
+        from_str = ", ".join(filter(None, from_tags)) or "N/A"
+        to_str = ", ".join(filter(None, to_tags)) or "N/A"
+
+        item = {
+            "tag": e.tag or "N/A",
+            "descricao": e.descricao,
+            "x_mm": x_mm,
+            "y_mm": y_mm,
+            "y_mm_cad": y_mm_cad,
+            "pagina": e.page,
+            "from": from_str,
+            "to": to_str,
+            "page_width_mm": W_mm,  # Use actual page dimensions
+            "page_height_mm": H_mm,
+        }
 
-    log_to_front(f"🔹 Quadrant {label} | origem ≈ ({ox:.1f}, {oy:.1f}) mm | dimensões ≈ ({rect_w_mm:.1f} x {rect_h_mm:.1f}) mm")
-    try:
-        quad_png = render_quadrant_png(page, rect, dpi=dpi)
-        
-        # Validate image data exists
-        if not quad_png or len(quad_png) == 0:
-            raise ValueError(f"Failed to render quadrant {label}: empty image data")
-        
-        quad_b64 = base64.b64encode(quad_png).decode("utf-8")
-        # Passa as dimensões CORRETAS do quadrante (não da página completa)
-        prompt_q = build_prompt(rect_w_mm, rect_h_mm, "quadrant", (ox, oy), label, diagram_type)
-        model_used, resp_q = await asyncio.to_thread(llm_call, quad_b64, prompt_q)
-        raw_q = resp_q.choices[0].message.content if resp_q and resp_q.choices else ""
-        log_to_front(f"   🔍 RAW QUADRANT {label}: {raw_q[:500]}")
-        items_q = ensure_json_list(raw_q)
+        # Apply system matcher to get SystemFullName
+        try:
+            match = match_system_fullname(item["tag"], item["descricao"], e.type, "electrical", diagram_subtype)
+            item.update(match)
+            log_to_front(f"  ✓ {item['tag']}: {match.get('SystemFullName', 'N/A')}")
+        except Exception as ex:
+            log_to_front(f"  ⚠️ Matcher falhou para {item['tag']}: {ex!r}")
+            item.update({
+                "SystemFullName": None,
+                "Confiança": 0,
+                "matcher_error": str(ex),
+                "diagram_type": "Electrical"
+            })
+            if diagram_subtype:
+                item["diagram_subtype"] = diagram_subtype
 
-        # anota metadados
-        for it in items_q:
-            if isinstance(it, dict):
-                it["_src"] = "quadrant"
-                it["_ox_mm"] = ox
-                it["_oy_mm"] = oy
-                it["_qw_mm"] = rect_w_mm
-                it["_qh_mm"] = rect_h_mm
+        # Add electrical-specific fields
+        item["geometric_refinement"] = None  # Not applicable for electrical (uses tile center)
+        item["modelo"] = raw_model
 
-        log_to_front(f"   └─ itens Quadrant {label}: {len(items_q)}")
-        return items_q
-    except Exception as e:
-        log_to_front(f"   ❌ Erro Quadrant {label}: {e!r}")
-        return []
+        page_items.append(item)
+    lap("export_and_match")
+    log_to_front(f"⏱️ Consolidação elétrica: {n_eqs}→{len(eqs)} equipamentos, {n_cons}→{len(graph)} conexões, "
+                 f"{n_eps}→{len(eps_all)} endpoints | " + " ".join(f"{k}={v:.1f}ms" for k, v in timings.items()))
+    return page_items, graph, eps_all
 
 
-# === BEGIN ADD: ElectricalAnalyzer ===
-def run_electrical_pipeline(doc, dpi_global=220, dpi_tiles=300, tile_px=2048, overlap=0.20)->List[Dict[str,Any]]:
+async def run_electrical_pipeline(doc, dpi_global=220, dpi_tiles=300, tile_px=2048, overlap=0.20,
+                            skip_blank: bool = INK_SKIP_ENABLED, ink_min_ratio: float = INK_MIN_RATIO,
+                            ink_metrics: Optional[InkScreenMetrics] = None)->List[Dict[str,Any]]:
     items: List[Dict[str,Any]] = []
-    cons_all: List[Conn] = []
-    eps_all: List[Endpoint] = []
+    ink_metrics = ink_metrics if ink_metrics is not None else InkScreenMetrics()
+    total_connections = 0
     all_pages: List[Dict[str, Any]] = []
     
     for pidx, page in enumerate(doc):
         page_num = pidx + 1
+        current_page.set(page_num)  # contabilidade de uso por página (herdado por tasks/threads)
         log_to_front(f"\n⚡ === Página {page_num} (Elétrico) ===")
         
         # Get ACTUAL page dimensions for correct pixel-to-mm ratio in prompts
@@ -2211,138 +3274,110 @@ def run_electrical_pipeline(doc, dpi_global=220, dpi_tiles=300, tile_px=2048, ov
         # No scaling to A3 - coordinates should match the actual diagram
         W_mm, H_mm = W_mm_actual, H_mm_actual
         log_to_front(f"📄 Dimensões de saída (actual): {W_mm:.1f}mm x {H_mm:.1f}mm")
+
+        # Página vazia: nenhuma chamada ao LLM
+        if skip_blank and ink_metrics.record(page_num, "page", str(page_num), screen_page_ink(page)):
+            all_pages.append({"pagina": page_num, "modelo": None, "resultado": [],
+                              "ink_screen": ink_metrics.summary(page_num)})
+            continue
         
-        # Passada global (contexto/tag grande)
-        pix = page.get_pixmap(dpi=dpi_global)
-        img = Image.open(io.BytesIO(pix.tobytes("png")))
-        Wpx, Hpx = img.size
+        # Passada global (contexto/tag grande) - render fora do event loop, chamada em paralelo aos tiles
+        page_rgb = await asyncio.to_thread(page_raster, page, dpi_global, colorspace="rgb")
+        Hpx, Wpx = page_rgb.shape[:2]
         # use llm_call já existente - use ACTUAL dimensions for correct mm-per-pixel ratio
-        page_b64 = base64.b64encode(pix.tobytes("png")).decode("utf-8")
-        raw_model, resp = llm_call(page_b64, build_prompt_electrical_global(pidx, Wpx, Hpx, W_mm_actual, H_mm_actual))
-        raw = resp.choices[0].message.content if resp and resp.choices else ""
-        global_list = ensure_json_list(raw)
-        log_to_front(f"⚡ Elétrico(Global) itens: {len(global_list)}")
+        # Prompt cita Wpx/Hpx: apenas o formato é otimizado, não as dimensões
+        page_payload = await asyncio.to_thread(encode_image_payload, page_rgb, allow_resize=False, label=f"global p{page_num}")
+        del page_rgb
+        global_task = asyncio.ensure_future(llm_call(page_payload.b64, build_prompt_electrical_global(pidx, Wpx, Hpx, W_mm_actual, H_mm_actual),
+                                                     mime=page_payload.mime, image_tokens=page_payload.tokens))
 
         # Tiles com overlap (recupera símbolos pequenos e conexões)
-        total_tiles = calculate_tile_count(page, tile_px=tile_px, overlap_ratio=overlap, dpi=dpi_tiles)
-        log_to_front(f"📐 Elétrico: tiles {tile_px}px com overlap {int(overlap*100)}% - Total: {total_tiles} tiles")
-        eqs: List[Equip] = parse_electrical_equips({"equipments": global_list}, pidx)
-        tile_count = 0
-        W_px_at_tiles = None  # Page width in pixels at dpi_tiles
-        H_px_at_tiles = None  # Page height in pixels at dpi_tiles
-        for tile,(ox,oy),(W,H), dpi in iter_tiles_with_overlap(page, tile_px=tile_px, overlap_ratio=overlap, dpi=dpi_tiles):
-            # Store page dimensions from first tile (same for all tiles)
-            if W_px_at_tiles is None:
-                W_px_at_tiles = W
-                H_px_at_tiles = H
-            
-            tile_count += 1
-            log_to_front(f"   🔄 Processando tile {tile_count}/{total_tiles}...")
-            buf=io.BytesIO(); tile.save(buf, format="PNG")
+        # Plano de tiles calculado uma única vez (sem renderizar): contagem, origens e dimensões
+        tile_plan = plan_tiles(page, tile_px=tile_px, overlap_ratio=overlap, dpi=dpi_tiles)
+        total_tiles = tile_plan.count
+        log_to_front(f"📐 Elétrico: tiles {tile_px}px com overlap {int(overlap*100)}% - Total: {total_tiles} tiles "
+                     f"(até {ELECTRICAL_TILE_CONCURRENCY} simultâneos)")
+        W_px_at_tiles = tile_plan.page_w_px  # Page width in pixels at dpi_tiles
+        H_px_at_tiles = tile_plan.page_h_px  # Page height in pixels at dpi_tiles
+
+        def prepare_tile(idx, tile_data):
+            # Thread do produtor: filtro de tinta + codificação + prompt
+            tile, (ox, oy), (W, H), _ = tile_data
+            label = f"{idx + 1}/{total_tiles}"
+            if skip_blank and ink_metrics.record(page_num, "tile", label, screen_ink(tile, min_ratio=ink_min_ratio)):
+                return None
             tile_w_px, tile_h_px = tile.size
-            b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
+            payload = encode_image_payload(np.asarray(tile), allow_resize=False, label=f"tile {idx + 1}")
             # Use ACTUAL dimensions for correct mm-per-pixel ratio
-            _, r = llm_call(b64, build_prompt_electrical_tile(pidx, ox, oy, tile_w_px, tile_h_px, W_mm_actual, H_mm_actual, W, H))
-            raw_tile = r.choices[0].message.content if r and r.choices else ""
-            parsed = ensure_json_list(raw_tile)  # aceita {equipments:[...]} OU lista
-            # normaliza possíveis formatos
-            if isinstance(parsed, list):
-                resp_norm = {"equipments": parsed}
-            else:
-                resp_norm = parsed if isinstance(parsed, dict) else {"equipments":[]}
-            # Pass tile offsets to add to coordinates
-            eqs.extend(parse_electrical_equips(resp_norm, pidx, ox, oy))
-            c,e = parse_electrical_edges(resp_norm, pidx, ox, oy)
-            cons_all.extend(c); eps_all.extend(e)
-        
-        log_to_front(f"✅ Processados {tile_count} tiles")
-
-        # Deduplicação e snap
-        eqs = merge_electrical_equips(eqs)
-        cons_all = merge_electrical_conns(cons_all)
-        eps_all = dedup_endpoints(eps_all)
-        cons_all, eps_all = snap_endpoints_to_tags(cons_all, eps_all, eqs)
-
-        # Detect diagram subtype for better matching
-        all_descriptions = " ".join([e.descricao for e in eqs])
-        diagram_subtype = detect_electrical_diagram_subtype([{"descricao": e.descricao} for e in eqs], all_descriptions)
-        log_to_front(f"⚡ Tipo de diagrama elétrico detectado: {diagram_subtype.upper()}")
-        
-        # Exporta em mm e aplica matcher para SystemFullName
-        page_items = []
-        for e in eqs:
-            # Convert px->mm using ACTUAL page dimensions (no scaling to A3)
-            # This matches P&ID behavior and keeps coordinates in actual diagram space
-            if W_px_at_tiles is not None and H_px_at_tiles is not None:
-                # Convert pixels to mm in actual page space
-                x_mm = ((e.bbox.x + e.bbox.w/2) / W_px_at_tiles) * W_mm
-                y_mm = ((e.bbox.y + e.bbox.h/2) / H_px_at_tiles) * H_mm
-            else:
-                # Fallback: Use DPI-based conversion
-                x_mm = ((e.bbox.x + e.bbox.w/2) / dpi_tiles) * 25.4
-                y_mm = ((e.bbox.y + e.bbox.h/2) / dpi_tiles) * 25.4
-            
-            # Round coordinates to multiples of 4mm for electrical diagrams
-            # Coordinates are in actual page dimensions (not scaled to A3)
-            x_mm = round_to_multiple_of_4(x_mm)
-            y_mm = round_to_multiple_of_4(y_mm)
-            y_mm_cad = y_mm  # For electrical diagrams, y_mm_cad is same as y_mm (no flip)
-            
-            # Build connections from/to for this equipment
-            from_tags = [c.from_tag for c in cons_all if c.to_tag == e.tag]
-            to_tags = [c.to_tag for c in cons_all if c.from_tag == e.tag]
-            from_str = ", ".join(filter(None, from_tags)) or "N/A"
-            to_str = ", ".join(filter(None, to_tags)) or "N/A"
-            
-            item = {
-                "tag": e.tag or "N/A",
-                "descricao": e.descricao,
-                "x_mm": x_mm,
-                "y_mm": y_mm,
-                "y_mm_cad": y_mm_cad,
-                "pagina": e.page,
-                "from": from_str,
-                "to": to_str,
-                "page_width_mm": W_mm,  # Use actual page dimensions
-                "page_height_mm": H_mm,
-            }
-            
-            # Apply system matcher to get SystemFullName
+            prompt = build_prompt_electrical_tile(pidx, ox, oy, tile_w_px, tile_h_px, W_mm_actual, H_mm_actual, W, H)
+            return payload, prompt, ox, oy
+
+        async def call_tile(idx, prepared):
+            payload, prompt, ox, oy = prepared
+            log_to_front(f"   🔄 Processando tile {idx + 1}/{total_tiles}...")
             try:
-                match = match_system_fullname(item["tag"], item["descricao"], e.type, "electrical", diagram_subtype)
-                item.update(match)
-                log_to_front(f"  ✓ {item['tag']}: {match.get('SystemFullName', 'N/A')}")
+                _, r = await llm_call(payload.b64, prompt, mime=payload.mime, image_tokens=payload.tokens)
             except Exception as ex:
-                log_to_front(f"  ⚠️ Matcher falhou para {item['tag']}: {ex!r}")
-                item.update({
-                    "SystemFullName": None,
-                    "Confiança": 0,
-                    "matcher_error": str(ex),
-                    "diagram_type": "Electrical"
-                })
-                if diagram_subtype:
-                    item["diagram_subtype"] = diagram_subtype
-            
-            # Add electrical-specific fields
-            item["geometric_refinement"] = None  # Not applicable for electrical (uses tile center)
-            item["modelo"] = raw_model
-            
-            page_items.append(item)
+                log_to_front(f"   ❌ Erro tile {idx + 1}/{total_tiles}: {ex!r}")
+                return None
+            raw_tile = r.choices[0].message.content if r and r.choices else ""
+            return parse_electrical_tile_response(raw_tile, pidx, ox, oy)
+
+        try:
+            tile_results = await pipelined_map(iter_tiles_with_overlap(page, plan=tile_plan), prepare_tile, call_tile)
+        except BaseException:
+            global_task.cancel()
+            raise
+
+        raw_model, resp = await global_task
+        raw = resp.choices[0].message.content if resp and resp.choices else ""
+        global_list = ensure_json_list(raw)
+        log_to_front(f"⚡ Elétrico(Global) itens: {len(global_list)}")
+        eqs: List[Equip] = parse_electrical_equips({"equipments": global_list}, pidx)
+
+        # Resultados mesclados na ordem dos tiles (independente da ordem de conclusão);
+        # conexões e endpoints são da página: nada acumula entre páginas
+        graph = new_connection_graph(page_num)
+        eps_page: List[Endpoint] = []
+        for result in tile_results:
+            if result is None:
+                continue
+            tile_eqs, c, e = result
+            eqs.extend(tile_eqs)
+            graph.extend(c); eps_page.extend(e)
+
+        # None = tile vazio (pré-filtro) ou chamada ao LLM com erro
+        tiles_ok = sum(r is not None for r in tile_results)
+        tiles_skipped = ink_metrics.summary(page_num)["skipped"]
+        tiles_failed = total_tiles - tiles_ok - tiles_skipped
+        log_to_front(f"{'⚠️' if tiles_failed else '✅'} Processados {tiles_ok} tiles, {tiles_failed} com erro, "
+                     f"{tiles_skipped} vazios ignorados")
+
+        # Deduplicação, snap, conversão para mm e matcher (fora do event loop)
+        stage_timings: Dict[str, float] = {}
+        page_items, graph, _ = await asyncio.to_thread(
+            assemble_electrical_page, eqs, graph, eps_page, W_mm, H_mm, W_px_at_tiles, H_px_at_tiles, dpi_tiles, raw_model,
+            stage_timings
+        )
         items.extend(page_items)
+        total_connections += len(graph)
         
         # Add page to all_pages with the expected structure
         all_pages.append({
             "pagina": page_num,
             "modelo": raw_model,
-            "resultado": sanitize_for_json(page_items)
+            "resultado": sanitize_for_json(page_items),
+            "ink_screen": ink_metrics.summary(page_num),
+            "stage_timings_ms": stage_timings,
+            # Conexões simplificadas (lista de arestas from/to da página)
+            "connections": sanitize_for_json(graph.edge_list())
         })
 
-    # Conexões simplificadas (from/to)
-    connections = []
-    for c in cons_all:
-        connections.append({"from": c.from_tag or "N/A", "to": c.to_tag or "N/A", "confidence": round(float(c.confidence),2)})
-
-    log_to_front(f"🧩 Elétrico: consolidados={len(items)} conexões={len(connections)}")
+    current_page.set(None)
+    log_to_front(f"🧩 Elétrico: consolidados={len(items)} conexões={total_connections}")
+    if skip_blank:
+        ink_summary = ink_metrics.summary()
+        log_to_front(f"🧹 Pré-filtro de tinta: {ink_summary['skipped']}/{ink_summary['screened']} ignorados {ink_summary['by_reason']}")
     
     # Return in the same format as the P&ID flow
     return all_pages
@@ -2359,6 +3394,223 @@ def detect_diagram_kind(text:str)->str:
     return "electrical" if (score_e>=2 and score_p==0) else "pid"
 # === END ADD ===
 
+# ============================================================
+# PÓS-PROCESSAMENTO DE PÁGINA (P&ID)
+# ============================================================
+def page_quadrant_layout(page, grid_auto: bool, grid_n: int, use_overlap: bool = False) -> List[Tuple[int, int, Any, str]]:
+    """Quadrantes (gx, gy, rect, label) de uma página: grade N×N fixa, com sobreposição ou adaptativa"""
+    # Use new overlapping quadrants if enabled
+    if grid_auto:
+        quads_with_labels = page_quadrants_adaptive(page, overlap_percent=0.1 if use_overlap else 0.0)
+        depth = max((label.count("-") + 1 for _, _, _, label in quads_with_labels), default=0)
+        log_to_front(f"🌳 Subdivisão adaptativa: {len(quads_with_labels)} quadrantes (profundidade máx. {depth}, limite {AUTO_GRID_MAX_CALLS})")
+    elif use_overlap:
+        log_to_front(f"📊 Gerando quadrantes com sobreposição de 50%...")
+        quads_with_labels = page_quadrants_with_overlap(page, grid_x=grid_n, grid_y=grid_n, overlap_percent=0.5)
+    else:
+        quads_with_labels = [(gx, gy, rect, f"{gy+1}-{gx+1}") for gx, gy, rect in page_quadrants(page, grid_x=grid_n, grid_y=grid_n)]
+    return quads_with_labels
+
+
+def build_pid_item(it: Dict[str, Any], page_num: int, W_mm: float, H_mm: float,
+                   diagram_type: str = "pid", diagram_subtype: str = "") -> Dict[str, Any]:
+    """
+    Item bruto do LLM → item da resposta: coordenadas globais (offset do quadrante),
+    clamp/arredondamento e matcher. Bloqueante (matcher usa embeddings).
+    """
+    x_in = float(it.get("x_mm") or 0.0)
+    y_in = float(it.get("y_mm") or 0.0)
+    tag = it.get("tag", "N/A")
+    src = it.get("_src", "global")
+
+    # Converte coordenadas locais de quadrantes para coordenadas globais da página
+    if src == "quadrant":
+        ox = float(it.get("_ox_mm", 0.0))
+        oy = float(it.get("_oy_mm", 0.0))
+        qw = float(it.get("_qw_mm", 0.0))
+        qh = float(it.get("_qh_mm", 0.0))
+
+        # Log detalhado da conversão
+        log_to_front(f"   🔄 Convertendo {tag}: local ({x_in:.1f}, {y_in:.1f}) + offset ({ox:.1f}, {oy:.1f}) = global ({x_in+ox:.1f}, {y_in+oy:.1f})")
+
+        # Sempre adiciona o offset do quadrante para obter coordenadas globais
+        x_in += ox
+        y_in += oy
+
+    # No Y flip - top-left origin (0,0) for both y_mm and y_mm_cad
+    y_cad = y_in
+
+    # Validate coordinates before clamping
+    x_was_clamped = x_in < 0.0 or x_in > W_mm
+    y_was_clamped = y_in < 0.0 or y_in > H_mm
+
+    # clamp to page bounds
+    x_in_orig = x_in
+    y_in_orig = y_in
+    x_in = max(0.0, min(W_mm, x_in))
+    y_in = max(0.0, min(H_mm, y_in))
+
+    # Log warning if coordinates were out of bounds (may indicate extraction issue)
+    if x_was_clamped or y_was_clamped:
+        log_to_front(f"   ⚠️ Coordenadas ajustadas para {tag}: ({x_in_orig:.1f}, {y_in_orig:.1f}) → ({x_in:.1f}, {y_in:.1f})")
+
+    # For electrical diagrams, round coordinates to multiples of 4mm
+    # Note: Coordinates are now based on actual page dimensions (not hardcoded A3)
+    if diagram_type.lower() == "electrical":
+        x_before_rounding = x_in
+        y_before_rounding = y_in
+        x_in = round_to_multiple_of_4(x_in)
+        y_in = round_to_multiple_of_4(y_in)
+        y_cad = y_in  # Update y_cad as well
+
+        if x_before_rounding != x_in or y_before_rounding != y_in:
+            log_to_front(f"   📐 Arredondamento para múltiplo de 4mm - {tag}: ({x_before_rounding:.1f}, {y_before_rounding:.1f}) → ({x_in:.1f}, {y_in:.1f})")
+    else:
+        # For P&ID diagrams, use 0.1mm precision
+        x_in = round(x_in, 1)
+        y_in = round(y_in, 1)
+        y_cad = y_in  # Update y_cad as well
+
+    item = {
+        "tag": tag,
+        "descricao": it.get("descricao", "Equipamento"),
+        "x_mm": x_in,
+        "y_mm": y_in,
+        "y_mm_cad": y_cad,
+        "pagina": page_num,
+        "from": it.get("from", "N/A"),
+        "to": it.get("to", "N/A"),
+        "page_width_mm": W_mm,
+        "page_height_mm": H_mm,
+    }
+
+    try:
+        tipo = it.get("tipo", "")
+        match = match_system_fullname(item["tag"], item["descricao"], tipo, diagram_type, diagram_subtype)
+        item.update(match)
+    except Exception as e:
+        item.update({
+            "SystemFullName": None,
+            "Confiança": 0,
+            "matcher_error": str(e),
+            "diagram_type": diagram_type
+        })
+        if diagram_subtype:
+            item["diagram_subtype"] = diagram_subtype
+
+    return item
+
+
+def assemble_pid_page(page, page_num: int, W_mm: float, H_mm: float,
+                      global_list: List[Dict[str, Any]], quad_items: List[Dict[str, Any]],
+                      diagram_type: str = "pid", dpi: int = 400, tol_mm: float = 10.0,
+                      use_dynamic_tolerance: bool = True, use_ocr_validation: bool = False,
+                      use_geometric_refinement: bool = True,
+                      prepared_items: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    Pós-processamento de uma página P&ID a partir das respostas já parseadas
+    (ensure_json_list): coordenadas globais, matcher, OCR, refinamento geométrico e dedup.
+    prepared_items: itens já passados por build_pid_item (quadrantes em streaming).
+    Bloqueante - no /analyze roda em thread; também usado pelo modo batch.
+    """
+    raw_items = (global_list or []) + (quad_items or [])
+    combined = []
+
+    # For electrical diagrams, detect subtype early for better matching
+    diagram_subtype = ""
+    if diagram_type.lower() == "electrical":
+        # Do a preliminary scan to detect subtype
+        all_descriptions = " ".join([str(it.get("descricao", "")) for it in raw_items if isinstance(it, dict)])
+        diagram_subtype = detect_electrical_diagram_subtype(raw_items, all_descriptions)
+        log_to_front(f"⚡ Tipo de diagrama elétrico detectado: {diagram_subtype.upper()}")
+
+    for it in raw_items:
+        if not isinstance(it, dict):
+            continue
+        combined.append(build_pid_item(it, page_num, W_mm, H_mm, diagram_type, diagram_subtype))
+    # Itens de quadrantes já convertidos durante o streaming (mesma ordem do fluxo sem streaming)
+    combined.extend(prepared_items or [])
+
+    # ITEM 6: Post-LLM Validation with OCR and Symbol Type Matching
+    if use_ocr_validation:
+        log_to_front(f"🔍 Validando itens com OCR e matching de símbolos...")
+        for item in combined:
+            # OCR validation
+            ocr_result = validate_tag_with_ocr(page, item, dpi=dpi)
+            item["ocr_validation"] = ocr_result
+
+            # Symbol type validation
+            type_result = validate_symbol_type(item, item.get("descricao", ""))
+            item["type_validation"] = type_result
+
+            # Combined validation confidence
+            ocr_conf = ocr_result.get("confidence", 0)
+            type_conf = type_result.get("confidence", 0)
+            item["validation_confidence"] = int((ocr_conf + type_conf) / 2)
+            item["validation_passed"] = (
+                ocr_result.get("validation_passed", True) and 
+                type_result.get("validation_passed", True)
+            )
+
+        validated_count = sum(1 for it in combined if it.get("validation_passed", False))
+        log_to_front(f"   ✅ Validados: {validated_count}/{len(combined)} itens")
+
+    # ITEM 7: Geometric Center Refinement
+    if use_geometric_refinement:
+        log_to_front(f"📐 Refinando coordenadas para centro geométrico...")
+        refined_count = 0
+        total_offset = 0.0
+
+        for item in combined:
+            refinement = refine_geometric_center(page, item, dpi=dpi)
+            item["geometric_refinement"] = refinement
+
+            if refinement.get("refinement_applied", False):
+                # Update coordinates with refined values
+                item["x_mm_original"] = item["x_mm"]
+                item["y_mm_original"] = item["y_mm"]
+                item["x_mm"] = refinement["refined_x_mm"]
+                item["y_mm"] = refinement["refined_y_mm"]
+
+                # Clamp refined coordinates
+                item["x_mm"] = max(0.0, min(W_mm, item["x_mm"]))
+                item["y_mm"] = max(0.0, min(H_mm, item["y_mm"]))
+
+                refined_count += 1
+                total_offset += refinement.get("offset_magnitude_mm", 0.0)
+
+        if refined_count > 0:
+            avg_offset = total_offset / refined_count
+            log_to_front(f"   ✅ Refinados: {refined_count}/{len(combined)} itens (offset médio: {avg_offset:.2f}mm)")
+
+    unique = dedup_items(combined, page_num=page_num, tol_mm=tol_mm, 
+                        use_dynamic_tolerance=use_dynamic_tolerance, log_metadata=False,
+                        is_electrical=(diagram_type.lower() == "electrical"))
+
+    duplicates_removed = len(combined) - len(unique)
+    if duplicates_removed > 0:
+        log_to_front(f"🔄 Removidos {duplicates_removed} duplicados de {len(combined)} itens")
+
+    log_to_front(f"📄 Página {page_num} | Global: {len(global_list)} | Quadrants: {len(quad_items)} | Únicos: {len(unique)}")
+    return unique
+
+
+def attach_job_usage(pages: List[Dict[str, Any]], params: Dict[str, Any], route: str = "analyze") -> Dict[str, Any]:
+    """
+    Encerra a contabilidade do job atual: grava o resumo (llm_usage.sqlite) e adiciona
+    a cada página seu bloco "usage" e o total do job em "job_usage".
+    """
+    page_usage = {page["pagina"]: usage_ledger.page_summary(page["pagina"]) for page in pages}
+    job_usage = usage_ledger.finish(route=route, params=params)
+    for page in pages:
+        page["usage"] = page_usage[page["pagina"]]
+        page["job_usage"] = job_usage
+    log_to_front(f"💰 Uso LLM: {job_usage['calls']} chamadas, {job_usage['total_tokens']} tokens "
+                 f"({job_usage['cached_tokens']} em cache), {job_usage['retries']} retentativas, "
+                 f"US$ {job_usage['cost_usd']:.4f}")
+    return job_usage
+
+
 # ============================================================
 # ROTA PRINCIPAL
 # ============================================================
@@ -2366,261 +3618,173 @@ def detect_diagram_kind(text:str)->str:
 async def analyze_pdf(
     file: UploadFile,
     dpi: int = Query(400, ge=100, le=600),
-    grid: int = Query(3, ge=1, le=6),
+    grid: str = Query("3", description="Quadrant grid: 1-6 for a fixed N×N grid or 'auto' for adaptive (quadtree) subdivision"),
     tol_mm: float = Query(10.0, ge=1.0, le=50.0),
     use_overlap: bool = Query(False, description="Use overlapping windows for better edge coverage"),
     use_dynamic_tolerance: bool = Query(True, description="Use dynamic tolerance based on symbol size"),
     use_ocr_validation: bool = Query(False, description="Validate TAGs using OCR (requires pytesseract)"),
     use_geometric_refinement: bool = Query(True, description="Refine coordinates to geometric center (enabled by default for better accuracy)"),
-    diagram_type: str = Query("pid", description="Diagram type: 'pid' for P&ID or 'electrical' for Electrical Diagram")
+    diagram_type: str = Query("pid", description="Diagram type: 'pid' for P&ID or 'electrical' for Electrical Diagram"),
+    skip_blank: bool = Query(INK_SKIP_ENABLED, description="Skip blank/low-ink pages, quadrants and tiles before calling the LLM"),
+    ink_threshold: float = Query(INK_MIN_RATIO, ge=0.0, le=0.1, description="Minimum ink ratio for a quadrant/tile to be sent to the LLM")
 ):
     if not OPENAI_API_KEY:
         raise HTTPException(status_code=400, detail="OPENAI_API_KEY não definida. Configure a chave no arquivo .env")
 
+    grid_auto = str(grid).strip().lower() == "auto"
+    grid_n = 0
+    if not grid_auto:
+        try:
+            grid_n = int(grid)
+        except ValueError:
+            grid_n = 0
+        if not 1 <= grid_n <= 6:
+            raise HTTPException(status_code=422, detail="grid deve ser um inteiro entre 1 e 6 ou 'auto'.")
+
     data = await file.read()
     if not data:
         raise HTTPException(status_code=400, detail="Arquivo vazio.")
 
     log_to_front(f"📥 Arquivo recebido: {file.filename} ({len(data)} bytes)")
+    # Identifica o job na fila global do LLM (herdado pelas tasks dos quadrantes)
+    current_job_id.set(f"analyze:{file.filename}:{uuid.uuid4().hex[:8]}")
+    # Parâmetros gravados junto ao uso do job (análise de tendência custo × grid/DPI)
+    usage_params = {"filename": file.filename, "diagram_type": diagram_type.lower(), "dpi": dpi, "grid": grid,
+                    "use_overlap": use_overlap, "skip_blank": skip_blank, "streaming": LLM_STREAMING}
 
     # Usa função robusta para abrir PDF com tratamento de erros ExtGState
     doc = open_pdf_safely(data, file.filename)
 
-    # === BEGIN EDIT: branch elétrico preservando P&ID ===
-    # 1) se o usuário pedir explicitamente:
-    if diagram_type.lower() == "electrical":
-        result = run_electrical_pipeline(doc)
-        return JSONResponse(result)
-
-    # 2) se você quiser auto-detecção quando diagram_type == "auto":
-    if diagram_type.lower() == "auto":
-        # tente pegar texto da primeira página (nativo ou OCR leve)
-        try:
-            txt = (doc[0].get_text() or "")
-        except Exception:
-            txt = ""
-        kind = detect_diagram_kind(txt)
-        if kind == "electrical":
-            result = run_electrical_pipeline(doc)
-            return JSONResponse(result)
-        # caso contrário, continue o fluxo P&ID normal abaixo
-    # === END EDIT ===
-
-    all_pages: List[Dict[str, Any]] = []
-
-    for page_idx, page in enumerate(doc):
-        page_num = page_idx + 1
-        log_to_front(f"\n===== Página {page_num} =====")
-
-        # Use actual page dimensions without swapping
-        # The LLM sees the actual page orientation, so dimensions must match
-        W_pts, H_pts = page.rect.width, page.rect.height
-        W_mm, H_mm = points_to_mm(W_pts), points_to_mm(H_pts)
-
-        log_to_front(f"Dimensões da página (mm): X={W_mm}, Y={H_mm}")
-
-        global_list: List[Dict[str, Any]] = []
-        quad_items: List[Dict[str, Any]] = []
-        model_used = PRIMARY_MODEL
-
-        try:
-            page_png = page.get_pixmap(dpi=dpi).tobytes("png")
-            page_b64 = base64.b64encode(page_png).decode("utf-8")
-            prompt_global = build_prompt(W_mm, H_mm, "global", diagram_type=diagram_type)
-            model_used, resp = llm_call(page_b64, prompt_global)
-            raw = resp.choices[0].message.content if resp and resp.choices else ""
-            log_to_front(f"🌐 RAW GLOBAL OUTPUT (page {page_num}): {raw[:500]}")
-            global_list = ensure_json_list(raw)
-        except Exception as e:
-            log_to_front(f"⚠️ Global falhou na página {page_num}: {e!r}")
-            global_list = []
-
-        log_to_front(f"🌐 Global → itens: {len(global_list)}")
-
-        # Skip quadrant processing for electrical diagrams to avoid duplicates
-        # Electrical diagrams are typically simpler and smaller (A3 vs A0)
-        # and can be fully analyzed in global mode
-        if grid > 1 and diagram_type.lower() != "electrical":
-            # Use new overlapping quadrants if enabled
-            if use_overlap:
-                log_to_front(f"📊 Gerando quadrantes com sobreposição de 50%...")
-                quads_with_labels = page_quadrants_with_overlap(page, grid_x=grid, grid_y=grid, overlap_percent=0.5)
-                tasks = [process_quadrant(gx, gy, rect, page, W_mm, H_mm, dpi, diagram_type) for gx, gy, rect, label in quads_with_labels]
-            else:
-                quads = page_quadrants(page, grid_x=grid, grid_y=grid)
-                tasks = [process_quadrant(gx, gy, rect, page, W_mm, H_mm, dpi, diagram_type) for gx, gy, rect in quads]
-            
-            results = await asyncio.gather(*tasks)
-            for r in results:
-                quad_items.extend(r)
-        elif diagram_type.lower() == "electrical":
-            log_to_front(f"⚡ Modo elétrico: usando apenas análise global (sem quadrantes) para evitar duplicatas")
-
-        raw_items = (global_list or []) + (quad_items or [])
-        combined = []
-        
-        # For electrical diagrams, detect subtype early for better matching
-        diagram_subtype = ""
+    try:
+        # === BEGIN EDIT: branch elétrico preservando P&ID ===
+        # 1) se o usuário pedir explicitamente:
         if diagram_type.lower() == "electrical":
-            # Do a preliminary scan to detect subtype
-            all_descriptions = " ".join([str(it.get("descricao", "")) for it in raw_items if isinstance(it, dict)])
-            diagram_subtype = detect_electrical_diagram_subtype(raw_items, all_descriptions)
-            log_to_front(f"⚡ Tipo de diagrama elétrico detectado: {diagram_subtype.upper()}")
-
-        for it in raw_items:
-            if not isinstance(it, dict):
-                continue
+            result = await run_electrical_pipeline(doc, skip_blank=skip_blank, ink_min_ratio=ink_threshold)
+            attach_job_usage(result, usage_params)
+            return JSONResponse(result)
 
-            x_in = float(it.get("x_mm") or 0.0)
-            y_in = float(it.get("y_mm") or 0.0)
-            tag = it.get("tag", "N/A")
-            src = it.get("_src", "global")
-
-            # Converte coordenadas locais de quadrantes para coordenadas globais da página
-            if src == "quadrant":
-                ox = float(it.get("_ox_mm", 0.0))
-                oy = float(it.get("_oy_mm", 0.0))
-                qw = float(it.get("_qw_mm", 0.0))
-                qh = float(it.get("_qh_mm", 0.0))
-                
-                # Log detalhado da conversão
-                log_to_front(f"   🔄 Convertendo {tag}: local ({x_in:.1f}, {y_in:.1f}) + offset ({ox:.1f}, {oy:.1f}) = global ({x_in+ox:.1f}, {y_in+oy:.1f})")
-                
-                # Sempre adiciona o offset do quadrante para obter coordenadas globais
-                x_in += ox
-                y_in += oy
+        # 2) se você quiser auto-detecção quando diagram_type == "auto":
+        if diagram_type.lower() == "auto":
+            # tente pegar texto da primeira página (nativo ou OCR leve)
+            try:
+                txt = (doc[0].get_text() or "")
+            except Exception:
+                txt = ""
+            kind = detect_diagram_kind(txt)
+            if kind == "electrical":
+                result = await run_electrical_pipeline(doc, skip_blank=skip_blank, ink_min_ratio=ink_threshold)
+                attach_job_usage(result, {**usage_params, "diagram_type": "electrical"})
+                return JSONResponse(result)
+            # caso contrário, continue o fluxo P&ID normal abaixo
+        # === END EDIT ===
+
+        ink_metrics = InkScreenMetrics()
+        page_slots = asyncio.Semaphore(max(1, ANALYZE_PAGE_CONCURRENCY))
+
+        async def global_pass(page, page_num: int, W_mm: float, H_mm: float) -> Tuple[str, List[Dict[str, Any]]]:
+            try:
+                page_payload = await asyncio.to_thread(
+                    lambda: encode_image_payload(page_raster(page, dpi, colorspace="rgb"), label=f"global p{page_num}")
+                )
+                prompt_global = build_prompt(W_mm, H_mm, "global", diagram_type=diagram_type)
+                model_used, resp = await llm_call(page_payload.b64, prompt_global, mime=page_payload.mime,
+                                                  image_tokens=page_payload.tokens)
+                raw = resp.choices[0].message.content if resp and resp.choices else ""
+                log_to_front(f"🌐 RAW GLOBAL OUTPUT (page {page_num}): {raw[:500]}")
+                global_list = ensure_json_list(raw)
+            except Exception as e:
+                log_to_front(f"⚠️ Global falhou na página {page_num}: {e!r}")
+                return PRIMARY_MODEL, []
 
-            # No Y flip - top-left origin (0,0) for both y_mm and y_mm_cad
-            y_cad = y_in
+            log_to_front(f"🌐 Global (página {page_num}) → itens: {len(global_list)}")
+            return model_used, global_list
 
-            # Validate coordinates before clamping
-            x_was_clamped = x_in < 0.0 or x_in > W_mm
-            y_was_clamped = y_in < 0.0 or y_in > H_mm
-            
-            # clamp to page bounds
-            x_in_orig = x_in
-            y_in_orig = y_in
-            x_in = max(0.0, min(W_mm, x_in))
-            y_in = max(0.0, min(H_mm, y_in))
-            
-            # Log warning if coordinates were out of bounds (may indicate extraction issue)
-            if x_was_clamped or y_was_clamped:
-                log_to_front(f"   ⚠️ Coordenadas ajustadas para {tag}: ({x_in_orig:.1f}, {y_in_orig:.1f}) → ({x_in:.1f}, {y_in:.1f})")
-            
-            # For electrical diagrams, round coordinates to multiples of 4mm
-            # Note: Coordinates are now based on actual page dimensions (not hardcoded A3)
+        async def quadrant_pass(page, page_num: int, W_mm: float, H_mm: float) -> List[Dict[str, Any]]:
+            # Skip quadrant processing for electrical diagrams to avoid duplicates
+            # Electrical diagrams are typically simpler and smaller (A3 vs A0)
+            # and can be fully analyzed in global mode
             if diagram_type.lower() == "electrical":
-                x_before_rounding = x_in
-                y_before_rounding = y_in
-                x_in = round_to_multiple_of_4(x_in)
-                y_in = round_to_multiple_of_4(y_in)
-                y_cad = y_in  # Update y_cad as well
-                
-                if x_before_rounding != x_in or y_before_rounding != y_in:
-                    log_to_front(f"   📐 Arredondamento para múltiplo de 4mm - {tag}: ({x_before_rounding:.1f}, {y_before_rounding:.1f}) → ({x_in:.1f}, {y_in:.1f})")
+                log_to_front(f"⚡ Modo elétrico: usando apenas análise global (sem quadrantes) para evitar duplicatas")
+                return []
+            if not (grid_auto or grid_n > 1):
+                return []
+
+            quads_with_labels = await asyncio.to_thread(page_quadrant_layout, page, grid_auto, grid_n, use_overlap)
+
+            # Pré-filtro de tinta no mesmo nível de raster usado para renderizar os quadrantes
+            if skip_blank:
+                quads_with_labels = await asyncio.to_thread(lambda: [
+                    (gx, gy, rect, label) for gx, gy, rect, label in quads_with_labels
+                    if not ink_metrics.record(page_num, "quadrant", label,
+                                              screen_ink(page_raster(page, dpi, clip=rect, colorspace="gray"),
+                                                         min_ratio=ink_threshold))
+                ])
+            if LLM_STREAMING:
+                tasks = [process_quadrant_streaming(gx, gy, rect, page, page_num, W_mm, H_mm, dpi, diagram_type, label=label)
+                         for gx, gy, rect, label in quads_with_labels]
             else:
-                # For P&ID diagrams, use 0.1mm precision
-                x_in = round(x_in, 1)
-                y_in = round(y_in, 1)
-                y_cad = y_in  # Update y_cad as well
-
-            item = {
-                "tag": tag,
-                "descricao": it.get("descricao", "Equipamento"),
-                "x_mm": x_in,
-                "y_mm": y_in,
-                "y_mm_cad": y_cad,
-                "pagina": page_num,
-                "from": it.get("from", "N/A"),
-                "to": it.get("to", "N/A"),
-                "page_width_mm": W_mm,
-                "page_height_mm": H_mm,
-            }
-
-            try:
-                tipo = it.get("tipo", "")
-                match = match_system_fullname(item["tag"], item["descricao"], tipo, diagram_type, diagram_subtype)
-                item.update(match)
-            except Exception as e:
-                item.update({
-                    "SystemFullName": None,
-                    "Confiança": 0,
-                    "matcher_error": str(e),
-                    "diagram_type": diagram_type
-                })
-                if diagram_subtype:
-                    item["diagram_subtype"] = diagram_subtype
-
-            combined.append(item)
+                tasks = [process_quadrant(gx, gy, rect, page, W_mm, H_mm, dpi, diagram_type, label=label)
+                         for gx, gy, rect, label in quads_with_labels]
 
-        # ITEM 6: Post-LLM Validation with OCR and Symbol Type Matching
-        if use_ocr_validation:
-            log_to_front(f"🔍 Validando itens com OCR e matching de símbolos...")
-            for item in combined:
-                # OCR validation
-                ocr_result = validate_tag_with_ocr(page, item, dpi=dpi)
-                item["ocr_validation"] = ocr_result
-                
-                # Symbol type validation
-                type_result = validate_symbol_type(item, item.get("descricao", ""))
-                item["type_validation"] = type_result
-                
-                # Combined validation confidence
-                ocr_conf = ocr_result.get("confidence", 0)
-                type_conf = type_result.get("confidence", 0)
-                item["validation_confidence"] = int((ocr_conf + type_conf) / 2)
-                item["validation_passed"] = (
-                    ocr_result.get("validation_passed", True) and 
-                    type_result.get("validation_passed", True)
+            quad_items: List[Dict[str, Any]] = []
+            for r in await asyncio.gather(*tasks):
+                quad_items.extend(r)
+            return quad_items
+
+        async def analyze_page(page_idx: int, page) -> Dict[str, Any]:
+            page_num = page_idx + 1
+            current_page.set(page_num)  # contexto desta task: uso do LLM atribuído à página
+            async with page_slots:
+                log_to_front(f"\n===== Página {page_num} =====")
+
+                # Página vazia: nenhuma chamada ao LLM
+                blank = skip_blank and ink_metrics.record(page_num, "page", str(page_num),
+                                                          await asyncio.to_thread(screen_page_ink, page))
+                if blank:
+                    return {"pagina": page_num, "modelo": None, "resultado": [],
+                            "ink_screen": ink_metrics.summary(page_num)}
+
+                # Use actual page dimensions without swapping
+                # The LLM sees the actual page orientation, so dimensions must match
+                W_pts, H_pts = page.rect.width, page.rect.height
+                W_mm, H_mm = points_to_mm(W_pts), points_to_mm(H_pts)
+
+                log_to_front(f"Dimensões da página (mm): X={W_mm}, Y={H_mm}")
+
+                # Passada global e quadrantes em paralelo
+                (model_used, global_list), quad_items = await asyncio.gather(
+                    global_pass(page, page_num, W_mm, H_mm),
+                    quadrant_pass(page, page_num, W_mm, H_mm),
+                )
+                # Pós-processamento começa assim que as chamadas desta página terminam
+                # (em streaming, os itens dos quadrantes já chegam convertidos e com matcher)
+                streamed = LLM_STREAMING and diagram_type.lower() != "electrical"
+                unique = await asyncio.to_thread(
+                    assemble_pid_page, page, page_num, W_mm, H_mm, global_list, [] if streamed else quad_items,
+                    diagram_type, dpi, tol_mm, use_dynamic_tolerance, use_ocr_validation, use_geometric_refinement,
+                    quad_items if streamed else None
                 )
-            
-            validated_count = sum(1 for it in combined if it.get("validation_passed", False))
-            log_to_front(f"   ✅ Validados: {validated_count}/{len(combined)} itens")
-        
-        # ITEM 7: Geometric Center Refinement
-        if use_geometric_refinement:
-            log_to_front(f"📐 Refinando coordenadas para centro geométrico...")
-            refined_count = 0
-            total_offset = 0.0
-            
-            for item in combined:
-                refinement = refine_geometric_center(page, item, dpi=dpi)
-                item["geometric_refinement"] = refinement
-                
-                if refinement.get("refinement_applied", False):
-                    # Update coordinates with refined values
-                    item["x_mm_original"] = item["x_mm"]
-                    item["y_mm_original"] = item["y_mm"]
-                    item["x_mm"] = refinement["refined_x_mm"]
-                    item["y_mm"] = refinement["refined_y_mm"]
-                    
-                    # Clamp refined coordinates
-                    item["x_mm"] = max(0.0, min(W_mm, item["x_mm"]))
-                    item["y_mm"] = max(0.0, min(H_mm, item["y_mm"]))
-                    
-                    refined_count += 1
-                    total_offset += refinement.get("offset_magnitude_mm", 0.0)
-            
-            if refined_count > 0:
-                avg_offset = total_offset / refined_count
-                log_to_front(f"   ✅ Refinados: {refined_count}/{len(combined)} itens (offset médio: {avg_offset:.2f}mm)")
 
-        unique = dedup_items(combined, page_num=page_num, tol_mm=tol_mm, 
-                            use_dynamic_tolerance=use_dynamic_tolerance, log_metadata=False,
-                            is_electrical=(diagram_type.lower() == "electrical"))
-        
-        duplicates_removed = len(combined) - len(unique)
-        if duplicates_removed > 0:
-            log_to_front(f"🔄 Removidos {duplicates_removed} duplicados de {len(combined)} itens")
-        
-        log_to_front(f"📄 Página {page_num} | Global: {len(global_list)} | Quadrants: {len(quad_items)} | Únicos: {len(unique)}")
+                return {
+                    "pagina": page_num,
+                    "modelo": model_used,
+                    "resultado": unique,
+                    "ink_screen": ink_metrics.summary(page_num)
+                }
 
-        all_pages.append({
-            "pagina": page_num,
-            "modelo": model_used,
-            "resultado": unique
-        })
+        # Páginas com paralelismo limitado; gather preserva a ordem das páginas na resposta
+        all_pages: List[Dict[str, Any]] = list(await asyncio.gather(
+            *(analyze_page(page_idx, page) for page_idx, page in enumerate(doc))
+        ))
 
+        if skip_blank:
+            ink_summary = ink_metrics.summary()
+            log_to_front(f"🧹 Pré-filtro de tinta: {ink_summary['skipped']}/{ink_summary['screened']} ignorados {ink_summary['by_reason']}")
+        stats = doc.raster_cache.stats()
+        log_to_front(f"🗂️ Cache de raster: {stats['levels']} níveis, {stats['hits']} hits, {stats['misses']} renderizações, {stats['evictions']} despejos")
+    finally:
+        # Fecha também em erro: remove o diretório temporário dos memmaps do cache de raster
+        doc.close()
     log_to_front("✅ Análise concluída.")
     
     # Auto-armazena na base de conhecimento
@@ -2654,7 +3818,7 @@ async def analyze_pdf(
         
         # Gera descrição automática ULTRA-COMPLETA
         try:
-            description = generate_process_description(all_items, ultra_complete=True)
+            description = await generate_process_description(all_items, ultra_complete=True)
             pid_knowledge_base[pid_id]["description"] = description
             log_to_front(f"📝 Descrição ultra-completa do processo gerada automaticamente")
         except Exception as e:
@@ -2663,6 +3827,9 @@ async def analyze_pdf(
         # Adiciona pid_id ao response
         for page in all_pages:
             page["pid_id"] = pid_id
+
+    # Uso do LLM (tokens, custo, latência) por página e do job inteiro
+    attach_job_usage(all_pages, usage_params)
     
     # Sanitize all float values to ensure JSON compliance
     all_pages = sanitize_for_json(all_pages)
@@ -2678,13 +3845,37 @@ def build_generation_prompt(process_description: str, width_mm: float = 1189.0,
     Constrói prompt técnico e detalhado para gerar P&ID ou diagrama elétrico a partir de descrição do processo.
     A0 sheet dimensions: 1189mm x 841mm (landscape)
     A3 sheet dimensions: 420mm x 297mm (landscape) - used for electrical diagrams
+    Prefixo estático compilado por diagram_type + sufixo com dimensões e descrição.
     """
-    
     is_electrical = diagram_type.lower() == "electrical"
-    
+
     # For electrical diagrams, always use A3 dimensions
     if is_electrical:
         width_mm, height_mm = get_electrical_diagram_dimensions()
+
+    compiled = compile_generation_prompt(diagram_type)
+    return compiled.render(f"""
+SHEET DIMENSIONS:
+- Dimensions: {width_mm} mm (width/X) x {height_mm} mm (height/Y)
+- Coordinates must be within limits: X: 0-{width_mm}, Y: 0-{height_mm}
+
+PROCESS DESCRIPTION:
+"{process_description}"
+""")
+
+
+def compile_generation_prompt(diagram_type: str = "pid") -> CompiledPrompt:
+    """Prefixo do prompt de geração, compilado uma vez por diagram_type"""
+    diagram_type = "electrical" if diagram_type.lower() == "electrical" else "pid"
+    return prompt_registry.compile(("generation", diagram_type),
+                                   lambda: _build_generation_prefix(diagram_type), _log_compiled_prompt)
+
+
+def _build_generation_prefix(diagram_type: str) -> str:
+    """Instruções estáticas do prompt de geração (sem descrição do processo nem dimensões)"""
+    is_electrical = diagram_type.lower() == "electrical"
+    
+    if is_electrical:
         diagram_name = "Electrical Diagram (Diagrama Elétrico)"
         standards = "electrical standards and symbols"
         task_description = "electrical diagram"
@@ -2705,8 +3896,7 @@ CRITICAL OUTPUT REQUIREMENT:
 You MUST respond with ONLY a valid JSON array. NO additional text, explanations, markdown, or descriptions.
 Start your response directly with '[' and end with ']'. Do NOT include any text before or after the JSON.
 
-TASK: Generate a representative {task_description} example for educational purposes based on this process description:
-"{process_description}"
+TASK: Generate a representative {task_description} example for educational purposes based on the PROCESS DESCRIPTION given at the end of this prompt.
 
 NOTE: This is for educational demonstration and learning purposes only, to illustrate {concepts}.
 
@@ -2715,7 +3905,7 @@ Focus exclusively on {"electrical components, connections, and power distributio
 
 TECHNICAL SPECIFICATIONS:
 - Sheet: {sheet_format}
-- Dimensions: {width_mm} mm (width/X) x {height_mm} mm (height/Y)
+- Dimensions: given in SHEET DIMENSIONS at the end of this prompt
 - Coordinate system: X increases left to right, Y increases top to bottom
 - Origin: Top left corner is point (0, 0)
 - Layout: {"VERTICAL - Power flow from source (TOP) to loads (BOTTOM)" if is_electrical else "Process flow from left (inlet) to right (outlet)"}
@@ -3060,46 +4250,46 @@ NOTE: Components are arranged VERTICALLY (top to bottom) following power flow.
 EXAMPLE OUTPUT FOR P&ID:
 
 [
-  {{
+  {
     "tag": "T-101",
     "descricao": "Feed Tank",
     "x_mm": 150.5,
     "y_mm": 450.8,
     "from": "N/A",
     "to": "P-101"
-  }},
-  {{
+  },
+  {
     "tag": "P-101",
     "descricao": "Centrifugal Feed Pump",
     "x_mm": 250.3,
     "y_mm": 400.2,
     "from": "T-101",
     "to": "E-201"
-  }},
-  {{
+  },
+  {
     "tag": "FT-101",
     "descricao": "Flow Transmitter",
     "x_mm": 280.7,
     "y_mm": 380.5,
     "from": "P-101",
     "to": "FCV-101"
-  }},
-  {{
+  },
+  {
     "tag": "FCV-101",
     "descricao": "Flow Control Valve",
     "x_mm": 320.4,
     "y_mm": 380.5,
     "from": "FT-101",
     "to": "E-201"
-  }},
-  {{
+  },
+  {
     "tag": "PT-102",
     "descricao": "Pressure Transmitter",
     "x_mm": 270.6,
     "y_mm": 420.1,
     "from": "P-101",
     "to": "N/A"
-  }}
+  }
 ]
 """
     
@@ -3108,7 +4298,7 @@ CRITICAL REMINDERS:
 - Return ONLY the JSON array shown above, no other text
 - NO explanations, NO markdown formatting (no ```json), NO introductory text
 - Start directly with '[' and end with ']'
-- Coordinates must be within limits: X: 0-{width_mm}, Y: 0-{height_mm}
+- Coordinates must be within the limits given in SHEET DIMENSIONS
 {"- Coordinates MUST be multiples of 4mm (e.g., 0.0, 4.0, 8.0, 12.0, 16.0, 20.0, etc.)" if is_electrical else "- Coordinates MUST use decimal precision (e.g., 150.5, NOT 150)"}
 - Coordinates must reference the CENTER of equipment and instruments (not piping)
 - This is an educational example to demonstrate {"electrical diagram concepts" if is_electrical else "P&ID concepts and ISA standards"}
@@ -3132,6 +4322,8 @@ async def generate_pid(
     
     if not prompt or len(prompt.strip()) < 10:
         raise HTTPException(status_code=400, detail="Prompt muito curto. Descreva o processo com mais detalhes.")
+    current_job_id.set(f"generate:{uuid.uuid4().hex[:8]}")
+    current_page.set(1)  # P&ID gerado tem uma única página
     
     log_to_front(f"🎨 Gerando P&ID para: {prompt}")
     
@@ -3152,34 +4344,15 @@ async def generate_pid(
         # Chama LLM sem imagem (apenas texto)
         log_to_front("🤖 Chamando LLM para gerar equipamentos...")
         
-        global client
-        try:
-            resp = client.chat.completions.create(
-                model=FALLBACK_MODEL,  # usa gpt-4o para geração de texto
-                messages=[{
-                    "role": "user",
-                    "content": generation_prompt
-                }],
-                temperature=0.7,  # um pouco de criatividade
-                timeout=OPENAI_REQUEST_TIMEOUT
-            )
-        except Exception as e:
-            # Check if it's an SSL error and retry without SSL verification
-            if "SSL" in str(e) or "certificate" in str(e).lower():
-                log_to_front(f"⚠️ Erro SSL detectado: {e!r}")
-                log_to_front("🔄 Tentando novamente sem verificação SSL...")
-                client = make_client(verify_ssl=False)
-                resp = client.chat.completions.create(
-                    model=FALLBACK_MODEL,
-                    messages=[{
-                        "role": "user",
-                        "content": generation_prompt
-                    }],
-                    temperature=0.7,
-                    timeout=OPENAI_REQUEST_TIMEOUT
-                )
-            else:
-                raise
+        resp = await chat_completion(
+            kind="generation",
+            model=FALLBACK_MODEL,  # usa gpt-4o para geração de texto
+            messages=[{
+                "role": "user",
+                "content": generation_prompt
+            }],
+            temperature=0.7,  # um pouco de criatividade
+        )
         
         raw = resp.choices[0].message.content if resp and resp.choices else ""
         log_to_front(f"📝 RAW GENERATION OUTPUT: {raw[:500]}")
@@ -3276,7 +4449,7 @@ async def generate_pid(
         
         # Gera descrição automática ULTRA-COMPLETA
         try:
-            description = generate_process_description(unique, ultra_complete=True)
+            description = await generate_process_description(unique, ultra_complete=True)
             pid_knowledge_base[pid_id]["description"] = description
             log_to_front(f"📝 Descrição ultra-completa do processo gerada automaticamente")
         except Exception as e:
@@ -3289,6 +4462,7 @@ async def generate_pid(
             "resultado": unique,
             "pid_id": pid_id
         }]
+        attach_job_usage(response_data, {"diagram_type": diagram_type}, route="generate")
         
         # Sanitize all float values to ensure JSON compliance
         response_data = sanitize_for_json(response_data)
@@ -3304,7 +4478,7 @@ async def generate_pid(
 # ============================================================
 # GERAÇÃO DE DESCRIÇÃO DO PROCESSO
 # ============================================================
-def generate_process_description(pid_data: List[Dict[str, Any]], ultra_complete: bool = False) -> str:
+async def generate_process_description(pid_data: List[Dict[str, Any]], ultra_complete: bool = False) -> str:
     """
     Gera uma descrição completa do P&ID baseada nos equipamentos identificados.
     
@@ -3324,7 +4498,7 @@ def generate_process_description(pid_data: List[Dict[str, Any]], ultra_complete:
         descricao = item.get("descricao", "")
         tipo = item.get("tipo", "")
         
-        if any(prefix in tag for prefix in ["FT", "PT", "TT", "LT", "FIC", "PIC", "TIC", "LIC", "PSV", "FE", "PE", "TE", "LE"]):
+        if kwc.is_instrument_tag(tag):
             instrumentos.append(item)
         else:
             equipamentos.append(item)
@@ -3571,8 +4745,9 @@ Seja técnico e específico, usando terminologia da engenharia de processos."""
     try:
         log_to_front(f"🤖 Gerando descrição {'ULTRA-COMPLETA' if ultra_complete else 'do processo'}...")
         
-        global client
-        resp = client.chat.completions.create(
+        started = time.perf_counter()
+        # Aguarda no loop de I/O compartilhado sem bloquear o event loop da API
+        resp = await run_llm(get_client().chat.completions.create(
             model=FALLBACK_MODEL,
             messages=[{
                 "role": "user",
@@ -3580,7 +4755,8 @@ Seja técnico e específico, usando terminologia da engenharia de processos."""
             }],
             temperature=0.7,
             timeout=OPENAI_REQUEST_TIMEOUT
-        )
+        ))
+        usage_ledger.record("description", FALLBACK_MODEL, resp, latency_s=time.perf_counter() - started)
         
         description = resp.choices[0].message.content if resp and resp.choices else "Erro ao gerar descrição"
         log_to_front(f"✅ Descrição {'ULTRA-COMPLETA' if ultra_complete else ''} do processo gerada")
@@ -3614,7 +4790,7 @@ async def describe_pid(
     # Só regenera se forçado OU se não existe descrição
     if regenerate or not description:
         log_to_front(f"🔄 {'Regenerando' if regenerate else 'Gerando'} descrição ultra-completa...")
-        description = generate_process_description(pid_info.get("data", []), ultra_complete=True)
+        description = await generate_process_description(pid_info.get("data", []), ultra_complete=True)
         # Atualiza a base de conhecimento com a descrição
         pid_knowledge_base[pid_id]["description"] = description
     else:
@@ -3664,14 +4840,12 @@ async def chat_with_vision(pid_id: str, question: str, pid_info: Dict[str, Any])
     try:
         log_to_front(f"🖼️ Usando MODO VISION para responder pergunta")
         
-        # Abre o PDF usando função robusta com tratamento de erros
-        doc = open_pdf_safely(pdf_data, f"stored_pid_{pid_id}.pdf")
-        
-        # Para perguntas gerais, usa a primeira página
-        # Para P&IDs multipáginas, poderia processar todas
-        page = doc[0]
-        pix = page.get_pixmap(dpi=200)  # Resolução menor para economizar tokens
-        img_bytes = pix.tobytes("png")
+        # Abre o PDF usando função robusta com tratamento de erros (fechado logo após renderizar)
+        with open_pdf_safely(pdf_data, f"stored_pid_{pid_id}.pdf") as doc:
+            # Para perguntas gerais, usa a primeira página
+            # Para P&IDs multipáginas, poderia processar todas
+            page = doc[0]
+            img_bytes = array_to_png(page_raster(page, 200, colorspace="rgb"))  # Resolução menor para economizar tokens
         img_b64 = base64.b64encode(img_bytes).decode("utf-8")
         
         # Prepara contexto com descrição + imagem
@@ -3691,8 +4865,8 @@ PERGUNTA DO USUÁRIO:
 Por favor, analise a IMAGEM do P&ID junto com a descrição e responda de forma clara, técnica e específica.
 Se a informação visual for relevante, use-a. Referencie equipamentos por suas TAGs quando possível."""
         
-        global client
-        resp = client.chat.completions.create(
+        resp = await chat_completion(
+            kind="chat",
             model=FALLBACK_MODEL,  # gpt-4o suporta vision
             messages=[{
                 "role": "user",
@@ -3702,13 +4876,11 @@ Se a informação visual for relevante, use-a. Referencie equipamentos por suas
                 ]
             }],
             temperature=0.5,
-            timeout=OPENAI_REQUEST_TIMEOUT
         )
         
         answer = resp.choices[0].message.content if resp and resp.choices else "Erro ao gerar resposta"
         log_to_front("✅ Resposta gerada usando VISION")
         
-        doc.close()
         return answer
         
     except Exception as e:
@@ -3729,7 +4901,7 @@ async def chat_with_text(pid_id: str, question: str, pid_info: Dict[str, Any]) -
         log_to_front(f"⚠️ Descrição ultra-completa não encontrada para {pid_id}")
         # Fallback: gera agora se não existir
         pid_data = pid_info.get("data", [])
-        description = generate_process_description(pid_data, ultra_complete=True)
+        description = await generate_process_description(pid_data, ultra_complete=True)
         pid_knowledge_base[pid_id]["description"] = description
         log_to_front(f"📝 Descrição ultra-completa gerada agora como fallback")
     
@@ -3750,15 +4922,14 @@ Se a informação solicitada não estiver disponível, indique isso claramente."
     try:
         log_to_front(f"📝 Usando MODO TEXTO (descrição ultra-completa pré-gerada)")
         
-        global client
-        resp = client.chat.completions.create(
+        resp = await chat_completion(
+            kind="chat",
             model=FALLBACK_MODEL,
             messages=[{
                 "role": "user",
                 "content": context
             }],
             temperature=0.5,
-            timeout=OPENAI_REQUEST_TIMEOUT
         )
         
         answer = resp.choices[0].message.content if resp and resp.choices else "Erro ao gerar resposta"
@@ -3793,6 +4964,7 @@ async def chat_about_pid(
     
     if pid_id not in pid_knowledge_base:
         raise HTTPException(status_code=404, detail=f"P&ID '{pid_id}' não encontrado. Execute análise ou geração primeiro.")
+    current_job_id.set(f"chat:{pid_id}")
     
     pid_info = pid_knowledge_base[pid_id]
     
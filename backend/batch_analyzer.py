@@ -0,0 +1,579 @@
+# backend/batch_analyzer.py
+"""
+Offline bulk analysis through a batch API (overnight digitization of large sets of sheets).
+
+The work is split in three resumable steps, all state living in one batch directory:
+
+1. plan:    every page is rendered with the same preprocessing as /analyze (ink
+            pre-screen, quadrant layout or electrical tiles, payload encoding) and the
+            global/quadrant/tile requests are written as Batch API JSONL files, plus a
+            manifest.json with the metadata needed to reassemble them
+2. submit:  the JSONL files are sent to a batch backend - the OpenAI Batch API or a
+            local file-based stand-in (LocalBatchBackend) for offline runs and tests
+3. collect: results are downloaded and each PDF is rebuilt through the usual
+            ensure_json_list → dedup → matcher path; one JSON per PDF, in the same
+            format as the /analyze response
+
+Usage:
+    python backend/batch_analyzer.py plan drawings/*.pdf --out batch_dir [--diagram-type pid] [--dpi 400] [--grid 3]
+    python backend/batch_analyzer.py submit batch_dir [--backend openai|local] [--local-dir DIR]
+    python backend/batch_analyzer.py status batch_dir
+    python backend/batch_analyzer.py collect batch_dir
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from backend import (
+    PRIMARY_MODEL, INK_SKIP_ENABLED, INK_MIN_RATIO,
+    open_pdf_safely, page_raster, screen_ink, screen_page_ink, points_to_mm,
+    page_quadrant_layout, render_quadrant_array, encode_image_payload,
+    plan_tiles, iter_tiles_with_overlap, build_prompt, build_prompt_electrical_global,
+    build_prompt_electrical_tile, build_vision_messages, ensure_json_list,
+    annotate_quadrant_items, assemble_pid_page, parse_electrical_equips,
+    parse_electrical_tile_response, assemble_electrical_page,
+    assign_no_tag_identifiers, sanitize_for_json, log_to_front,
+)
+from llm_client import get_client, run_llm_sync
+
+# Limites por arquivo de entrada da Batch API (50.000 requisições / 200 MB)
+LLM_BATCH_MAX_REQUESTS = int(os.getenv("LLM_BATCH_MAX_REQUESTS", "50000"))
+LLM_BATCH_MAX_BYTES = int(float(os.getenv("LLM_BATCH_MAX_MB", "190")) * 1024 * 1024)
+LLM_BATCH_COMPLETION_WINDOW = os.getenv("LLM_BATCH_COMPLETION_WINDOW", "24h")
+LLM_BATCH_ENDPOINT = "/v1/chat/completions"
+
+MANIFEST_FILE = "manifest.json"
+RESULTS_DIR = "results"
+_FINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+
+@dataclass
+class BatchOptions:
+    """Mesmos parâmetros (e padrões) do /analyze"""
+    diagram_type: str = "pid"
+    model: str = PRIMARY_MODEL
+    dpi: int = 400
+    grid: str = "3"
+    use_overlap: bool = False
+    skip_blank: bool = INK_SKIP_ENABLED
+    ink_threshold: float = INK_MIN_RATIO
+    tol_mm: float = 10.0
+    use_dynamic_tolerance: bool = True
+    use_ocr_validation: bool = False
+    use_geometric_refinement: bool = True
+    # Pipeline elétrico
+    dpi_global: int = 220
+    dpi_tiles: int = 300
+    tile_px: int = 2048
+    overlap: float = 0.20
+
+    @property
+    def grid_auto(self) -> bool:
+        return str(self.grid).strip().lower() == "auto"
+
+    @property
+    def grid_n(self) -> int:
+        return 0 if self.grid_auto else int(self.grid)
+
+
+# ============================================================
+# PLANEJAMENTO (PDFs → JSONL)
+# ============================================================
+class _RequestWriter:
+    """Grava requisições em arquivos JSONL, abrindo um novo arquivo ao atingir os limites"""
+
+    def __init__(self, out_dir: str, max_requests: int = LLM_BATCH_MAX_REQUESTS,
+                 max_bytes: int = LLM_BATCH_MAX_BYTES):
+        self.out_dir = out_dir
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.files: List[str] = []
+        self._fh = None
+        self._count = 0
+        self._bytes = 0
+        self.total = 0
+
+    def write(self, custom_id: str, body: Dict[str, Any]) -> None:
+        line = json.dumps({"custom_id": custom_id, "method": "POST", "url": LLM_BATCH_ENDPOINT, "body": body},
+                          ensure_ascii=False) + "\n"
+        size = len(line.encode("utf-8"))
+        if self._fh is None or self._count >= self.max_requests or self._bytes + size > self.max_bytes:
+            self._rotate()
+        self._fh.write(line)
+        self._count += 1
+        self._bytes += size
+        self.total += 1
+
+    def _rotate(self) -> None:
+        self.close()
+        name = f"requests-{len(self.files):03d}.jsonl"
+        self.files.append(name)
+        self._fh = open(os.path.join(self.out_dir, name), "w", encoding="utf-8")
+        self._count = 0
+        self._bytes = 0
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+def _request_body(options: BatchOptions, prompt: str, payload) -> Dict[str, Any]:
+    # Mesmos parâmetros de geração do llm_call (temperature=0 fora do gpt-5)
+    body = {"model": options.model, "messages": build_vision_messages(prompt, payload.b64, payload.mime)}
+    if options.model != "gpt-5":
+        body["temperature"] = 0
+    return body
+
+
+def _plan_pid_page(page, pidx: int, page_entry: Dict[str, Any], options: BatchOptions,
+                   emit: Callable[[str, str, Dict[str, Any], Dict[str, Any]], None]) -> None:
+    page_num = pidx + 1
+    W_mm, H_mm = page_entry["W_mm"], page_entry["H_mm"]
+
+    payload = encode_image_payload(page_raster(page, options.dpi, colorspace="rgb"), label=f"global p{page_num}")
+    emit("global", "global", {}, _request_body(options, build_prompt(W_mm, H_mm, "global", diagram_type=options.diagram_type), payload))
+
+    if not (options.grid_auto or options.grid_n > 1):
+        return
+    for gx, gy, rect, label in page_quadrant_layout(page, options.grid_auto, options.grid_n, options.use_overlap):
+        if options.skip_blank and screen_ink(page_raster(page, options.dpi, clip=rect, colorspace="gray"),
+                                             min_ratio=options.ink_threshold).skip:
+            page_entry["skipped_regions"] += 1
+            continue
+        ox, oy = points_to_mm(rect.x0), points_to_mm(rect.y0)
+        w_mm, h_mm = points_to_mm(rect.width), points_to_mm(rect.height)
+        payload = encode_image_payload(render_quadrant_array(page, rect, options.dpi, upscale=False), label=f"quadrante {label}")
+        prompt = build_prompt(w_mm, h_mm, "quadrant", (ox, oy), label, options.diagram_type)
+        emit("quadrant", label, {"ox": ox, "oy": oy, "w": w_mm, "h": h_mm}, _request_body(options, prompt, payload))
+
+
+def _plan_electrical_page(page, pidx: int, page_entry: Dict[str, Any], options: BatchOptions,
+                          emit: Callable[[str, str, Dict[str, Any], Dict[str, Any]], None]) -> None:
+    W_mm, H_mm = page_entry["W_mm"], page_entry["H_mm"]
+    page_rgb = page_raster(page, options.dpi_global, colorspace="rgb")
+    Hpx, Wpx = page_rgb.shape[:2]
+    payload = encode_image_payload(page_rgb, allow_resize=False, label=f"global p{pidx + 1}")
+    emit("global", "global", {}, _request_body(options, build_prompt_electrical_global(pidx, Wpx, Hpx, W_mm, H_mm), payload))
+
+    plan = plan_tiles(page, tile_px=options.tile_px, overlap_ratio=options.overlap, dpi=options.dpi_tiles)
+    page_entry["W_px"], page_entry["H_px"] = plan.page_w_px, plan.page_h_px
+    for idx, (tile, (ox, oy), (W, H), _) in enumerate(iter_tiles_with_overlap(page, plan=plan)):
+        if options.skip_blank and screen_ink(tile, min_ratio=options.ink_threshold).skip:
+            page_entry["skipped_regions"] += 1
+            continue
+        tile_w_px, tile_h_px = tile.size
+        payload = encode_image_payload(np.asarray(tile), allow_resize=False, label=f"tile {idx + 1}")
+        prompt = build_prompt_electrical_tile(pidx, ox, oy, tile_w_px, tile_h_px, W_mm, H_mm, W, H)
+        emit("tile", str(idx + 1), {"ox": ox, "oy": oy}, _request_body(options, prompt, payload))
+
+
+def plan_batch(pdf_paths: Iterable[str], out_dir: str, options: Optional[BatchOptions] = None,
+               max_requests: int = LLM_BATCH_MAX_REQUESTS, max_bytes: int = LLM_BATCH_MAX_BYTES) -> Dict[str, Any]:
+    """Renderiza os PDFs, grava as requisições JSONL e o manifest.json em out_dir"""
+    options = options or BatchOptions()
+    if not options.grid_auto and not 1 <= options.grid_n <= 6:
+        raise ValueError("grid deve ser um inteiro entre 1 e 6 ou 'auto'.")
+    os.makedirs(out_dir, exist_ok=True)
+    writer = _RequestWriter(out_dir, max_requests, max_bytes)
+    electrical = options.diagram_type.lower() == "electrical"
+    documents: List[Dict[str, Any]] = []
+
+    try:
+        for doc_idx, path in enumerate(pdf_paths):
+            with open(path, "rb") as f:
+                data = f.read()
+            filename = os.path.basename(path)
+            log_to_front(f"📦 Batch: planejando {filename}")
+            doc = open_pdf_safely(data, filename)
+            doc_entry = {"path": os.path.abspath(path), "filename": filename, "pages": []}
+            try:
+                for pidx, page in enumerate(doc):
+                    page_entry = {
+                        "pagina": pidx + 1,
+                        "W_mm": points_to_mm(page.rect.width),
+                        "H_mm": points_to_mm(page.rect.height),
+                        "skipped": False,
+                        "skipped_regions": 0,
+                        "requests": [],
+                    }
+                    doc_entry["pages"].append(page_entry)
+                    if options.skip_blank and screen_page_ink(page).skip:
+                        page_entry["skipped"] = True
+                        continue
+
+                    def emit(scope, label, meta, body, _page=page_entry, _pidx=pidx):
+                        custom_id = f"d{doc_idx}-p{_pidx + 1}-{scope}-{label}"
+                        writer.write(custom_id, body)
+                        _page["requests"].append({"custom_id": custom_id, "scope": scope, "label": label, **meta})
+
+                    if electrical:
+                        _plan_electrical_page(page, pidx, page_entry, options, emit)
+                    else:
+                        _plan_pid_page(page, pidx, page_entry, options, emit)
+            finally:
+                doc.close()
+            documents.append(doc_entry)
+    finally:
+        writer.close()
+
+    manifest = {
+        "version": 1,
+        "created": datetime.now().isoformat(),
+        "options": asdict(options),
+        "input_files": writer.files,
+        "total_requests": writer.total,
+        "backend": None,
+        "batches": [],
+        "documents": documents,
+    }
+    save_manifest(out_dir, manifest)
+    log_to_front(f"📦 Batch planejado: {writer.total} requisições em {len(writer.files)} arquivo(s), {len(documents)} PDF(s)")
+    return manifest
+
+
+def load_manifest(batch_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(batch_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(batch_dir: str, manifest: Dict[str, Any]) -> None:
+    tmp = os.path.join(batch_dir, MANIFEST_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(batch_dir, MANIFEST_FILE))
+
+
+# ============================================================
+# BACKENDS DE BATCH
+# ============================================================
+def _read_jsonl(text: str) -> List[Dict[str, Any]]:
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+class OpenAIBatchBackend:
+    """Batch API da OpenAI (upload do JSONL, criação do batch, download dos resultados)"""
+    name = "openai"
+
+    def _client(self):
+        client = get_client()
+        if client is None:
+            raise RuntimeError("OPENAI_API_KEY não definida. Configure a chave no arquivo .env")
+        return client
+
+    def submit(self, input_path: str, metadata: Optional[Dict[str, str]] = None) -> str:
+        client = self._client()
+        with open(input_path, "rb") as f:
+            content = f.read()
+        uploaded = run_llm_sync(client.files.create(file=(os.path.basename(input_path), content), purpose="batch"))
+        batch = run_llm_sync(client.batches.create(
+            input_file_id=uploaded.id, endpoint=LLM_BATCH_ENDPOINT,
+            completion_window=LLM_BATCH_COMPLETION_WINDOW, metadata=metadata or None,
+        ))
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return run_llm_sync(self._client().batches.retrieve(batch_id)).status
+
+    def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        client = self._client()
+        batch = run_llm_sync(client.batches.retrieve(batch_id))
+        records: List[Dict[str, Any]] = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = run_llm_sync(client.files.content(file_id))
+                records.extend(_read_jsonl(content.text))
+        return records
+
+
+class LocalBatchBackend:
+    """
+    Stand-in offline da Batch API baseado em arquivos.
+
+    Cada batch é um diretório <root>/<batch_id>/ com input.jsonl. O batch fica
+    "completed" quando existe output.jsonl (formato de saída da Batch API). Com um
+    `responder(request) -> str`, a saída é gerada na submissão; sem ele, output.jsonl
+    pode ser colocado no diretório por outro processo (ex.: respostas gravadas).
+    """
+    name = "local"
+
+    def __init__(self, root: str, responder: Optional[Callable[[Dict[str, Any]], str]] = None):
+        self.root = root
+        self.responder = responder
+
+    def _dir(self, batch_id: str) -> str:
+        return os.path.join(self.root, batch_id)
+
+    def submit(self, input_path: str, metadata: Optional[Dict[str, str]] = None) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex[:12]}"
+        batch_dir = self._dir(batch_id)
+        os.makedirs(batch_dir, exist_ok=True)
+        shutil.copyfile(input_path, os.path.join(batch_dir, "input.jsonl"))
+        with open(os.path.join(batch_dir, "batch.json"), "w", encoding="utf-8") as f:
+            json.dump({"id": batch_id, "created_at": int(time.time()), "metadata": metadata or {}}, f)
+        if self.responder is not None:
+            self._process(batch_dir)
+        return batch_id
+
+    def _process(self, batch_dir: str) -> None:
+        with open(os.path.join(batch_dir, "input.jsonl"), "r", encoding="utf-8") as f:
+            requests = _read_jsonl(f.read())
+        tmp = os.path.join(batch_dir, "output.jsonl.tmp")
+        with open(tmp, "w", encoding="utf-8") as out:
+            for i, request in enumerate(requests):
+                record: Dict[str, Any] = {"id": f"batch_req_{i}", "custom_id": request["custom_id"]}
+                try:
+                    content = self.responder(request)
+                    record["response"] = {"status_code": 200, "request_id": f"req_{i}", "body": {
+                        "id": f"chatcmpl-local-{i}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": request["body"].get("model"),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": content}}],
+                    }}
+                    record["error"] = None
+                except Exception as e:
+                    record["response"] = None
+                    record["error"] = {"code": "responder_error", "message": str(e)}
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp, os.path.join(batch_dir, "output.jsonl"))
+
+    def status(self, batch_id: str) -> str:
+        if not os.path.isdir(self._dir(batch_id)):
+            return "failed"
+        return "completed" if os.path.exists(os.path.join(self._dir(batch_id), "output.jsonl")) else "in_progress"
+
+    def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        with open(os.path.join(self._dir(batch_id), "output.jsonl"), "r", encoding="utf-8") as f:
+            return _read_jsonl(f.read())
+
+
+def get_batch_backend(name: str, local_dir: Optional[str] = None):
+    if name == "openai":
+        return OpenAIBatchBackend()
+    if name == "local":
+        if not local_dir:
+            raise ValueError("O backend local requer --local-dir")
+        return LocalBatchBackend(local_dir)
+    raise ValueError(f"Backend de batch desconhecido: {name}")
+
+
+# ============================================================
+# SUBMISSÃO E STATUS
+# ============================================================
+def submit_batch(batch_dir: str, backend) -> Dict[str, Any]:
+    """Envia os arquivos JSONL ainda não submetidos e registra os IDs no manifest"""
+    manifest = load_manifest(batch_dir)
+    submitted = {b["input_file"] for b in manifest["batches"]}
+    manifest["backend"] = backend.name
+    if isinstance(backend, LocalBatchBackend):
+        manifest["local_dir"] = os.path.abspath(backend.root)
+    for name in manifest["input_files"]:
+        if name in submitted:
+            continue
+        batch_id = backend.submit(os.path.join(batch_dir, name), metadata={"source": "batch_analyzer", "input_file": name})
+        manifest["batches"].append({"input_file": name, "batch_id": batch_id})
+        save_manifest(batch_dir, manifest)
+        log_to_front(f"📤 Batch submetido: {name} → {batch_id}")
+    return manifest
+
+
+def batch_status(batch_dir: str, backend) -> Dict[str, str]:
+    manifest = load_manifest(batch_dir)
+    return {b["batch_id"]: backend.status(b["batch_id"]) for b in manifest["batches"]}
+
+
+# ============================================================
+# REMONTAGEM (resultados → resposta do /analyze)
+# ============================================================
+def _index_results(records: Iterable[Dict[str, Any]]) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+    """custom_id → (modelo, conteúdo); conteúdo None para requisições com erro"""
+    out: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+    for record in records:
+        response = record.get("response") or {}
+        body = response.get("body") or {}
+        choices = body.get("choices") or []
+        if record.get("error") or response.get("status_code") != 200 or not choices:
+            out[record["custom_id"]] = (body.get("model"), None)
+            continue
+        out[record["custom_id"]] = (body.get("model"), (choices[0].get("message") or {}).get("content") or "")
+    return out
+
+
+def _assemble_pid_document(doc, doc_entry: Dict[str, Any], results, options: BatchOptions) -> List[Dict[str, Any]]:
+    pages = []
+    for page_entry in doc_entry["pages"]:
+        page_num = page_entry["pagina"]
+        if page_entry["skipped"]:
+            pages.append({"pagina": page_num, "modelo": None, "resultado": []})
+            continue
+        global_list: List[Dict[str, Any]] = []
+        quad_items: List[Dict[str, Any]] = []
+        model_used, failed = None, 0
+        for req in page_entry["requests"]:
+            model, content = results.get(req["custom_id"], (None, None))
+            if content is None:
+                failed += 1
+                continue
+            items = ensure_json_list(content)
+            if req["scope"] == "global":
+                model_used = model
+                global_list = items
+            else:
+                quad_items.extend(annotate_quadrant_items(items, req["ox"], req["oy"], req["w"], req["h"]))
+        unique = assemble_pid_page(
+            doc[page_num - 1], page_num, page_entry["W_mm"], page_entry["H_mm"], global_list, quad_items,
+            options.diagram_type, options.dpi, options.tol_mm, options.use_dynamic_tolerance,
+            options.use_ocr_validation, options.use_geometric_refinement,
+        )
+        pages.append({"pagina": page_num, "modelo": model_used or options.model, "resultado": unique,
+                      "batch": {"requests": len(page_entry["requests"]), "failed": failed}})
+    return pages
+
+
+def _assemble_electrical_document(doc_entry: Dict[str, Any], results, options: BatchOptions) -> List[Dict[str, Any]]:
+    pages = []
+    for page_entry in doc_entry["pages"]:
+        page_num = page_entry["pagina"]
+        pidx = page_num - 1
+        if page_entry["skipped"]:
+            pages.append({"pagina": page_num, "modelo": None, "resultado": []})
+            continue
+        eqs, cons, eps = [], [], []
+        model_used, failed = None, 0
+        for req in page_entry["requests"]:
+            model, content = results.get(req["custom_id"], (None, None))
+            if content is None:
+                failed += 1
+                continue
+            if req["scope"] == "global":
+                model_used = model
+                eqs = parse_electrical_equips({"equipments": ensure_json_list(content)}, pidx) + eqs
+            else:
+                tile_eqs, c, e = parse_electrical_tile_response(content, pidx, req["ox"], req["oy"])
+                eqs.extend(tile_eqs)
+                cons.extend(c); eps.extend(e)
+        stage_timings: Dict[str, float] = {}
+        page_items, graph, _ = assemble_electrical_page(
+            eqs, cons, eps, page_entry["W_mm"], page_entry["H_mm"],
+            page_entry.get("W_px"), page_entry.get("H_px"), options.dpi_tiles, model_used or options.model,
+            stage_timings,
+        )
+        pages.append({"pagina": page_num, "modelo": model_used or options.model, "resultado": page_items,
+                      "batch": {"requests": len(page_entry["requests"]), "failed": failed},
+                      "stage_timings_ms": stage_timings, "connections": graph.edge_list()})
+    return pages
+
+
+def collect_batch(batch_dir: str, backend) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Baixa os resultados (todos os batches devem estar concluídos) e grava
+    results/<pdf>.json para cada documento. Retorna {arquivo: páginas}.
+    """
+    manifest = load_manifest(batch_dir)
+    options = BatchOptions(**manifest["options"])
+    if not manifest["batches"]:
+        raise RuntimeError("Nenhum batch submetido para este diretório")
+
+    records: List[Dict[str, Any]] = []
+    for entry in manifest["batches"]:
+        status = backend.status(entry["batch_id"])
+        if status != "completed":
+            raise RuntimeError(f"Batch {entry['batch_id']} ainda não concluído (status: {status})")
+        records.extend(backend.results(entry["batch_id"]))
+    results = _index_results(records)
+
+    out_dir = os.path.join(batch_dir, RESULTS_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    collected: Dict[str, List[Dict[str, Any]]] = {}
+    for doc_entry in manifest["documents"]:
+        log_to_front(f"🧩 Batch: remontando {doc_entry['filename']}")
+        if options.diagram_type.lower() == "electrical":
+            pages = _assemble_electrical_document(doc_entry, results, options)
+        else:
+            with open(doc_entry["path"], "rb") as f:
+                doc = open_pdf_safely(f.read(), doc_entry["filename"])
+            try:
+                pages = _assemble_pid_document(doc, doc_entry, results, options)
+            finally:
+                doc.close()
+
+        # Mesmo pós-processamento final do /analyze (IDs sem tag apenas no fluxo P&ID)
+        all_items = [item for page in pages for item in page["resultado"]]
+        if all_items and options.diagram_type.lower() != "electrical":
+            all_items = assign_no_tag_identifiers(all_items)
+            item_idx = 0
+            for page in pages:
+                num_items = len(page["resultado"])
+                page["resultado"] = all_items[item_idx:item_idx + num_items]
+                item_idx += num_items
+        pages = sanitize_for_json(pages)
+
+        stem = os.path.splitext(doc_entry["filename"])[0]
+        with open(os.path.join(out_dir, f"{stem}.json"), "w", encoding="utf-8") as f:
+            json.dump(pages, f, ensure_ascii=False, indent=2)
+        collected[doc_entry["filename"]] = pages
+    log_to_front(f"✅ Batch remontado: {len(collected)} PDF(s) em {out_dir}")
+    return collected
+
+
+# ============================================================
+# CLI
+# ============================================================
+def _backend_from_args(args, manifest: Optional[Dict[str, Any]] = None):
+    name = args.backend or (manifest or {}).get("backend") or "openai"
+    local_dir = args.local_dir or (manifest or {}).get("local_dir")
+    return get_batch_backend(name, local_dir)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Análise offline de PDFs via Batch API")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_plan = sub.add_parser("plan", help="Gera as requisições JSONL e o manifest")
+    p_plan.add_argument("pdfs", nargs="+")
+    p_plan.add_argument("--out", required=True)
+    p_plan.add_argument("--diagram-type", default="pid", choices=["pid", "electrical"])
+    p_plan.add_argument("--model", default=PRIMARY_MODEL)
+    p_plan.add_argument("--dpi", type=int, default=400)
+    p_plan.add_argument("--grid", default="3")
+    p_plan.add_argument("--use-overlap", action="store_true")
+    p_plan.add_argument("--no-skip-blank", action="store_true")
+
+    for command in ("submit", "status", "collect"):
+        p = sub.add_parser(command)
+        p.add_argument("batch_dir")
+        p.add_argument("--backend", choices=["openai", "local"], default=None)
+        p.add_argument("--local-dir", default=None)
+
+    args = parser.parse_args(argv)
+    if args.command == "plan":
+        options = BatchOptions(diagram_type=args.diagram_type, model=args.model, dpi=args.dpi, grid=args.grid,
+                               use_overlap=args.use_overlap, skip_blank=not args.no_skip_blank)
+        plan_batch(args.pdfs, args.out, options)
+        return 0
+
+    manifest = load_manifest(args.batch_dir)
+    backend = _backend_from_args(args, manifest)
+    if args.command == "submit":
+        submit_batch(args.batch_dir, backend)
+    elif args.command == "status":
+        for batch_id, status in batch_status(args.batch_dir, backend).items():
+            print(f"{batch_id}: {status}")
+    else:
+        collect_batch(args.batch_dir, backend)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+# backend/connection_graph.py
+"""
+Per-page graph of electrical connections with adjacency lists keyed by tag.
+
+Edges are inserted incrementally as tile results arrive. Duplicates (same
+from/to and similar path, see electrical_merge.PathIndex) are rejected on
+insertion, keep-first, so inserting the tiles in order gives the same edges
+as merge_electrical_conns over the concatenated list. Lookups of the
+equipment connected to a tag cost O(degree) instead of a scan over all
+connections:
+
+    graph = ConnectionGraph(page=1, similarity=_path_sim)
+    graph.extend(tile_conns)
+    graph.sources("M-101")   # from_tag of the edges arriving at M-101
+    graph.targets("M-101")   # to_tag of the edges leaving M-101
+    graph.edge_list()        # serializable edges for the response
+
+Edges are the Conn objects themselves (from_tag, to_tag, path, direction,
+confidence); the graph never modifies them.
+"""
+from collections import defaultdict
+from typing import Any, Callable, DefaultDict, Dict, Hashable, Iterable, List, Optional
+
+from electrical_merge import PathIndex
+
+
+def _hashable(tag: Any) -> bool:
+    try:
+        hash(tag)
+    except TypeError:
+        return False
+    return True
+
+
+class ConnectionGraph:
+    def __init__(self, page: Optional[int] = None, similarity: Optional[Callable] = None,
+                 scale: float = 20.0, threshold: float = 0.8):
+        self.page = page
+        self.edges: List[Any] = []
+        # Sem função de similaridade não há deduplicação de caminhos
+        self._index = PathIndex(similarity, scale=scale, threshold=threshold) if similarity else None
+        self._out: DefaultDict[Hashable, List[int]] = defaultdict(list)  # from_tag -> arestas
+        self._in: DefaultDict[Hashable, List[int]] = defaultdict(list)   # to_tag -> arestas
+        self.rejected = 0
+
+    def add(self, conn: Any, dedup: bool = True) -> bool:
+        """Insere a conexão; False se for duplicata de uma aresta já existente"""
+        if self._index is not None:
+            key = (conn.from_tag, conn.to_tag)
+            if dedup and self._index.find(key, conn.path) is not None:
+                self.rejected += 1
+                return False
+            self._index.insert(key, conn.path)
+        i = len(self.edges)
+        self.edges.append(conn)
+        # TAG não hashável (lista no JSON) fica fora das listas de adjacência
+        if _hashable(conn.from_tag):
+            self._out[conn.from_tag].append(i)
+        if _hashable(conn.to_tag):
+            self._in[conn.to_tag].append(i)
+        return True
+
+    def extend(self, conns: Iterable[Any], dedup: bool = True) -> int:
+        """Insere em ordem; retorna quantas arestas foram aceitas"""
+        return sum(1 for c in conns if self.add(c, dedup=dedup))
+
+    def sources(self, tag: Hashable) -> List[Any]:
+        """from_tag das arestas que chegam em `tag`, em ordem de inserção"""
+        if not _hashable(tag):
+            return [c.from_tag for c in self.edges if c.to_tag == tag]
+        return [self.edges[i].from_tag for i in self._in.get(tag, ())]
+
+    def targets(self, tag: Hashable) -> List[Any]:
+        """to_tag das arestas que saem de `tag`, em ordem de inserção"""
+        if not _hashable(tag):
+            return [c.to_tag for c in self.edges if c.from_tag == tag]
+        return [self.edges[i].to_tag for i in self._out.get(tag, ())]
+
+    def degree(self, tag: Hashable) -> int:
+        return len(self._in.get(tag, ())) + len(self._out.get(tag, ()))
+
+    def tags(self) -> List[Hashable]:
+        """TAGs com ao menos uma aresta (sem None)"""
+        return [t for t in dict.fromkeys([*self._out, *self._in]) if t is not None]
+
+    def edge_list(self) -> List[Dict[str, Any]]:
+        """Arestas serializáveis, na ordem de inserção"""
+        return [{
+            "from": c.from_tag or "N/A",
+            "to": c.to_tag or "N/A",
+            "direction": c.direction,
+            "confidence": round(float(c.confidence), 2),
+        } for c in self.edges]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"page": self.page, "edges": len(self.edges), "tags": len(self.tags()), "rejected": self.rejected}
+
+    def __len__(self) -> int:
+        return len(self.edges)
@@ -0,0 +1,318 @@
+# backend/electrical_merge.py
+"""
+Merge engine for electrical detections (global pass + tiles).
+
+Same decisions as the original pure-Python loops, without the quadratic scans:
+
+- nms_indices: greedy NMS in the given order. Each kept box suppresses the
+  later boxes whose IoU exceeds the threshold, computed in one numpy batch over
+  the candidates that share a grid cell with it (boxes that do not overlap
+  have IoU 0 and can never be suppressed when the threshold is >= 0).
+- centroid_clusters: first-fit clustering by group centroid. Centroids are
+  kept as running sums (same float results as re-summing the group in
+  insertion order) and indexed in a grid with cells of 2·eps, so a point
+  only checks the groups in the neighbouring 3x3 cells.
+- same_tag_groups: tag -> indices map, pairwise IoU matrix per tag.
+- PathIndex / dedup_paths: connections bucketed by (from_tag, to_tag) and
+  hashed by their first points, so a path is only compared with kept paths
+  that can reach the similarity threshold. PathIndex accepts insertions one
+  at a time (tiles as they arrive).
+
+IoU follows BBox.iou exactly (including degenerate and NaN boxes, which
+never overlap anything), so outputs are identical to the previous code.
+Boxes are (x, y, w, h) rows of a float array.
+"""
+import math
+from collections import defaultdict
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Caixa que cobre mais células do que isso é testada contra todas (evita explodir a grade)
+MAX_CELLS_PER_BOX = 64
+
+
+def box_array(boxes: Sequence[Tuple[float, float, float, float]]) -> np.ndarray:
+    """(n, 4) float64 com x, y, w, h"""
+    arr = np.asarray(boxes, dtype=np.float64)
+    return arr.reshape(-1, 4)
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    IoU (len(a), len(b)) com a mesma aritmética de BBox.iou (a = self): max/min do
+    Python (que não propagam NaN como np.maximum), interseção só quando positiva e
+    0.0 quando a união não é positiva.
+    """
+    ax, ay, aw, ah = (a[:, i, None] for i in range(4))
+    bx, by, bw, bh = (b[None, :, i] for i in range(4))
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        x1 = np.where(bx > ax, bx, ax)
+        y1 = np.where(by > ay, by, ay)
+        ax2, bx2 = ax + aw, bx + bw
+        ay2, by2 = ay + ah, by + bh
+        x2 = np.where(bx2 < ax2, bx2, ax2)
+        y2 = np.where(by2 < ay2, by2, ay2)
+        iw, ih = x2 - x1, y2 - y1
+        inter = np.where(iw > 0, iw, 0.0) * np.where(ih > 0, ih, 0.0)
+        area_a = np.where(0 > aw, 0.0, aw) * np.where(0 > ah, 0.0, ah)
+        area_b = np.where(0 > bw, 0.0, bw) * np.where(0 > bh, 0.0, bh)
+        union = area_a + area_b - inter
+        return np.where(union > 0, inter / union, 0.0)
+
+
+class _BoxGrid:
+    """Índice de caixas por célula (cada caixa entra em todas as células que cobre)"""
+
+    def __init__(self, boxes: np.ndarray):
+        sizes = np.maximum(boxes[:, 2], boxes[:, 3])
+        sizes = sizes[np.isfinite(sizes) & (sizes > 0)]
+        self.cell = float(np.median(sizes)) if len(sizes) else 1.0
+        self.cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        self.wide: List[int] = []  # não finitas ou grandes demais: candidatas de todas
+        self.ranges: List[Optional[Tuple[int, int, int, int]]] = []
+        for i, (x, y, w, h) in enumerate(boxes.tolist()):
+            rng = self._range(x, y, w, h)
+            self.ranges.append(rng)
+            if rng is None:
+                self.wide.append(i)
+                continue
+            cx0, cy0, cx1, cy1 = rng
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    self.cells[(cx, cy)].append(i)
+
+    def _range(self, x, y, w, h) -> Optional[Tuple[int, int, int, int]]:
+        if not all(math.isfinite(v) for v in (x, y, w, h)):
+            return None
+        c = self.cell
+        cx0, cy0 = math.floor(x / c), math.floor(y / c)
+        cx1, cy1 = math.floor((x + max(w, 0.0)) / c), math.floor((y + max(h, 0.0)) / c)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > MAX_CELLS_PER_BOX:
+            return None
+        return cx0, cy0, cx1, cy1
+
+    def neighbours(self, i: int) -> Optional[set]:
+        """Caixas que podem sobrepor a caixa i (None = todas)"""
+        rng = self.ranges[i]
+        if rng is None:
+            return None
+        cx0, cy0, cx1, cy1 = rng
+        out = set(self.wide)
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                out.update(self.cells.get((cx, cy), ()))
+        return out
+
+
+def nms_indices(boxes: np.ndarray, iou_thr: float) -> List[int]:
+    """Índices mantidos pelo NMS guloso na ordem das linhas (a primeira caixa tem prioridade)"""
+    n = len(boxes)
+    alive = np.ones(n, dtype=bool)
+    # Sem sobreposição o IoU é 0: só dá para podar candidatos quando 0 nunca suprime
+    grid = _BoxGrid(boxes) if iou_thr >= 0 else None
+    kept: List[int] = []
+    for i in range(n):
+        if not alive[i]:
+            continue
+        kept.append(i)
+        near = grid.neighbours(i) if grid is not None else None
+        if near is None:
+            cand = np.arange(i + 1, n)
+        else:
+            cand = np.fromiter((j for j in near if j > i), dtype=np.intp)
+        cand = cand[alive[cand]]
+        if not len(cand):
+            continue
+        ious = iou_matrix(boxes[cand], boxes[i:i + 1])[:, 0]
+        alive[cand[~(ious <= iou_thr)]] = False
+    return kept
+
+
+def centroid_clusters(centers: Sequence[Tuple[float, float]], eps: float) -> List[List[int]]:
+    """
+    Agrupamento first-fit: cada ponto entra no primeiro grupo (ordem de criação) cujo
+    centróide atual está a no máximo eps; senão abre um grupo novo.
+    """
+    eps2 = eps ** 2
+    # Grade de 2·eps: qualquer centróide a ~eps está nas 3x3 células vizinhas
+    cell = 2.0 * abs(eps)
+    use_grid = math.isfinite(eps2) and eps2 > 0 and math.isfinite(cell)
+    groups: List[List[int]] = []
+    sums: List[List[float]] = []  # [soma x, soma y] na ordem de inserção
+    grid_cell: List[Optional[Tuple[int, int]]] = []
+    grid: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+
+    def key_of(gx, gy):
+        if not (math.isfinite(gx) and math.isfinite(gy)):
+            return None
+        return math.floor(gx / cell), math.floor(gy / cell)
+
+    for idx, (cx, cy) in enumerate(centers):
+        if use_grid:
+            k = key_of(cx, cy)
+            cand = []
+            if k is not None:
+                for dx in (-1, 0, 1):
+                    for dy in (-1, 0, 1):
+                        cand.extend(grid.get((k[0] + dx, k[1] + dy), ()))
+                cand.sort()
+        else:
+            cand = range(len(groups))
+        target = None
+        for g in cand:
+            n = len(groups[g])
+            gx, gy = sums[g][0] / n, sums[g][1] / n
+            if (cx - gx) ** 2 + (cy - gy) ** 2 <= eps2:
+                target = g
+                break
+        if target is None:
+            target = len(groups)
+            groups.append([])
+            sums.append([0, 0])
+            grid_cell.append(None)
+        groups[target].append(idx)
+        sums[target][0] += cx
+        sums[target][1] += cy
+        if use_grid:
+            n = len(groups[target])
+            new_key = key_of(sums[target][0] / n, sums[target][1] / n)
+            old_key = grid_cell[target]
+            if new_key != old_key:
+                if old_key is not None:
+                    grid[old_key].remove(target)
+                if new_key is not None:
+                    grid[new_key].append(target)
+                grid_cell[target] = new_key
+    return groups
+
+
+def _equal_groups(values: Sequence[Hashable]) -> List[List[int]]:
+    """Índices agrupados por valor igual (==); valores não hasháveis vindos do JSON por varredura"""
+    by_value: Dict[Hashable, List[int]] = defaultdict(list)
+    unhashable: List[List[int]] = []
+    for i, v in enumerate(values):
+        try:
+            by_value[v].append(i)
+        except TypeError:
+            for g in unhashable:
+                if values[g[0]] == v:
+                    g.append(i)
+                    break
+            else:
+                unhashable.append([i])
+    return list(by_value.values()) + unhashable
+
+
+def same_tag_groups(tags: Sequence[Hashable], boxes: np.ndarray, iou_thr: float) -> List[List[int]]:
+    """
+    Fusão por TAG na ordem dos itens: cada item ainda livre absorve os itens seguintes
+    livres com a mesma TAG e IoU > iou_thr em relação a ele. Retorna os grupos
+    (primeiro índice = item que absorveu).
+    """
+    owner: Dict[int, List[int]] = {}
+    for idxs in _equal_groups(tags):
+        if len(idxs) == 1:
+            owner[idxs[0]] = idxs
+            continue
+        ious = iou_matrix(boxes[idxs], boxes[idxs])
+        used = set()
+        for a in range(len(idxs)):
+            if a in used:
+                continue
+            group = [idxs[a]]
+            for b in range(a + 1, len(idxs)):
+                if b not in used and ious[a, b] > iou_thr:
+                    group.append(idxs[b])
+                    used.add(b)
+            owner[idxs[a]] = group
+    return [owner[i] for i in range(len(tags)) if i in owner]
+
+
+Path = Sequence[Tuple[float, float]]
+
+
+class PathIndex:
+    """
+    Caminhos mantidos, agrupados por chave (from_tag, to_tag), com inserção incremental:
+    add() recusa um caminho com similarity(novo, mantido) > threshold para algum caminho
+    mantido com a mesma chave.
+
+    similarity deve seguir _path_sim: média, nos primeiros min(len) pontos, de
+    max(0, 1 - d/scale). Acima de threshold, mais de threshold·n pares de pontos de mesmo
+    índice estão a menos de `scale` e algum deles está entre os primeiros
+    floor((1 - threshold)·len) + 2 pontos de cada caminho: só esses pontos são indexados
+    numa grade (chave, índice do ponto, célula) e consultados nas células vizinhas.
+    """
+
+    def __init__(self, similarity: Callable[[Path, Path], float], scale: float = 20.0, threshold: float = 0.8):
+        self.similarity = similarity
+        self.scale = scale
+        self.threshold = threshold
+        self._prune = 0 < threshold < 1 and scale > 0 and math.isfinite(scale)
+        self.keys: List[Hashable] = []
+        self.paths: List[Path] = []
+        self._buckets: Dict[Hashable, List[int]] = defaultdict(list)  # sem poda
+        self._grid: Dict[Tuple[Hashable, int, int, int], List[int]] = defaultdict(list)
+        self._unhashable: List[int] = []  # TAGs vindas do JSON que não são hasháveis (listas etc.)
+
+    def _prefix(self, path: Path):
+        n = len(path)
+        q = min(n, int((1 - self.threshold) * n) + 2)
+        for k in range(q):
+            x, y = float(path[k][0]), float(path[k][1])
+            if math.isfinite(x) and math.isfinite(y):
+                yield k, math.floor(x / self.scale), math.floor(y / self.scale)
+
+    def _similar(self, path: Path, j: int) -> bool:
+        return self.similarity(path, self.paths[j]) > self.threshold
+
+    def find(self, key: Hashable, path: Path) -> Optional[int]:
+        """Índice do primeiro caminho mantido (ordem de inserção) que torna `path` duplicata"""
+        try:
+            hash(key)
+        except TypeError:
+            return next((j for j in self._unhashable if self.keys[j] == key and self._similar(path, j)), None)
+        if self._prune:
+            cand = set()
+            for k, cx, cy in self._prefix(path):
+                for dx in (-1, 0, 1):
+                    for dy in (-1, 0, 1):
+                        cand.update(self._grid.get((key, k, cx + dx, cy + dy), ()))
+            cand = sorted(cand)
+        else:
+            cand = self._buckets.get(key, ())
+        return next((j for j in cand if self._similar(path, j)), None)
+
+    def add(self, key: Hashable, path: Path) -> Optional[int]:
+        """Insere e retorna o índice do caminho; None se for duplicata de um já mantido"""
+        if self.find(key, path) is not None:
+            return None
+        return self.insert(key, path)
+
+    def insert(self, key: Hashable, path: Path) -> int:
+        """Insere sem verificar duplicatas"""
+        i = len(self.paths)
+        self.keys.append(key)
+        self.paths.append(path)
+        try:
+            hash(key)
+        except TypeError:
+            self._unhashable.append(i)
+            return i
+        if self._prune:
+            for k, cx, cy in self._prefix(path):
+                self._grid[(key, k, cx, cy)].append(i)
+        else:
+            self._buckets[key].append(i)
+        return i
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+
+def dedup_paths(keys: Sequence[Hashable], paths: Sequence[Path], similarity: Callable[[Path, Path], float],
+                scale: float = 20.0, threshold: float = 0.8) -> List[int]:
+    """Índices mantidos (primeira ocorrência) de caminhos com mesma chave e similaridade > threshold"""
+    index = PathIndex(similarity, scale=scale, threshold=threshold)
+    return [i for i, (key, path) in enumerate(zip(keys, paths)) if index.add(key, path) is not None]
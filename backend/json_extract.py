@@ -0,0 +1,177 @@
+# backend/json_extract.py
+"""
+Linear-time extraction of JSON values from LLM output.
+
+The model answer should be a JSON array of items, but in practice it arrives
+wrapped in markdown fences or prose, wrapped in an object
+({"equipments": [...]}), split into several arrays, or cut off in the middle of
+the last item (max_tokens). scan_json_values() walks the text once, decoding
+each candidate with json.JSONDecoder.raw_decode (C scanner) and resuming after
+the decoded value or after the point where decoding failed, so no character is
+re-scanned by later candidates:
+
+- text outside JSON (fences, prose) is skipped;
+- a truncated or malformed array keeps the elements completed before the error;
+- inside an object that fails to decode, only arrays are searched (salvages a
+  truncated {"equipments": [...]} wrapper without re-decoding inner objects).
+
+json_list() turns the values into the item list (ensure_json_list in backend).
+"""
+import re
+import json
+from dataclasses import dataclass
+from typing import Any, List, Optional, Tuple
+
+_DECODER = json.JSONDecoder()
+# Inícios plausíveis: '{' seguido de chave/fechamento, '[' seguido de um valor ou ']'
+_ARRAY_START = re.compile(r'\[[ \t\n\r]*(?:[\[{"\-0-9\]]|null|true|false)')
+_VALUE_START = re.compile(r'\{[ \t\n\r]*["}]|' + _ARRAY_START.pattern)
+_WS = re.compile(r"[ \t\n\r]*")
+# Janela inicial de decodificação (cresce ×4 quando o valor não cabe)
+_WINDOW = 512
+
+
+@dataclass
+class JsonFragment:
+    value: Any
+    start: int
+    end: int
+    complete: bool  # False: array truncado/malformado com os elementos recuperados
+
+
+class _DecodeError(ValueError):
+    def __init__(self, pos: Optional[int]):
+        super().__init__(f"JSON inválido (posição {pos})")
+        self.pos = pos
+
+
+def _cut_by_window(exc: json.JSONDecodeError, size: int) -> bool:
+    """Erro causado pelo fim da janela (e não por JSON inválido)"""
+    return exc.msg.startswith("Unterminated string") or exc.pos >= size - 8
+
+
+def _decode(text: str, pos: int) -> Tuple[Any, int]:
+    """
+    raw_decode de um valor em text[pos], numa janela crescente a partir de pos:
+    JSONDecodeError calcula linha/coluna varrendo o documento até o erro, então
+    decodificar o texto inteiro custaria O(pos) por candidato inválido.
+    """
+    n = len(text)
+    size = _WINDOW
+    while True:
+        stop = min(n, pos + size)
+        chunk = text[pos:stop]
+        try:
+            value, end = _DECODER.raw_decode(chunk)
+        except json.JSONDecodeError as e:
+            if stop < n and _cut_by_window(e, len(chunk)):
+                size *= 4
+                continue
+            raise _DecodeError(pos + e.pos) from None
+        except RecursionError:
+            raise _DecodeError(None) from None
+        if end == len(chunk) and stop < n:
+            size *= 4  # número pode continuar depois da janela
+            continue
+        return value, pos + end
+
+
+def _error_pos(exc: ValueError, fallback: int) -> int:
+    pos = getattr(exc, "pos", None)
+    return pos if isinstance(pos, int) and pos > fallback else fallback
+
+
+def _salvage_array(text: str, start: int) -> Tuple[Optional[List[Any]], int, bool]:
+    """Array em text[start] ('['): (valor, fim, completo); elementos válidos até o primeiro erro"""
+    try:
+        value, end = _decode(text, start)
+        return value, end, True
+    except ValueError:
+        pass
+    items: List[Any] = []
+    n = len(text)
+    j = _WS.match(text, start + 1).end()
+    while j < n:
+        if text[j] == "]":
+            return items, j + 1, True
+        try:
+            item, j = _decode(text, j)
+        except ValueError as e:
+            return (items or None), _error_pos(e, j + 1), False
+        items.append(item)
+        j = _WS.match(text, j).end()
+        if j < n and text[j] == ",":
+            j = _WS.match(text, j + 1).end()
+        elif j < n and text[j] == "]":
+            return items, j + 1, True
+        else:
+            return items, j, False  # separador inválido ou texto terminou
+    return (items or None), n, False
+
+
+def scan_json_values(text: str) -> List[JsonFragment]:
+    """Arrays e objetos JSON de nível superior, na ordem do texto (passada única)"""
+    fragments: List[JsonFragment] = []
+    if not text:
+        return fragments
+    n = len(text)
+    pos = 0
+    span_end = 0  # dentro de um objeto que falhou: só procura arrays até aqui
+    while pos < n:
+        if pos < span_end:
+            m = _ARRAY_START.search(text, pos, span_end)
+            if m is None:
+                pos = span_end
+                continue
+        else:
+            m = _VALUE_START.search(text, pos)
+            if m is None:
+                break
+        start = m.start()
+        if text[start] == "[":
+            value, end, complete = _salvage_array(text, start)
+            if value is not None:
+                fragments.append(JsonFragment(value, start, end, complete))
+            pos = max(end, start + 1)
+            continue
+        try:
+            value, end = _decode(text, start)
+        except ValueError as e:
+            span_end = max(span_end, _error_pos(e, start + 1))
+            pos = start + 1
+            continue
+        fragments.append(JsonFragment(value, start, end, True))
+        pos = end
+    return fragments
+
+
+def _wrapped_list(obj: dict) -> Optional[List[Any]]:
+    for v in obj.values():
+        if isinstance(v, list):
+            return v
+    return None
+
+
+def json_list(text: str) -> List[Any]:
+    """
+    Lista de itens da resposta: o array (ou a primeira lista de um objeto envolvente);
+    com vários arrays de objetos, todos são concatenados na ordem do texto.
+    """
+    lists: List[List[Any]] = []
+    for fragment in scan_json_values(text):
+        value = fragment.value
+        if isinstance(value, dict):
+            value = _wrapped_list(value)
+        if isinstance(value, list):
+            lists.append(value)
+    if not lists:
+        return []
+    object_lists = [lst for lst in lists if lst and all(isinstance(it, dict) for it in lst)]
+    if len(object_lists) <= 1:
+        return object_lists[0] if object_lists else lists[0]
+    return [item for lst in object_lists for item in lst]
+
+
+def has_complete_json(text: str) -> bool:
+    """Há ao menos um objeto/array JSON completo (respostas truncadas não contam)"""
+    return any(fragment.complete for fragment in scan_json_values(text))
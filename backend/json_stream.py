@@ -0,0 +1,92 @@
+# backend/json_stream.py
+"""
+Incremental parser for JSON arrays arriving in chunks (streamed LLM output).
+
+The model answers with a JSON array of objects, sometimes wrapped in markdown
+fences or in an object ({"equipments": [...]}). JsonArrayStreamParser scans the
+text as it arrives and returns each element of the first array as soon as its
+closing brace is received, so per-item work (coordinate conversion, matcher)
+can run while the model is still generating.
+
+    parser = JsonArrayStreamParser()
+    for chunk in stream:
+        for item in parser.feed(chunk):
+            handle(item)
+
+Only elements that parse as JSON are returned; the full text remains the source
+of truth (ensure_json_list) once the stream ends.
+"""
+import json
+from typing import Any, List
+
+
+class JsonArrayStreamParser:
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0            # próximo caractere a examinar em _buf
+        self._depth = 0          # profundidade de [ e { (0 = fora do array)
+        self._in_string = False
+        self._escape = False
+        self._start = -1         # início do elemento atual em _buf (-1 = nenhum)
+        self.started = False
+        self.done = False
+        self.emitted = 0
+        self.invalid = 0
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Acrescenta texto e retorna os elementos do array que se completaram"""
+        if self.done or not chunk:
+            return []
+        self._buf += chunk
+        out: List[Any] = []
+        buf = self._buf
+        i = self._pos
+        n = len(buf)
+        while i < n:
+            ch = buf[i]
+            if not self.started:
+                # Antes do array: ignora texto/cercas markdown até o primeiro '['
+                if ch == "[":
+                    self.started = True
+                    self._depth = 1
+                i += 1
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                if self._depth == 1:
+                    self._start = i
+                self._depth += 1
+            elif ch in "]}":
+                self._depth -= 1
+                if self._depth == 1 and self._start >= 0:
+                    self._emit(buf[self._start:i + 1], out)
+                    self._start = -1
+                elif self._depth == 0:
+                    self.done = True
+                    break
+            i += 1
+
+        # Descarta o texto já consumido (mantém apenas o elemento em andamento)
+        keep = self._start if self._start >= 0 else i
+        self._buf = buf[keep:]
+        self._pos = i - keep
+        if self._start >= 0:
+            self._start = 0
+        return out
+
+    def _emit(self, text: str, out: List[Any]) -> None:
+        try:
+            item = json.loads(text)
+        except ValueError:
+            self.invalid += 1
+            return
+        self.emitted += 1
+        out.append(item)
@@ -0,0 +1,326 @@
+# backend/keyword_classifier.py
+"""
+Compiled keyword matching shared by the description/tag heuristics.
+
+The heuristics (symbol size, ISA type validation, NO-TAG prefixes, electrical
+subtype, pole count, equipment type keywords, instrument tags) used to scan
+their own keyword lists with `kw in text` for every item. All their keywords
+are compiled here into one regex shaped as a trie inside a lookahead, so a
+single left-to-right pass finds, at each position, the longest keyword that
+starts there; keywords that are prefixes of it match at the same position
+(precomputed closure). The result is every keyword contained in the text with
+its first position - the same answers as `kw in text` and `text.find(kw)` -
+memoized per text:
+
+    hits = classify_description("bomba centrífuga com transmissor de pressão")
+    "bomba" in hits                    # True
+    hits["transmissor de pressão"]     # first position (as str.find)
+
+Keyword tables live here so the matcher is compiled once at import; callers
+keep their own decision order (first keyword of a list, longest tag prefix,
+counts...).
+"""
+import re
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+# Memo de descrições/TAGs já classificadas (entradas repetem muito entre itens e páginas)
+CLASSIFY_CACHE_SIZE = 65536
+
+# ------------------------------------------------------------
+# Tabelas (ordem importa onde a heurística escolhe o primeiro)
+# ------------------------------------------------------------
+SYMBOL_SIZE_LARGE = [
+    "tank", "tanque", "vessel", "vaso", "tower", "torre", "column", "coluna",
+    "reactor", "reator", "furnace", "forno", "boiler", "caldeira", "heat exchanger",
+    "trocador", "exchanger", "compressor", "compressor"
+]
+SYMBOL_SIZE_MEDIUM = [
+    "pump", "bomba", "filter", "filtro", "separator", "separador",
+    "drum", "tambor", "accumulator", "acumulador"
+]
+SMALL_INSTRUMENT_PREFIXES = ["PT", "TT", "FT", "LT", "PI", "TI", "FI", "LI",
+                             "PSV", "PCV", "FCV", "TCV", "LCV", "VALVE", "VÁLVULA"]
+
+# ISA S5.1 standard instrument tags
+INSTRUMENT_TYPES = {
+    "PT": ["pressure", "transmitter", "transmissor de pressão", "pressão"],
+    "TT": ["temperature", "transmitter", "transmissor de temperatura", "temperatura"],
+    "FT": ["flow", "transmitter", "transmissor de vazão", "vazão"],
+    "LT": ["level", "transmitter", "transmissor de nível", "nível"],
+    "PI": ["pressure", "indicator", "indicador de pressão"],
+    "TI": ["temperature", "indicator", "indicador de temperatura"],
+    "FI": ["flow", "indicator", "indicador de vazão"],
+    "LI": ["level", "indicator", "indicador de nível"],
+    "PSV": ["pressure", "safety", "valve", "válvula de segurança", "alívio"],
+    "FCV": ["flow", "control", "valve", "válvula de controle de vazão"],
+    "PCV": ["pressure", "control", "valve", "válvula de controle de pressão"],
+    "TCV": ["temperature", "control", "valve", "válvula de controle de temperatura"],
+    "LCV": ["level", "control", "valve", "válvula de controle de nível"],
+}
+# Equipment tags
+EQUIPMENT_TYPES = {
+    "P": ["pump", "bomba"],
+    "T": ["tank", "tanque"],
+    "TK": ["tank", "tanque"],
+    "V": ["vessel", "vaso", "vasel"],
+    "E": ["exchanger", "heat", "trocador"],
+    "R": ["reactor", "reator"],
+    "C": ["compressor", "column", "tower", "compressor", "coluna", "torre"],
+    "K": ["compressor", "compressor"],
+    "F": ["furnace", "forno"],
+}
+
+# Descrição -> prefixo do instrumento para itens sem TAG (primeira ocorrência na ordem da tabela)
+NO_TAG_INSTRUMENT_PREFIXES = {
+    # Pressure instruments
+    "transmissor de pressão": "PT",
+    "pressure transmitter": "PT",
+    "indicador de pressão": "PI",
+    "pressure indicator": "PI",
+    "chave de pressão alta": "PSH",
+    "pressure switch high": "PSH",
+    "chave de pressão baixa": "PSL",
+    "pressure switch low": "PSL",
+
+    # Temperature instruments
+    "controlador indicativo de temperatura": "TIC",
+    "temperature indicating controller": "TIC",
+    "indicador de temperatura": "TI",
+    "temperature indicator": "TI",
+    "transmissor de temperatura": "TT",
+    "temperature transmitter": "TT",
+
+    # Level instruments
+    "transmissor de nível": "LT",
+    "level transmitter": "LT",
+    "controlador indicação de nível": "LIC",
+    "controlador de nível": "LIC",
+    "level indicating controller": "LIC",
+    "level controller": "LIC",
+
+    # Flow instruments
+    "indicador de vazão": "FI",
+    "flow indicator": "FI",
+    "transmissor de vazão": "FT",
+    "flow transmitter": "FT",
+    "controlador de vazão": "FIC",
+    "flow indicating controller": "FIC",
+    "flow controller": "FIC",
+    "válvula de controle de vazão": "FV",
+    "flow control valve": "FV",
+}
+
+# Keywords that suggest multifilar (detailed, multi-conductor)
+MULTIFILAR_KEYWORDS = [
+    "multifilar", "multi-filar", "três fases", "three phase", "trifásico",
+    "three-phase", "l1", "l2", "l3", "r", "s", "t", "u", "v", "w",
+    "cabo", "condutor", "wire", "conductor", "phase"
+]
+# Keywords that suggest unipolar (single-line, simplified)
+UNIPOLAR_KEYWORDS = [
+    "unipolar", "uni-polar", "unifilar", "uni-filar", "single line",
+    "single-line", "diagrama simplificado", "simplified"
+]
+
+# TAGs de instrumento (substring da TAG, maiúsculas) na descrição de processo
+INSTRUMENT_TAG_MARKERS = ["FT", "PT", "TT", "LT", "FIC", "PIC", "TIC", "LIC", "PSV", "FE", "PE", "TE", "LE"]
+
+# Polos: verificados do mais específico (3) ao menos específico (1)
+POLE_KEYWORDS: List[Tuple[str, List[str]]] = [
+    ("3-pole", [
+        "3-pole", "3 pole", "three-pole", "three pole",
+        "tripolar", "tri-polar", "trifásico", "trifasico", "tri-fásico",
+        "three-phase", "three phase", "3-phase", "3 phase",
+        "três fases", "tres fases"
+    ]),
+    ("2-pole", [
+        "2-pole", "2 pole", "two-pole", "two pole",
+        "bipolar", "bi-polar", "bifásico", "bifasico", "bi-fásico",
+        "two-phase", "two phase", "2-phase", "2 phase"
+    ]),
+    ("1-pole", [
+        "1-pole", "1 pole", "single-pole", "single pole",
+        "monopolar", "mono-polar", "monofásico", "monofasico", "mono-fásico",
+        "single-phase", "single phase", "1-phase", "1 phase",
+        "unipolar", "uni-polar"
+    ]),
+]
+
+# Equipment type keywords (Portuguese and English)
+# Order matters: more specific types first to avoid false matches
+# e.g., check for "motor protection switch" before checking for "motor"
+EQUIPMENT_TYPE_KEYWORDS: List[Tuple[str, List[str]]] = [
+    # Protection and control devices (check these first as they're compound terms)
+    ('protection-switch', ['motor protection switch', 'protection switch', 'disjuntor-motor', 'disjuntor de proteção']),
+    ('motor-starter', ['motor starter', 'partida', 'starter']),
+
+    # Drives and converters
+    ('drive', ['vfd', 'inversor', 'drive', 'soft-starter', 'soft starter', 'acionamento eletrônico', 'acionamento eletronico', 'frequency converter']),
+
+    # Cables and connections
+    ('cable', ['cabo', 'cable', 'condutor', 'conductor']),
+    ('connection-point', ['ponto de conexão', 'ponto de conexao', 'connection point', 'terminal point']),
+
+    # Motors (check after motor-related compound terms)
+    ('motor', ['motor elétrico', 'motor eletrico', 'three-phase motor', 'single-phase motor', 'ac motor', 'dc motor']),
+
+    # Other equipment
+    ('contactor', ['contator', 'contactor']),
+    ('circuit-breaker', ['disjuntor', 'circuit-breaker', 'circuit breaker']),
+    ('fuse', ['fusível', 'fusivel', 'fuse']),
+    ('relay', ['relé', 'rele', 'relay']),
+    ('transformer', ['transformador', 'transformer']),
+    ('switch', ['chave', 'switch', 'interruptor']),
+    ('generator', ['gerador', 'generator']),
+    ('capacitor', ['capacitor', 'condensador']),
+    ('resistor', ['resistor', 'resistência', 'resistencia']),
+]
+
+
+def _trie_pattern(words: Iterable[str]) -> str:
+    """Regex em forma de trie; opcionais gulosos fazem casar a palavra mais longa"""
+    trie: Dict[str, dict] = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node: Dict[str, dict]) -> str:
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return build(trie)
+
+
+class KeywordMatcher:
+    """Todas as palavras-chave contidas no texto (com a primeira posição), numa passada"""
+
+    def __init__(self, words: Iterable[str], cache_size: int = CLASSIFY_CACHE_SIZE):
+        self.words = list(dict.fromkeys(w for w in words if w))
+        # Palavras de um caractere ("r", "s", "t"...) casariam em quase toda posição: vão por conjunto
+        self._chars = frozenset(w for w in self.words if len(w) == 1)
+        longer = [w for w in self.words if len(w) > 1]
+        self._regex = re.compile(f"(?=({_trie_pattern(longer)}))") if longer else None
+        # Palavra mais longa casada numa posição -> todas as palavras que casam ali
+        self._closure = {w: [p for p in longer if w.startswith(p)] for w in longer}
+        self.hits = lru_cache(maxsize=cache_size)(self._scan)
+
+    def _scan(self, text: str) -> Mapping[str, int]:
+        found: Dict[str, int] = {}
+        if not text:
+            return MappingProxyType(found)
+        for ch in self._chars.intersection(text):
+            found[ch] = text.find(ch)
+        if self._regex is not None:
+            for m in self._regex.finditer(text):
+                for w in self._closure[m.group(1)]:
+                    found.setdefault(w, m.start())
+        return MappingProxyType(found)
+
+    def stats(self) -> Dict[str, int]:
+        info = self.hits.cache_info()
+        return {"keywords": len(self.words), "cache_hits": info.hits, "cache_misses": info.misses,
+                "cache_size": info.currsize}
+
+
+def _description_vocabulary() -> List[str]:
+    words: List[str] = [*SYMBOL_SIZE_LARGE, *SYMBOL_SIZE_MEDIUM, *(p.lower() for p in SMALL_INSTRUMENT_PREFIXES)]
+    for table in (INSTRUMENT_TYPES, EQUIPMENT_TYPES):
+        for kws in table.values():
+            words.extend(kws)
+    words.extend(NO_TAG_INSTRUMENT_PREFIXES)
+    words.extend(MULTIFILAR_KEYWORDS)
+    words.extend(UNIPOLAR_KEYWORDS)
+    for _, kws in POLE_KEYWORDS + EQUIPMENT_TYPE_KEYWORDS:
+        words.extend(kws)
+    words.append("motor")  # motor genérico (fora de termos compostos)
+    return words
+
+
+# Descrições (texto já em minúsculas) e TAGs (maiúsculas) - compilados uma vez
+DESCRIPTION_MATCHER = KeywordMatcher(_description_vocabulary())
+TAG_MATCHER = KeywordMatcher(INSTRUMENT_TAG_MARKERS)
+
+# Prefixo de TAG mais longo (alternativas em ordem decrescente de tamanho)
+_TYPE_PREFIXES = sorted(list(INSTRUMENT_TYPES) + list(EQUIPMENT_TYPES), key=len, reverse=True)
+_TYPE_PREFIX_RE = re.compile("|".join(map(re.escape, _TYPE_PREFIXES)))
+_SMALL_PREFIX_RE = re.compile("|".join(map(re.escape, SMALL_INSTRUMENT_PREFIXES)))
+
+
+
+def _keyword_ranks(groups: List[Tuple[str, List[str]]]) -> Dict[str, Tuple[int, int]]:
+    """Palavra -> (ordem do grupo, ordem da palavra no grupo), primeira ocorrência"""
+    ranks: Dict[str, Tuple[int, int]] = {}
+    for g, (_, kws) in enumerate(groups):
+        for k, kw in enumerate(kws):
+            ranks.setdefault(kw, (g, k))
+    return ranks
+
+
+# Percorrer só as palavras encontradas em vez das tabelas inteiras
+POLE_RANKS = _keyword_ranks(POLE_KEYWORDS)
+EQUIPMENT_TYPE_RANKS = _keyword_ranks(EQUIPMENT_TYPE_KEYWORDS)
+
+SYMBOL_SIZE_LARGE_SET = frozenset(SYMBOL_SIZE_LARGE)
+SYMBOL_SIZE_MEDIUM_SET = frozenset(SYMBOL_SIZE_MEDIUM)
+SMALL_INSTRUMENT_DESC_SET = frozenset(p.lower() for p in SMALL_INSTRUMENT_PREFIXES)
+MULTIFILAR_SET = frozenset(MULTIFILAR_KEYWORDS)
+UNIPOLAR_SET = frozenset(UNIPOLAR_KEYWORDS)
+INSTRUMENT_TAG_SET = frozenset(INSTRUMENT_TAG_MARKERS)
+
+
+def classify_description(text_lower: str) -> Mapping[str, int]:
+    """Palavras-chave (de todas as heurísticas) contidas no texto -> primeira posição (memoizado)"""
+    return DESCRIPTION_MATCHER.hits(text_lower)
+
+
+def first_keyword(text_lower: str, keywords: Iterable[str]) -> Optional[str]:
+    """Primeira palavra da lista (na ordem da lista) contida no texto"""
+    hits = classify_description(text_lower)
+    return next((kw for kw in keywords if kw in hits), None)
+
+
+def count_keywords(text_lower: str, keywords: frozenset) -> int:
+    """Quantas palavras distintas do conjunto aparecem no texto"""
+    return len(keywords.intersection(classify_description(text_lower)))
+
+
+def pole_count(text_lower: str) -> str:
+    """Polo do primeiro grupo de POLE_KEYWORDS com alguma palavra no texto ('' se nenhum)"""
+    ranks = [POLE_RANKS[w][0] for w in classify_description(text_lower) if w in POLE_RANKS]
+    return POLE_KEYWORDS[min(ranks)][0] if ranks else ""
+
+
+def equipment_type_hits(text_lower: str) -> List[Tuple[str, List[Tuple[str, int]]]]:
+    """Tipos de EQUIPMENT_TYPE_KEYWORDS presentes no texto, em ordem, com (palavra, posição) na ordem da tabela"""
+    hits = classify_description(text_lower)
+    found = sorted((EQUIPMENT_TYPE_RANKS[w], w, pos) for w, pos in hits.items() if w in EQUIPMENT_TYPE_RANKS)
+    out: List[Tuple[str, List[Tuple[str, int]]]] = []
+    last = None
+    for (g, _), w, pos in found:
+        if g != last:
+            out.append((EQUIPMENT_TYPE_KEYWORDS[g][0], []))
+            last = g
+        out[-1][1].append((w, pos))
+    return out
+
+
+def tag_type_prefix(tag_upper: str) -> str:
+    """Prefixo ISA/equipamento mais longo no início da TAG ('' se nenhum)"""
+    m = _TYPE_PREFIX_RE.match(tag_upper)
+    return m.group(0) if m else ""
+
+
+def has_small_instrument_prefix(tag_upper: str) -> bool:
+    return _SMALL_PREFIX_RE.match(tag_upper) is not None
+
+
+def is_instrument_tag(tag: str) -> bool:
+    """TAG contém algum marcador de instrumento (FT, PT, ..., LE)"""
+    return bool(TAG_MATCHER.hits(tag))
@@ -0,0 +1,183 @@
+# backend/llm_cache.py
+"""
+Persistent, content-addressed cache of LLM responses.
+
+Entries are keyed by (model, sha256 of the prompt, sha256 of the encoded image,
+generation params), so re-uploading an unchanged drawing, a Streamlit rerun or a
+retry after a timeout reuses the previous answer instead of paying for the call
+again. The cache is a single SQLite file shared by all workers of the machine:
+
+- TTL: entries older than LLM_CACHE_TTL_HOURS are ignored and pruned
+- size: when the stored payloads exceed LLM_CACHE_MAX_MB, least recently used
+  entries are evicted
+
+Hit/miss/eviction counters are exposed through stats() (reported in /ping).
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH") or os.path.join(BACKEND_DIR, "llm_cache.sqlite")
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168"))  # 7 dias
+LLM_CACHE_MAX_BYTES = int(float(os.getenv("LLM_CACHE_MAX_MB", "512")) * 1024 * 1024)
+
+
+def sha256_text(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def cache_key(model: str, prompt: str, image: str = "", params: Optional[Dict[str, Any]] = None) -> str:
+    """Chave determinística: modelo + hash do prompt + hash da imagem codificada + parâmetros"""
+    parts = {
+        "model": model,
+        "prompt": sha256_text(prompt),
+        "image": sha256_text(image) if image else "",
+        "params": params or {},
+    }
+    return sha256_text(json.dumps(parts, sort_keys=True, separators=(",", ":")))
+
+
+class LLMResponseCache:
+    """Cache SQLite (thread-safe) com expiração por TTL e despejo LRU por tamanho"""
+
+    def __init__(self, path: str = LLM_CACHE_PATH, ttl_s: float = LLM_CACHE_TTL_HOURS * 3600,
+                 max_bytes: int = LLM_CACHE_MAX_BYTES, enabled: bool = LLM_CACHE_ENABLED, clock=time.time):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, model TEXT NOT NULL, value TEXT NOT NULL,"
+                " size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        now = self._clock()
+        with self._lock:
+            try:
+                db = self._db()
+                row = db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] > self.ttl_s:
+                    db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    db.commit()
+                    self.evictions += 1
+                    row = None
+                if row is None:
+                    self.misses += 1
+                    return None
+                db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                db.commit()
+                self.hits += 1
+                return row[0]
+            except sqlite3.Error as e:
+                self.errors += 1
+                print(f"⚠️ Cache LLM indisponível (leitura): {e!r}")
+                return None
+
+    def put(self, key: str, model: str, value: str) -> None:
+        if not self.enabled:
+            return
+        now = self._clock()
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            try:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, value, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model, value, size, now, now),
+                )
+                self.writes += 1
+                self._prune(db, now)
+                db.commit()
+            except sqlite3.Error as e:
+                self.errors += 1
+                print(f"⚠️ Cache LLM indisponível (escrita): {e!r}")
+
+    def _prune(self, db: sqlite3.Connection, now: float) -> None:
+        expired = db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_s,)).rowcount
+        self.evictions += max(0, expired)
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Despejo LRU até caber no orçamento
+        for key, size in db.execute("SELECT key, size FROM responses ORDER BY accessed ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            if not self.enabled:
+                return
+            db = self._db()
+            db.execute("DELETE FROM responses")
+            db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        entries, total = 0, 0
+        if self.enabled:
+            with self._lock:
+                try:
+                    entries, total = self._db().execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+                except sqlite3.Error:
+                    self.errors += 1
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "entries": entries,
+            "bytes_used": total,
+            "max_bytes": self.max_bytes,
+            "ttl_hours": round(self.ttl_s / 3600, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "errors": self.errors,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# Cache único do processo
+llm_cache = LLMResponseCache()
@@ -0,0 +1,210 @@
+# backend/llm_cassette.py
+"""
+Record/replay cassettes for OpenAI traffic (offline benchmarks and load tests).
+
+A cassette is a directory with one JSON file per request, named by a hash of the
+endpoint and the canonical request body (model, messages including the image,
+parameters). "stream" and "stream_options" are left out of the hash, so a call
+recorded without streaming replays for a streaming request and vice versa.
+
+Record mode: set LLM_RECORD_DIR and llm_client wraps the shared httpx transport
+with RecordingTransport, which stores every successful chat completion and
+embeddings response (streamed answers are reassembled into a single completion).
+Replay: point OPENAI_BASE_URL at mock_llm_server.py started with the same
+directory (see that module).
+
+    {"key": ..., "path": "/v1/chat/completions", "model": "gpt-5",
+     "prompt_preview": "...", "streamed": false, "latency_s": 12.3,
+     "response": {...}}
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+RECORDED_PATHS = ("/chat/completions", "/embeddings")
+_VOLATILE_FIELDS = ("stream", "stream_options")
+
+
+def endpoint_of(path: str) -> Optional[str]:
+    """Endpoint gravável ("/chat/completions" ou "/embeddings") de um caminho de URL"""
+    for endpoint in RECORDED_PATHS:
+        if path.rstrip("/").endswith(endpoint):
+            return endpoint
+    return None
+
+
+def request_key(endpoint: str, body: Dict[str, Any]) -> str:
+    """Hash estável de endpoint + corpo canônico (sem campos de streaming)"""
+    canonical = {k: v for k, v in body.items() if k not in _VOLATILE_FIELDS}
+    payload = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(f"{endpoint}\n{payload}".encode("utf-8")).hexdigest()
+
+
+def prompt_text(body: Dict[str, Any]) -> str:
+    """Texto das mensagens (sem imagens) ou entrada de embeddings de um corpo de requisição"""
+    if "messages" not in body:
+        value = body.get("input", "")
+        return "\n".join(value) if isinstance(value, list) else str(value)
+    parts: List[str] = []
+    for message in body.get("messages") or []:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(p.get("text", "") for p in content if isinstance(p, dict) and p.get("type") == "text")
+    return "\n".join(parts)
+
+
+def completion_from_sse(text: str) -> Optional[Dict[str, Any]]:
+    """Remonta a chat.completion de uma resposta SSE (stream=True); None se vazia"""
+    content: List[str] = []
+    meta: Dict[str, Any] = {}
+    finish_reason, usage = None, None
+    for line in text.splitlines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if not data or data == "[DONE]":
+            continue
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            continue
+        for field in ("id", "created", "model"):
+            meta.setdefault(field, chunk.get(field))
+        if chunk.get("usage"):
+            usage = chunk["usage"]
+        for choice in chunk.get("choices") or []:
+            delta = (choice.get("delta") or {}).get("content")
+            if delta:
+                content.append(delta)
+            if choice.get("finish_reason"):
+                finish_reason = choice["finish_reason"]
+    if not meta:
+        return None
+    return {
+        "id": meta.get("id"), "object": "chat.completion", "created": meta.get("created"), "model": meta.get("model"),
+        "choices": [{"index": 0, "finish_reason": finish_reason or "length",
+                     "message": {"role": "assistant", "content": "".join(content)}}],
+        "usage": usage,
+    }
+
+
+def completion_chunks(completion: Dict[str, Any], piece: int = 64,
+                      include_usage: bool = False) -> Iterator[Dict[str, Any]]:
+    """chat.completion → chunks de stream (conteúdo em pedaços de `piece` caracteres)"""
+    base = {"id": completion.get("id"), "object": "chat.completion.chunk",
+            "created": completion.get("created"), "model": completion.get("model")}
+    choice = (completion.get("choices") or [{}])[0]
+    content = (choice.get("message") or {}).get("content") or ""
+    yield {**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}
+    for i in range(0, len(content), piece):
+        yield {**base, "choices": [{"index": 0, "delta": {"content": content[i:i + piece]}, "finish_reason": None}]}
+    yield {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": choice.get("finish_reason") or "stop"}]}
+    if include_usage:
+        yield {**base, "choices": [], "usage": completion.get("usage")}
+
+
+class CassetteStore:
+    """Diretório de gravações: <root>/<key>.json (escrita atômica, segura entre threads)"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return record
+
+    def put(self, key: str, record: Dict[str, Any]) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"key": key, **record}, f, ensure_ascii=False)
+        os.replace(tmp, self._path(key))
+        with self._lock:
+            self.recorded += 1
+
+    def __len__(self) -> int:
+        try:
+            return sum(1 for name in os.listdir(self.root) if name.endswith(".json"))
+        except OSError:
+            return 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"root": self.root, "cassettes": len(self), "recorded": self.recorded,
+                    "hits": self.hits, "misses": self.misses}
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    """
+    Transporte httpx que grava respostas 200 de chat completions/embeddings no cassete.
+    Respostas em stream são lidas por inteiro antes de voltar ao SDK (a gravação não
+    preserva a entrega incremental, apenas o conteúdo).
+    """
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, store: CassetteStore):
+        self.inner = inner
+        self.store = store
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        endpoint = endpoint_of(request.url.path) if request.method == "POST" else None
+        if endpoint is None:
+            return await self.inner.handle_async_request(request)
+        started = time.perf_counter()
+        response = await self.inner.handle_async_request(request)
+        if response.status_code != 200:
+            return response
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
+        latency = time.perf_counter() - started
+        try:
+            self._record(endpoint, json.loads(request.content or b"{}"), response, content, latency)
+        except Exception as e:  # gravação nunca derruba a chamada real
+            print(f"⚠️ Falha ao gravar cassete LLM: {e!r}")
+        # Corpo já decodificado: remove cabeçalhos de codificação/tamanho do original
+        headers = [(k, v) for k, v in response.headers.multi_items()
+                   if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")]
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request,
+                              extensions=response.extensions)
+
+    def _record(self, endpoint: str, body: Dict[str, Any], response: httpx.Response,
+                content: bytes, latency: float) -> None:
+        streamed = "text/event-stream" in response.headers.get("content-type", "")
+        payload = completion_from_sse(content.decode("utf-8")) if streamed else json.loads(content)
+        if payload is None:
+            return
+        self.store.put(request_key(endpoint, body), {
+            "path": endpoint,
+            "model": body.get("model"),
+            "prompt_preview": prompt_text(body)[:300],
+            "streamed": streamed,
+            "latency_s": round(latency, 3),
+            "response": payload,
+        })
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
@@ -0,0 +1,188 @@
+# backend/llm_client.py
+"""
+Shared OpenAI client for all model traffic (chat completions + embeddings).
+
+One AsyncOpenAI client per process, backed by a single pooled httpx.AsyncClient
+(explicit connection limits, keep-alive and optional HTTP/2). The client lives on
+a dedicated I/O event loop thread, so async code (FastAPI routes) and sync code
+(system matcher, startup checks) share the same connection pool:
+
+- async callers: resp = await run_llm(get_client().chat.completions.create(...))
+- sync callers:  resp = run_llm_sync(get_client().embeddings.create(...))
+
+The client is built once. On an SSL error, disable_ssl_verification() swaps it
+(at most once per process) for a client without certificate verification.
+
+OPENAI_BASE_URL points the client at another OpenAI-compatible server (e.g. the
+local mock_llm_server.py for offline benchmarks). With LLM_RECORD_DIR set, the
+transport records every chat/embeddings response into a cassette directory
+(llm_cassette) that the mock server can replay.
+"""
+import os
+import asyncio
+import threading
+from typing import Any, Awaitable, Dict, Optional
+
+import httpx, certifi
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_REQUEST_TIMEOUT = int(os.getenv("OPENAI_REQUEST_TIMEOUT", "600"))
+# Servidor compatível com OpenAI (padrão: api.openai.com) e gravação de cassetes
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+LLM_RECORD_DIR = os.getenv("LLM_RECORD_DIR") or None
+
+# Pool HTTP compartilhado
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "100"))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "false").lower() in ("1", "true", "yes")
+LLM_VERIFY_SSL = os.getenv("LLM_VERIFY_SSL", "true").lower() in ("1", "true", "yes")
+
+# HTTP/2 requer o pacote opcional h2 (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
+_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_thread: Optional[threading.Thread] = None
+_client: Optional[AsyncOpenAI] = None
+_verify_ssl = LLM_VERIFY_SSL
+_client_builds = 0
+_recorder = None  # CassetteStore do modo gravação (LLM_RECORD_DIR)
+
+
+def _io_loop() -> asyncio.AbstractEventLoop:
+    """Event loop dedicado ao tráfego OpenAI (criado uma única vez, thread daemon)"""
+    global _loop, _thread
+    with _lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="llm-io", daemon=True)
+            thread.start()
+            _loop, _thread = loop, thread
+        return _loop
+
+
+def _build_client(verify_ssl: bool) -> AsyncOpenAI:
+    global _client_builds, _recorder
+    pool = dict(
+        verify=certifi.where() if verify_ssl else False,
+        limits=httpx.Limits(
+            max_connections=LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        http2=LLM_HTTP2 and H2_AVAILABLE,
+    )
+    if LLM_RECORD_DIR:
+        # Modo gravação: o pool fica no transporte interno, embrulhado pelo gravador
+        from llm_cassette import CassetteStore, RecordingTransport
+        if _recorder is None:
+            _recorder = CassetteStore(LLM_RECORD_DIR)
+            print(f"🎙️ Gravando respostas LLM em {LLM_RECORD_DIR}")
+        http_client = httpx.AsyncClient(
+            transport=RecordingTransport(httpx.AsyncHTTPTransport(**pool), _recorder),
+            timeout=OPENAI_REQUEST_TIMEOUT,
+        )
+    else:
+        http_client = httpx.AsyncClient(timeout=OPENAI_REQUEST_TIMEOUT, **pool)
+    _client_builds += 1
+    return AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, http_client=http_client)
+
+
+def get_client() -> Optional[AsyncOpenAI]:
+    """Cliente assíncrono compartilhado do processo (None sem OPENAI_API_KEY)"""
+    global _client
+    if not OPENAI_API_KEY:
+        return None
+    with _lock:
+        if _client is None:
+            if LLM_HTTP2 and not H2_AVAILABLE:
+                print("⚠️ LLM_HTTP2 ativo mas o pacote 'h2' não está instalado - usando HTTP/1.1")
+            _client = _build_client(_verify_ssl)
+        return _client
+
+
+def is_ssl_error(exc: BaseException) -> bool:
+    return "SSL" in str(exc) or "certificate" in str(exc).lower()
+
+
+def disable_ssl_verification() -> None:
+    """
+    Passa a usar um cliente sem verificação de certificado (idempotente).
+    O cliente anterior é fechado no loop de I/O sem interromper requisições em andamento.
+    """
+    global _client, _verify_ssl
+    with _lock:
+        if not _verify_ssl:
+            return
+        _verify_ssl = False
+        old, _client = _client, (_build_client(False) if OPENAI_API_KEY else None)
+    if old is not None:
+        asyncio.run_coroutine_threadsafe(_close_later(old), _io_loop())
+
+
+async def _close_later(client: AsyncOpenAI, delay: float = OPENAI_REQUEST_TIMEOUT) -> None:
+    await asyncio.sleep(delay)
+    await client.close()
+
+
+async def run_llm(coro: Awaitable[Any]) -> Any:
+    """
+    Executa uma chamada do cliente compartilhado a partir de código assíncrono.
+    Cancelar quem aguarda cancela a requisição no loop de I/O.
+    """
+    loop = _io_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        return await coro
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+def run_llm_sync(coro: Awaitable[Any]) -> Any:
+    """Executa uma chamada do cliente compartilhado a partir de código síncrono"""
+    loop = _io_loop()
+    if threading.current_thread() is _thread:
+        raise RuntimeError("run_llm_sync não pode ser chamado dentro do loop de I/O")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def pool_info() -> Dict[str, Any]:
+    """Configuração do pool HTTP compartilhado (exposta no /ping)"""
+    return {
+        "max_connections": LLM_POOL_MAX_CONNECTIONS,
+        "max_keepalive_connections": LLM_POOL_MAX_KEEPALIVE,
+        "keepalive_expiry_s": LLM_KEEPALIVE_EXPIRY,
+        "http2": LLM_HTTP2 and H2_AVAILABLE,
+        "verify_ssl": _verify_ssl,
+        "client_builds": _client_builds,
+        "base_url": OPENAI_BASE_URL or "https://api.openai.com/v1",
+        "recording": _recorder.stats() if _recorder is not None else None,
+    }
+
+
+def shutdown_client() -> None:
+    """Fecha o cliente e encerra o loop de I/O (shutdown do servidor)"""
+    global _client, _loop, _thread
+    with _lock:
+        client, loop, _client = _client, _loop, None
+        _loop, _thread = None, None
+    if loop is None:
+        return
+    if client is not None:
+        try:
+            asyncio.run_coroutine_threadsafe(client.close(), loop).result(timeout=10)
+        except Exception:
+            pass
+    loop.call_soon_threadsafe(loop.stop)
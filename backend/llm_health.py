@@ -0,0 +1,155 @@
+# backend/llm_health.py
+"""
+Per-model circuit breakers for the PRIMARY_MODEL → FALLBACK_MODEL cascade.
+
+Each model has a breaker with three states:
+- closed: calls go to the model normally
+- open: after LLM_BREAKER_FAILURES consecutive failures (transient errors or
+  calls slower than LLM_BREAKER_SLOW_S), calls skip the model during a cooldown
+  and go straight to the fallback
+- half_open: once the cooldown ends, a single probe call is let through; success
+  closes the breaker, failure reopens it with a doubled cooldown
+  (capped at LLM_BREAKER_MAX_COOLDOWN_S)
+
+Per-model health (state, failures, latency percentiles) is reported in /ping.
+"""
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict
+
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+LLM_BREAKER_SLOW_S = float(os.getenv("LLM_BREAKER_SLOW_S", "180"))
+LLM_BREAKER_COOLDOWN_S = float(os.getenv("LLM_BREAKER_COOLDOWN_S", "60"))
+LLM_BREAKER_MAX_COOLDOWN_S = float(os.getenv("LLM_BREAKER_MAX_COOLDOWN_S", "900"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, model: str, failure_threshold: int = LLM_BREAKER_FAILURES,
+                 slow_s: float = LLM_BREAKER_SLOW_S, cooldown_s: float = LLM_BREAKER_COOLDOWN_S,
+                 max_cooldown_s: float = LLM_BREAKER_MAX_COOLDOWN_S,
+                 clock: Callable[[], float] = time.monotonic):
+        self.model = model
+        self.failure_threshold = max(1, failure_threshold)
+        self.slow_s = slow_s
+        self.base_cooldown_s = cooldown_s
+        self.max_cooldown_s = max_cooldown_s
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.cooldown_s = cooldown_s
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.successes = 0
+        self.failures = 0
+        self.slow_calls = 0
+        self.short_circuited = 0
+        self.trips = 0
+        self._latencies: Deque[float] = deque(maxlen=500)
+
+    def allow(self) -> bool:
+        """True se a chamada pode ir para o modelo (em half_open, apenas uma sonda por vez)"""
+        with self._lock:
+            if self.state == OPEN and self.clock() - self.opened_at >= self.cooldown_s:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record_success(self, latency_s: float) -> None:
+        with self._lock:
+            self._latencies.append(latency_s)
+            if latency_s > self.slow_s:
+                # Resposta chegou, mas lenta demais: conta como falha de saúde
+                self.slow_calls += 1
+                self._fail_locked()
+                return
+            self.successes += 1
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                self.state = CLOSED
+                self.cooldown_s = self.base_cooldown_s
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._fail_locked()
+
+    def release(self) -> None:
+        """Chamada cancelada ou com erro que não indica saúde do modelo: libera a sonda"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _fail_locked(self) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            # Sonda falhou: reabre com cooldown dobrado
+            self.cooldown_s = min(self.max_cooldown_s, self.cooldown_s * 2)
+            self._open_locked()
+        elif self.state == CLOSED and self.consecutive_failures >= self.failure_threshold:
+            self._open_locked()
+        self._probe_in_flight = False
+
+    def _open_locked(self) -> None:
+        self.state = OPEN
+        self.opened_at = self.clock()
+        self.trips += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lat = sorted(self._latencies)
+            state = self.state
+            remaining = 0.0
+            if state == OPEN:
+                remaining = max(0.0, self.cooldown_s - (self.clock() - self.opened_at))
+
+            def pct(q):
+                return round(lat[min(len(lat) - 1, int(len(lat) * q))], 2) if lat else None
+
+            return {
+                "state": state,
+                "healthy": state == CLOSED,
+                "consecutive_failures": self.consecutive_failures,
+                "cooldown_s": self.cooldown_s,
+                "cooldown_remaining_s": round(remaining, 1),
+                "successes": self.successes,
+                "failures": self.failures,
+                "slow_calls": self.slow_calls,
+                "short_circuited": self.short_circuited,
+                "trips": self.trips,
+                "latency_s": {"p50": pct(0.5), "p95": pct(0.95)},
+            }
+
+
+class BreakerRegistry:
+    """Um disjuntor por modelo, criado sob demanda"""
+
+    def __init__(self, **options):
+        self._options = options
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            if model not in self._breakers:
+                self._breakers[model] = CircuitBreaker(model, **self._options)
+            return self._breakers[model]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {b.model: b.snapshot() for b in breakers}
+
+
+# Disjuntores do processo
+model_breakers = BreakerRegistry()
@@ -0,0 +1,171 @@
+# backend/llm_hedge.py
+"""
+Hedged requests for tail-latency control (optional, LLM_HEDGE_ENABLED).
+
+Service latencies of successful calls (without scheduler queue time) are tracked
+online per model. When a call is still running LLM_HEDGE_PERCENTILE latency of its
+model after leaving the scheduler queue, a duplicate request is sent (to the same
+model or to the fallback, LLM_HEDGE_TARGET). The first response with valid JSON
+wins and the other request is cancelled.
+
+Hedges are capped per job (LLM_HEDGE_MAX_PER_JOB) so extra spend stays bounded,
+and no hedge is sent until a model has LLM_HEDGE_MIN_SAMPLES latency samples.
+Counters are reported in /ping.
+"""
+import os
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY_S = float(os.getenv("LLM_HEDGE_MIN_DELAY_S", "5"))
+LLM_HEDGE_MAX_PER_JOB = int(os.getenv("LLM_HEDGE_MAX_PER_JOB", "8"))
+LLM_HEDGE_TARGET = os.getenv("LLM_HEDGE_TARGET", "same").lower()  # "same" ou "fallback"
+
+_MAX_TRACKED_JOBS = 1000
+
+
+class LatencyTracker:
+    """Janela deslizante de latências por modelo (percentis calculados sob demanda)"""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def record(self, model: str, latency_s: float) -> None:
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.window)).append(latency_s)
+
+    def models(self) -> List[str]:
+        with self._lock:
+            return list(self._samples)
+
+    def count(self, model: str) -> int:
+        with self._lock:
+            return len(self._samples.get(model, ()))
+
+    def percentile(self, model: str, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+class HedgePolicy:
+    def __init__(self, enabled: bool = LLM_HEDGE_ENABLED, percentile: float = LLM_HEDGE_PERCENTILE,
+                 min_samples: int = LLM_HEDGE_MIN_SAMPLES, min_delay_s: float = LLM_HEDGE_MIN_DELAY_S,
+                 max_per_job: int = LLM_HEDGE_MAX_PER_JOB, target: str = LLM_HEDGE_TARGET):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay_s = min_delay_s
+        self.max_per_job = max_per_job
+        self.target = target
+        self.latency = LatencyTracker()
+        self._lock = threading.Lock()
+        self._per_job: "OrderedDict[str, int]" = OrderedDict()
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    def delay_for(self, model: str) -> Optional[float]:
+        """Tempo de espera antes do hedge (None = sem hedge para este modelo)"""
+        if not self.enabled or self.latency.count(model) < self.min_samples:
+            return None
+        return max(self.min_delay_s, self.latency.percentile(model, self.percentile) or 0.0)
+
+    def try_acquire(self, job_id: str) -> bool:
+        with self._lock:
+            used = self._per_job.get(job_id, 0)
+            if used >= self.max_per_job:
+                self.budget_denied += 1
+                return False
+            self._per_job[job_id] = used + 1
+            self._per_job.move_to_end(job_id)
+            while len(self._per_job) > _MAX_TRACKED_JOBS:
+                self._per_job.popitem(last=False)
+            self.hedges += 1
+            return True
+
+    def record_win(self) -> None:
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self) -> Dict[str, Any]:
+        thresholds = {}
+        for model in self.latency.models():
+            delay = self.delay_for(model)
+            thresholds[model] = round(delay, 2) if delay is not None else None
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "percentile": self.percentile,
+                "target": self.target,
+                "max_per_job": self.max_per_job,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "budget_denied": self.budget_denied,
+                "threshold_s": thresholds,
+            }
+
+
+async def hedge_race(primary: Callable[[], Awaitable[Any]], hedge: Callable[[], Awaitable[Any]],
+                     delay_s: Optional[float], acquire: Callable[[], bool],
+                     is_valid: Callable[[Any], bool], dispatched: Optional[asyncio.Event] = None) -> Tuple[Any, bool]:
+    """
+    Executa primary(); se não terminar em delay_s e acquire() permitir, dispara hedge().
+    Com `dispatched`, delay_s só começa a contar quando o evento é marcado (requisição
+    original saiu da fila do scheduler): espera na fila não gera cópias.
+    Retorna (resultado, venceu_pelo_hedge). A primeira resposta válida vence e a outra
+    é cancelada; se nenhuma for válida, retorna a primeira resposta recebida ou propaga
+    o erro da requisição original.
+    """
+    first = asyncio.ensure_future(primary())
+    tasks = {first: False}
+    try:
+        if delay_s is None:
+            return await first, False
+        if dispatched is not None and not dispatched.is_set():
+            waiter = asyncio.ensure_future(dispatched.wait())
+            try:
+                await asyncio.wait({first, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+            if first.done():
+                return await first, False
+        done, _ = await asyncio.wait({first}, timeout=delay_s)
+        if done or not acquire():
+            return await first, False
+
+        tasks[asyncio.ensure_future(hedge())] = True
+        pending = set(tasks)
+        fallback: Optional[Tuple[Any, bool]] = None
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # Em empate, a requisição original tem preferência
+            for task in sorted(done, key=lambda t: tasks[t]):
+                if task.exception() is not None:
+                    if not tasks[task]:
+                        error = task.exception()
+                    continue
+                result = task.result()
+                if is_valid(result):
+                    return result, tasks[task]
+                fallback = fallback or (result, tasks[task])
+        if fallback is not None:
+            return fallback
+        raise error or next(t.exception() for t in tasks)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+# Política de hedge do processo
+hedge_policy = HedgePolicy()
@@ -0,0 +1,342 @@
+# backend/llm_scheduler.py
+"""
+Process-wide scheduler for LLM requests.
+
+Every chat completion goes through LLMScheduler.submit(), which:
+1. Queues the request fairly across jobs (round-robin between job queues)
+2. Caps the number of requests in flight (LLM_MAX_CONCURRENCY)
+3. Waits on per-model token buckets for requests/min and tokens/min
+4. Syncs the buckets with the provider's x-ratelimit-* response headers
+5. Retries requests rejected with 429 after the advertised reset time
+   (and 5xx/connection errors with jittered exponential backoff, since the
+   SDK runs with max_retries=0)
+
+Queue depth, wait times and rate-limit counters are exposed through stats().
+The scheduler runs on the shared I/O loop of llm_client.
+"""
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import inspect
+import contextvars
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+# Limites padrão por modelo (sobrescritos pelos headers do provedor e por LLM_RATE_LIMITS)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_DEFAULT_RPM = float(os.getenv("LLM_DEFAULT_RPM", "500"))
+LLM_DEFAULT_TPM = float(os.getenv("LLM_DEFAULT_TPM", "500000"))
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "3"))
+LLM_OUTPUT_TOKEN_RESERVE = int(os.getenv("LLM_OUTPUT_TOKEN_RESERVE", "1000"))
+# Backoff de erros transitórios (5xx, conexão, 429 sem retry-after)
+LLM_BACKOFF_BASE_S = float(os.getenv("LLM_BACKOFF_BASE_S", "1.0"))
+LLM_BACKOFF_MAX_S = float(os.getenv("LLM_BACKOFF_MAX_S", "30"))
+# Ex.: LLM_RATE_LIMITS={"gpt-5": {"rpm": 500, "tpm": 450000}, "gpt-4o": {"rpm": 5000, "tpm": 800000}}
+try:
+    LLM_RATE_LIMITS: Dict[str, Dict[str, float]] = json.loads(os.getenv("LLM_RATE_LIMITS", "{}"))
+except ValueError:
+    LLM_RATE_LIMITS = {}
+
+# Job atual (fila justa entre uploads simultâneos); definido por rota
+current_job_id: contextvars.ContextVar[str] = contextvars.ContextVar("current_job_id", default="default")
+
+
+def parse_reset_seconds(value: Optional[str]) -> Optional[float]:
+    """Converte durações dos headers ("1s", "6m0s", "20ms", "0.5") em segundos"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        matched = True
+        total += float(amount) * {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}[unit]
+    return total if matched else None
+
+
+class TokenBucket:
+    """Balde de tokens com reposição contínua (capacidade = limite por minuto)"""
+
+    def __init__(self, per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.clock = clock
+        self.updated = clock()
+        self.blocked_until = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / 60.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, amount: float) -> float:
+        """Segundos até que `amount` esteja disponível (0 = imediato)"""
+        now = self.clock()
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        wait_block = max(0.0, self.blocked_until - now)
+        if self.tokens >= amount:
+            return wait_block
+        return max(wait_block, (amount - self.tokens) / self.rate)
+
+    def take(self, amount: float) -> None:
+        self._refill(self.clock())
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def sync(self, limit: Optional[float], remaining: Optional[float], reset_s: Optional[float]) -> None:
+        """Alinha o balde com os headers x-ratelimit-limit/remaining/reset"""
+        now = self.clock()
+        self._refill(now)
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+            if remaining <= 0 and reset_s:
+                self.block(reset_s)
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, self.clock() + seconds)
+        self.tokens = min(self.tokens, 0.0)
+        self.updated = self.clock()
+
+
+class ModelLimiter:
+    def __init__(self, rpm: float, tpm: float, clock: Callable[[], float] = time.monotonic):
+        self.requests = TokenBucket(rpm, clock)
+        self.tokens = TokenBucket(tpm, clock)
+
+    def delay_for(self, tokens: float) -> float:
+        return max(self.requests.delay_for(1), self.tokens.delay_for(tokens))
+
+    def take(self, tokens: float) -> None:
+        self.requests.take(1)
+        self.tokens.take(tokens)
+
+    def sync_headers(self, headers: Any) -> None:
+        if not headers:
+            return
+
+        def num(name):
+            try:
+                return float(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+
+        self.requests.sync(num("x-ratelimit-limit-requests"), num("x-ratelimit-remaining-requests"),
+                           parse_reset_seconds(headers.get("x-ratelimit-reset-requests")))
+        self.tokens.sync(num("x-ratelimit-limit-tokens"), num("x-ratelimit-remaining-tokens"),
+                         parse_reset_seconds(headers.get("x-ratelimit-reset-tokens")))
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    code = getattr(exc, "status_code", None)
+    if code is None and getattr(exc, "response", None) is not None:
+        code = getattr(exc.response, "status_code", None)
+    return code
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """429, erros 5xx e falhas de conexão/timeout (o SDK roda com max_retries=0)"""
+    code = _status_code(exc)
+    if code is not None:
+        return code == 429 or code >= 500
+    return type(exc).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def backoff_delay(attempt: int, base: float = LLM_BACKOFF_BASE_S, cap: float = LLM_BACKOFF_MAX_S) -> float:
+    """Backoff exponencial com jitter completo: uniforme em [0, min(cap, base * 2^(attempt-1))]"""
+    return random.uniform(0.0, min(cap, base * 2.0 ** max(0, attempt - 1)))
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 limits: Optional[Dict[str, Dict[str, float]]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_concurrency = max_concurrency
+        self.limits = limits if limits is not None else LLM_RATE_LIMITS
+        self.clock = clock
+        self.in_flight = 0
+        self._waiting: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._models: Dict[str, ModelLimiter] = {}
+        self._wait_ms: Deque[float] = deque(maxlen=2000)
+        self.dispatched = 0
+        self.rate_limited = 0
+        self.max_queue_depth = 0
+
+    # ---------- limites por modelo ----------
+    def limiter(self, model: str) -> ModelLimiter:
+        if model not in self._models:
+            cfg = self.limits.get(model, {})
+            self._models[model] = ModelLimiter(cfg.get("rpm", LLM_DEFAULT_RPM), cfg.get("tpm", LLM_DEFAULT_TPM), self.clock)
+        return self._models[model]
+
+    # ---------- fila justa + limite de concorrência ----------
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in self._waiting.values())
+
+    async def _acquire_slot(self, job_id: str) -> None:
+        if self.in_flight < self.max_concurrency and not self._waiting:
+            self.in_flight += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(job_id, deque()).append(fut)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release_slot()  # slot concedido junto com o cancelamento
+            else:
+                self._drop_waiter(job_id, fut)
+            raise
+
+    def _drop_waiter(self, job_id: str, fut: asyncio.Future) -> None:
+        queue = self._waiting.get(job_id)
+        if queue and fut in queue:
+            queue.remove(fut)
+            if not queue:
+                del self._waiting[job_id]
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        # Round-robin: atende o primeiro job da fila e o move para o fim
+        while self._waiting and self.in_flight < self.max_concurrency:
+            job_id, queue = next(iter(self._waiting.items()))
+            fut = queue.popleft()
+            if queue:
+                self._waiting.move_to_end(job_id)
+            else:
+                del self._waiting[job_id]
+            if not fut.done():
+                self.in_flight += 1
+                fut.set_result(None)
+
+    # ---------- execução ----------
+    async def submit(self, model: str, call: Callable[[], Awaitable[Any]], est_tokens: int = 0,
+                     job_id: Optional[str] = None, stats: Optional[Dict[str, Any]] = None,
+                     on_dispatch: Optional[Callable[[], None]] = None) -> Any:
+        """
+        Executa call() respeitando fila, concorrência e limites do modelo.
+        call() deve retornar uma resposta "raw" (with_raw_response) para leitura dos headers;
+        o retorno é a resposta já convertida (.parse()).
+        stats (opcional) recebe "retries", "queue_s" e "service_s" (duração só da tentativa
+        que respondeu, sem fila, esperas de rate limit nem backoff).
+        on_dispatch (opcional) é chamado no loop do scheduler quando a requisição sai da fila.
+        """
+        job_id = job_id or current_job_id.get()
+        queued_at = self.clock()
+        await self._acquire_slot(job_id)
+        limiter = self.limiter(model)
+        try:
+            attempt = 0
+            while True:
+                delay = limiter.delay_for(est_tokens)
+                while delay > 0:
+                    await asyncio.sleep(delay)
+                    delay = limiter.delay_for(est_tokens)
+                limiter.take(est_tokens)
+                if attempt == 0:
+                    self._wait_ms.append((self.clock() - queued_at) * 1000.0)
+                    self.dispatched += 1
+                    if stats is not None:
+                        stats["queue_s"] = self.clock() - queued_at
+                    if on_dispatch is not None:
+                        on_dispatch()
+                if stats is not None:
+                    stats["retries"] = attempt
+                attempt_started = self.clock()
+                try:
+                    raw = await call()
+                except Exception as e:
+                    if not is_transient_error(e) or attempt >= LLM_RATE_LIMIT_RETRIES:
+                        raise
+                    attempt += 1
+                    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+                    if _status_code(e) == 429:
+                        # Bloqueia o modelo até o reset anunciado e recoloca a requisição
+                        self.rate_limited += 1
+                        limiter.sync_headers(headers)
+                        retry_after = parse_reset_seconds(headers.get("retry-after")) or backoff_delay(attempt + 1)
+                        limiter.requests.block(retry_after)
+                    else:
+                        await asyncio.sleep(backoff_delay(attempt))
+                    continue
+
+                limiter.sync_headers(getattr(raw, "headers", None))
+                resp = raw.parse() if hasattr(raw, "parse") else raw
+                if inspect.isawaitable(resp):
+                    resp = await resp  # AsyncAPIResponse.parse() é assíncrono
+                usage = getattr(resp, "usage", None)
+                total = getattr(usage, "total_tokens", None) if usage is not None else None
+                if isinstance(total, (int, float)):
+                    # Ajusta o balde pelo consumo real (estimativa → uso efetivo)
+                    if total < est_tokens:
+                        limiter.tokens.refund(est_tokens - total)
+                    else:
+                        limiter.tokens.take(total - est_tokens)
+                if stats is not None:
+                    stats["service_s"] = self.clock() - attempt_started
+                return resp
+        finally:
+            self._release_slot()
+
+    # ---------- métricas ----------
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._wait_ms)
+        p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "queue_by_job": {job: len(q) for job, q in self._waiting.items()},
+            "max_queue_depth": self.max_queue_depth,
+            "dispatched": self.dispatched,
+            "rate_limited": self.rate_limited,
+            "wait_ms": {
+                "avg": round(sum(waits) / len(waits), 1) if waits else 0.0,
+                "p95": round(p95, 1),
+                "max": round(waits[-1], 1) if waits else 0.0,
+            },
+            "models": {
+                model: {
+                    "rpm": lim.requests.capacity,
+                    "tpm": lim.tokens.capacity,
+                    "requests_available": round(max(0.0, lim.requests.tokens), 1),
+                    "tokens_available": round(max(0.0, lim.tokens.tokens)),
+                }
+                for model, lim in self._models.items()
+            },
+        }
+
+
+def estimate_request_tokens(messages: Any, image_tokens: int = 0,
+                            output_reserve: int = LLM_OUTPUT_TOKEN_RESERVE) -> int:
+    """Estimativa grosseira (≈4 caracteres por token) para reservar o balde de tokens"""
+    chars = 0
+    for msg in messages or []:
+        content = msg.get("content") if isinstance(msg, dict) else None
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if isinstance(part, dict) and part.get("type") == "text":
+                    chars += len(part.get("text", ""))
+    return chars // 4 + image_tokens + output_reserve
+
+
+# Instância única do processo
+scheduler = LLMScheduler()
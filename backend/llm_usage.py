@@ -0,0 +1,259 @@
+# backend/llm_usage.py
+"""
+Per-job accounting of LLM usage (tokens, cost, latency, retries).
+
+Every model call records one entry: vision calls, generation, process
+description, chat and the system_matcher embeddings. Each entry keeps the kind
+of call, model, prompt/cached/completion/image tokens, latency, scheduler
+retries and whether the answer came from the response cache. Entries are tagged
+with the current job (current_job_id) and page (current_page), both context
+variables, so calls made from worker threads (asyncio.to_thread) are attributed
+correctly.
+
+Totals per job, per page, per model and per kind of call are returned by
+summary(), added to the /analyze response and persisted to SQLite by finish()
+for trend analysis (e.g. spend against grid/DPI settings).
+
+Cost uses USD prices per 1M tokens (input, cached input, output), overridable
+with LLM_PRICING.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+import contextvars
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional
+
+from llm_scheduler import current_job_id
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LLM_USAGE_ENABLED = os.getenv("LLM_USAGE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_USAGE_PATH = os.getenv("LLM_USAGE_PATH") or os.path.join(BACKEND_DIR, "llm_usage.sqlite")
+
+# Preços em USD por 1M de tokens: entrada, entrada em cache, saída
+DEFAULT_PRICING: Dict[str, Dict[str, float]] = {
+    "gpt-5": {"input": 1.25, "cached_input": 0.125, "output": 10.0},
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.0},
+    "text-embedding-3-small": {"input": 0.02, "cached_input": 0.02, "output": 0.0},
+}
+# Ex.: LLM_PRICING={"gpt-5": {"input": 1.25, "cached_input": 0.125, "output": 10}}
+try:
+    LLM_PRICING: Dict[str, Dict[str, float]] = {**DEFAULT_PRICING, **json.loads(os.getenv("LLM_PRICING", "{}"))}
+except ValueError:
+    LLM_PRICING = dict(DEFAULT_PRICING)
+
+_MAX_OPEN_JOBS = 200
+
+# Página atual (definida por página no /analyze; herdada por tarefas e threads)
+current_page: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("current_page", default=None)
+
+
+@dataclass
+class UsageEntry:
+    kind: str                    # vision | generation | description | chat | embedding
+    model: str
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    image_tokens: int = 0        # estimativa enviada ao scheduler (já incluída em prompt_tokens)
+    latency_s: float = 0.0
+    retries: int = 0
+    cache_hit: bool = False
+    error: bool = False
+    page: Optional[int] = None
+
+
+def price_for(model: str, pricing: Optional[Dict[str, Dict[str, float]]] = None) -> Optional[Dict[str, float]]:
+    """Preço do modelo; aceita variantes com data (ex.: gpt-4o-2024-08-06 → gpt-4o)"""
+    pricing = pricing if pricing is not None else LLM_PRICING
+    if model in pricing:
+        return pricing[model]
+    for name in sorted(pricing, key=len, reverse=True):
+        if model.startswith(name + "-"):
+            return pricing[name]
+    return None
+
+
+def entry_cost(entry: UsageEntry, pricing: Optional[Dict[str, Dict[str, float]]] = None) -> float:
+    if entry.cache_hit:
+        return 0.0
+    price = price_for(entry.model, pricing)
+    if price is None:
+        return 0.0
+    uncached = max(0, entry.prompt_tokens - entry.cached_tokens)
+    return (uncached * price.get("input", 0.0)
+            + entry.cached_tokens * price.get("cached_input", price.get("input", 0.0))
+            + entry.completion_tokens * price.get("output", 0.0)) / 1_000_000
+
+
+def usage_from_response(resp: Any) -> Dict[str, int]:
+    """Tokens do objeto usage de uma resposta (chat ou embeddings); zeros se ausente"""
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return {"prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    return {
+        "prompt_tokens": int(getattr(usage, "prompt_tokens", 0) or 0),
+        "cached_tokens": int(cached or 0),
+        "completion_tokens": int(getattr(usage, "completion_tokens", 0) or 0),
+    }
+
+
+def _totals(entries: List[UsageEntry], pricing) -> Dict[str, Any]:
+    billed = [e for e in entries if not e.cache_hit and not e.error]
+    prompt = sum(e.prompt_tokens for e in billed)
+    completion = sum(e.completion_tokens for e in billed)
+    latencies = [e.latency_s for e in entries if not e.cache_hit]
+    return {
+        "calls": len(billed),
+        "cache_hits": sum(1 for e in entries if e.cache_hit),
+        "errors": sum(1 for e in entries if e.error),
+        "retries": sum(e.retries for e in entries),
+        "prompt_tokens": prompt,
+        "cached_tokens": sum(e.cached_tokens for e in billed),
+        "completion_tokens": completion,
+        "image_tokens": sum(e.image_tokens for e in billed),
+        "total_tokens": prompt + completion,
+        "cost_usd": round(sum(entry_cost(e, pricing) for e in billed), 6),
+        "latency_s": {
+            "total": round(sum(latencies), 3),
+            "max": round(max(latencies), 3) if latencies else 0.0,
+        },
+    }
+
+
+class UsageLedger:
+    """Entradas por job em memória; finish() grava o resumo no SQLite e libera o job"""
+
+    def __init__(self, path: str = LLM_USAGE_PATH, enabled: bool = LLM_USAGE_ENABLED,
+                 pricing: Optional[Dict[str, Dict[str, float]]] = None, clock=time.time):
+        self.path = path
+        self.enabled = enabled
+        self.pricing = pricing if pricing is not None else LLM_PRICING
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, List[UsageEntry]]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.persisted = 0
+        self.errors = 0
+
+    # ---------- registro ----------
+    def record(self, kind: str, model: str, resp: Any = None, latency_s: float = 0.0, retries: int = 0,
+               image_tokens: int = 0, cache_hit: bool = False, error: bool = False,
+               job_id: Optional[str] = None, page: Optional[int] = None) -> UsageEntry:
+        entry = UsageEntry(kind=kind, model=model, image_tokens=image_tokens, latency_s=round(latency_s, 3),
+                           retries=retries, cache_hit=cache_hit, error=error,
+                           page=page if page is not None else current_page.get(),
+                           **usage_from_response(resp))
+        job_id = job_id or current_job_id.get()
+        with self._lock:
+            if job_id not in self._jobs:
+                self._jobs[job_id] = []
+                # Jobs nunca finalizados (ex.: rotas sem finish) não crescem sem limite
+                while len(self._jobs) > _MAX_OPEN_JOBS:
+                    self._jobs.popitem(last=False)
+            self._jobs[job_id].append(entry)
+        return entry
+
+    def entries(self, job_id: Optional[str] = None) -> List[UsageEntry]:
+        with self._lock:
+            return list(self._jobs.get(job_id or current_job_id.get(), ()))
+
+    # ---------- agregação ----------
+    def summary(self, job_id: Optional[str] = None) -> Dict[str, Any]:
+        job_id = job_id or current_job_id.get()
+        entries = self.entries(job_id)
+        by: Dict[str, Dict[Any, List[UsageEntry]]] = {"by_model": {}, "by_kind": {}, "by_page": {}}
+        for e in entries:
+            by["by_model"].setdefault(e.model, []).append(e)
+            by["by_kind"].setdefault(e.kind, []).append(e)
+            if e.page is not None:
+                by["by_page"].setdefault(e.page, []).append(e)
+        out = {"job_id": job_id, **_totals(entries, self.pricing)}
+        for name, groups in by.items():
+            out[name] = {str(k): _totals(v, self.pricing) for k, v in sorted(groups.items(), key=lambda kv: str(kv[0]))}
+        return out
+
+    def page_summary(self, page: int, job_id: Optional[str] = None) -> Dict[str, Any]:
+        return _totals([e for e in self.entries(job_id) if e.page == page], self.pricing)
+
+    # ---------- persistência ----------
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_usage ("
+                " job_id TEXT PRIMARY KEY, created REAL NOT NULL, route TEXT, params TEXT,"
+                " calls INTEGER, cache_hits INTEGER, retries INTEGER, prompt_tokens INTEGER,"
+                " cached_tokens INTEGER, completion_tokens INTEGER, image_tokens INTEGER,"
+                " cost_usd REAL, latency_s REAL, summary TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_job_usage_created ON job_usage(created)")
+            self._conn = conn
+        return self._conn
+
+    def finish(self, route: str = "", params: Optional[Dict[str, Any]] = None,
+               job_id: Optional[str] = None) -> Dict[str, Any]:
+        """Resumo final do job: gravado no SQLite (se habilitado) e removido da memória"""
+        job_id = job_id or current_job_id.get()
+        summary = self.summary(job_id)
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            if not self.enabled:
+                return summary
+            try:
+                db = self._db()
+                db.execute(
+                    "INSERT OR REPLACE INTO job_usage (job_id, created, route, params, calls, cache_hits, retries,"
+                    " prompt_tokens, cached_tokens, completion_tokens, image_tokens, cost_usd, latency_s, summary)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, self._clock(), route, json.dumps(params or {}, ensure_ascii=False, default=str),
+                     summary["calls"], summary["cache_hits"], summary["retries"], summary["prompt_tokens"],
+                     summary["cached_tokens"], summary["completion_tokens"], summary["image_tokens"],
+                     summary["cost_usd"], summary["latency_s"]["total"], json.dumps(summary, ensure_ascii=False)),
+                )
+                db.commit()
+                self.persisted += 1
+            except sqlite3.Error as e:
+                self.errors += 1
+                print(f"⚠️ Registro de uso LLM indisponível: {e!r}")
+        return summary
+
+    def history(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Últimos jobs gravados (mais recentes primeiro)"""
+        with self._lock:
+            if not self.enabled:
+                return []
+            rows = self._db().execute(
+                "SELECT job_id, created, route, params, summary FROM job_usage ORDER BY created DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [{"job_id": r[0], "created": r[1], "route": r[2], "params": json.loads(r[3] or "{}"),
+                 "usage": json.loads(r[4])} for r in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"enabled": self.enabled, "open_jobs": len(self._jobs), "persisted": self.persisted,
+                    "errors": self.errors, "path": self.path}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def entry_dict(entry: UsageEntry) -> Dict[str, Any]:
+    return asdict(entry)
+
+
+# Registro de uso do processo
+usage_ledger = UsageLedger()
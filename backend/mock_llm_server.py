@@ -0,0 +1,338 @@
+# backend/mock_llm_server.py
+"""
+Local OpenAI-compatible stand-in for offline benchmarks and load tests.
+
+Serves /v1/chat/completions (with and without streaming) and /v1/embeddings:
+
+- replay: answers from a cassette directory recorded with LLM_RECORD_DIR
+  (llm_cassette), keyed by the hash of the request body;
+- synth: plausible answers generated from the prompt - a JSON array of P&ID
+  items within the page/quadrant dimensions, {equipments, connections} for
+  electrical global/tile prompts, plain text for descriptions and chat, and
+  deterministic unit vectors for embeddings;
+- auto (default): replay when the cassette has the request, otherwise synth.
+
+Latency (log-normal around --latency-ms, or the recorded latency divided by
+--replay-speed) and injected errors (--error-rate for 500, --rate-limit-rate for
+429 + retry-after) are drawn from a generator seeded by --seed and the request
+hash, so the same request sequence gives the same answers, delays and failures.
+
+    python backend/mock_llm_server.py --port 8900 --cassettes cassettes/ --seed 7
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_API_KEY=mock python backend/backend.py
+"""
+import re
+import sys
+import json
+import time
+import math
+import base64
+import random
+import asyncio
+import hashlib
+import argparse
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from llm_cassette import CassetteStore, completion_chunks, prompt_text, request_key
+from prompt_compiler import count_tokens
+
+MOCK_MODES = ("auto", "replay", "synth")
+EMBEDDING_DIM = 1536
+IMAGE_TOKENS = 765  # estimativa por imagem na contagem de tokens de entrada
+
+_PID_SYMBOLS = [
+    ("P", "Bomba Centrífuga"), ("T", "Tanque de Armazenamento"), ("E", "Trocador de Calor"),
+    ("V", "Vaso de Pressão"), ("PI", "Indicador de Pressão"), ("TI", "Indicador de Temperatura"),
+    ("FIC", "Controlador Indicador de Vazão"), ("LT", "Transmissor de Nível"),
+    ("XV", "Válvula On-Off"), ("PSV", "Válvula de Segurança"),
+]
+_ELECTRICAL_SYMBOLS = [
+    ("CB", "Disjuntor trifásico"), ("M", "Motor trifásico"), ("K", "Contator tripolar"),
+    ("F", "Fusível"), ("TR", "Transformador"), ("KA", "Relé auxiliar"),
+]
+_MM_DIMS = re.compile(r"([\d.]+)\s*mm \((?:largura|width)[^)]*\) x ([\d.]+)\s*mm")
+_TILE_DIMS = re.compile(r"This tile is (\d+)px x (\d+)px")
+_PAGE_DIMS = re.compile(r"width=(\d+)px, height=(\d+)px")
+
+
+@dataclass
+class MockConfig:
+    cassette_dir: Optional[str] = None
+    mode: str = "auto"
+    latency_ms: float = 800.0       # mediana da latência sintética
+    latency_sigma: float = 0.5      # desvio do log-normal (0 = latência fixa)
+    replay_speed: float = 1.0       # latência gravada ÷ replay_speed (0 = sem espera)
+    error_rate: float = 0.0         # fração de respostas 500
+    rate_limit_rate: float = 0.0    # fração de respostas 429
+    retry_after_s: float = 0.5
+    min_items: int = 3
+    max_items: int = 12
+    stream_piece: int = 48          # caracteres por chunk em streaming
+    seed: int = 0
+    rpm: int = 10_000
+    tpm: int = 10_000_000
+
+
+@dataclass
+class MockReply:
+    status: int
+    body: Dict[str, Any]
+    delay_s: float = 0.0
+    headers: Dict[str, str] = field(default_factory=dict)
+    source: str = "synth"
+
+
+class MockLLM:
+    """Lógica do servidor (sem HTTP): decide replay/síntese, latência e erros por requisição"""
+
+    def __init__(self, config: MockConfig):
+        if config.mode not in MOCK_MODES:
+            raise ValueError(f"mode deve ser um de {MOCK_MODES}")
+        self.config = config
+        self.store = CassetteStore(config.cassette_dir) if config.cassette_dir else None
+        self._lock = threading.Lock()
+        self._attempts: Dict[str, int] = {}
+        self.counts = {"requests": 0, "replayed": 0, "synthesized": 0, "errors": 0, "rate_limited": 0, "misses": 0}
+
+    # ---------- núcleo ----------
+    def handle(self, endpoint: str, body: Dict[str, Any]) -> MockReply:
+        key = request_key(endpoint, body)
+        with self._lock:
+            attempt = self._attempts.get(key, 0)
+            self._attempts[key] = attempt + 1
+            self.counts["requests"] += 1
+        # Sorteios determinísticos por (seed, requisição, tentativa): repetições podem ter outro desfecho
+        rng = random.Random(f"{self.config.seed}:{key}:{attempt}")
+        delay = self._synthetic_delay(rng)
+
+        roll = rng.random()
+        if roll < self.config.rate_limit_rate:
+            self._count("rate_limited")
+            return MockReply(429, _error("Rate limit reached (mock)", "rate_limit_exceeded"), delay_s=0.0,
+                             headers={"retry-after": str(self.config.retry_after_s)}, source="error")
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            self._count("errors")
+            return MockReply(500, _error("Upstream error (mock)", "server_error"), delay_s=delay, source="error")
+
+        if self.config.mode != "synth" and self.store is not None:
+            record = self.store.get(key)
+            if record is not None:
+                self._count("replayed")
+                speed = self.config.replay_speed
+                recorded = float(record.get("latency_s") or 0.0)
+                return MockReply(200, record["response"], delay_s=recorded / speed if speed > 0 else 0.0,
+                                 headers=self._headers(), source="replay")
+        if self.config.mode == "replay":
+            self._count("misses")
+            return MockReply(404, _error(f"Requisição sem gravação no cassete ({key[:12]})", "cassette_miss"),
+                             source="miss")
+
+        self._count("synthesized")
+        seeded = random.Random(f"{self.config.seed}:{key}")  # conteúdo não depende da tentativa
+        if endpoint == "/embeddings":
+            payload = synth_embeddings(body)
+        else:
+            payload = synth_completion(body, seeded, self.config.min_items, self.config.max_items)
+        return MockReply(200, payload, delay_s=delay, headers=self._headers())
+
+    def _synthetic_delay(self, rng: random.Random) -> float:
+        median = max(0.0, self.config.latency_ms) / 1000.0
+        if self.config.latency_sigma <= 0:
+            return median
+        return median * math.exp(rng.gauss(0.0, self.config.latency_sigma))
+
+    def _headers(self) -> Dict[str, str]:
+        # Limites generosos: o scheduler sincroniza seus baldes por estes headers
+        return {
+            "x-ratelimit-limit-requests": str(self.config.rpm),
+            "x-ratelimit-remaining-requests": str(self.config.rpm),
+            "x-ratelimit-reset-requests": "0s",
+            "x-ratelimit-limit-tokens": str(self.config.tpm),
+            "x-ratelimit-remaining-tokens": str(self.config.tpm),
+            "x-ratelimit-reset-tokens": "0s",
+        }
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        return {"mode": self.config.mode, "seed": self.config.seed, **counts,
+                "cassettes": self.store.stats() if self.store is not None else None}
+
+
+def _error(message: str, code: str) -> Dict[str, Any]:
+    return {"error": {"message": message, "type": code, "code": code}}
+
+
+# ---------- síntese ----------
+def synth_content(prompt: str, rng: random.Random, min_items: int = 3, max_items: int = 12) -> str:
+    """Conteúdo plausível para o prompt: itens P&ID, equipamentos elétricos ou texto livre"""
+    n = rng.randint(min_items, max_items)
+    if "ELECTRICAL SCHEMATIC" in prompt:
+        dims = _TILE_DIMS.search(prompt) or _PAGE_DIMS.search(prompt)
+        wpx, hpx = (int(dims.group(1)), int(dims.group(2))) if dims else (2048, 2048)
+        equipments, tags = [], []
+        for _ in range(n):
+            prefix, desc = rng.choice(_ELECTRICAL_SYMBOLS)
+            tag = f"{prefix}-{rng.randint(1, 999):03d}"
+            w, h = rng.randint(20, 120), rng.randint(20, 120)
+            equipments.append({
+                "type": desc.split()[0].lower(), "tag": tag, "descricao": desc,
+                "bbox": {"x": rng.randint(0, max(0, wpx - w)), "y": rng.randint(0, max(0, hpx - h)), "w": w, "h": h},
+                "confidence": round(rng.uniform(0.6, 0.99), 2), "partial": False,
+            })
+            tags.append(tag)
+        result: Dict[str, Any] = {"equipments": equipments}
+        if "TILE" in prompt:
+            result["connections"] = [
+                {"from_tag": a, "to_tag": b, "path": [], "direction": "unknown", "confidence": 0.8}
+                for a, b in zip(tags, tags[1:]) if rng.random() < 0.5
+            ]
+            result["unresolved_endpoints"] = []
+        return json.dumps(result, ensure_ascii=False)
+
+    dims = _MM_DIMS.search(prompt)
+    if dims is None:
+        words = ["processo", "bombeamento", "controle", "nível", "pressão", "segurança", "vazão", "temperatura"]
+        body = " ".join(rng.choice(words) for _ in range(40))
+        return f"Descrição sintética (servidor mock): {body}."
+    W, H = float(dims.group(1)), float(dims.group(2))
+    items, tags = [], []
+    for _ in range(n):
+        prefix, desc = rng.choice(_PID_SYMBOLS)
+        tag = f"{prefix}-{rng.randint(100, 999)}"
+        items.append({"tag": tag, "descricao": desc,
+                      "x_mm": round(rng.uniform(0.05, 0.95) * W, 1), "y_mm": round(rng.uniform(0.05, 0.95) * H, 1),
+                      "from": rng.choice(tags) if tags else "N/A", "to": "N/A"})
+        tags.append(tag)
+    return json.dumps(items, ensure_ascii=False)
+
+
+def synth_completion(body: Dict[str, Any], rng: random.Random, min_items: int = 3, max_items: int = 12) -> Dict[str, Any]:
+    prompt = prompt_text(body)
+    content = synth_content(prompt, rng, min_items, max_items)
+    images = sum(1 for m in body.get("messages") or [] if isinstance(m.get("content"), list)
+                 for p in m["content"] if isinstance(p, dict) and p.get("type") == "image_url")
+    prompt_tokens = count_tokens(prompt) + IMAGE_TOKENS * images
+    completion_tokens = count_tokens(content)
+    return {
+        "id": f"chatcmpl-mock-{rng.getrandbits(64):016x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens,
+                  "prompt_tokens_details": {"cached_tokens": 0}},
+    }
+
+
+def embedding_vector(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Vetor unitário determinístico por texto (textos iguais → vetores iguais)"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def synth_embeddings(body: Dict[str, Any]) -> Dict[str, Any]:
+    inputs = body.get("input", "")
+    inputs = inputs if isinstance(inputs, list) else [inputs]
+    as_base64 = body.get("encoding_format") == "base64"
+    data = []
+    for i, text in enumerate(inputs):
+        vec = embedding_vector(str(text), int(body.get("dimensions") or EMBEDDING_DIM))
+        embedding = base64.b64encode(vec.astype("<f4").tobytes()).decode("ascii") if as_base64 else vec.tolist()
+        data.append({"object": "embedding", "index": i, "embedding": embedding})
+    tokens = sum(count_tokens(str(t)) for t in inputs)
+    return {"object": "list", "data": data, "model": body.get("model", "text-embedding-3-small"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+
+# ---------- HTTP ----------
+def _sse(chunks: Iterator[Dict[str, Any]]) -> List[str]:
+    return [f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n" for chunk in chunks] + ["data: [DONE]\n\n"]
+
+
+def create_app(config: Optional[MockConfig] = None, mock: Optional[MockLLM] = None) -> FastAPI:
+    mock = mock or MockLLM(config or MockConfig())
+    app = FastAPI(title="Mock LLM server")
+    app.state.mock = mock
+
+    async def reply_for(endpoint: str, request: Request) -> Tuple[MockReply, Dict[str, Any]]:
+        body = await request.json()
+        return await asyncio.to_thread(mock.handle, endpoint, body), body
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        reply, body = await reply_for("/chat/completions", request)
+        if reply.status != 200 or not body.get("stream"):
+            await asyncio.sleep(reply.delay_s)
+            return JSONResponse(reply.body, status_code=reply.status, headers=reply.headers)
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        events = _sse(completion_chunks(reply.body, mock.config.stream_piece, include_usage))
+
+        async def stream():
+            # Primeiro token após ~30% da latência; o restante distribuído pelos chunks
+            await asyncio.sleep(reply.delay_s * 0.3)
+            step = reply.delay_s * 0.7 / max(1, len(events))
+            for event in events:
+                yield event
+                await asyncio.sleep(step)
+
+        return StreamingResponse(stream(), media_type="text/event-stream", headers=reply.headers)
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        reply, _ = await reply_for("/embeddings", request)
+        await asyncio.sleep(reply.delay_s)
+        return JSONResponse(reply.body, status_code=reply.status, headers=reply.headers)
+
+    @app.get("/v1/models")
+    async def models():
+        names = ["gpt-5", "gpt-4o", "text-embedding-3-small"]
+        return {"object": "list", "data": [{"id": n, "object": "model", "owned_by": "mock"} for n in names]}
+
+    @app.get("/stats")
+    async def stats():
+        return mock.stats()
+
+    return app
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Servidor local compatível com OpenAI (replay de cassetes / respostas sintéticas)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--cassettes", help="Diretório de cassetes gravados com LLM_RECORD_DIR")
+    parser.add_argument("--mode", choices=MOCK_MODES, default="auto")
+    parser.add_argument("--latency-ms", type=float, default=800.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--replay-speed", type=float, default=1.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--min-items", type=int, default=3)
+    parser.add_argument("--max-items", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    config = MockConfig(cassette_dir=args.cassettes, mode=args.mode, latency_ms=args.latency_ms,
+                        latency_sigma=args.latency_sigma, replay_speed=args.replay_speed, error_rate=args.error_rate,
+                        rate_limit_rate=args.rate_limit_rate, min_items=args.min_items, max_items=args.max_items,
+                        seed=args.seed)
+    print(f"🧪 Mock LLM em http://{args.host}:{args.port}/v1 (modo {args.mode}, seed {args.seed})")
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
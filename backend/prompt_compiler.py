@@ -0,0 +1,105 @@
+# backend/prompt_compiler.py
+"""
+Compiled prompt prefixes for provider-side prompt caching.
+
+Prompts are split into a large static prefix (instructions, symbol lists, output
+format) and a short dynamic suffix (dimensions, quadrant label, process
+description). The prefix depends only on its key - e.g. (kind, diagram_type,
+scope) - so it is compiled once, memoized, and sent byte-identical on every call.
+The provider caches the longest shared prefix of a request (OpenAI: from 1024
+tokens), so every quadrant after the first bills and processes the instructions
+as cached tokens.
+
+Prefix token counts use tiktoken when installed (pip install tiktoken), otherwise
+an estimate of ≈4 characters per token. Compiled prefixes are reported in /ping.
+"""
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+# Tamanho mínimo de prefixo para o cache automático da OpenAI
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("o200k_base")
+    TIKTOKEN_AVAILABLE = True
+except Exception:  # pacote ausente ou encoding indisponível offline
+    _ENCODING = None
+    TIKTOKEN_AVAILABLE = False
+
+
+def count_tokens(text: str) -> int:
+    """Tokens de um texto (tiktoken se disponível; senão ≈4 caracteres por token)"""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return (len(text) + 3) // 4
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    key: Tuple[Hashable, ...]
+    prefix: str
+    prefix_tokens: int
+
+    @property
+    def cacheable(self) -> bool:
+        return self.prefix_tokens >= PROMPT_CACHE_MIN_TOKENS
+
+    def render(self, suffix: str) -> str:
+        """Prefixo estático + sufixo dinâmico (o prefixo nunca muda entre chamadas)"""
+        return f"{self.prefix}\n\n{suffix.strip()}" if suffix.strip() else self.prefix
+
+
+class PromptRegistry:
+    """Prefixos compilados por chave, construídos uma única vez por processo"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._compiled: Dict[Tuple[Hashable, ...], CompiledPrompt] = {}
+        self.hits = 0
+        self.compiles = 0
+
+    def compile(self, key: Tuple[Hashable, ...], build: Callable[[], str],
+                on_compile: Optional[Callable[[CompiledPrompt], None]] = None) -> CompiledPrompt:
+        """Prefixo memoizado por chave; on_compile é chamado só na primeira compilação"""
+        with self._lock:
+            compiled = self._compiled.get(key)
+            if compiled is not None:
+                self.hits += 1
+                return compiled
+        prefix = build()
+        compiled = CompiledPrompt(key=key, prefix=prefix, prefix_tokens=count_tokens(prefix))
+        with self._lock:
+            # Em corrida, mantém o primeiro (mesmo texto; garante um único objeto por chave)
+            created = key not in self._compiled
+            if created:
+                self._compiled[key] = compiled
+                self.compiles += 1
+            compiled = self._compiled[key]
+        if created and on_compile is not None:
+            on_compile(compiled)
+        return compiled
+
+    def clear(self) -> None:
+        with self._lock:
+            self._compiled.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            compiled = list(self._compiled.values())
+            hits, compiles = self.hits, self.compiles
+        return {
+            "compiled": len(compiled),
+            "hits": hits,
+            "compiles": compiles,
+            "token_counter": "tiktoken" if TIKTOKEN_AVAILABLE else "estimate",
+            "prefixes": {
+                "/".join(str(part) for part in p.key): {"tokens": p.prefix_tokens, "cacheable": p.cacheable}
+                for p in compiled
+            },
+        }
+
+
+# Prefixos do processo
+prompt_registry = PromptRegistry()
@@ -0,0 +1,69 @@
+# backend/spatial_index.py
+"""
+Uniform-grid spatial index for radius queries over 2D points (mm or px).
+
+Points are bucketed into square cells of a fixed size; a radius query visits
+only the cells overlapping the query square and checks exact distances there,
+so deduplication and snapping cost O(n · k) instead of O(n²) (k = points in the
+neighbouring cells). The radius may differ per query: large radii simply visit
+more rings of cells.
+
+    grid = UniformGrid(cell_size=10.0)
+    grid.insert(x, y, item)
+    for dist, item in grid.within(qx, qy, r):
+        ...
+
+Points with non-finite coordinates are never stored nor matched (as with
+math.hypot comparisons, NaN is never "within" any distance).
+"""
+import math
+from collections import defaultdict
+from typing import Any, DefaultDict, Iterator, List, Tuple
+
+
+class UniformGrid:
+    def __init__(self, cell_size: float):
+        if not cell_size > 0 or not math.isfinite(cell_size):
+            raise ValueError("cell_size deve ser positivo e finito")
+        self.cell_size = float(cell_size)
+        self._cells: DefaultDict[Tuple[int, int], List[Tuple[float, float, Any]]] = defaultdict(list)
+        self.size = 0
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def insert(self, x: float, y: float, value: Any) -> bool:
+        """Insere o ponto; False (não inserido) se as coordenadas não forem finitas"""
+        if not (math.isfinite(x) and math.isfinite(y)):
+            return False
+        self._cells[self._cell(x, y)].append((x, y, value))
+        self.size += 1
+        return True
+
+    def within(self, x: float, y: float, radius: float) -> Iterator[Tuple[float, Any]]:
+        """(distância, valor) de cada ponto a no máximo `radius` de (x, y), sem ordem definida"""
+        if not (math.isfinite(x) and math.isfinite(y)) or not radius >= 0:
+            return
+        for key in self._keys_near(x, y, radius):
+            bucket = self._cells.get(key)
+            if not bucket:
+                continue
+            for px, py, value in bucket:
+                d = math.hypot(x - px, y - py)
+                if d <= radius:
+                    yield d, value
+
+    def _keys_near(self, x: float, y: float, radius: float) -> List[Tuple[int, int]]:
+        """Células que cruzam o quadrado de lado 2·radius centrado em (x, y)"""
+        cells = self._cells
+        if math.isinf(radius):
+            return list(cells)
+        cx0, cy0 = self._cell(x - radius, y - radius)
+        cx1, cy1 = self._cell(x + radius, y + radius)
+        # Consulta muito maior que o índice: percorre as células ocupadas em vez do retângulo
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(cells):
+            return [k for k in cells if cx0 <= k[0] <= cx1 and cy0 <= k[1] <= cy1]
+        return [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)]
+
+    def __len__(self) -> int:
+        return self.size
@@ -16,26 +16,23 @@ Enhanced features for electrical diagrams:
 """
 import os
 import re
-import httpx, certifi
 import pandas as pd
 import numpy as np
-from openai import OpenAI
 import pickle
+import time
 from dotenv import load_dotenv
 
+from llm_client import get_client, run_llm_sync, is_ssl_error, disable_ssl_verification
+from llm_usage import usage_ledger
+import keyword_classifier as kwc
+
 # Load environment variables from .env file
 load_dotenv()
 
 # Config OpenAI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_REQUEST_TIMEOUT = int(os.getenv("OPENAI_REQUEST_TIMEOUT", "600"))
-
-def make_client(verify_ssl: bool = True) -> OpenAI:
-    http_client = httpx.Client(
-        verify=certifi.where() if verify_ssl else False,
-        timeout=OPENAI_REQUEST_TIMEOUT,
-    )
-    return OpenAI(api_key=OPENAI_API_KEY, http_client=http_client)
+EMBEDDING_MODEL = "text-embedding-3-small"
 
 # Get the directory where this file is located
 BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -47,8 +44,6 @@ CACHE_FILE_PID = os.path.join(BACKEND_DIR, "ref_embeddings_pid.pkl")
 CACHE_FILE_ELECTRICAL = os.path.join(BACKEND_DIR, "ref_embeddings_electrical.pkl")
 
 # Global variables for lazy initialization
-client = None
-
 # P&ID reference data
 df_ref_pid = None
 ref_embeddings_pid = None
@@ -65,17 +60,30 @@ ref_texts_electrical = None
 match_cache = {}
 
 def _initialize_client():
-    """Initialize OpenAI client."""
-    global client
-    
-    if client is not None:
-        return  # Already initialized
-    
-    # Check if API key is valid
-    if not OPENAI_API_KEY:
+    """Check that the shared process-wide client (llm_client) is available."""
+    # Sem referência local: após disable_ssl_verification o cliente antigo é fechado
+    if not OPENAI_API_KEY or get_client() is None:
         raise ValueError("OPENAI_API_KEY não definido. Configure a chave no arquivo .env")
-    
-    client = make_client(verify_ssl=False)
+
+
+def _create_embeddings(input):
+    """
+    embeddings.create no cliente compartilhado. Em erro SSL, passa o cliente do
+    processo para conexão sem verificação (uma única vez) e tenta novamente.
+    Tokens e latência são registrados no job atual (llm_usage).
+    """
+    _initialize_client()
+    started = time.perf_counter()
+    try:
+        resp = run_llm_sync(get_client().embeddings.create(model=EMBEDDING_MODEL, input=input))
+    except Exception as e:
+        if not is_ssl_error(e):
+            raise
+        print(f"⚠️ Embeddings falharam com erro SSL, tentando sem verificação: {e!r}")
+        disable_ssl_verification()
+        resp = run_llm_sync(get_client().embeddings.create(model=EMBEDDING_MODEL, input=input))
+    usage_ledger.record("embedding", EMBEDDING_MODEL, resp, latency_s=time.perf_counter() - started)
+    return resp
 
 
 def _initialize_pid():
@@ -229,10 +237,7 @@ def embed_texts(texts):
         print(f"🔄 Criando embeddings para batch {batch_num}/{total_batches} ({len(batch)} textos)...")
         
         try:
-            resp = client.embeddings.create(
-                model="text-embedding-3-small",
-                input=batch
-            )
+            resp = _create_embeddings(batch)
             batch_embeddings = [d.embedding for d in resp.data]
             all_embeddings.extend(batch_embeddings)
         except Exception as e:
@@ -276,49 +281,11 @@ def detect_pole_count(text: str) -> str:
     if not text:
         return ""
     
-    text_lower = text.lower()
-    
     # Check for explicit pole mentions
     # Portuguese: monopolar, bipolar, tripolar, trifásico (3-phase)
     # English: 1-pole, 2-pole, 3-pole, single-pole, three-phase
-    
-    # 3-pole indicators (most specific first)
-    three_pole_keywords = [
-        "3-pole", "3 pole", "three-pole", "three pole",
-        "tripolar", "tri-polar", "trifásico", "trifasico", "tri-fásico",
-        "three-phase", "three phase", "3-phase", "3 phase",
-        "três fases", "tres fases"
-    ]
-    
-    # 2-pole indicators
-    two_pole_keywords = [
-        "2-pole", "2 pole", "two-pole", "two pole",
-        "bipolar", "bi-polar", "bifásico", "bifasico", "bi-fásico",
-        "two-phase", "two phase", "2-phase", "2 phase"
-    ]
-    
-    # 1-pole indicators
-    one_pole_keywords = [
-        "1-pole", "1 pole", "single-pole", "single pole",
-        "monopolar", "mono-polar", "monofásico", "monofasico", "mono-fásico",
-        "single-phase", "single phase", "1-phase", "1 phase",
-        "unipolar", "uni-polar"
-    ]
-    
-    # Check in order of specificity (3, 2, 1)
-    for keyword in three_pole_keywords:
-        if keyword in text_lower:
-            return "3-pole"
-    
-    for keyword in two_pole_keywords:
-        if keyword in text_lower:
-            return "2-pole"
-    
-    for keyword in one_pole_keywords:
-        if keyword in text_lower:
-            return "1-pole"
-    
-    return ""
+    # Check in order of specificity (3, 2, 1) - kwc.POLE_KEYWORDS
+    return kwc.pole_count(text.lower())
 
 
 def extract_equipment_type_keywords(text: str) -> list:
@@ -338,56 +305,24 @@ def extract_equipment_type_keywords(text: str) -> list:
     
     text_lower = text.lower()
     
-    # Equipment type keywords (Portuguese and English)
-    # Order matters: more specific types first to avoid false matches
-    # e.g., check for "motor protection switch" before checking for "motor"
-    equipment_types = [
-        # Protection and control devices (check these first as they're compound terms)
-        ('protection-switch', ['motor protection switch', 'protection switch', 'disjuntor-motor', 'disjuntor de proteção']),
-        ('motor-starter', ['motor starter', 'partida', 'starter']),
-        
-        # Drives and converters
-        ('drive', ['vfd', 'inversor', 'drive', 'soft-starter', 'soft starter', 'acionamento eletrônico', 'acionamento eletronico', 'frequency converter']),
-        
-        # Cables and connections
-        ('cable', ['cabo', 'cable', 'condutor', 'conductor']),
-        ('connection-point', ['ponto de conexão', 'ponto de conexao', 'connection point', 'terminal point']),
-        
-        # Motors (check after motor-related compound terms)
-        ('motor', ['motor elétrico', 'motor eletrico', 'three-phase motor', 'single-phase motor', 'ac motor', 'dc motor']),
-        
-        # Other equipment
-        ('contactor', ['contator', 'contactor']),
-        ('circuit-breaker', ['disjuntor', 'circuit-breaker', 'circuit breaker']),
-        ('fuse', ['fusível', 'fusivel', 'fuse']),
-        ('relay', ['relé', 'rele', 'relay']),
-        ('transformer', ['transformador', 'transformer']),
-        ('switch', ['chave', 'switch', 'interruptor']),
-        ('generator', ['gerador', 'generator']),
-        ('capacitor', ['capacitor', 'condensador']),
-        ('resistor', ['resistor', 'resistência', 'resistencia']),
-    ]
-    
     found_types = []
     matched_positions = []  # Track where matches occur to avoid overlaps
     
-    # First pass: find all specific matches
-    for eq_type, keywords in equipment_types:
-        for keyword in keywords:
-            pos = text_lower.find(keyword)
-            if pos >= 0:
-                # Check if this position overlaps with an already matched region
-                overlaps = False
-                keyword_end = pos + len(keyword)
-                for matched_start, matched_end in matched_positions:
-                    if not (keyword_end <= matched_start or pos >= matched_end):
-                        overlaps = True
-                        break
-                
-                if not overlaps:
-                    found_types.append(eq_type)
-                    matched_positions.append((pos, keyword_end))
-                    break  # Only add each type once
+    # First pass: find all specific matches (kwc.EQUIPMENT_TYPE_KEYWORDS: order matters, specific types first)
+    for eq_type, keyword_hits in kwc.equipment_type_hits(text_lower):
+        for keyword, pos in keyword_hits:
+            # Check if this position overlaps with an already matched region
+            overlaps = False
+            keyword_end = pos + len(keyword)
+            for matched_start, matched_end in matched_positions:
+                if not (keyword_end <= matched_start or pos >= matched_end):
+                    overlaps = True
+                    break
+            
+            if not overlaps:
+                found_types.append(eq_type)
+                matched_positions.append((pos, keyword_end))
+                break  # Only add each type once
     
     # Special case: if no specific motor type found but "motor" appears standalone
     # (not part of "motor protection" or "motor starter"), add generic "motor"
@@ -578,10 +513,7 @@ def match_system_fullname(tag: str, descricao: str, tipo: str = "", diagram_type
             diagram_label = "P&ID"
             query_text = f"{tipo} {tag} {descricao}".strip()
         
-        emb_q = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=query_text
-        ).data[0].embedding
+        emb_q = _create_embeddings(query_text).data[0].embedding
 
         sims = [cosine_similarity(emb_q, emb_ref) for emb_ref in ref_embeddings]
         best_idx = int(np.argmax(sims))
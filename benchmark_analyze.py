@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the full /analyze path against the local mock LLM server.
+
+Starts backend/mock_llm_server.py on a free port (subprocess), points the
+backend at it (OPENAI_BASE_URL) and posts a PDF to /analyze several times.
+With the same seed, cassettes and parameters every run sees the same answers,
+latencies and injected errors, so timings are comparable between commits.
+
+    python benchmark_analyze.py --runs 3 --grid 3 --latency-ms 800
+    python benchmark_analyze.py --pdf diagrama.pdf --cassettes cassettes/ --mode replay --replay-speed 0
+
+Record cassettes from real traffic first with LLM_RECORD_DIR=cassettes/ and a
+real OPENAI_API_KEY.
+"""
+import sys
+import os
+import time
+import json
+import socket
+import argparse
+import shutil
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(ROOT, "backend")
+
+
+def create_pdf(pages: int) -> bytes:
+    """PDF sintético com símbolos (retângulos e círculos) e TAGs em texto"""
+    import fitz
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page(width=1191, height=842)  # A3 paisagem
+        shape = page.new_shape()
+        for i, x in enumerate(range(60, 1120, 110)):
+            for j, y in enumerate(range(60, 780, 120)):
+                if (i + j) % 2:
+                    shape.draw_rect(fitz.Rect(x, y, x + 50, y + 30))
+                else:
+                    shape.draw_circle(fitz.Point(x + 25, y + 15), 15)
+                page.insert_text(fitz.Point(x, y + 48), f"P-{p + 1}{i:02d}{j}", fontsize=7)
+        shape.finish(color=(0, 0, 0), width=1)
+        shape.commit()
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_mock(args, port: int) -> subprocess.Popen:
+    cmd = [sys.executable, os.path.join(BACKEND_DIR, "mock_llm_server.py"), "--port", str(port),
+           "--mode", args.mode, "--latency-ms", str(args.latency_ms), "--latency-sigma", str(args.latency_sigma),
+           "--replay-speed", str(args.replay_speed), "--error-rate", str(args.error_rate),
+           "--rate-limit-rate", str(args.rate_limit_rate), "--seed", str(args.seed)]
+    if args.cassettes:
+        cmd += ["--cassettes", args.cassettes]
+    proc = subprocess.Popen(cmd, cwd=BACKEND_DIR)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/v1/models", timeout=1)
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("Servidor mock não respondeu em 30s")
+
+
+def mock_stats(port: int) -> dict:
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=5) as r:
+        return json.load(r)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark offline do /analyze com o servidor LLM mock")
+    parser.add_argument("--pdf", help="PDF a analisar (padrão: PDF sintético)")
+    parser.add_argument("--pages", type=int, default=2, help="Páginas do PDF sintético")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--grid", default="3")
+    parser.add_argument("--diagram-type", default="pid")
+    parser.add_argument("--cassettes")
+    parser.add_argument("--mode", choices=("auto", "replay", "synth"), default="auto")
+    parser.add_argument("--latency-ms", type=float, default=800.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--replay-speed", type=float, default=1.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--with-cache", action="store_true", help="Mantém o cache persistente de respostas LLM")
+    args = parser.parse_args(argv)
+
+    port = free_port()
+    mock = start_mock(args, port)
+    tmp = tempfile.mkdtemp(prefix="bench_analyze_")
+    # Backend apontado para o mock (antes de importar o backend)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+    os.environ["OPENAI_API_KEY"] = "mock-key"
+    os.environ["LLM_RECORD_DIR"] = ""
+    os.environ["LLM_USAGE_PATH"] = os.path.join(tmp, "usage.sqlite")
+    if not args.with_cache:
+        os.environ["LLM_CACHE_ENABLED"] = "false"
+    sys.path.insert(0, BACKEND_DIR)
+
+    try:
+        from fastapi.testclient import TestClient
+        import backend as backend_module
+        import system_matcher
+        # Embeddings do mock não podem sobrescrever o cache real das referências
+        system_matcher.CACHE_FILE_PID = os.path.join(tmp, "ref_embeddings_pid.pkl")
+        system_matcher.CACHE_FILE_ELECTRICAL = os.path.join(tmp, "ref_embeddings_electrical.pkl")
+
+        data = open(args.pdf, "rb").read() if args.pdf else create_pdf(args.pages)
+        name = os.path.basename(args.pdf) if args.pdf else "benchmark.pdf"
+        params = {"dpi": args.dpi, "grid": args.grid, "diagram_type": args.diagram_type}
+        timings = []
+        with TestClient(backend_module.app) as client:
+            for run in range(args.runs):
+                started = time.perf_counter()
+                r = client.post("/analyze", params=params, files={"file": (name, data, "application/pdf")})
+                elapsed = time.perf_counter() - started
+                if r.status_code != 200:
+                    print(f"❌ Execução {run + 1}: HTTP {r.status_code} {r.text[:300]}")
+                    return 1
+                pages = r.json()
+                items = sum(len(p.get("resultado", [])) for p in pages)
+                usage = pages[0].get("job_usage", {}) if pages else {}
+                timings.append(elapsed)
+                print(f"⏱️ Execução {run + 1}: {elapsed:.2f}s | {len(pages)} páginas | {items} itens | "
+                      f"{usage.get('calls', 0)} chamadas | {usage.get('total_tokens', 0)} tokens | "
+                      f"{usage.get('retries', 0)} retentativas")
+
+        print("\n=== Resultado ===")
+        print(f"Execuções: {len(timings)} | mediana {statistics.median(timings):.2f}s | "
+              f"mín {min(timings):.2f}s | máx {max(timings):.2f}s")
+        print(f"Mock: {json.dumps(mock_stats(port), ensure_ascii=False)}")
+        return 0
+    finally:
+        mock.terminate()
+        mock.wait(timeout=10)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark dedup_items (uniform-grid spatial index) vs the previous quadratic
+scan, from 100 to 100k items.
+
+Items are spread over one page with a fixed density (~1 item per 400 mm² by
+default), a share of them repeated near an earlier position as quadrant
+overlap would, plus untagged (N/A) items. The quadratic version is skipped
+above --quadratic-max items; the kept set is checked to be identical whenever
+both run.
+
+    python benchmark_dedup.py --sizes 100,1000,10000,100000 --quadratic-max 20000
+"""
+import sys
+import os
+import math
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from backend import dedup_items, calculate_dynamic_tolerance
+
+DESCS = ["Bomba centrífuga", "Tanque de armazenamento", "Transmissor de pressão", "Válvula de controle", "Motor"]
+
+
+def quadratic_dedup(items, tol_mm=10.0):
+    """Implementação anterior: varre as posições/itens mantidos a cada item"""
+    final, seen_tags = [], {}
+    for it in items:
+        tag = it.get("tag", "").strip().upper()
+        pos = (it["x_mm"], it["y_mm"])
+        page = it["pagina"]
+        tol = calculate_dynamic_tolerance(it, tol_mm)
+        if tag and tag != "N/A":
+            positions = seen_tags.setdefault((tag, page), [])
+            duplicate = any(math.hypot(pos[0] - p[0], pos[1] - p[1]) <= tol for p in positions)
+            if not duplicate:
+                positions.append(pos)
+        else:
+            duplicate = any(e["pagina"] == page and
+                            math.hypot(pos[0] - e["x_mm"], pos[1] - e["y_mm"]) <= tol for e in final)
+        if not duplicate:
+            final.append(it)
+    return final
+
+
+def make_items(n: int, seed: int, area_per_item: float, dup_rate: float, untagged_rate: float):
+    rng = random.Random(seed)
+    side = math.sqrt(n * area_per_item)
+    items = []
+    for i in range(n):
+        if items and rng.random() < dup_rate:
+            src = items[rng.randrange(len(items))]
+            item = dict(src, x_mm=src["x_mm"] + rng.uniform(-3, 3), y_mm=src["y_mm"] + rng.uniform(-3, 3))
+        else:
+            tag = "N/A" if rng.random() < untagged_rate else f"P-{i}"
+            item = {"tag": tag, "descricao": rng.choice(DESCS),
+                    "x_mm": rng.uniform(0, side), "y_mm": rng.uniform(0, side), "pagina": 1}
+        item["id"] = i
+        items.append(item)
+    return items
+
+
+def timed(fn, items, repeat: int):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        batch = [dict(it) for it in items]
+        started = time.perf_counter()
+        result = fn(batch)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de deduplicação (índice espacial vs quadrático)")
+    parser.add_argument("--sizes", default="100,1000,10000,100000")
+    parser.add_argument("--quadratic-max", type=int, default=20000, help="Maior tamanho medido com a versão quadrática")
+    parser.add_argument("--area-per-item", type=float, default=400.0, help="mm² por item (densidade)")
+    parser.add_argument("--dup-rate", type=float, default=0.2)
+    parser.add_argument("--untagged-rate", type=float, default=0.1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    print(f"{'itens':>8} {'mantidos':>9} {'grade':>11} {'quadrático':>12} {'ganho':>8}")
+    for n in (int(s) for s in args.sizes.split(",")):
+        items = make_items(n, args.seed, args.area_per_item, args.dup_rate, args.untagged_rate)
+        grid_s, kept = timed(lambda b: dedup_items(b, page_num=1, tol_mm=10.0), items, args.repeat)
+        quad_col, gain_col = "-", "-"
+        if n <= args.quadratic_max:
+            quad_s, expected = timed(lambda b: quadratic_dedup(b, tol_mm=10.0), items, 1)
+            if [it["id"] for it in kept] != [it["id"] for it in expected]:
+                print(f"❌ Resultado diferente da versão quadrática com {n} itens")
+                return 1
+            quad_col, gain_col = f"{quad_s * 1000:.1f} ms", f"{quad_s / grid_s:.1f}x"
+        print(f"{n:>8} {len(kept):>9} {grid_s * 1000:>8.1f} ms {quad_col:>12} {gain_col:>8}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark JSON extraction from LLM output: single-pass raw_decode scanner
+(ensure_json_list / json_extract) vs the previous DOTALL regex
+(extract_first_json_array).
+
+Pathological ~200 KB outputs: a valid array, the same array truncated in the
+last item (max_tokens), an array that never closes, a truncated
+{"equipments": [...]} wrapper, several fenced arrays and prose with many
+stray brackets. The regex backtracks super-linearly on the truncated cases, so
+it runs in a subprocess with a time limit and is reported as "> limit" when
+it does not finish.
+
+    python benchmark_json_extraction.py --kb 200 --regex-timeout 10
+"""
+import sys
+import os
+import json
+import time
+import argparse
+import multiprocessing as mp
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from json_extract import json_list
+
+OLD_PATTERN = r"\[\s*(?:\{.*?\}\s*,\s*)*\{.*?\}\s*\]|\[\s*\]"
+ITEM = {"tag": "P-101", "descricao": "Bomba Centrífuga", "x_mm": 234.5, "y_mm": 567.8,
+        "from": "T-101", "to": "E-201"}
+
+
+def make_cases(kb: int):
+    item = json.dumps(ITEM, ensure_ascii=False)
+    n = max(1, kb * 1024 // (len(item) + 2))
+    items = ",\n".join([item] * n)
+    third = ",\n".join([item] * max(1, n // 3))
+    return {
+        "valid": (f"[{items}]", n),
+        "truncated_last_item": (f'[{items},\n{{"tag": "P-9', n),
+        "never_closed": (f"[{items}", n),
+        "truncated_wrapper": (f'{{"equipments": [{items},\n{{"tag": "P-', n),
+        "multiple_fenced_arrays": ("\n".join(f"```json\n[{third}]\n```" for _ in range(3)), 3 * max(1, n // 3)),
+        "prose_with_brackets": ("Veja [nota] e {ref} " * (kb * 1024 // 20) + f"[{item}]", 1),
+    }
+
+
+def _run_regex(text, queue):
+    import re
+    started = time.perf_counter()
+    m = re.compile(OLD_PATTERN, re.DOTALL).search(text)
+    elapsed = time.perf_counter() - started
+    try:
+        items = len(json.loads(m.group(0))) if m else 0
+    except ValueError:
+        items = "inválido"  # o trecho casado atravessa arrays e não é JSON
+    queue.put((elapsed, items))
+
+
+def time_regex(text: str, timeout: float):
+    queue = mp.Queue()
+    proc = mp.Process(target=_run_regex, args=(text, queue))
+    proc.start()
+    proc.join(timeout)
+    if proc.is_alive():
+        proc.terminate()
+        proc.join()
+        return None, None
+    return queue.get()
+
+
+def time_scanner(text: str, repeat: int):
+    best = float("inf")
+    items = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        items = len(json_list(text))
+        best = min(best, time.perf_counter() - started)
+    return best, items
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de extração de JSON (scanner vs regex)")
+    parser.add_argument("--kb", type=int, default=200, help="Tamanho aproximado de cada saída (KB)")
+    parser.add_argument("--regex-timeout", type=float, default=10.0, help="Limite por caso para a regex antiga (s)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f"{'caso':<24} {'KB':>6} {'esperado':>8} {'scanner':>10} {'itens':>6} {'regex':>12} {'itens':>6}")
+    for name, (text, expected) in make_cases(args.kb).items():
+        scan_s, scan_items = time_scanner(text, args.repeat)
+        regex_s, regex_items = time_regex(text, args.regex_timeout)
+        regex_col = f"> {args.regex_timeout:.0f}s" if regex_s is None else f"{regex_s * 1000:.1f} ms"
+        print(f"{name:<24} {len(text) / 1024:>6.0f} {expected:>8} {scan_s * 1000:>7.1f} ms {scan_items:>6} "
+              f"{regex_col:>12} {'-' if regex_items is None else regex_items:>6}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
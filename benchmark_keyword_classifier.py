@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark the description/tag heuristics on 50k descriptions: previous
+per-helper linear keyword scans vs the shared compiled matcher
+(keyword_classifier).
+
+Each description goes through estimate_symbol_size, validate_symbol_type,
+detect_pole_count and extract_equipment_type_keywords, as it would when an
+item is deduplicated, validated and matched. Descriptions are drawn from a
+pool of --unique distinct texts (real diagrams repeat them a lot); the new
+version is measured with a cold memo (cleared before each run) and warm.
+Results are checked to be identical.
+
+    python benchmark_keyword_classifier.py --count 50000 --unique 5000
+"""
+import sys
+import os
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import keyword_classifier as kwc
+from backend import estimate_symbol_size, validate_symbol_type
+from system_matcher import detect_pole_count, extract_equipment_type_keywords
+from test_keyword_classifier import (reference_symbol_size, reference_validate, reference_pole,
+                                     reference_types)
+
+TAGS = ["P-101", "TK-2", "PT-301", "LCV-7", "M-12", "CB-3", "K-1", "E-201", "X-9"]
+WORDS = ["bomba centrífuga", "tanque de armazenamento", "transmissor de pressão", "válvula de controle de vazão",
+         "motor elétrico", "disjuntor tripolar", "contator", "relé térmico", "motor protection switch",
+         "inversor de frequência", "cabo", "three-phase", "trocador de calor", "com", "de", "para", "linha 2",
+         "instalado no skid", "alimentação 380v", "fusível"]
+
+
+def make_descriptions(count: int, unique: int, seed: int):
+    rng = random.Random(seed)
+    pool = [(rng.choice(TAGS), " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 7))).capitalize())
+            for _ in range(unique)]
+    return [rng.choice(pool) for _ in range(count)]
+
+
+def run_old(items):
+    return [(reference_symbol_size(tag, desc), reference_validate(tag, desc), reference_pole(desc),
+             reference_types(desc)) for tag, desc in items]
+
+
+def run_new(items):
+    out = []
+    for tag, desc in items:
+        v = validate_symbol_type({"tag": tag}, desc)
+        out.append((estimate_symbol_size(tag, desc), (v["tag_prefix"], v["found_keywords"]),
+                    detect_pole_count(desc), extract_equipment_type_keywords(desc)))
+    return out
+
+
+def timed(fn, items, repeat: int, before=None):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        if before:
+            before()
+        started = time.perf_counter()
+        result = fn(items)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark do classificador de palavras-chave (matcher compilado vs varreduras)")
+    parser.add_argument("--count", type=int, default=50000, help="Número de descrições")
+    parser.add_argument("--unique", type=int, default=5000, help="Descrições distintas no conjunto")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    items = make_descriptions(args.count, args.unique, args.seed)
+    old_s, old = timed(run_old, items, args.repeat)
+    cold_s, cold = timed(run_new, items, args.repeat, before=kwc.DESCRIPTION_MATCHER.hits.cache_clear)
+    warm_s, warm = timed(run_new, items, args.repeat)
+    if not (old == cold == warm):
+        print("❌ Resultados diferentes entre as versões")
+        return 1
+
+    print(f"{args.count} descrições ({args.unique} distintas), {len(kwc.DESCRIPTION_MATCHER.words)} palavras-chave\n")
+    print(f"{'versão':>22} | {'tempo (s)':>10} | {'µs/desc':>8} | {'ganho':>6}")
+    print("-" * 56)
+    for name, secs in (("varreduras lineares", old_s), ("matcher (memo frio)", cold_s), ("matcher (memo quente)", warm_s)):
+        print(f"{name:>22} | {secs:10.3f} | {secs / args.count * 1e6:8.2f} | {old_s / secs:5.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
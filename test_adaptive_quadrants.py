@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Test adaptive (quadtree) quadrant subdivision used by grid=auto.
+
+Validates that:
+1. Dense regions are split deeper than sparse ones
+2. The number of quadrants never exceeds the per-page call budget
+3. Sparse or empty pages produce no quadrants (global pass only)
+4. Every inked area of the page is still covered by some quadrant
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import fitz
+
+from backend import open_pdf_with_fallback, page_quadrants_adaptive
+
+
+def create_pdf(dense: bool = True) -> bytes:
+    """A0-like sheet: dense symbol field in the top-left, a few symbols elsewhere"""
+    doc = fitz.open()
+    page = doc.new_page(width=3370, height=2384)
+    if dense:
+        shape = page.new_shape()
+        for row in range(40):
+            for col in range(40):
+                x, y = 60 + col * 30, 60 + row * 25
+                shape.draw_rect(fitz.Rect(x, y, x + 18, y + 14))
+                shape.draw_line(fitz.Point(x, y + 20), fitz.Point(x + 18, y + 20))
+        shape.finish(width=1.5)
+        shape.commit()
+    page.draw_circle(fitz.Point(2900, 2000), 30)
+    page.insert_text((2850, 2060), "P-101", fontsize=14)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_dense_regions_split_deeper():
+    """The dense corner gets smaller quadrants than the rest of the sheet"""
+    print("\n=== Testing adaptive depth ===")
+    doc = open_pdf_with_fallback(create_pdf(), "dense.pdf")
+    page = doc[0]
+    quads = page_quadrants_adaptive(page, max_calls=16)
+    assert 1 < len(quads) <= 16, f"Expected 2..16 quadrants, got {len(quads)}"
+
+    dense_area = fitz.Rect(60, 60, 1260, 1060)
+    dense = [r for _, _, r, _ in quads if r.intersects(dense_area)]
+    sparse = [r for _, _, r, _ in quads if not r.intersects(dense_area)]
+    assert dense and sparse
+    min_dense = min(r.width * r.height for r in dense)
+    max_sparse = max(r.width * r.height for r in sparse)
+    assert min_dense < max_sparse, "Dense region should be split into smaller quadrants"
+    assert all(label for _, _, _, label in quads)
+    doc.close()
+    print(f"✅ {len(quads)} adaptive quadrants, dense region split deeper")
+
+
+def test_budget_is_respected():
+    """The quadtree never emits more quadrants than the budget"""
+    print("\n=== Testing call budget ===")
+    doc = open_pdf_with_fallback(create_pdf(), "budget.pdf")
+    for budget in (4, 7, 10, 25):
+        quads = page_quadrants_adaptive(doc[0], max_calls=budget)
+        assert len(quads) <= budget, f"budget={budget}: {len(quads)} quadrants"
+    doc.close()
+    print("✅ Budget respected for every limit")
+
+
+def test_sparse_page_uses_global_only():
+    """A sparse sheet is not subdivided at all"""
+    print("\n=== Testing sparse page ===")
+    doc = open_pdf_with_fallback(create_pdf(dense=False), "sparse.pdf")
+    assert page_quadrants_adaptive(doc[0]) == []
+    doc.close()
+    print("✅ Sparse page: no quadrant calls")
+
+
+def test_ink_is_covered():
+    """Both the dense field and the isolated symbol fall inside some quadrant"""
+    print("\n=== Testing coverage ===")
+    doc = open_pdf_with_fallback(create_pdf(), "coverage.pdf")
+    quads = page_quadrants_adaptive(doc[0], max_calls=16, overlap_percent=0.1)
+    for point in (fitz.Point(70, 70), fitz.Point(1200, 1000), fitz.Point(2900, 2000)):
+        assert any(point in r for _, _, r, _ in quads), f"{point} not covered"
+    assert all(r in doc[0].rect for _, _, r, _ in quads), "Quadrants must stay inside the page"
+    doc.close()
+    print("✅ All inked areas covered")
+
+
+if __name__ == "__main__":
+    try:
+        test_dense_regions_split_deeper()
+        test_budget_is_respected()
+        test_sparse_page_uses_global_only()
+        test_ink_is_covered()
+        print("\n✅ ALL ADAPTIVE QUADRANT TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
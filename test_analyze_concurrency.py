@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Test page-level concurrency in /analyze.
+
+Validates that:
+1. The global pass and the quadrant pass of a page run at the same time
+2. Pages are processed in parallel, never above ANALYZE_PAGE_CONCURRENCY
+3. The response keeps page order and each page keeps its own items
+4. Generating the process description does not block the event loop
+"""
+import sys
+import os
+import asyncio
+import json
+import time
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import fitz
+
+import backend as backend_module
+
+
+class FakeUpload:
+    def __init__(self, data: bytes, filename: str):
+        self._data = data
+        self.filename = filename
+
+    async def read(self) -> bytes:
+        return self._data
+
+
+class _Msg:
+    def __init__(self, content):
+        self.content = content
+
+
+class _Choice:
+    def __init__(self, content):
+        self.message = _Msg(content)
+
+
+class _Resp:
+    def __init__(self, content):
+        self.choices = [_Choice(content)]
+
+
+def create_pdf(pages: int) -> bytes:
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=842, height=595)
+        shape = page.new_shape()
+        for x in range(40, 800, 80):
+            for y in range(40, 560, 80):
+                shape.draw_rect(fitz.Rect(x, y, x + 40, y + 25))
+        shape.finish(color=(0, 0, 0), width=1)
+        shape.commit()
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def run_analyze(pages: int, page_concurrency: int):
+    events = []
+    state = {"in_flight": 0, "peak": 0}
+
+    async def fake_llm_call(image_b64, prompt, prefer_model=None, mime="image/png", image_tokens=0):
+        scope = "quadrant" if "LOCAL ao quadrante" in prompt else "global"
+        state["in_flight"] += 1
+        state["peak"] = max(state["peak"], state["in_flight"])
+        events.append(("start", scope, time.perf_counter()))
+        await asyncio.sleep(1.0 if scope == "global" else 0.3)
+        events.append(("end", scope, time.perf_counter()))
+        state["in_flight"] -= 1
+        n = len(events)
+        item = {"tag": f"P-{n}", "descricao": "Bomba", "x_mm": 100.0 + n * 30, "y_mm": 100.0}
+        return "fake-model", _Resp(json.dumps([item]))
+
+    saved = (backend_module.OPENAI_API_KEY, backend_module.llm_call, backend_module.match_system_fullname,
+             backend_module.generate_process_description, backend_module.ANALYZE_PAGE_CONCURRENCY)
+    backend_module.OPENAI_API_KEY = "sk-test"
+    backend_module.llm_call = fake_llm_call
+    backend_module.match_system_fullname = lambda *a, **k: {"SystemFullName": None, "Confiança": 0}
+    async def fake_description(*a, **k):
+        return ""
+
+    backend_module.generate_process_description = fake_description
+    backend_module.ANALYZE_PAGE_CONCURRENCY = page_concurrency
+    before = set(backend_module.pid_knowledge_base)
+    # Resumo de uso do job vai para um SQLite temporário, não para backend/
+    ledger = backend_module.usage_ledger
+    usage_dir = tempfile.TemporaryDirectory()
+    saved_usage_path = ledger.path
+    ledger.close()
+    ledger.path = os.path.join(usage_dir.name, "usage.sqlite")
+    try:
+        start = time.perf_counter()
+        response = asyncio.run(backend_module.analyze_pdf(
+            FakeUpload(create_pdf(pages), "concurrency.pdf"), dpi=100, grid="2", tol_mm=10.0,
+            use_overlap=False, use_dynamic_tolerance=True, use_ocr_validation=False,
+            use_geometric_refinement=False, diagram_type="pid", skip_blank=False, ink_threshold=0.001
+        ))
+        elapsed = time.perf_counter() - start
+    finally:
+        (backend_module.OPENAI_API_KEY, backend_module.llm_call, backend_module.match_system_fullname,
+         backend_module.generate_process_description, backend_module.ANALYZE_PAGE_CONCURRENCY) = saved
+        for key in set(backend_module.pid_knowledge_base) - before:
+            del backend_module.pid_knowledge_base[key]
+        ledger.close()
+        ledger.path = saved_usage_path
+        usage_dir.cleanup()
+    return json.loads(response.body), events, state["peak"], elapsed
+
+
+def test_global_and_quadrants_overlap():
+    """Quadrant calls are in flight while the global call of the same page runs"""
+    print("\n=== Testing global/quadrant overlap ===")
+    result, events, peak, _ = run_analyze(pages=1, page_concurrency=1)
+    global_end = next(t for kind, scope, t in events if kind == "end" and scope == "global")
+    quad_starts = [t for kind, scope, t in events if kind == "start" and scope == "quadrant"]
+    assert len(quad_starts) == 4
+    assert any(t < global_end for t in quad_starts), "Quadrants should not wait for the global pass"
+    assert peak == 5, f"Global + 4 quadrants should be in flight together, got {peak}"
+    assert len(result) == 1 and len(result[0]["resultado"]) == 5
+    print("✅ Global pass and quadrants run concurrently")
+
+
+def test_pages_bounded_and_ordered():
+    """Pages run in parallel up to the limit and the response keeps page order"""
+    print("\n=== Testing page parallelism ===")
+    result, _, peak, elapsed = run_analyze(pages=4, page_concurrency=2)
+    assert [p["pagina"] for p in result] == [1, 2, 3, 4]
+    assert all(item["pagina"] == p["pagina"] for p in result for item in p["resultado"])
+    assert 5 < peak <= 10, f"Two pages (5 calls each) should overlap, got {peak}"
+    print(f"✅ 4 pages in {elapsed:.2f}s, peak {peak} calls in flight")
+
+
+def test_description_does_not_block_loop():
+    """Other coroutines keep running while the process description is generated"""
+    print("\n=== Testing non-blocking process description ===")
+
+    class FakeCompletions:
+        async def create(self, **kwargs):
+            await asyncio.sleep(0.5)
+            return _Resp("Descrição do processo")
+
+    fake_client = type("FakeClient", (), {"chat": type("Chat", (), {"completions": FakeCompletions()})()})()
+    saved_client = backend_module.get_client
+    backend_module.get_client = lambda: fake_client
+    ticks = []
+
+    async def ticker():
+        for _ in range(20):
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.02)
+
+    async def main():
+        items = [{"tag": "P-101", "descricao": "Bomba", "x_mm": 10.0, "y_mm": 10.0}]
+        started = time.perf_counter()
+        description, _ = await asyncio.gather(
+            backend_module.generate_process_description(items, ultra_complete=True), ticker())
+        return description, started
+
+    try:
+        description, started = asyncio.run(main())
+    finally:
+        backend_module.get_client = saved_client
+    assert description == "Descrição do processo"
+    assert sum(1 for t in ticks if t - started < 0.45) >= 10, "Event loop was blocked by the description call"
+    print(f"✅ {len(ticks)} ticks while the description was generated")
+
+
+if __name__ == "__main__":
+    try:
+        test_global_and_quadrants_overlap()
+        test_pages_bounded_and_ordered()
+        test_description_does_not_block_loop()
+        print("\n✅ ALL ANALYZE CONCURRENCY TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Test the offline batch mode against the local file-based batch backend.
+
+Validates that:
+1. plan writes Batch API JSONL requests (global + quadrants) and a manifest
+2. Blank pages are screened out at planning time (no requests)
+3. Input files rotate when the per-file request limit is reached
+4. submit + collect through LocalBatchBackend rebuild pages in /analyze format
+5. Failed requests are counted and do not break reassembly
+"""
+import sys
+import os
+import json
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import fitz
+
+import backend as backend_module
+from batch_analyzer import (BatchOptions, LocalBatchBackend, plan_batch, submit_batch,
+                            batch_status, collect_batch, load_manifest)
+
+
+def create_pdf(path: str, blank_second_page: bool = True) -> None:
+    doc = fitz.open()
+    page = doc.new_page(width=842, height=595)
+    shape = page.new_shape()
+    for x in range(40, 800, 80):
+        for y in range(40, 560, 80):
+            shape.draw_rect(fitz.Rect(x, y, x + 40, y + 25))
+    shape.finish(color=(0, 0, 0), width=1)
+    shape.commit()
+    if blank_second_page:
+        doc.new_page(width=842, height=595)
+    doc.save(path)
+    doc.close()
+
+
+def fake_responder(request):
+    """Global: uma bomba; quadrantes: um instrumento em coordenadas locais"""
+    prompt = request["body"]["messages"][0]["content"][0]["text"]
+    if "LOCAL ao quadrante" in prompt:
+        return json.dumps([{"tag": "FT-101", "descricao": "Transmissor de Vazão", "x_mm": 20.0, "y_mm": 20.0}])
+    return "```json\n" + json.dumps([{"tag": "P-101", "descricao": "Bomba Centrífuga", "x_mm": 150.0, "y_mm": 100.0}]) + "\n```"
+
+
+def _patched(fn):
+    def wrapper(*args, **kwargs):
+        saved = backend_module.match_system_fullname
+        backend_module.match_system_fullname = lambda *a, **k: None
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            backend_module.match_system_fullname = saved
+    wrapper.__name__ = fn.__name__
+    return wrapper
+
+
+def test_plan_writes_batch_requests():
+    """One global + N×N quadrant requests per inked page, in Batch API format"""
+    print("\n=== Testing batch planning ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf = os.path.join(tmp, "sheet.pdf")
+        create_pdf(pdf)
+        manifest = plan_batch([pdf], os.path.join(tmp, "batch"), BatchOptions(grid="2"))
+
+        pages = manifest["documents"][0]["pages"]
+        assert [p["skipped"] for p in pages] == [False, True], "Blank page must be skipped at planning"
+        scopes = [r["scope"] for r in pages[0]["requests"]]
+        assert scopes[0] == "global" and scopes.count("quadrant") >= 1
+        assert manifest["total_requests"] == len(scopes)
+
+        with open(os.path.join(tmp, "batch", manifest["input_files"][0]), encoding="utf-8") as f:
+            lines = [json.loads(l) for l in f]
+        assert [l["custom_id"] for l in lines] == [r["custom_id"] for r in pages[0]["requests"]]
+        first = lines[0]
+        assert first["method"] == "POST" and first["url"] == "/v1/chat/completions"
+        assert first["body"]["model"] == manifest["options"]["model"]
+        image = first["body"]["messages"][0]["content"][1]["image_url"]["url"]
+        assert image.startswith("data:image/"), "Same payload encoding as /analyze"
+
+        # Rotação dos arquivos de entrada
+        rotated = plan_batch([pdf], os.path.join(tmp, "rotated"), BatchOptions(grid="2"), max_requests=2)
+        assert len(rotated["input_files"]) == (rotated["total_requests"] + 1) // 2
+    print(f"✅ {len(scopes)} requests planned, blank page skipped")
+
+
+@_patched
+def test_local_backend_round_trip():
+    """submit → status → collect rebuilds one JSON per PDF in /analyze format"""
+    print("\n=== Testing local batch round trip ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf = os.path.join(tmp, "sheet.pdf")
+        create_pdf(pdf)
+        batch_dir = os.path.join(tmp, "batch")
+        plan_batch([pdf], batch_dir, BatchOptions(grid="2"))
+
+        backend = LocalBatchBackend(os.path.join(tmp, "remote"), responder=fake_responder)
+        submit_batch(batch_dir, backend)
+        submit_batch(batch_dir, backend)  # idempotente: nada é reenviado
+        manifest = load_manifest(batch_dir)
+        assert len(manifest["batches"]) == len(manifest["input_files"])
+        assert set(batch_status(batch_dir, backend).values()) == {"completed"}
+
+        results = collect_batch(batch_dir, backend)
+        pages = results["sheet.pdf"]
+        assert [p["pagina"] for p in pages] == [1, 2]
+        assert pages[1]["resultado"] == []
+        tags = sorted(item["tag"] for item in pages[0]["resultado"])
+        assert "P-101" in tags and "FT-101" in tags, tags
+        assert pages[0]["batch"]["failed"] == 0
+        assert os.path.exists(os.path.join(batch_dir, "results", "sheet.json"))
+    print(f"✅ Reassembled tags: {tags}")
+
+
+@_patched
+def test_failed_requests_are_counted():
+    """A request that errors in the batch is skipped, like a failed quadrant in /analyze"""
+    print("\n=== Testing failed batch requests ===")
+
+    def flaky(request):
+        if "-quadrant-" in request["custom_id"]:
+            raise RuntimeError("upstream error")
+        return fake_responder(request)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf = os.path.join(tmp, "sheet.pdf")
+        create_pdf(pdf, blank_second_page=False)
+        batch_dir = os.path.join(tmp, "batch")
+        manifest = plan_batch([pdf], batch_dir, BatchOptions(grid="2"))
+        n_quadrants = len(manifest["documents"][0]["pages"][0]["requests"]) - 1
+
+        backend = LocalBatchBackend(os.path.join(tmp, "remote"), responder=flaky)
+        submit_batch(batch_dir, backend)
+        page = collect_batch(batch_dir, backend)["sheet.pdf"][0]
+        assert page["batch"]["failed"] == n_quadrants
+        assert [item["tag"] for item in page["resultado"]] == ["P-101"]
+    print(f"✅ {n_quadrants} failed requests skipped")
+
+
+if __name__ == "__main__":
+    try:
+        test_plan_writes_batch_requests()
+        test_local_backend_round_trip()
+        test_failed_requests_are_counted()
+        print("\n✅ ALL BATCH TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
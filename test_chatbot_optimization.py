@@ -15,11 +15,11 @@ def test_description_generation_once():
     
     checks = {
         "Descrição gerada em /analyze": (
-            'description = generate_process_description(all_items, ultra_complete=True)',
+            'description = await generate_process_description(all_items, ultra_complete=True)',
             'pid_knowledge_base[pid_id]["description"] = description'
         ),
         "Descrição gerada em /generate": (
-            'description = generate_process_description(unique, ultra_complete=True)',
+            'description = await generate_process_description(unique, ultra_complete=True)',
             'pid_knowledge_base[pid_id]["description"] = description'
         ),
         "PDF armazenado para modo vision": (
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Test the per-page connection graph of the electrical pipeline.
+
+Validates that:
+1. Incremental insertion (tile by tile) keeps the same edges as
+   merge_electrical_conns over the concatenated list
+2. sources/targets match the previous scans over all connections
+3. The edge list is serializable and snapped edges are not deduplicated
+4. run_electrical_pipeline keeps connections per page (nothing leaks from
+   page 1 into page 2) and returns each page's edge list
+"""
+import sys
+import os
+import json
+import random
+import asyncio
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import fitz
+
+import backend as backend_module
+from backend import Conn, merge_electrical_conns, new_connection_graph, open_pdf_with_fallback
+
+TAGS = [None, "M-1", "M-2", "CB-1", "CB-2", "TB-1"]
+
+
+def random_tiles(seed, tiles=6, per_tile=40, extent=300.0):
+    """Conexões por tile: cada fio aparece em 1-3 tiles com pequeno deslocamento"""
+    rng = random.Random(seed)
+    wires = [((rng.choice(TAGS), rng.choice(TAGS)),
+              [(rng.uniform(0, extent), rng.uniform(0, extent)) for _ in range(rng.randint(1, 5))])
+             for _ in range(per_tile)]
+    out = []
+    for _ in range(tiles):
+        tile = []
+        for (a, b), pts in rng.sample(wires, per_tile // 2):
+            jit = rng.choice([0.0, 2.0, 30.0])
+            tile.append(Conn(a, b, [(x + rng.uniform(-jit, jit), y) for x, y in pts], "undirected", rng.random()))
+        out.append(tile)
+    return out
+
+
+def test_incremental_insert_matches_merge():
+    """Tile-by-tile insertion keeps exactly merge_electrical_conns' edges"""
+    print("\n=== Testing incremental insertion ===")
+    for seed in range(10):
+        tiles = random_tiles(seed)
+        graph = new_connection_graph(1)
+        for tile in tiles:
+            graph.extend(tile)
+        flat = [c for tile in tiles for c in tile]
+        assert [id(c) for c in graph.edges] == [id(c) for c in merge_electrical_conns(flat)], seed
+        assert len(graph) + graph.rejected == len(flat)
+    print("✅ Incremental graph equals batch merge")
+
+
+def test_adjacency_matches_scan():
+    """sources/targets equal the old O(C) scans, in order"""
+    print("\n=== Testing adjacency lookups ===")
+    graph = new_connection_graph(1)
+    for tile in random_tiles(3):
+        graph.extend(tile)
+    for tag in TAGS + ["X-404"]:
+        assert graph.sources(tag) == [c.from_tag for c in graph.edges if c.to_tag == tag], tag
+        assert graph.targets(tag) == [c.to_tag for c in graph.edges if c.from_tag == tag], tag
+        assert graph.degree(tag) == len(graph.sources(tag)) + len(graph.targets(tag))
+    assert None not in graph.tags() and set(graph.tags()) <= set(TAGS)
+
+    odd = new_connection_graph(1)
+    odd.add(Conn(["K1"], "M-1", [(0.0, 0.0)], "forward", 0.9))
+    assert odd.targets(["K1"]) == ["M-1"] and odd.sources("M-1") == [["K1"]]
+    print("✅ Adjacency lookups match scans")
+
+
+def test_edge_list_and_snapped_edges():
+    """Serializable edges; dedup=False keeps repeated snapped edges"""
+    print("\n=== Testing edge list ===")
+    graph = new_connection_graph(2)
+    assert graph.add(Conn("M-1", None, [(0.0, 0.0), (5.0, 5.0)], "undirected", 0.5))
+    assert not graph.add(Conn("M-1", None, [(0.0, 0.0), (5.0, 5.0)], "undirected", 0.5))
+    assert graph.add(Conn("M-1", None, [(0.0, 0.0), (5.0, 5.0)], "undirected", 0.5), dedup=False)
+    edges = graph.edge_list()
+    assert edges == [{"from": "M-1", "to": "N/A", "direction": "undirected", "confidence": 0.5}] * 2
+    json.dumps(edges)
+    assert graph.stats() == {"page": 2, "edges": 2, "tags": 1, "rejected": 1}
+    print("✅ Edge list serializable")
+
+
+def create_pdf(pages: int) -> bytes:
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=842, height=595)
+        page.draw_rect(fitz.Rect(40, 40, 200, 120), color=(0, 0, 0))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_pipeline_connections_per_page():
+    """Page 2 does not inherit page 1's connections"""
+    print("\n=== Testing per-page connections in the pipeline ===")
+
+    class _Resp:
+        def __init__(self, content):
+            msg = type("Msg", (), {"content": content})()
+            self.choices = [type("Choice", (), {"message": msg})()]
+
+    async def fake_llm_call(image_b64, prompt, prefer_model=None, mime="image/png", image_tokens=0):
+        if not prompt.startswith("ELECTRICAL SCHEMATIC TILE"):
+            return "fake-model", _Resp("[]")
+        # Mesmo equipamento M-1 nas duas páginas; só a página 1 liga CB-1 -> M-1
+        first = state["page"] == 1
+        content = {"equipments": [{"type": "MOTOR", "tag": "M-1", "bbox": {"x": 10, "y": 10, "w": 20, "h": 20}}],
+                   "connections": ([{"from_tag": "CB-1", "to_tag": "M-1", "path": [[0, 0], [15, 15]]}]
+                                   if first else []),
+                   "unresolved_endpoints": []}
+        return "fake-model", _Resp(json.dumps(content))
+
+    state = {"page": 0}  # página em processamento (conta as rasterizações da passada global)
+    original_llm, original_match = backend_module.llm_call, backend_module.match_system_fullname
+    original_raster = backend_module.page_raster
+    backend_module.llm_call = fake_llm_call
+    backend_module.match_system_fullname = lambda *a, **k: {"SystemFullName": None, "Confiança": 0}
+
+    def tracking_raster(page, *args, **kwargs):
+        if kwargs.get("colorspace") == "rgb":  # passada global; tiles rasterizam em cinza
+            state["page"] += 1
+        return original_raster(page, *args, **kwargs)
+
+    backend_module.page_raster = tracking_raster
+    try:
+        doc = open_pdf_with_fallback(create_pdf(2), "electrical.pdf")
+        pages = asyncio.run(backend_module.run_electrical_pipeline(doc, dpi_global=72, dpi_tiles=72, tile_px=2048,
+                                                                   overlap=0.0, skip_blank=False))
+        doc.close()
+    finally:
+        backend_module.llm_call, backend_module.match_system_fullname = original_llm, original_match
+        backend_module.page_raster = original_raster
+
+    assert len(pages) == 2
+    assert pages[0]["connections"] == [{"from": "CB-1", "to": "M-1", "direction": "undirected", "confidence": 0.0}]
+    assert pages[1]["connections"] == []
+    assert pages[0]["resultado"][0]["from"] == "CB-1"
+    assert pages[1]["resultado"][0]["from"] == "N/A", "Page 2 must not see page 1's connections"
+    assert "merge_conns" in pages[1]["stage_timings_ms"]
+    print("✅ Connections stay on their page")
+
+
+if __name__ == "__main__":
+    try:
+        test_incremental_insert_matches_merge()
+        test_adjacency_matches_scan()
+        test_edge_list_and_snapped_edges()
+        test_pipeline_connections_per_page()
+        print("\n✅ ALL CONNECTION GRAPH TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
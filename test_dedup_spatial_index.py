@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Test the spatial index behind dedup_items.
+
+Validates that:
+1. UniformGrid radius queries match a brute-force scan (any radius vs cell size)
+2. Non-finite coordinates and radii never match
+3. dedup_items keeps exactly the same items as the previous quadratic
+   implementation (keep-first, same tag / untagged rules, electrical mode,
+   dynamic tolerance, pages, N/A and NaN positions)
+4. Deduplication scales: 20k items finish well under the quadratic time
+"""
+import sys
+import os
+import math
+import time
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from spatial_index import UniformGrid
+from backend import dedup_items, calculate_dynamic_tolerance
+
+
+def reference_dedup(items, tol_mm=10.0, use_dynamic_tolerance=True):
+    """Implementação quadrática anterior (itens já normalizados)"""
+    final, seen_tags = [], {}
+    for it in items:
+        tag = it.get("tag", "").strip().upper()
+        pos = (it["x_mm"], it["y_mm"])
+        page = it["pagina"]
+        tol = calculate_dynamic_tolerance(it, tol_mm) if use_dynamic_tolerance else tol_mm
+        duplicate = False
+        if tag and tag != "N/A":
+            positions = seen_tags.setdefault((tag, page), [])
+            duplicate = any(math.hypot(pos[0] - p[0], pos[1] - p[1]) <= tol for p in positions)
+            if not duplicate:
+                positions.append(pos)
+        else:
+            duplicate = any(e["pagina"] == page and
+                            math.hypot(pos[0] - e["x_mm"], pos[1] - e["y_mm"]) <= tol for e in final)
+        if not duplicate:
+            final.append(it)
+    return final
+
+
+def random_items(n, seed, extent=300.0):
+    rng = random.Random(seed)
+    tags = ["P-101", "P-102", "TK-201", "PT-301", "FV-401", "N/A", "", "CB-101", "M-201"]
+    descs = ["Bomba centrífuga", "Tanque de armazenamento", "Transmissor de pressão",
+             "Válvula de controle", "Motor", "Disjuntor"]
+    items = []
+    for i in range(n):
+        x, y = rng.uniform(0, extent), rng.uniform(0, extent)
+        if rng.random() < 0.2:  # coordenadas arredondadas (elétrico) geram posições idênticas
+            x, y = round(x / 4) * 4, round(y / 4) * 4
+        if rng.random() < 0.02:
+            x = float("nan")
+        items.append({"id": i, "tag": rng.choice(tags), "descricao": rng.choice(descs),
+                      "x_mm": x, "y_mm": y, "pagina": rng.choice([1, 1, 2])})
+    return items
+
+
+def test_grid_matches_brute_force():
+    """Radius queries return exactly the points a full scan finds"""
+    print("\n=== Testing UniformGrid vs brute force ===")
+    rng = random.Random(3)
+    points = [(rng.uniform(-50, 50), rng.uniform(-50, 50)) for _ in range(500)]
+    for cell in (0.5, 7.0, 200.0):
+        grid = UniformGrid(cell)
+        for i, (x, y) in enumerate(points):
+            grid.insert(x, y, i)
+        assert len(grid) == len(points)
+        for _ in range(50):
+            qx, qy, r = rng.uniform(-60, 60), rng.uniform(-60, 60), rng.choice([0.0, 1.0, 9.0, 40.0, math.inf])
+            expected = {i for i, (x, y) in enumerate(points) if math.hypot(qx - x, qy - y) <= r}
+            assert {v for _, v in grid.within(qx, qy, r)} == expected
+    print("✅ Grid queries match brute force")
+
+
+def test_non_finite_never_match():
+    """NaN/inf points are not stored; NaN query or radius returns nothing"""
+    print("\n=== Testing non-finite coordinates ===")
+    grid = UniformGrid(10.0)
+    assert not grid.insert(float("nan"), 0.0, "a")
+    assert not grid.insert(math.inf, 0.0, "b")
+    assert grid.insert(0.0, 0.0, "c")
+    assert list(grid.within(float("nan"), 0.0, 5.0)) == []
+    assert list(grid.within(0.0, 0.0, float("nan"))) == []
+    assert [v for _, v in grid.within(0.0, 0.0, 0.0)] == ["c"]
+    try:
+        UniformGrid(0.0)
+        raise AssertionError("cell_size 0 deve falhar")
+    except ValueError:
+        pass
+    print("✅ Non-finite values handled")
+
+
+def test_dedup_matches_reference():
+    """Same kept items (and order) as the quadratic implementation"""
+    print("\n=== Testing dedup_items vs previous implementation ===")
+    for seed in range(8):
+        for dynamic in (True, False):
+            for electrical in (False, True):
+                items = random_items(600, seed)
+                kept = dedup_items(items, page_num=1, tol_mm=10.0, use_dynamic_tolerance=dynamic,
+                                   log_metadata=True, is_electrical=electrical)
+                expected = reference_dedup(items, tol_mm=10.0, use_dynamic_tolerance=dynamic)
+                assert [it["id"] for it in kept] == [it["id"] for it in expected], \
+                    f"Divergência (seed={seed}, dynamic={dynamic}, electrical={electrical})"
+                assert all("_dedup_tolerance" in it for it in kept)
+    print("✅ Kept items identical to the previous implementation")
+
+
+def test_keep_first_and_tags():
+    """First occurrence wins; different tags never collide; untagged collides with anything"""
+    print("\n=== Testing keep-first semantics ===")
+    items = [
+        {"tag": "P-101", "descricao": "Bomba", "x_mm": 100.0, "y_mm": 100.0, "pagina": 1, "id": "a"},
+        {"tag": "p-101 ", "descricao": "Bomba", "x_mm": 103.0, "y_mm": 100.0, "pagina": 1, "id": "b"},
+        {"tag": "P-102", "descricao": "Bomba", "x_mm": 101.0, "y_mm": 100.0, "pagina": 1, "id": "c"},
+        {"tag": "N/A", "descricao": "Bomba", "x_mm": 100.5, "y_mm": 100.0, "pagina": 1, "id": "d"},
+        {"tag": "P-101", "descricao": "Bomba", "x_mm": 100.0, "y_mm": 100.0, "pagina": 2, "id": "e"},
+        {"tag": "P-101", "descricao": "Bomba", "x_mm": 400.0, "y_mm": 100.0, "pagina": 1, "id": "f"},
+    ]
+    kept = dedup_items(items, page_num=1, tol_mm=10.0)
+    assert [it["id"] for it in kept] == ["a", "c", "e", "f"]
+    print("✅ Keep-first semantics preserved")
+
+
+def test_dedup_scales():
+    """20k items on one page deduplicate in well under the quadratic time"""
+    print("\n=== Testing dedup scaling ===")
+    items = random_items(20000, seed=42, extent=20000.0)
+    started = time.perf_counter()
+    kept = dedup_items(items, page_num=1, tol_mm=10.0)
+    elapsed = time.perf_counter() - started
+    print(f"   20000 itens -> {len(kept)} mantidos em {elapsed:.2f}s")
+    assert elapsed < 10.0
+    print("✅ Deduplication scales")
+
+
+if __name__ == "__main__":
+    try:
+        test_grid_matches_brute_force()
+        test_non_finite_never_match()
+        test_dedup_matches_reference()
+        test_keep_first_and_tags()
+        test_dedup_scales()
+        print("\n✅ ALL SPATIAL INDEX TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
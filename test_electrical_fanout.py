@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Test the producer/consumer tile fan-out of the electrical pipeline.
+
+Validates that:
+1. Tile requests run concurrently, never above the configured limit
+2. Results are merged in tile order even when calls finish out of order
+3. Prepared payloads waiting in memory stay bounded by the queue size
+4. The event loop keeps serving other tasks while tiles are processed
+5. Tiles whose LLM call failed are reported separately from processed tiles
+"""
+import sys
+import os
+import asyncio
+import random
+import json
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import fitz
+
+import backend as backend_module
+from backend import pipelined_map, open_pdf_with_fallback, plan_tiles
+
+
+def test_bounded_concurrency_and_order():
+    """Calls overlap up to the limit and results come back in source order"""
+    print("\n=== Testing pipelined_map ===")
+    state = {"in_flight": 0, "peak": 0, "pending": 0, "max_pending": 0}
+    rng = random.Random(0)
+
+    def prepare(idx, item):
+        if item % 5 == 0:
+            return None  # descartado (ex.: tile vazio)
+        state["pending"] += 1
+        state["max_pending"] = max(state["max_pending"], state["pending"])
+        return item * 10
+
+    async def call(idx, prepared):
+        state["pending"] -= 1
+        state["in_flight"] += 1
+        state["peak"] = max(state["peak"], state["in_flight"])
+        await asyncio.sleep(rng.uniform(0.001, 0.02))
+        state["in_flight"] -= 1
+        return prepared + 1
+
+    results = asyncio.run(pipelined_map(range(40), prepare, call, concurrency=4, queue_size=3))
+    expected = [None if i % 5 == 0 else i * 10 + 1 for i in range(40)]
+    assert results == expected, "Results must follow tile order"
+    assert 1 < state["peak"] <= 4, f"Peak concurrency {state['peak']}"
+    assert state["max_pending"] <= 3 + 4 + 1, f"Too many payloads in memory: {state['max_pending']}"
+    print(f"✅ Peak {state['peak']} calls, at most {state['max_pending']} payloads pending")
+
+
+def test_errors_cancel_pending_work():
+    """An exception from a consumer cancels the pipeline instead of hanging"""
+    print("\n=== Testing error propagation ===")
+
+    async def call(idx, prepared):
+        if idx == 3:
+            raise RuntimeError("boom")
+        await asyncio.sleep(0.01)
+        return idx
+
+    try:
+        asyncio.run(asyncio.wait_for(pipelined_map(range(20), lambda i, x: x, call, concurrency=2), 5))
+    except RuntimeError as e:
+        assert str(e) == "boom"
+    else:
+        raise AssertionError("Error should propagate")
+    print("✅ Errors propagate")
+
+
+def create_pdf() -> bytes:
+    doc = fitz.open()
+    page = doc.new_page(width=842, height=595)
+    shape = page.new_shape()
+    for x in range(40, 800, 60):
+        for y in range(40, 560, 60):
+            shape.draw_rect(fitz.Rect(x, y, x + 30, y + 20))
+    shape.finish(color=(0, 0, 0), width=1)
+    shape.commit()
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_electrical_pipeline_concurrent_and_ordered():
+    """Tiles of one page overlap in time and equipment keeps tile order"""
+    print("\n=== Testing electrical fan-out ===")
+    state = {"in_flight": 0, "peak": 0, "ticks": 0}
+
+    class _Msg:
+        def __init__(self, content):
+            self.content = content
+
+    class _Choice:
+        def __init__(self, content):
+            self.message = _Msg(content)
+
+    class _Resp:
+        def __init__(self, content):
+            self.choices = [_Choice(content)]
+
+    async def fake_llm_call(image_b64, prompt, prefer_model=None, mime="image/png", image_tokens=0):
+        if not prompt.startswith("ELECTRICAL SCHEMATIC TILE"):
+            return "fake-model", _Resp("[]")
+        state["in_flight"] += 1
+        state["peak"] = max(state["peak"], state["in_flight"])
+        n = len(calls)
+        calls.append(n)
+        # Tiles iniciais terminam por último
+        await asyncio.sleep(0.05 if n < 2 else 0.005)
+        state["in_flight"] -= 1
+        item = {"tag": f"K{n}", "descricao": "Contator", "bbox": {"x": 10, "y": 10, "w": 5, "h": 5}}
+        return "fake-model", _Resp(json.dumps([item]))
+
+    async def ticker(stop):
+        while not stop.is_set():
+            state["ticks"] += 1
+            await asyncio.sleep(0.001)
+
+    async def main():
+        stop = asyncio.Event()
+        tick = asyncio.ensure_future(ticker(stop))
+        pages = await backend_module.run_electrical_pipeline(doc, dpi_global=72, dpi_tiles=150, tile_px=384,
+                                                             overlap=0.2, skip_blank=False)
+        stop.set()
+        await tick
+        return pages
+
+    calls = []
+    original_llm, original_match = backend_module.llm_call, backend_module.match_system_fullname
+    backend_module.llm_call = fake_llm_call
+    backend_module.match_system_fullname = lambda *a, **k: {"SystemFullName": None, "Confiança": 0}
+    try:
+        doc = open_pdf_with_fallback(create_pdf(), "electrical.pdf")
+        plan = plan_tiles(doc[0], tile_px=384, overlap_ratio=0.2, dpi=150)
+        start = time.perf_counter()
+        pages = asyncio.run(main())
+        elapsed = time.perf_counter() - start
+        doc.close()
+    finally:
+        backend_module.llm_call, backend_module.match_system_fullname = original_llm, original_match
+
+    assert plan.count > 2
+    assert state["peak"] > 1, "Tiles should be requested concurrently"
+    assert state["ticks"] > 0, "Event loop must stay responsive"
+    assert len(pages) == 1
+    tags = [item["tag"] for item in pages[0]["resultado"]]
+    assert tags == [f"K{i}" for i in range(len(calls))], f"Tile order lost: {tags}"
+    print(f"✅ {plan.count} tiles, peak {state['peak']} concurrent, {elapsed:.2f}s")
+
+
+def test_failed_tiles_reported():
+    """The page summary counts failed tiles apart from processed ones"""
+    print("\n=== Testing failed tile accounting ===")
+
+    class _Resp:
+        def __init__(self, content):
+            self.choices = [type("Choice", (), {"message": type("Msg", (), {"content": content})()})()]
+
+    async def flaky_llm_call(image_b64, prompt, prefer_model=None, mime="image/png", image_tokens=0):
+        if not prompt.startswith("ELECTRICAL SCHEMATIC TILE"):
+            return "fake-model", _Resp("[]")
+        n = len(calls)
+        calls.append(n)
+        if n % 2:
+            raise RuntimeError("tile falhou")
+        return "fake-model", _Resp("[]")
+
+    calls, logs = [], []
+    saved = (backend_module.llm_call, backend_module.match_system_fullname, backend_module.log_to_front)
+    backend_module.llm_call = flaky_llm_call
+    backend_module.match_system_fullname = lambda *a, **k: {"SystemFullName": None, "Confiança": 0}
+    backend_module.log_to_front = logs.append
+    try:
+        doc = open_pdf_with_fallback(create_pdf(), "electrical.pdf")
+        asyncio.run(backend_module.run_electrical_pipeline(doc, dpi_global=72, dpi_tiles=150, tile_px=384,
+                                                           overlap=0.2, skip_blank=False))
+        doc.close()
+    finally:
+        backend_module.llm_call, backend_module.match_system_fullname, backend_module.log_to_front = saved
+
+    failed = len(calls) // 2
+    summary = next(line for line in logs if "Processados" in line)
+    assert f"Processados {len(calls) - failed} tiles, {failed} com erro, 0 vazios" in summary, summary
+    print(f"✅ {summary}")
+
+
+if __name__ == "__main__":
+    try:
+        test_bounded_concurrency_and_order()
+        test_errors_cancel_pending_work()
+        test_electrical_pipeline_concurrent_and_ordered()
+        test_failed_tiles_reported()
+        print("\n✅ ALL ELECTRICAL FAN-OUT TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Test the numpy merge engine behind merge_electrical_equips.
+
+Validates that:
+1. iou_matrix reproduces BBox.iou bit-for-bit (overlaps, touching, degenerate, NaN)
+2. _nms and _cluster_centroid return the same items in the same order as the
+   previous pure-Python loops
+3. merge_electrical_equips output is identical on random fixture sets
+   (duplicated tile detections, partials, confidence ties, same-tag repeats)
+4. Merging thousands of detections is fast
+5. merge_electrical_conns, dedup_endpoints and snap_endpoints_to_tags match
+   the previous scans; assemble_electrical_page reports per-stage timings
+"""
+import sys
+import os
+import math
+import time
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import numpy as np
+
+from backend import (BBox, Equip, Conn, Endpoint, _nms, _cluster_centroid, _path_sim, _pt_dist,
+                     merge_electrical_equips, merge_electrical_conns, dedup_endpoints,
+                     snap_endpoints_to_tags, assemble_electrical_page)
+from electrical_merge import iou_matrix, box_array
+
+
+# Implementação anterior (referência)
+def reference_nms(eqs, iou_thr=0.55):
+    eqs = sorted(eqs, key=lambda e: e.confidence, reverse=True)
+    kept = []
+    for e in eqs:
+        if all(e.bbox.iou(k.bbox) <= iou_thr for k in kept):
+            kept.append(e)
+    return kept
+
+
+def reference_cluster(eqs, eps=10.0):
+    groups = []
+    for e in eqs:
+        cx = e.bbox.x + e.bbox.w / 2; cy = e.bbox.y + e.bbox.h / 2
+        placed = False
+        for g in groups:
+            gx = sum(x.bbox.x + x.bbox.w / 2 for x in g) / len(g)
+            gy = sum(x.bbox.y + x.bbox.h / 2 for x in g) / len(g)
+            if (cx - gx) ** 2 + (cy - gy) ** 2 <= eps ** 2:
+                g.append(e); placed = True; break
+        if not placed:
+            groups.append([e])
+    return groups
+
+
+def reference_merge(dets):
+    by_type = {}
+    for d in dets:
+        by_type.setdefault(d.type, []).append(d)
+    merged = []
+    for t, group in by_type.items():
+        group = sorted(group, key=lambda x: (x.partial, -x.confidence))
+        group = reference_nms(group, iou_thr=0.55)
+        for cl in reference_cluster(group, eps=10.0):
+            merged.append(max(cl, key=lambda x: (1 if x.tag else 0, x.confidence)))
+    tagged = [m for m in merged if m.tag]; untag = [m for m in merged if not m.tag]
+    final = []; used = set()
+    for i, a in enumerate(tagged):
+        if i in used:
+            continue
+        cand = [a]
+        for j, b in enumerate(tagged):
+            if j <= i or j in used:
+                continue
+            if a.tag == b.tag and a.bbox.iou(b.bbox) > 0.3:
+                cand.append(b); used.add(j)
+        final.append(max(cand, key=lambda x: x.confidence))
+    final.extend(untag)
+    return final
+
+
+def reference_conns(cons):
+    out = []
+    for c in cons:
+        if not any((c.from_tag == d.from_tag and c.to_tag == d.to_tag and _path_sim(c.path, d.path) > 0.8) for d in out):
+            out.append(c)
+    return out
+
+
+def reference_endpoints(eps):
+    out = []
+    for e in eps:
+        if not any(abs(e.point[0] - d.point[0]) < 5 and abs(e.point[1] - d.point[1]) < 5 and e.page == d.page for d in out):
+            out.append(e)
+    return out
+
+
+def reference_snap(cons, eps, eqs, radius=25.0):
+    tags = [(e.tag, e) for e in eqs if e.tag]
+    added = []; leftovers = []
+    for e in eps:
+        best = None; bestd = 1e9
+        for tag, eq in tags:
+            d = _pt_dist(e.point, (eq.bbox.x + eq.bbox.w / 2, eq.bbox.y + eq.bbox.h / 2))
+            if d < bestd: bestd = d; best = eq
+        if best and bestd <= radius:
+            added.append(Conn(best.tag, None, [e.point, (best.bbox.x, best.bbox.y)], "undirected", 0.5))
+        else:
+            leftovers.append(e)
+    return cons + added, leftovers
+
+
+def random_wiring(n, seed, extent=400.0):
+    """Conexões repetidas por tiles (caminhos com jitter e comprimentos variados) e endpoints"""
+    rng = random.Random(seed)
+    tags = [None, "M-1", "M-2", "CB-1", "CB-2", "TB-1"]
+    cons, eps = [], []
+    while len(cons) < n:
+        pts = [(rng.uniform(0, extent), rng.uniform(0, extent)) for _ in range(rng.randint(0, 8))]
+        key = (rng.choice(tags), rng.choice(tags))
+        for _ in range(rng.randint(1, 3)):
+            jit = rng.choice([0.0, 3.0, 15.0, 40.0])
+            path = [(x + rng.uniform(-jit, jit), y + rng.uniform(-jit, jit)) for x, y in pts]
+            if path and rng.random() < 0.3:
+                path[0] = (path[0][0] + 100.0, path[0][1])  # primeiro ponto fora, resto igual
+            if rng.random() < 0.3:
+                path = path[:-1]
+            cons.append(Conn(*key, path, "undirected", 0.5))
+    for _ in range(n):
+        x, y = rng.uniform(0, extent), rng.uniform(0, extent)
+        for _ in range(rng.randint(1, 2)):
+            eps.append(Endpoint(None, (x + rng.choice([0.0, 2.0, 4.9, 6.0]), y + rng.choice([0.0, 4.99, 5.0])),
+                                rng.choice([1, 2])))
+    eps.append(Endpoint(None, (float("nan"), 1.0), 1))
+    cons.append(Conn(["X"], "M-1", [(1.0, 1.0)], "undirected", 0.5))
+    cons.append(Conn(["X"], "M-1", [(1.0, 1.0)], "undirected", 0.5))
+    return cons[:n] + cons[-2:], eps
+
+
+def random_detections(n, seed, extent=400.0):
+    """Detecções de várias tiles: cada símbolo aparece 1-4 vezes com jitter"""
+    rng = random.Random(seed)
+    types = ["MOTOR", "BREAKER", "TRANSFORMER", "RELAY"]
+    dets = []
+    while len(dets) < n:
+        x, y = rng.uniform(0, extent), rng.uniform(0, extent)
+        w, h = rng.choice([8, 12, 20, 30]), rng.choice([8, 12, 20])
+        t = rng.choice(types)
+        tag = rng.choice([None, "", f"{t[0]}-{rng.randint(1, 30)}"])
+        for _ in range(rng.randint(1, 4)):
+            jx, jy = rng.choice([0.0, rng.uniform(-6, 6)]), rng.choice([0.0, rng.uniform(-6, 6)])
+            conf = rng.choice([0.5, 0.7, 0.9, round(rng.random(), 2)])
+            dets.append(Equip(t, rng.choice([tag, tag, None]), BBox(x + jx, y + jy, w, h), 1, conf,
+                              rng.random() < 0.2))
+    if n > 10:
+        dets[3] = Equip("MOTOR", "M-1", BBox(float("nan"), 5.0, 10.0, 10.0), 1, 0.9)
+        dets[7] = Equip("MOTOR", "M-1", BBox(5.0, 5.0, -4.0, 10.0), 1, 0.8)
+    return dets[:n]
+
+
+def test_iou_matches_bbox():
+    """Batched IoU equals BBox.iou exactly"""
+    print("\n=== Testing iou_matrix ===")
+    rng = random.Random(1)
+    boxes = [BBox(rng.choice([0, 5, 10.5]), rng.choice([0, 3, 7.25]), rng.choice([0, 5, 10, -2]),
+                  rng.choice([0, 5, 10])) for _ in range(60)]
+    boxes += [BBox(0, 0, 10, 10), BBox(10, 0, 10, 10), BBox(float("nan"), 0, 10, 10), BBox(0, 0, math.inf, 10)]
+    arr = box_array([(b.x, b.y, b.w, b.h) for b in boxes])
+    m = iou_matrix(arr, arr)
+    for i, a in enumerate(boxes):
+        for j, b in enumerate(boxes):
+            expected = a.iou(b)
+            got = m[i, j]
+            assert (math.isnan(expected) and np.isnan(got)) or got == expected, (i, j, got, expected)
+    print("✅ IoU identical to BBox.iou")
+
+
+def test_nms_and_clusters_match_reference():
+    """Same kept items and groups, same order"""
+    print("\n=== Testing NMS and clustering ===")
+    for seed in range(10):
+        dets = random_detections(300, seed)
+        for thr in (0.0, 0.3, 0.55, 1.0):
+            assert [id(e) for e in _nms(dets, thr)] == [id(e) for e in reference_nms(dets, thr)], (seed, thr)
+        for eps in (0.0, 4.0, 10.0, 50.0):
+            got = [[id(e) for e in g] for g in _cluster_centroid(dets, eps)]
+            exp = [[id(e) for e in g] for g in reference_cluster(dets, eps)]
+            assert got == exp, (seed, eps)
+    print("✅ NMS and clustering identical to the previous loops")
+
+
+def test_merge_matches_reference():
+    """merge_electrical_equips output identical on fixture sets"""
+    print("\n=== Testing merge_electrical_equips ===")
+    for seed in range(20):
+        dets = random_detections(random.Random(seed).randint(5, 400), seed)
+        assert [id(e) for e in merge_electrical_equips(dets)] == [id(e) for e in reference_merge(dets)], seed
+    assert merge_electrical_equips([]) == []
+    print("✅ Merge output identical to the previous implementation")
+
+
+def test_merge_scales():
+    """5k detections merge quickly"""
+    print("\n=== Testing merge scaling ===")
+    dets = random_detections(5000, seed=99, extent=6000.0)
+    started = time.perf_counter()
+    result = merge_electrical_equips(dets)
+    elapsed = time.perf_counter() - started
+    print(f"   5000 detecções -> {len(result)} em {elapsed:.2f}s")
+    assert elapsed < 10.0
+    print("✅ Merge scales")
+
+
+def test_wiring_matches_reference():
+    """Connection merge, endpoint dedup and snapping identical to the previous scans"""
+    print("\n=== Testing connection merge and endpoint snapping ===")
+    for seed in range(15):
+        cons, eps = random_wiring(300, seed)
+        assert [id(c) for c in merge_electrical_conns(cons)] == [id(c) for c in reference_conns(cons)], seed
+        assert [id(e) for e in dedup_endpoints(eps)] == [id(e) for e in reference_endpoints(eps)], seed
+        eqs = random_detections(200, seed)
+        eqs.append(Equip("MOTOR", "M-9", BBox(*eqs[0].bbox.__dict__.values()), 1, 0.1))  # empate de distância
+        for radius in (0.0, 10.0, 25.0, 1e10):
+            got_cons, got_left = snap_endpoints_to_tags([], eps, eqs, radius=radius)
+            exp_cons, exp_left = reference_snap([], eps, eqs, radius=radius)
+            assert [(c.from_tag, c.path) for c in got_cons] == [(c.from_tag, c.path) for c in exp_cons], (seed, radius)
+            assert [id(e) for e in got_left] == [id(e) for e in exp_left], (seed, radius)
+    print("✅ Wiring merge and snapping identical to the previous scans")
+
+
+def test_stage_timings():
+    """assemble_electrical_page fills the per-stage timings"""
+    print("\n=== Testing stage timings ===")
+    cons, eps = random_wiring(50, 1)
+    timings = {}
+    assemble_electrical_page([], cons, eps, 420.0, 297.0, 4000, 3000, 300, "gpt-5", timings)
+    assert list(timings) == ["merge_equips", "merge_conns", "dedup_endpoints", "snap_endpoints", "export_and_match"]
+    assert all(v >= 0 for v in timings.values())
+    print(f"✅ Stage timings: {timings}")
+
+
+if __name__ == "__main__":
+    try:
+        test_iou_matches_bbox()
+        test_nms_and_clusters_match_reference()
+        test_merge_matches_reference()
+        test_merge_scales()
+        test_wiring_matches_reference()
+        test_stage_timings()
+        print("\n✅ ALL MERGE ENGINE TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
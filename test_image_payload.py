@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Test the vision payload optimizer (format, bit depth and size under a budget).
+
+Validates that:
+1. Image-token estimates follow the detail=high tiling rule
+2. Binarized quadrants are sent as 1-bit PNG at the size the model actually sees
+3. Continuous-tone images fall back to WebP/JPEG to fit the byte budget
+4. Prompts that quote pixel sizes keep their dimensions (allow_resize=False)
+5. A token budget shrinks the image
+"""
+import sys
+import os
+import io
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import numpy as np
+from PIL import Image
+
+from backend import (
+    encode_image_payload, estimate_image_tokens, vision_effective_size,
+    preprocess_array, array_to_png
+)
+
+
+def drawing(h: int = 1500, w: int = 2000) -> np.ndarray:
+    arr = np.full((h, w), 255, dtype=np.uint8)
+    for i in range(0, w - 60, 120):
+        arr[200:260, i:i + 60] = 0
+        arr[700, i:i + 100] = 0
+    arr[:, 1000:1002] = 0
+    return arr
+
+
+def test_token_estimate():
+    """85 + 170 per 512 px tile after the provider resize"""
+    print("\n=== Testing token estimate ===")
+    assert vision_effective_size(1024, 1024) == (768, 768)
+    assert estimate_image_tokens(1024, 1024) == 85 + 170 * 4
+    assert vision_effective_size(2048, 4096) == (768, 1536)
+    assert estimate_image_tokens(2048, 4096) == 85 + 170 * 6
+    assert estimate_image_tokens(400, 300) == 85 + 170
+    print("✅ Token estimates follow the tiling rule")
+
+
+def test_bilevel_quadrant_is_1bit_png():
+    """Hybrid-binarized quadrants are sent as 1-bit PNG, far smaller than the old 2x gray PNG"""
+    print("\n=== Testing 1-bit PNG ===")
+    gray = drawing()
+    binarized = preprocess_array(gray, upscale=False)
+    payload = encode_image_payload(binarized, label="test")
+
+    assert payload.fmt == "png1" and payload.mime == "image/png"
+    assert (payload.width, payload.height) == vision_effective_size(*binarized.shape[::-1])
+    img = Image.open(io.BytesIO(payload.data))
+    assert img.mode == "1" and img.size == (payload.width, payload.height)
+
+    legacy = array_to_png(preprocess_array(gray))
+    assert len(payload.data) * 5 < len(legacy), f"{len(payload.data)} vs legacy {len(legacy)}"
+    print(f"✅ {len(legacy)//1024} KB → {len(payload.data)//1024} KB")
+
+
+def test_lossy_fallback_fits_budget():
+    """Noisy continuous-tone images switch to a lossy format to fit the byte budget"""
+    print("\n=== Testing byte budget ===")
+    rng = np.random.default_rng(0)
+    noisy = rng.integers(0, 256, size=(700, 700, 3), dtype=np.uint8)
+    payload = encode_image_payload(noisy, max_bytes=200 * 1024, label="noise")
+    assert len(payload.data) <= 200 * 1024
+    assert payload.fmt in ("webp", "jpeg"), payload.fmt
+    print(f"✅ {payload.fmt} {len(payload.data)//1024} KB within budget")
+
+
+def test_fixed_dimensions_and_token_budget():
+    """allow_resize=False keeps pixel dimensions; max_tokens shrinks the image"""
+    print("\n=== Testing dimension controls ===")
+    gray = drawing()
+    fixed = encode_image_payload(gray, allow_resize=False, label="tile")
+    assert (fixed.width, fixed.height) == (2000, 1500)
+    img = Image.open(io.BytesIO(fixed.data))
+    assert img.size == (2000, 1500)
+
+    small = encode_image_payload(gray, max_tokens=85 + 170 * 2, label="budget")
+    assert small.tokens <= 85 + 170 * 2, small.tokens
+    print("✅ Fixed-size and token-budget modes work")
+
+
+if __name__ == "__main__":
+    try:
+        test_token_estimate()
+        test_bilevel_quadrant_is_1bit_png()
+        test_lossy_fallback_fits_budget()
+        test_fixed_dimensions_and_token_budget()
+        print("\n✅ ALL IMAGE PAYLOAD TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Test the PNG-free quadrant image pipeline.
+
+Validates that:
+1. Preprocessing works on numpy arrays and never touches the (read-only) raster view
+2. A quadrant is encoded exactly once and never decoded on the way to the payload
+3. Preprocessing is skipped entirely when disabled
+4. The legacy bytes-based preprocess_image_adaptive still works
+"""
+import sys
+import os
+import io
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import fitz
+import numpy as np
+from PIL import Image
+
+import backend as backend_module
+from backend import (
+    open_pdf_with_fallback, preprocess_array, preprocess_image_adaptive,
+    render_quadrant_from_page, array_to_png
+)
+
+
+def create_pdf() -> bytes:
+    doc = fitz.open()
+    page = doc.new_page(width=1190, height=842)
+    page.insert_text((100, 100), "P-101 Bomba", fontsize=14)
+    page.draw_rect(fitz.Rect(150, 150, 400, 300), width=2)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_preprocess_array_methods():
+    """All methods return new arrays at the normalized scale"""
+    print("\n=== Testing array preprocessing ===")
+    gray = np.full((300, 500), 255, dtype=np.uint8)
+    gray[100:120, 50:450] = 0
+    gray.flags.writeable = False
+
+    for method in ("hybrid", "binary", "grayscale"):
+        out = preprocess_array(gray, method)
+        assert out.dtype == np.uint8 and out.ndim == 2
+        assert out.shape == (2 * 1200, 2 * 2000), f"{method}: {out.shape}"
+        assert not np.shares_memory(out, gray)
+    assert gray[0, 0] == 255 and gray[110, 100] == 0, "Input must not be modified"
+
+    binary = preprocess_array(gray, "binary")
+    assert binary[0, 0] > 128, "Background should stay white"
+    print("✅ hybrid / binary / grayscale run on numpy arrays")
+
+
+def test_single_encode_no_decode():
+    """Render → preprocess → one PNG encode, with no PNG decode in between"""
+    print("\n=== Testing single encode ===")
+    doc = open_pdf_with_fallback(create_pdf(), "pipeline.pdf")
+    page = doc[0]
+    rect = fitz.Rect(0, 0, 595, 421)
+
+    encodes = []
+    original_encode = backend_module.array_to_png
+    original_open = Image.open
+
+    def counting_encode(arr):
+        encodes.append(arr.shape)
+        return original_encode(arr)
+
+    def forbidden_open(*args, **kwargs):
+        raise AssertionError("PNG should not be decoded inside the pipeline")
+
+    backend_module.array_to_png = counting_encode
+    Image.open = forbidden_open
+    try:
+        png = render_quadrant_from_page(page, rect, dpi=150, preprocess=True)
+        raw = render_quadrant_from_page(page, rect, dpi=150, preprocess=False)
+    finally:
+        backend_module.array_to_png = original_encode
+        Image.open = original_open
+
+    assert len(encodes) == 2, f"Expected one encode per quadrant, got {encodes}"
+
+    img = Image.open(io.BytesIO(raw))
+    crop = page.get_raster(150, clip=rect)
+    assert img.mode == "L" and img.size == (crop.shape[1], crop.shape[0]), "Disabled preprocessing returns the raw crop"
+    assert np.array_equal(np.asarray(img), crop)
+
+    img = Image.open(io.BytesIO(png))
+    assert img.width == 2 * max(crop.shape[1], 2000)
+    doc.close()
+    print("✅ One encode per quadrant, no intermediate decode")
+
+
+def test_legacy_bytes_interface():
+    """preprocess_image_adaptive still accepts and returns PNG bytes"""
+    print("\n=== Testing legacy interface ===")
+    src = np.full((100, 200), 255, dtype=np.uint8)
+    src[40:60, 20:180] = 0
+    out = preprocess_image_adaptive(array_to_png(src), method="hybrid")
+    img = Image.open(io.BytesIO(out))
+    assert img.size == (4000, 2000)
+    print("✅ Legacy bytes interface preserved")
+
+
+if __name__ == "__main__":
+    try:
+        test_preprocess_array_methods()
+        test_single_encode_no_decode()
+        test_legacy_bytes_interface()
+        print("\n✅ ALL IMAGE PIPELINE TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Test the ink-density / connected-component pre-screen.
+
+Validates that:
+1. Blank, low-ink and frame-only rasters are skipped with the right reason
+2. Rasters with symbols and text are kept
+3. Whole empty pages are detected at low resolution
+4. The electrical pipeline skips empty tiles before calling the LLM and reports the decisions
+"""
+import sys
+import os
+import asyncio
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import fitz
+import numpy as np
+
+import backend as backend_module
+from backend import (
+    open_pdf_with_fallback, screen_ink, screen_page_ink, plan_tiles, InkScreenMetrics
+)
+
+
+def create_pdf(draw_content: bool = True, draw_frame: bool = True) -> bytes:
+    doc = fitz.open()
+    page = doc.new_page(width=1190, height=842)
+    if draw_frame:
+        page.draw_rect(fitz.Rect(10, 10, 1180, 832), width=2)
+    if draw_content:
+        # Conteúdo apenas no canto superior esquerdo
+        page.insert_text((60, 80), "CB-101 Disjuntor", fontsize=12)
+        page.insert_text((60, 110), "K1 Contator", fontsize=12)
+        page.draw_rect(fitz.Rect(60, 130, 160, 200))
+        page.draw_circle(fitz.Point(220, 160), 25)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_screen_reasons():
+    """Each skip decision carries its reason"""
+    print("\n=== Testing screen reasons ===")
+    blank = np.full((512, 512), 255, dtype=np.uint8)
+    assert screen_ink(blank).reason == "blank"
+
+    speck = blank.copy()
+    speck[10, 10] = 0
+    result = screen_ink(speck)
+    assert result.skip and result.reason == "low_ink"
+
+    frame = blank.copy()
+    frame[:, 250:254] = 0  # um único traço longo (moldura)
+    result = screen_ink(frame)
+    if backend_module.CV2_AVAILABLE:
+        assert result.skip and result.reason == "few_components" and result.components == 1, result
+
+    symbols = blank.copy()
+    for i in range(5):
+        symbols[50 + i*80:90 + i*80, 100:140] = 0
+    result = screen_ink(symbols)
+    assert not result.skip and result.reason == "ink", result
+
+    assert screen_ink(symbols, min_ratio=0.5).reason == "low_ink", "Threshold must be configurable"
+    print("✅ blank / low_ink / few_components / ink classified correctly")
+
+
+def test_empty_page_detection():
+    """An empty page (frame only or nothing) is skipped; a drawing is kept"""
+    print("\n=== Testing page screen ===")
+    for content, frame, expect_skip in ((False, False, True), (False, True, True), (True, True, False)):
+        doc = open_pdf_with_fallback(create_pdf(content, frame), "page.pdf")
+        result = screen_page_ink(doc[0])
+        assert result.skip == expect_skip, f"content={content} frame={frame}: {result}"
+        doc.close()
+    print("✅ Empty pages detected at low resolution")
+
+
+def test_electrical_pipeline_skips_empty_tiles():
+    """Empty tiles never reach llm_call and every decision is reported"""
+    print("\n=== Testing electrical tile skipping ===")
+    calls = []
+
+    class _Msg:
+        content = "[]"
+
+    class _Choice:
+        message = _Msg()
+
+    class _Resp:
+        choices = [_Choice()]
+
+    async def fake_llm_call(image_b64, prompt, prefer_model=None, mime="image/png", image_tokens=0):
+        calls.append(prompt)
+        return "fake-model", _Resp()
+
+    original = backend_module.llm_call
+    backend_module.llm_call = fake_llm_call
+    try:
+        doc = open_pdf_with_fallback(create_pdf(), "electrical.pdf")
+        plan = plan_tiles(doc[0], tile_px=512, overlap_ratio=0.2, dpi=150)
+        metrics = InkScreenMetrics()
+        pages = asyncio.run(backend_module.run_electrical_pipeline(
+            doc, dpi_global=72, dpi_tiles=150, tile_px=512, overlap=0.2, ink_metrics=metrics
+        ))
+        doc.close()
+    finally:
+        backend_module.llm_call = original
+
+    summary = pages[0]["ink_screen"]
+    tile_decisions = [d for d in summary["decisions"] if d["scope"] == "tile"]
+    assert len(tile_decisions) == plan.count
+    assert summary["skipped"] > 0, "Empty tiles should be skipped"
+    assert len(calls) == 1 + plan.count - summary["skipped"], "Skipped tiles must not call the LLM"
+    assert all(d["reason"] for d in summary["decisions"])
+    print(f"✅ {summary['skipped']}/{plan.count} tiles skipped, {len(calls)} LLM calls")
+
+
+if __name__ == "__main__":
+    try:
+        test_screen_reasons()
+        test_empty_page_detection()
+        test_electrical_pipeline_skips_empty_tiles()
+        print("\n✅ ALL INK SCREEN TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
@@ -1,16 +1,19 @@
 #!/usr/bin/env python3
 """
 Test script to verify that ensure_json_list can extract JSON from various formats.
-This validates that the parsing logic will work with LLM responses.
+This validates that the parsing logic will work with LLM responses, including
+dict-wrapped lists, truncated outputs, multiple arrays and large outputs.
 """
 
 import sys
 import os
+import time
 
 # Add backend to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
 
 from backend import ensure_json_list
+from json_extract import has_complete_json
 
 def test_valid_json_array():
     """Test extraction of a valid JSON array"""
@@ -96,6 +99,62 @@ def test_no_json():
     return True
 
 
+def test_dict_wrapped_list():
+    """Test extraction of a list wrapped in an object ({"equipments": [...]})"""
+    test = 'Resultado: {"equipments": [{"tag": "CB-101"}, {"tag": "M-101"}], "connections": []}'
+    result = ensure_json_list(test)
+    assert [it["tag"] for it in result] == ["CB-101", "M-101"], f"Got {result}"
+    print("✓ Test 5 passed: Dict-wrapped list")
+    return True
+
+
+def test_truncated_output():
+    """Test that complete items survive a response cut in the last item"""
+    test = '```json\n[{"tag": "CB-101", "x_mm": 1.5}, {"tag": "M-101", "x_mm": 2.5}, {"tag": "K-1'
+    result = ensure_json_list(test)
+    assert [it["tag"] for it in result] == ["CB-101", "M-101"], f"Got {result}"
+
+    wrapped = '{"equipments": [{"tag": "CB-101"}, {"tag": "M-101"}, {"tag": "K-'
+    result = ensure_json_list(wrapped)
+    assert [it["tag"] for it in result] == ["CB-101", "M-101"], f"Got {result}"
+    assert not has_complete_json(wrapped), "Truncated output must not count as complete JSON"
+    assert has_complete_json(test.replace('{"tag": "K-1', '{"tag": "K-1"}]'))
+    print("✓ Test 6 passed: Truncated output keeps completed items")
+    return True
+
+
+def test_multiple_arrays():
+    """Test that several arrays of objects are concatenated in order"""
+    test = """Parte 1:
+```json
+[{"tag": "P-101"}]
+```
+Coordenadas de exemplo [234.5, 567.8]. Parte 2:
+```json
+[{"tag": "P-102"}, {"tag": "P-103"}]
+```"""
+    result = ensure_json_list(test)
+    assert [it["tag"] for it in result] == ["P-101", "P-102", "P-103"], f"Got {result}"
+    assert ensure_json_list("Veja [nota] e {ref}: [1, 2]") == [1, 2]
+    assert ensure_json_list("[]") == []
+    print("✓ Test 7 passed: Multiple arrays concatenated")
+    return True
+
+
+def test_pathological_output_is_fast():
+    """Test that a 200 KB truncated output is parsed in linear time"""
+    item = '{"tag": "P-101", "descricao": "Bomba Centrífuga", "x_mm": 234.5, "y_mm": 567.8}'
+    n = 200 * 1024 // (len(item) + 2)
+    test = "[" + ",\n".join([item] * n) + ',\n{"tag": "P-9'
+    started = time.perf_counter()
+    result = ensure_json_list(test)
+    elapsed = time.perf_counter() - started
+    assert len(result) == n, f"Expected {n} items, got {len(result)}"
+    assert elapsed < 1.0, f"Extraction took {elapsed:.2f}s"
+    print(f"✓ Test 8 passed: 200 KB truncated output in {elapsed * 1000:.1f} ms")
+    return True
+
+
 if __name__ == "__main__":
     print("Testing JSON extraction logic...")
     print()
@@ -106,6 +165,10 @@ if __name__ == "__main__":
         all_passed = all_passed and test_json_with_markdown()
         all_passed = all_passed and test_json_embedded_in_text()
         all_passed = all_passed and test_no_json()
+        all_passed = all_passed and test_dict_wrapped_list()
+        all_passed = all_passed and test_truncated_output()
+        all_passed = all_passed and test_multiple_arrays()
+        all_passed = all_passed and test_pathological_output_is_fast()
     except Exception as e:
         print(f"✗ Test failed with error: {e}")
         all_passed = False
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Test the compiled keyword classifier shared by the description/tag heuristics.
+
+Validates that:
+1. classify_description finds exactly the keywords `kw in text` finds, with
+   the position of text.find(kw) (overlapping and nested keywords included)
+2. estimate_symbol_size, validate_symbol_type, assign_no_tag_identifiers,
+   detect_electrical_diagram_subtype, detect_pole_count and
+   extract_equipment_type_keywords return the same as the previous linear scans
+3. The instrument tag test of generate_process_description is unchanged
+4. Repeated descriptions are served from the memo
+"""
+import sys
+import os
+import copy
+import random
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import keyword_classifier as kwc
+from keyword_classifier import classify_description, KeywordMatcher
+from backend import (estimate_symbol_size, validate_symbol_type, assign_no_tag_identifiers,
+                     detect_electrical_diagram_subtype)
+from system_matcher import detect_pole_count, extract_equipment_type_keywords
+
+FILLER = ["de", "com", "the", "para", "motor", "a", "l", "tri", "-", "3", " ", "pressão", "válvula", "TAG"]
+
+
+def random_text(rng):
+    """Descrições com palavras-chave de todas as tabelas, fragmentos e maiúsculas"""
+    words = kwc.DESCRIPTION_MATCHER.words
+    parts = []
+    for _ in range(rng.randint(0, 8)):
+        w = rng.choice(words) if rng.random() < 0.6 else rng.choice(FILLER)
+        if rng.random() < 0.2:
+            w = w[:rng.randint(1, max(1, len(w) - 1))]  # palavra truncada
+        parts.append(w.upper() if rng.random() < 0.2 else w)
+    return rng.choice([" ", "", "-"]).join(parts)
+
+
+# Implementação anterior (referência)
+def reference_symbol_size(tag, descricao):
+    tag_upper = tag.upper(); desc_lower = descricao.lower()
+    for keyword in kwc.SYMBOL_SIZE_LARGE:
+        if keyword in desc_lower:
+            return 50.0
+    for prefix in kwc.SMALL_INSTRUMENT_PREFIXES:
+        if tag_upper.startswith(prefix) or prefix.lower() in desc_lower:
+            return 10.0
+    for keyword in kwc.SYMBOL_SIZE_MEDIUM:
+        if keyword in desc_lower:
+            return 25.0
+    return 20.0
+
+
+def reference_validate(tag, description):
+    tag = tag.strip().upper(); desc_lower = description.lower()
+    tag_prefix = ""
+    for prefix in sorted(list(kwc.INSTRUMENT_TYPES) + list(kwc.EQUIPMENT_TYPES), key=len, reverse=True):
+        if tag.startswith(prefix):
+            tag_prefix = prefix
+            break
+    if not tag_prefix:
+        return None, []
+    expected = kwc.INSTRUMENT_TYPES.get(tag_prefix) or kwc.EQUIPMENT_TYPES.get(tag_prefix) or []
+    return tag_prefix, [kw for kw in expected if kw in desc_lower]
+
+
+def reference_no_tag(items):
+    counters = {}
+    for item in items:
+        if item.get("tag") == "N/A":
+            descricao = item.get("descricao", "").lower()
+            prefix = next((p for kw, p in kwc.NO_TAG_INSTRUMENT_PREFIXES.items() if kw in descricao), "NO-TAG")
+            counters.setdefault(prefix, 1)
+            item["tag"] = f"NO-TAG{counters[prefix]}" if prefix == "NO-TAG" else f"{prefix}-notag{counters[prefix]}"
+            counters[prefix] += 1
+    return items
+
+
+def reference_subtype(items, description=""):
+    desc_lower = description.lower()
+    multi = sum(1 for k in kwc.MULTIFILAR_KEYWORDS if k in desc_lower)
+    uni = sum(1 for k in kwc.UNIPOLAR_KEYWORDS if k in desc_lower)
+    for item in items:
+        tag = str(item.get("tag", "")).lower(); d = str(item.get("descricao", "")).lower()
+        multi += sum(1 for k in kwc.MULTIFILAR_KEYWORDS if k in tag or k in d)
+        uni += sum(1 for k in kwc.UNIPOLAR_KEYWORDS if k in tag or k in d)
+    return "unipolar" if uni > multi else "multifilar"
+
+
+def reference_pole(text):
+    if not text:
+        return ""
+    text_lower = text.lower()
+    for pole_count, keywords in kwc.POLE_KEYWORDS:
+        for keyword in keywords:
+            if keyword in text_lower:
+                return pole_count
+    return ""
+
+
+def reference_types(text):
+    if not text:
+        return []
+    text_lower = text.lower()
+    found, spans = [], []
+    for eq_type, keywords in kwc.EQUIPMENT_TYPE_KEYWORDS:
+        for keyword in keywords:
+            pos = text_lower.find(keyword)
+            if pos >= 0:
+                end = pos + len(keyword)
+                if all(end <= s or pos >= e for s, e in spans):
+                    found.append(eq_type); spans.append((pos, end))
+                    break
+    if 'motor' not in found and 'protection-switch' not in found and 'motor-starter' not in found:
+        if 'motor' in text_lower:
+            pos = text_lower.find('motor')
+            if all(pos + 5 <= s or pos >= e for s, e in spans):
+                found.append('motor')
+    return found
+
+
+def test_hits_match_substring_scan():
+    """Every keyword found, at the str.find position"""
+    print("\n=== Testing classify_description ===")
+    rng = random.Random(0)
+    words = kwc.DESCRIPTION_MATCHER.words
+    for _ in range(3000):
+        text = random_text(rng).lower()
+        expected = {w: text.find(w) for w in words if w in text}
+        assert dict(classify_description(text)) == expected, text
+
+    nested = KeywordMatcher(["a", "ab", "abc", "bc", "c", "a.b"])
+    assert dict(nested.hits("xabcabc a.b")) == {"a": 1, "ab": 1, "abc": 1, "bc": 2, "c": 3, "a.b": 8}
+    assert dict(KeywordMatcher([]).hits("abc")) == {} and dict(nested.hits("")) == {}
+    print("✅ Hits identical to the substring scans")
+
+
+def test_helpers_match_reference():
+    """Heuristics return the same as the previous loops"""
+    print("\n=== Testing heuristics ===")
+    rng = random.Random(1)
+    tags = [""] + list(kwc.INSTRUMENT_TYPES) + list(kwc.EQUIPMENT_TYPES) + ["PSV-101", "tk-2", " LCV-7", "X-1", "valve", "N/A"]
+    for _ in range(3000):
+        tag = rng.choice(tags) + rng.choice(["", "-101", "A"])
+        text = random_text(rng)
+        assert estimate_symbol_size(tag, text) == reference_symbol_size(tag, text), (tag, text)
+        result = validate_symbol_type({"tag": tag}, text)
+        prefix, found = reference_validate(tag, text)
+        assert (result["tag_prefix"], result["found_keywords"]) == (prefix, found), (tag, text)
+        assert detect_pole_count(text) == reference_pole(text), text
+        assert extract_equipment_type_keywords(text) == reference_types(text), text
+
+    for _ in range(300):
+        items = [{"tag": rng.choice(["N/A", "PT-1", rng.choice(tags)]), "descricao": random_text(rng)}
+                 for _ in range(rng.randint(0, 12))]
+        assert assign_no_tag_identifiers(copy.deepcopy(items)) == reference_no_tag(copy.deepcopy(items))
+        description = random_text(rng)
+        assert detect_electrical_diagram_subtype(items, description) == reference_subtype(items, description)
+
+    # Tabelas compartilhadas não são alteradas pelos chamadores
+    result = validate_symbol_type({"tag": "PT-101"}, "transmissor de pressão")
+    result["expected_keywords"].append("x")
+    assert kwc.INSTRUMENT_TYPES["PT"][-1] == "pressão"
+    print("✅ Heuristics identical to the previous scans")
+
+
+def test_instrument_tag_markers():
+    """Case-sensitive substring test on the raw tag"""
+    print("\n=== Testing instrument tag markers ===")
+    for tag in ["FT-101", "ft-101", "XPSV", "P-101", "N/A", "TE1", "LIC", "", "PE"]:
+        expected = any(p in tag for p in kwc.INSTRUMENT_TAG_MARKERS)
+        assert kwc.is_instrument_tag(tag) == expected, tag
+    print("✅ Instrument tag markers unchanged")
+
+
+def test_memoized():
+    """Repeated descriptions hit the cache"""
+    print("\n=== Testing memo ===")
+    before = kwc.DESCRIPTION_MATCHER.stats()
+    for _ in range(10):
+        classify_description("bomba centrífuga trifásica com transmissor de pressão")
+    after = kwc.DESCRIPTION_MATCHER.stats()
+    assert after["cache_hits"] - before["cache_hits"] >= 9
+    print(f"✅ Memo: {after}")
+
+
+if __name__ == "__main__":
+    try:
+        test_hits_match_substring_scan()
+        test_helpers_match_reference()
+        test_instrument_tag_markers()
+        test_memoized()
+        print("\n✅ ALL KEYWORD CLASSIFIER TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
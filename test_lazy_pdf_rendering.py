@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Test lazy, on-demand page rendering in open_pdf_with_fallback.
+
+Validates that:
+1. Opening a PDF does not rasterize any page
+2. Each PDFPage keeps one cached fitz.DisplayList and renders only the requested clip
+3. Quadrants are rendered at the requested DPI from the vector source (no resampling)
+4. The pdf2image fallback renders one page at a time, keeping a single bitmap in memory
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import fitz
+from PIL import Image
+
+import backend as backend_module
+from backend import (
+    open_pdf_with_fallback, render_quadrant_from_page, page_quadrants_with_overlap,
+    PDFDocument, PDFPage, page_pixel_size
+)
+
+
+def create_pdf(num_pages: int = 3, width: float = 1190.0, height: float = 842.0) -> bytes:
+    """Create a simple multi-page PDF with PyMuPDF"""
+    doc = fitz.open()
+    for i in range(num_pages):
+        page = doc.new_page(width=width, height=height)
+        page.insert_text((100, 100), f"P-10{i} Bomba Centrífuga")
+        page.draw_rect(fitz.Rect(200, 200, 400, 400))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_open_is_lazy():
+    """Opening the document must not render or build display lists"""
+    print("\n=== Testing lazy open ===")
+    doc = open_pdf_with_fallback(create_pdf(5), "lazy.pdf")
+    assert doc.source == "pymupdf"
+    assert len(doc) == 5
+    assert all(page._displaylist is None for page in doc), "No page should be rendered on open"
+    assert isinstance(doc[0].rect, fitz.Rect), "PDFPage.rect should be a real fitz.Rect"
+    assert "P-100" in doc[0].get_text(), "Native text should be available from the PyMuPDF page"
+    doc.close()
+    print("✅ No page rasterized when opening the document")
+
+
+def test_clip_rendering_uses_requested_dpi():
+    """A clip is rendered at the requested DPI straight from the vector source"""
+    print("\n=== Testing clip rendering ===")
+    doc = open_pdf_with_fallback(create_pdf(1), "clip.pdf")
+    page = doc[0]
+
+    pix = page.get_pixmap(dpi=400, clip=fitz.Rect(0, 0, 72, 72))
+    assert (pix.width, pix.height) == (400, 400), f"Expected 400x400, got {pix.width}x{pix.height}"
+
+    dl = page._displaylist
+    assert dl is not None, "DisplayList should be cached after the first render"
+    page.get_pixmap(dpi=100)
+    assert page._displaylist is dl, "DisplayList should be reused across renders"
+
+    full = page.get_pixmap(dpi=72)
+    assert (full.width, full.height) == (1190, 842)
+    doc.close()
+    print("✅ Clip rendered at native 400 DPI and DisplayList reused")
+
+
+def test_quadrant_render_from_vector_source():
+    """Quadrants come from the vector source at the quadrant DPI"""
+    print("\n=== Testing quadrant rendering ===")
+    doc = open_pdf_with_fallback(create_pdf(1), "quad.pdf")
+    page = doc[0]
+    quads = page_quadrants_with_overlap(page, grid_x=3, grid_y=3, overlap_percent=0.5)
+    assert len(quads) == 13, f"Expected 9 + 4 quadrants, got {len(quads)}"
+
+    png = render_quadrant_from_page(page, quads[0][2], dpi=100)
+    img = Image.open(__import__('io').BytesIO(png))
+    assert img.width > 0 and img.height > 0
+    doc.close()
+    print("✅ Quadrant rendered from the open document")
+
+
+def test_fallback_renders_one_page_at_a_time():
+    """pdf2image fallback renders single pages lazily and keeps only the last one"""
+    print("\n=== Testing pdf2image lazy fallback ===")
+    calls = []
+
+    def fake_convert_from_bytes(data, first_page=None, last_page=None, fmt='png', size=None, **kwargs):
+        calls.append((first_page, last_page, size))
+        return [Image.new("RGB", size, "white")]
+
+    original = backend_module.convert_from_bytes
+    backend_module.convert_from_bytes = fake_convert_from_bytes
+    try:
+        doc = PDFDocument(source="pdf2image", data=b"%PDF-fake")
+        for i in range(3):
+            doc._pages.append(PDFPage(doc, i, 1189.0, 841.0, source="pdf2image"))
+
+        assert calls == [], "Nothing should be rendered before a pixmap is requested"
+
+        pix = doc[1].get_pixmap(dpi=100)
+        expected_size = page_pixel_size(doc[1], 100)
+        assert calls == [(2, 2, expected_size)]
+        assert pix.width == expected_size[0]
+
+        # Same page and DPI: served from the single-entry cache
+        doc[1].get_pixmap(dpi=100, clip=doc[1].rect * 0.5)
+        assert len(calls) == 1, "Same page/DPI should not be re-rendered"
+
+        # Another page replaces the cached bitmap
+        doc[2].get_pixmap(dpi=100)
+        assert len(calls) == 2
+        assert doc._fallback_render[0] == 2, "Only the last rendered page is kept"
+        doc.close()
+    finally:
+        backend_module.convert_from_bytes = original
+    print("✅ Fallback renders page by page with flat memory")
+
+
+if __name__ == "__main__":
+    try:
+        test_open_is_lazy()
+        test_clip_rendering_uses_requested_dpi()
+        test_quadrant_render_from_vector_source()
+        test_fallback_renders_one_page_at_a_time()
+        print("\n✅ ALL LAZY RENDERING TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Test the persistent LLM response cache.
+
+Validates that:
+1. Keys change with the model, prompt, image and generation params
+2. Entries survive reopening the SQLite file (persistent across restarts)
+3. Expired entries are ignored and the size budget evicts least recently used entries
+4. llm_call serves identical re-runs from the cache without calling the model
+5. Truncated responses are not cached
+"""
+import sys
+import os
+import asyncio
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from openai.types.chat import ChatCompletion
+
+import backend as backend_module
+from llm_cache import LLMResponseCache, cache_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_completion(content: str, model: str = "gpt-5", finish_reason: str = "stop") -> ChatCompletion:
+    return ChatCompletion.model_validate({
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": finish_reason,
+                     "message": {"role": "assistant", "content": content}}],
+    })
+
+
+def test_cache_key():
+    """Any change in model, prompt, image or params gives a different key"""
+    print("\n=== Testing cache keys ===")
+    base = cache_key("gpt-5", "prompt", "image/png;AAAA", {})
+    assert base == cache_key("gpt-5", "prompt", "image/png;AAAA", {})
+    variants = [
+        cache_key("gpt-4o", "prompt", "image/png;AAAA", {}),
+        cache_key("gpt-5", "prompt 2", "image/png;AAAA", {}),
+        cache_key("gpt-5", "prompt", "image/png;AAAB", {}),
+        cache_key("gpt-5", "prompt", "image/webp;AAAA", {}),
+        cache_key("gpt-5", "prompt", "image/png;AAAA", {"temperature": 0}),
+    ]
+    assert len(set(variants + [base])) == len(variants) + 1
+    print("✅ Keys are content-addressed")
+
+
+def test_persistence_ttl_and_lru():
+    """Entries persist on disk, expire after the TTL and respect the byte budget"""
+    print("\n=== Testing persistence and eviction ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.sqlite")
+        clock = FakeClock()
+        cache = LLMResponseCache(path, ttl_s=3600, max_bytes=10_000, enabled=True, clock=clock)
+        cache.put("a", "gpt-5", "x" * 4000)
+        assert cache.get("a") == "x" * 4000
+        assert cache.get("missing") is None
+        cache.close()
+
+        reopened = LLMResponseCache(path, ttl_s=3600, max_bytes=10_000, enabled=True, clock=clock)
+        assert reopened.get("a") == "x" * 4000, "Entries must survive a restart"
+
+        # LRU: "a" foi lido por último, então "b" é despejado primeiro
+        clock.now += 1
+        reopened.put("b", "gpt-5", "y" * 4000)
+        clock.now += 1
+        reopened.get("a")
+        clock.now += 1
+        reopened.put("c", "gpt-5", "z" * 4000)
+        assert reopened.get("b") is None and reopened.get("a") is not None and reopened.get("c") is not None
+        assert reopened.stats()["bytes_used"] <= 10_000
+
+        clock.now += 7200
+        assert reopened.get("a") is None, "Expired entries must be ignored"
+        stats = reopened.stats()
+        assert stats["hits"] >= 3 and stats["misses"] >= 2 and stats["evictions"] >= 2
+        reopened.close()
+    print("✅ Persistence, TTL and LRU eviction work")
+
+
+def test_llm_call_uses_cache():
+    """A second identical call is served from the cache; truncated answers are not stored"""
+    print("\n=== Testing llm_call cache ===")
+    calls = []
+
+    async def fake_chat_completion(image_tokens=0, **kwargs):
+        calls.append(kwargs["model"])
+        prompt = kwargs["messages"][0]["content"][0]["text"]
+        finish = "length" if "truncate" in prompt else "stop"
+        return make_completion('[{"tag": "P-101"}]', kwargs["model"], finish)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = LLMResponseCache(os.path.join(tmp, "cache.sqlite"), enabled=True)
+        saved = backend_module.chat_completion, backend_module.llm_cache
+        backend_module.chat_completion, backend_module.llm_cache = fake_chat_completion, cache
+        try:
+            model, first = asyncio.run(backend_module.llm_call("AAAA", "analyze"))
+            model2, second = asyncio.run(backend_module.llm_call("AAAA", "analyze"))
+            assert calls == ["gpt-5"], f"Second call should be a cache hit: {calls}"
+            assert model2 == model and second.choices[0].message.content == first.choices[0].message.content
+
+            asyncio.run(backend_module.llm_call("BBBB", "analyze"))
+            assert len(calls) == 2, "A different image must miss the cache"
+
+            asyncio.run(backend_module.llm_call("AAAA", "truncate me"))
+            asyncio.run(backend_module.llm_call("AAAA", "truncate me"))
+            assert len(calls) == 4, "Truncated responses must not be cached"
+            assert cache.stats()["hits"] == 1
+        finally:
+            backend_module.chat_completion, backend_module.llm_cache = saved
+            cache.close()
+    print("✅ Identical re-runs skip the model")
+
+
+if __name__ == "__main__":
+    try:
+        test_cache_key()
+        test_persistence_ttl_and_lru()
+        test_llm_call_uses_cache()
+        print("\n✅ ALL LLM CACHE TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Test the shared, pooled OpenAI client.
+
+Validates that:
+1. One client is built per process and reused by every caller
+2. The SSL fallback rebuilds the client at most once
+3. Async and sync callers run on the same dedicated I/O loop
+4. Cancelling an async caller cancels the request on the I/O loop
+"""
+import sys
+import os
+import asyncio
+import threading
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import llm_client
+
+
+def _with_fake_key(fn):
+    def wrapper():
+        saved = (llm_client.OPENAI_API_KEY, llm_client._client, llm_client._verify_ssl, llm_client._client_builds)
+        llm_client.OPENAI_API_KEY = "sk-test"
+        llm_client._client, llm_client._verify_ssl, llm_client._client_builds = None, True, 0
+        try:
+            fn()
+        finally:
+            (llm_client.OPENAI_API_KEY, llm_client._client,
+             llm_client._verify_ssl, llm_client._client_builds) = saved
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+
+
+@_with_fake_key
+def test_single_client_per_process():
+    """get_client() always returns the same pooled client"""
+    print("\n=== Testing shared client ===")
+    first = llm_client.get_client()
+    assert first is not None
+    assert all(llm_client.get_client() is first for _ in range(10))
+    info = llm_client.pool_info()
+    assert info["client_builds"] == 1
+    assert info["max_connections"] == llm_client.LLM_POOL_MAX_CONNECTIONS
+    assert info["http2"] in (True, False)
+    print("✅ One client built and reused")
+
+
+@_with_fake_key
+def test_ssl_fallback_builds_once():
+    """Repeated SSL failures switch the client only once"""
+    print("\n=== Testing SSL fallback ===")
+    secure = llm_client.get_client()
+    for _ in range(5):
+        llm_client.disable_ssl_verification()
+    insecure = llm_client.get_client()
+    assert insecure is not secure
+    assert llm_client.pool_info()["verify_ssl"] is False
+    assert llm_client.pool_info()["client_builds"] == 2
+    assert llm_client.is_ssl_error(Exception("[SSL: CERTIFICATE_VERIFY_FAILED]"))
+    assert not llm_client.is_ssl_error(Exception("rate limit"))
+    print("✅ SSL fallback built a single replacement client")
+
+
+def test_async_and_sync_callers_share_io_loop():
+    """run_llm and run_llm_sync both execute on the llm-io thread"""
+    print("\n=== Testing I/O loop ===")
+
+    async def where():
+        await asyncio.sleep(0)
+        return threading.current_thread().name
+
+    assert llm_client.run_llm_sync(where()) == "llm-io"
+
+    async def main():
+        names = await asyncio.gather(*[llm_client.run_llm(where()) for _ in range(20)])
+        return set(names)
+
+    assert asyncio.run(main()) == {"llm-io"}
+    print("✅ Sync and async calls share one loop")
+
+
+def test_cancellation_propagates():
+    """Cancelling the awaiting task cancels the coroutine on the I/O loop"""
+    print("\n=== Testing cancellation ===")
+    cancelled = threading.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def main():
+        task = asyncio.ensure_future(llm_client.run_llm(slow()))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(main())
+    assert cancelled.wait(2), "Request on the I/O loop should be cancelled"
+    print("✅ Cancellation reaches the I/O loop")
+
+
+if __name__ == "__main__":
+    try:
+        test_single_client_per_process()
+        test_ssl_fallback_builds_once()
+        test_async_and_sync_callers_share_io_loop()
+        test_cancellation_propagates()
+        print("\n✅ ALL LLM CLIENT TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
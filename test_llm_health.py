@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Test the per-model circuit breaker and the gpt-5 → fallback routing.
+
+Validates that:
+1. Consecutive failures or slow calls open the breaker
+2. After the cooldown a single probe is allowed; failure doubles the cooldown
+3. llm_call skips an open model and goes straight to the fallback
+4. Non-transient errors (e.g. 400) do not trip the breaker
+5. Backoff delays are jittered and capped
+6. Time spent waiting in the scheduler queue does not count as a slow call
+"""
+import sys
+import os
+import asyncio
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import backend as backend_module
+from llm_health import CircuitBreaker, BreakerRegistry, CLOSED, OPEN, HALF_OPEN
+from llm_scheduler import LLMScheduler, backoff_delay
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTimeout(Exception):
+    status_code = 504
+
+
+class FakeBadRequest(Exception):
+    status_code = 400
+
+
+def test_breaker_state_machine():
+    """closed → open → half_open → open (doubled cooldown) → half_open → closed"""
+    print("\n=== Testing breaker states ===")
+    clock = FakeClock()
+    b = CircuitBreaker("gpt-5", failure_threshold=3, slow_s=10, cooldown_s=60, max_cooldown_s=300, clock=clock)
+    for _ in range(2):
+        assert b.allow()
+        b.record_failure()
+    assert b.state == CLOSED
+    b.record_success(1.0)
+    assert b.consecutive_failures == 0, "A success resets the failure streak"
+
+    for _ in range(3):
+        b.record_failure()
+    assert b.state == OPEN and not b.allow()
+
+    clock.now = 61
+    assert b.allow() and b.state == HALF_OPEN
+    assert not b.allow(), "Only one probe at a time"
+    b.record_failure()
+    assert b.state == OPEN and b.cooldown_s == 120
+
+    clock.now = 61 + 121
+    assert b.allow()
+    b.record_success(2.0)
+    assert b.state == CLOSED and b.cooldown_s == 60
+
+    for _ in range(3):
+        b.record_success(30.0)  # acima de slow_s
+    assert b.state == OPEN and b.snapshot()["slow_calls"] == 3
+    print("✅ Breaker transitions are correct")
+
+
+def test_llm_call_routes_around_open_breaker():
+    """After repeated gpt-5 failures, calls go straight to the fallback"""
+    print("\n=== Testing routing ===")
+    calls = []
+
+    class _Msg:
+        content = "[]"
+
+    class _Choice:
+        message = _Msg()
+        finish_reason = "length"  # não entra no cache
+
+    class _Resp:
+        choices = [_Choice()]
+
+    async def fake_chat_completion(image_tokens=0, **kwargs):
+        calls.append(kwargs["model"])
+        if kwargs["model"] == "gpt-5":
+            raise FakeTimeout("gateway timeout")
+        return _Resp()
+
+    registry = BreakerRegistry(failure_threshold=2, cooldown_s=3600)
+    saved = (backend_module.chat_completion, backend_module.model_breakers, backend_module.llm_cache.enabled)
+    backend_module.chat_completion, backend_module.model_breakers = fake_chat_completion, registry
+    backend_module.llm_cache.enabled = False
+    try:
+        for _ in range(5):
+            model, _ = asyncio.run(backend_module.llm_call("AAAA", "prompt"))
+            assert model == backend_module.FALLBACK_MODEL
+    finally:
+        (backend_module.chat_completion, backend_module.model_breakers, backend_module.llm_cache.enabled) = saved
+
+    assert calls.count("gpt-5") == 2, f"gpt-5 should be skipped once the breaker opens: {calls}"
+    assert calls.count(backend_module.FALLBACK_MODEL) == 5
+    health = registry.snapshot()
+    assert health["gpt-5"]["state"] == OPEN and health["gpt-5"]["short_circuited"] == 3
+    assert health[backend_module.FALLBACK_MODEL]["healthy"]
+    print(f"✅ gpt-5 called {calls.count('gpt-5')}x, then routed to fallback")
+
+
+def test_non_transient_errors_do_not_trip():
+    """Bad requests are the caller's problem, not a sign of model health"""
+    print("\n=== Testing non-transient errors ===")
+
+    async def fake_chat_completion(image_tokens=0, **kwargs):
+        raise FakeBadRequest("invalid image")
+
+    registry = BreakerRegistry(failure_threshold=1)
+    saved = (backend_module.chat_completion, backend_module.model_breakers, backend_module.llm_cache.enabled)
+    backend_module.chat_completion, backend_module.model_breakers = fake_chat_completion, registry
+    backend_module.llm_cache.enabled = False
+    try:
+        for _ in range(3):
+            try:
+                asyncio.run(backend_module.llm_call("AAAA", "prompt"))
+            except FakeBadRequest:
+                pass
+    finally:
+        (backend_module.chat_completion, backend_module.model_breakers, backend_module.llm_cache.enabled) = saved
+    assert all(h["state"] == CLOSED for h in registry.snapshot().values())
+    print("✅ 400 errors leave the breaker closed")
+
+
+def test_queued_fast_calls_do_not_trip():
+    """Fast calls that wait for a scheduler slot are not slow calls"""
+    print("\n=== Testing queue wait vs breaker latency ===")
+
+    class _Resp:
+        choices = []
+
+    class _Completions:
+        async def create(self, **kwargs):
+            await asyncio.sleep(0.1)
+            return _Resp()
+
+    class _Client:
+        def __init__(self):
+            self.chat = self
+            self.completions = self
+            self.with_raw_response = _Completions()
+
+        def with_options(self, **kwargs):
+            return self
+
+    registry = BreakerRegistry(failure_threshold=1, slow_s=0.25, cooldown_s=3600)
+    saved = (backend_module.get_client, backend_module.scheduler, backend_module.model_breakers)
+    backend_module.get_client = lambda: _Client()
+    backend_module.scheduler = LLMScheduler(max_concurrency=1, limits={"gpt-5": {"rpm": 100000, "tpm": 1e9}})
+    backend_module.model_breakers = registry
+    try:
+        async def main():
+            # 5 chamadas de 0.1s em fila única: a última espera ~0.4s pelo slot
+            await asyncio.gather(*[
+                backend_module._timed_completion("gpt-5", {}, 0, [{"role": "user", "content": "x"}])
+                for _ in range(5)
+            ])
+
+        asyncio.run(main())
+    finally:
+        backend_module.get_client, backend_module.scheduler, backend_module.model_breakers = saved
+    health = registry.snapshot()["gpt-5"]
+    assert health["state"] == CLOSED and health["slow_calls"] == 0, health
+    print("✅ Queue wait ignored by the breaker")
+
+
+def test_backoff_jitter():
+    """Delays are random, grow exponentially and respect the cap"""
+    delays = [backoff_delay(3, base=1.0, cap=30.0) for _ in range(200)]
+    assert all(0.0 <= d <= 4.0 for d in delays)
+    assert len(set(round(d, 6) for d in delays)) > 100, "Delays should be jittered"
+    assert all(backoff_delay(20, base=1.0, cap=5.0) <= 5.0 for _ in range(50))
+
+
+if __name__ == "__main__":
+    try:
+        test_breaker_state_machine()
+        test_llm_call_routes_around_open_breaker()
+        test_non_transient_errors_do_not_trip()
+        test_queued_fast_calls_do_not_trip()
+        test_backoff_jitter()
+        print("\n✅ ALL MODEL HEALTH TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
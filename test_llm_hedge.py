@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Test hedged LLM requests.
+
+Validates that:
+1. No hedge is sent before the model has enough latency samples
+2. A call slower than the latency percentile triggers a duplicate request
+3. The first valid JSON wins and the slower request is cancelled
+4. An invalid (non-JSON) answer does not beat a valid one
+5. Hedges are capped per job
+6. The hedge delay only starts once the original request leaves the scheduler queue
+"""
+import sys
+import os
+import asyncio
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import backend as backend_module
+from llm_hedge import HedgePolicy, hedge_race
+from llm_health import BreakerRegistry
+
+
+def test_policy_threshold_and_budget():
+    """The hedge delay follows the online percentile; the per-job budget is enforced"""
+    print("\n=== Testing hedge policy ===")
+    policy = HedgePolicy(enabled=True, percentile=0.9, min_samples=10, min_delay_s=0.0, max_per_job=2)
+    assert policy.delay_for("gpt-5") is None
+    for i in range(1, 11):
+        policy.latency.record("gpt-5", float(i))
+    assert policy.delay_for("gpt-5") == 10.0
+
+    assert policy.try_acquire("job-a") and policy.try_acquire("job-a")
+    assert not policy.try_acquire("job-a"), "Budget must cap hedges per job"
+    assert policy.try_acquire("job-b")
+    stats = policy.stats()
+    assert stats["hedges"] == 3 and stats["budget_denied"] == 1
+    assert not HedgePolicy(enabled=False).delay_for("gpt-5")
+    print("✅ Threshold and budget work")
+
+
+def test_race_first_valid_wins_and_loser_cancelled():
+    """The hedge wins a slow primary, and the primary is cancelled"""
+    print("\n=== Testing hedge race ===")
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+            return "slow"
+        except asyncio.CancelledError:
+            cancelled.append("primary")
+            raise
+
+    async def fast():
+        await asyncio.sleep(0.01)
+        return "fast"
+
+    async def main():
+        return await hedge_race(slow, fast, 0.02, lambda: True, lambda r: True)
+
+    result, hedged = asyncio.run(main())
+    assert (result, hedged) == ("fast", True)
+    assert cancelled == ["primary"], "Loser must be cancelled"
+
+    # Resposta inválida do hedge não vence a original válida
+    async def primary_valid():
+        await asyncio.sleep(0.1)
+        return "valid"
+
+    async def hedge_invalid():
+        return "garbage"
+
+    result, hedged = asyncio.run(hedge_race(primary_valid, hedge_invalid, 0.01, lambda: True,
+                                            lambda r: r == "valid"))
+    assert (result, hedged) == ("valid", False)
+
+    # Sem orçamento: apenas a requisição original
+    calls = []
+
+    async def counted():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "x"
+
+    result, hedged = asyncio.run(hedge_race(counted, counted, 0.01, lambda: False, lambda r: True))
+    assert (result, hedged) == ("x", False) and len(calls) == 1
+    print("✅ First valid answer wins, loser cancelled")
+
+
+def test_no_hedge_while_queued():
+    """Time waiting for a scheduler slot does not count towards the hedge delay"""
+    print("\n=== Testing hedge delay after dispatch ===")
+    calls = []
+
+    async def main():
+        dispatched = asyncio.Event()
+
+        async def queued_primary():
+            calls.append("primary")
+            await asyncio.sleep(0.2)  # na fila do scheduler
+            dispatched.set()
+            await asyncio.sleep(0.05)
+            return "primary"
+
+        async def hedge():
+            calls.append("hedge")
+            return "hedge"
+
+        return await hedge_race(queued_primary, hedge, 0.1, lambda: True, lambda r: True, dispatched)
+
+    result, hedged = asyncio.run(main())
+    assert (result, hedged) == ("primary", False) and calls == ["primary"], calls
+
+    # Depois do despacho o prazo vale normalmente
+    calls.clear()
+
+    async def main_slow():
+        dispatched = asyncio.Event()
+
+        async def slow_primary():
+            calls.append("primary")
+            dispatched.set()
+            await asyncio.sleep(5)
+            return "primary"
+
+        async def hedge():
+            calls.append("hedge")
+            return "hedge"
+
+        return await hedge_race(slow_primary, hedge, 0.05, lambda: True, lambda r: True, dispatched)
+
+    result, hedged = asyncio.run(asyncio.wait_for(main_slow(), 1.0))
+    assert (result, hedged) == ("hedge", True) and calls == ["primary", "hedge"], calls
+    print("✅ Hedge delay counted from dispatch")
+
+
+def test_llm_call_hedges_slow_calls():
+    """llm_call duplicates a call slower than the model's p95 and returns the fast answer"""
+    print("\n=== Testing llm_call hedging ===")
+    calls = []
+
+    class _Msg:
+        def __init__(self, content):
+            self.content = content
+
+    class _Choice:
+        def __init__(self, content):
+            self.message = _Msg(content)
+            self.finish_reason = "length"  # não entra no cache
+
+    class _Resp:
+        def __init__(self, content):
+            self.choices = [_Choice(content)]
+
+    async def fake_chat_completion(image_tokens=0, on_dispatch=None, **kwargs):
+        calls.append(kwargs["model"])
+        if on_dispatch is not None:
+            on_dispatch()
+        # A primeira chamada de cada par "trava"; a cópia responde rápido
+        await asyncio.sleep(2.0 if len(calls) % 2 == 1 else 0.01)
+        return _Resp('[{"tag": "P-101"}]')
+
+    policy = HedgePolicy(enabled=True, percentile=0.95, min_samples=5, min_delay_s=0.0, max_per_job=1)
+    for _ in range(5):
+        policy.latency.record("gpt-5", 0.05)
+
+    saved = (backend_module.chat_completion, backend_module.hedge_policy,
+             backend_module.model_breakers, backend_module.llm_cache.enabled)
+    backend_module.chat_completion, backend_module.hedge_policy = fake_chat_completion, policy
+    backend_module.model_breakers = BreakerRegistry()
+    backend_module.llm_cache.enabled = False
+    try:
+        async def main():
+            backend_module.current_job_id.set("hedge-job")
+            return await backend_module.llm_call("AAAA", "prompt")
+
+        model_used, _ = asyncio.run(asyncio.wait_for(main(), 1.0))
+        assert model_used == "gpt-5"
+        assert calls == ["gpt-5", "gpt-5"], calls
+        assert policy.stats()["hedge_wins"] == 1
+
+        # Orçamento do job esgotado: a chamada lenta não é duplicada
+        calls.clear()
+        asyncio.run(main())
+        assert calls == ["gpt-5"]
+        assert policy.stats()["budget_denied"] == 1
+    finally:
+        (backend_module.chat_completion, backend_module.hedge_policy,
+         backend_module.model_breakers, backend_module.llm_cache.enabled) = saved
+    print("✅ Slow call hedged within budget")
+
+
+if __name__ == "__main__":
+    try:
+        test_policy_threshold_and_budget()
+        test_race_first_valid_wins_and_loser_cancelled()
+        test_no_hedge_while_queued()
+        test_llm_call_hedges_slow_calls()
+        print("\n✅ ALL HEDGING TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Test the global LLM request scheduler.
+
+Validates that:
+1. Token buckets refill over time and follow x-ratelimit-* headers
+2. Concurrency never exceeds the cap
+3. Queued requests are served round-robin across jobs
+4. 429 responses are retried after retry-after instead of failing the quadrant
+5. Queue depth and wait-time metrics are reported
+"""
+import sys
+import os
+import asyncio
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+from llm_scheduler import (
+    TokenBucket, ModelLimiter, LLMScheduler, parse_reset_seconds, estimate_request_tokens
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRaw:
+    def __init__(self, value, headers=None, total_tokens=None):
+        self.value = value
+        self.headers = headers or {}
+        self.total_tokens = total_tokens
+
+    def parse(self):
+        return self.value
+
+
+class FakeRateLimit(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after="0.05"):
+        super().__init__("429 Too Many Requests")
+        self.response = type("R", (), {"status_code": 429, "headers": {"retry-after": retry_after}})()
+
+
+def test_token_bucket_and_headers():
+    """Buckets refill at limit/60 per second and sync with provider headers"""
+    print("\n=== Testing token buckets ===")
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock)  # 1 per second
+    bucket.take(60)
+    assert bucket.delay_for(1) == 1.0
+    clock.now = 2.0
+    assert bucket.delay_for(2) == 0.0
+
+    assert parse_reset_seconds("6m0s") == 360.0
+    assert parse_reset_seconds("20ms") == 0.02
+    assert parse_reset_seconds("1.5") == 1.5
+
+    limiter = ModelLimiter(500, 100000, clock)
+    limiter.sync_headers({
+        "x-ratelimit-limit-requests": "30", "x-ratelimit-remaining-requests": "0",
+        "x-ratelimit-reset-requests": "2s", "x-ratelimit-limit-tokens": "90000",
+        "x-ratelimit-remaining-tokens": "1000", "x-ratelimit-reset-tokens": "10s",
+    })
+    assert limiter.requests.capacity == 30 and limiter.tokens.capacity == 90000
+    assert limiter.delay_for(500) >= 2.0, "Exhausted requests must wait for the reset"
+    print("✅ Buckets refill and follow headers")
+
+
+def test_concurrency_cap_and_fair_queue():
+    """At most N in flight; waiting jobs are served round-robin"""
+    print("\n=== Testing concurrency and fairness ===")
+    sched = LLMScheduler(max_concurrency=2, limits={"m": {"rpm": 100000, "tpm": 1e9}})
+    order = []
+    peak = {"now": 0, "max": 0}
+
+    async def run(job, i):
+        async def call():
+            peak["now"] += 1
+            peak["max"] = max(peak["max"], peak["now"])
+            await asyncio.sleep(0.01)
+            peak["now"] -= 1
+            order.append(job)
+            return FakeRaw(f"{job}-{i}")
+        return await sched.submit("m", call, 10, job_id=job)
+
+    async def main():
+        tasks = [run("A", i) for i in range(6)] + [run("B", i) for i in range(2)]
+        return await asyncio.gather(*tasks)
+
+    results = asyncio.run(main())
+    assert len(results) == 8 and results[0] == "A-0"
+    assert peak["max"] <= 2, f"Concurrency cap exceeded: {peak['max']}"
+    # B must not wait for all of A's queued requests
+    assert order.index("B") < 5, f"Job B starved: {order}"
+    stats = sched.stats()
+    assert stats["dispatched"] == 8 and stats["in_flight"] == 0 and stats["queue_depth"] == 0
+    assert stats["max_queue_depth"] == 6
+    assert stats["wait_ms"]["max"] > 0
+    print(f"✅ Peak concurrency {peak['max']}, order {''.join(order)}")
+
+
+def test_rate_limit_is_retried():
+    """A 429 blocks the model for retry-after and the request is retried"""
+    print("\n=== Testing 429 handling ===")
+    sched = LLMScheduler(max_concurrency=4, limits={"m": {"rpm": 100000, "tpm": 1e9}})
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise FakeRateLimit("0.02")
+        return FakeRaw("ok", headers={"x-ratelimit-remaining-requests": "99"})
+
+    result = asyncio.run(sched.submit("m", call, 10, job_id="job"))
+    assert result == "ok" and len(attempts) == 3
+    assert sched.stats()["rate_limited"] == 2
+    print("✅ 429 retried after retry-after")
+
+
+def test_async_parse_is_awaited():
+    """AsyncOpenAI raw responses have an async parse(); the parsed value is returned"""
+    class AsyncRaw(FakeRaw):
+        async def parse(self):
+            return self.value
+
+    async def call():
+        return AsyncRaw("parsed")
+
+    sched = LLMScheduler(max_concurrency=1, limits={"m": {"rpm": 100000, "tpm": 1e9}})
+    assert asyncio.run(sched.submit("m", call, 10, job_id="job")) == "parsed"
+
+
+def test_estimate_request_tokens():
+    """Text is estimated at ~4 chars/token plus image tokens and an output reserve"""
+    messages = [{"role": "user", "content": [{"type": "text", "text": "x" * 400}, {"type": "image_url"}]}]
+    assert estimate_request_tokens(messages, image_tokens=765, output_reserve=0) == 100 + 765
+
+
+if __name__ == "__main__":
+    try:
+        test_token_bucket_and_headers()
+        test_concurrency_cap_and_fair_queue()
+        test_rate_limit_is_retried()
+        test_async_parse_is_awaited()
+        test_estimate_request_tokens()
+        print("\n✅ ALL SCHEDULER TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
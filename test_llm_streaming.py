@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Test streamed LLM output for quadrants.
+
+Validates that:
+1. The incremental parser emits each array element as soon as it closes,
+   for any chunking, and agrees with ensure_json_list
+2. chat_completion_stream delivers items while the stream is running and
+   returns the reassembled completion
+3. Quadrant items are converted and matched before the model finishes,
+   with the same result as the non-streaming path
+4. An interrupted stream is retried without streaming
+"""
+import sys
+import os
+import json
+import time
+import random
+import asyncio
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import fitz
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+import backend as backend_module
+from json_stream import JsonArrayStreamParser
+from llm_health import BreakerRegistry
+
+ITEMS = [
+    {"tag": "P-101", "descricao": "Bomba Centrífuga", "x_mm": 10.0, "y_mm": 12.5},
+    {"tag": "FT-101", "descricao": "Transmissor de Vazão \"[A]\" {x}", "x_mm": 40.0, "y_mm": 20.0,
+     "from": "P-101", "nested": {"pts": [[1, 2], [3, 4]]}},
+    {"tag": "TV-10\\1", "descricao": "Válvula", "x_mm": 70.0, "y_mm": 30.0},
+]
+
+
+def feed_all(text, sizes):
+    parser = JsonArrayStreamParser()
+    out, i = [], 0
+    while i < len(text):
+        n = sizes()
+        out.extend(parser.feed(text[i:i + n]))
+        i += n
+    return out, parser
+
+
+def test_parser_any_chunking():
+    """Every chunking yields the same elements as a full parse"""
+    print("\n=== Testing incremental JSON parser ===")
+    texts = [
+        json.dumps(ITEMS, ensure_ascii=False),
+        "```json\n" + json.dumps(ITEMS, indent=2) + "\n```",
+        "Segue a lista:\n" + json.dumps({"equipments": ITEMS}) + "\nFim.",
+        "[]",
+    ]
+    rng = random.Random(7)
+    for text in texts:
+        expected = backend_module.ensure_json_list(text)
+        for sizes in (lambda: 1, lambda: 7, lambda: rng.randint(1, 40), lambda: 10 ** 6):
+            items, parser = feed_all(text, sizes)
+            assert items == expected, (text[:40], items)
+            assert parser.done
+    # Elemento inválido é ignorado, os demais continuam
+    items, parser = feed_all('[{"tag": "A"}, {"tag": B}, {"tag": "C"}]', lambda: 3)
+    assert [it["tag"] for it in items] == ["A", "C"] and parser.invalid == 1
+    print("✅ Parser agrees with ensure_json_list for all chunkings")
+
+
+def _chunk(content=None, finish_reason=None, usage=None):
+    choices = [] if content is None and finish_reason is None else [
+        {"index": 0, "delta": {"content": content}, "finish_reason": finish_reason}]
+    return ChatCompletionChunk.model_validate({
+        "id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 1, "model": "gpt-5",
+        "choices": choices, "usage": usage,
+    })
+
+
+class FakeStreamClient:
+    """Cliente com with_raw_response.create(stream=True) → stream de chunks com atraso"""
+
+    def __init__(self, text, delay_s=0.05, piece=9):
+        self.text, self.delay_s, self.piece = text, delay_s, piece
+        self.chat = self
+        self.completions = self
+        self.with_raw_response = self
+        self.kwargs = None
+
+    def with_options(self, **_):
+        return self
+
+    async def create(self, **kwargs):
+        self.kwargs = kwargs
+        client = self
+
+        class Raw:
+            headers = {}
+
+            async def parse(self):
+                async def gen():
+                    for i in range(0, len(client.text), client.piece):
+                        await asyncio.sleep(client.delay_s)
+                        yield _chunk(client.text[i:i + client.piece])
+                    yield _chunk("", "stop")
+                    yield _chunk(usage={"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15})
+                return gen()
+
+        return Raw()
+
+
+def test_chat_completion_stream_delivers_early():
+    """Items reach the caller while the stream is still open"""
+    print("\n=== Testing chat_completion_stream ===")
+    text = json.dumps(ITEMS)
+    client = FakeStreamClient(text)
+    saved = backend_module.get_client
+    backend_module.get_client = lambda: client
+    try:
+        async def main():
+            arrivals = []
+            resp = await backend_module.chat_completion_stream(
+                lambda item: arrivals.append((item["tag"], time.perf_counter())), 0,
+                model="gpt-5", messages=[{"role": "user", "content": "x"}])
+            return arrivals, resp, time.perf_counter()
+
+        arrivals, resp, finished = asyncio.run(main())
+    finally:
+        backend_module.get_client = saved
+
+    assert client.kwargs["stream"] is True
+    assert [tag for tag, _ in arrivals] == [it["tag"] for it in ITEMS]
+    assert finished - arrivals[0][1] > 0.2, "First item must arrive well before the stream ends"
+    assert isinstance(resp, ChatCompletion)
+    assert resp.choices[0].message.content == text and resp.choices[0].finish_reason == "stop"
+    assert resp.usage.total_tokens == 15
+    print(f"✅ First item {finished - arrivals[0][1]:.2f}s before the end of the stream")
+
+
+def _make_page():
+    doc = fitz.open()
+    page = doc.new_page(width=842, height=595)
+    page.draw_rect(fitz.Rect(50, 50, 300, 200), color=(0, 0, 0))
+    data = doc.tobytes()
+    doc.close()
+    return backend_module.open_pdf_safely(data, "stream.pdf")
+
+
+def _run_quadrant(fake_stream, fake_complete=None):
+    matched = []
+
+    def fake_match(tag, descricao, tipo="", diagram_type="pid", diagram_subtype=""):
+        time.sleep(0.05)
+        matched.append((tag, time.perf_counter()))
+        return {"SystemFullName": f"SYS/{tag}", "Confiança": 90}
+
+    saved = (backend_module.chat_completion_stream, backend_module.chat_completion, backend_module.match_system_fullname,
+             backend_module.model_breakers, backend_module.llm_cache.enabled)
+    backend_module.chat_completion_stream = fake_stream
+    if fake_complete is not None:
+        backend_module.chat_completion = fake_complete
+    backend_module.match_system_fullname = fake_match
+    backend_module.model_breakers = BreakerRegistry()
+    backend_module.llm_cache.enabled = False
+    doc = _make_page()
+    try:
+        page = doc[0]
+        rect = fitz.Rect(0, 0, page.rect.width / 2, page.rect.height / 2)
+        W_mm, H_mm = backend_module.points_to_mm(page.rect.width), backend_module.points_to_mm(page.rect.height)
+        items = asyncio.run(backend_module.process_quadrant_streaming(0, 0, rect, page, 1, W_mm, H_mm, 100, label="1-1"))
+        expected = [backend_module.build_pid_item(it, 1, W_mm, H_mm) for it in backend_module.annotate_quadrant_items(
+            json.loads(json.dumps(ITEMS)), backend_module.points_to_mm(rect.x0), backend_module.points_to_mm(rect.y0),
+            backend_module.points_to_mm(rect.width), backend_module.points_to_mm(rect.height))]
+    finally:
+        doc.close()
+        (backend_module.chat_completion_stream, backend_module.chat_completion, backend_module.match_system_fullname,
+         backend_module.model_breakers, backend_module.llm_cache.enabled) = saved
+    return items, expected, matched
+
+
+def _completion(text):
+    return ChatCompletion.model_validate({
+        "id": "x", "object": "chat.completion", "created": 1, "model": "gpt-5",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+    })
+
+
+def test_quadrant_matching_overlaps_generation():
+    """The matcher runs on early items while later ones are still being generated"""
+    print("\n=== Testing streamed quadrant ===")
+    state = {}
+
+    async def fake_stream(on_item, image_tokens=0, **kwargs):
+        for item in ITEMS:
+            await asyncio.sleep(0.2)
+            on_item(json.loads(json.dumps(item)))
+        state["end"] = time.perf_counter()
+        return _completion(json.dumps(ITEMS))
+
+    items, expected, matched = _run_quadrant(fake_stream)
+    assert items == expected, "Streaming must give the same items as the full parse"
+    assert items[0]["SystemFullName"] == "SYS/P-101"
+    assert matched[0][1] < state["end"], "First match must happen before the stream ends"
+    print(f"✅ First match {state['end'] - matched[0][1]:.2f}s before the stream ended")
+
+
+def test_interrupted_stream_is_retried():
+    """Partial items are dropped and the quadrant is redone with a full call"""
+    print("\n=== Testing interrupted stream ===")
+
+    async def fake_stream(on_item, image_tokens=0, **kwargs):
+        on_item(dict(ITEMS[0]))
+        raise backend_module.LLMStreamInterrupted(ConnectionError("reset"), 1)
+
+    async def fake_complete(image_tokens=0, **kwargs):
+        return _completion(json.dumps(ITEMS))
+
+    items, expected, _ = _run_quadrant(fake_stream, fake_complete)
+    assert items == expected
+    print("✅ Interrupted stream recovered with a full call")
+
+
+if __name__ == "__main__":
+    try:
+        test_parser_any_chunking()
+        test_chat_completion_stream_delivers_early()
+        test_quadrant_matching_overlaps_generation()
+        test_interrupted_stream_is_retried()
+        print("\n✅ ALL STREAMING TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
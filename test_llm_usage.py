@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Test per-job LLM usage accounting.
+
+Validates that:
+1. Usage entries are aggregated per job, page, model and kind, with cost from
+   prompt/cached/completion tokens (cache hits are free)
+2. finish() persists the job summary to SQLite and releases the in-memory entries
+3. chat_completion records tokens, page and scheduler retries for the current job
+"""
+import sys
+import os
+import asyncio
+import tempfile
+from types import SimpleNamespace
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import backend as backend_module
+import llm_scheduler
+from llm_usage import UsageLedger, price_for, current_page
+from llm_scheduler import current_job_id
+
+PRICING = {"gpt-5": {"input": 1.0, "cached_input": 0.1, "output": 10.0}}
+
+
+def _resp(prompt, completion, cached=0):
+    return SimpleNamespace(usage=SimpleNamespace(
+        prompt_tokens=prompt, completion_tokens=completion, total_tokens=prompt + completion,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=cached)))
+
+
+def test_summary_and_cost():
+    """Totals per page/model/kind; cached tokens billed at the cached price"""
+    print("\n=== Testing usage summary ===")
+    ledger = UsageLedger(path=":memory:", pricing=PRICING)
+    ledger.record("vision", "gpt-5", _resp(1_000_000, 100_000, cached=500_000), latency_s=2.0, job_id="j", page=1)
+    ledger.record("vision", "gpt-5-2025-08-07", _resp(1000, 100), latency_s=1.0, retries=2, job_id="j", page=2)
+    ledger.record("vision", "gpt-5", _resp(1000, 100), cache_hit=True, job_id="j", page=2)
+    ledger.record("description", "unknown-model", _resp(50, 50), latency_s=0.5, job_id="j")
+
+    summary = ledger.summary("j")
+    assert summary["calls"] == 3 and summary["cache_hits"] == 1 and summary["retries"] == 2
+    assert summary["prompt_tokens"] == 1_001_050 and summary["cached_tokens"] == 500_000
+    # 500k × 1.0 + 500k × 0.1 + 100k × 10 (por 1M) + chamada com data no nome do modelo
+    expected = 0.5 + 0.05 + 1.0 + (1000 * 1.0 + 100 * 10.0) / 1e6
+    assert abs(summary["cost_usd"] - expected) < 1e-6, summary["cost_usd"]
+    assert summary["by_page"]["2"]["calls"] == 1 and summary["by_page"]["2"]["cache_hits"] == 1
+    assert set(summary["by_kind"]) == {"vision", "description"}
+    assert ledger.page_summary(1, "j")["prompt_tokens"] == 1_000_000
+    assert ledger.summary("other")["calls"] == 0
+    assert price_for("gpt-5-2025-08-07", PRICING) == PRICING["gpt-5"]
+    assert price_for("gpt-50", PRICING) is None
+    print("✅ Usage aggregated per page, model and kind with cost")
+
+
+def test_finish_persists_summary():
+    """finish() stores the job in SQLite and drops its entries from memory"""
+    print("\n=== Testing usage persistence ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        ledger = UsageLedger(path=os.path.join(tmp, "usage.sqlite"), pricing=PRICING)
+        ledger.record("vision", "gpt-5", _resp(100, 10), job_id="job-1", page=1)
+        summary = ledger.finish(route="analyze", params={"dpi": 400, "grid": "3"}, job_id="job-1")
+        assert summary["total_tokens"] == 110
+        assert ledger.stats()["open_jobs"] == 0 and ledger.stats()["persisted"] == 1
+
+        history = ledger.history()
+        assert len(history) == 1 and history[0]["job_id"] == "job-1"
+        assert history[0]["params"] == {"dpi": 400, "grid": "3"}
+        assert history[0]["usage"]["by_page"]["1"]["total_tokens"] == 110
+        ledger.close()
+
+    disabled = UsageLedger(path="/nonexistent/dir/usage.sqlite", enabled=False)
+    disabled.record("vision", "gpt-5", _resp(1, 1), job_id="x")
+    assert disabled.finish(job_id="x")["calls"] == 1 and disabled.history() == []
+    print("✅ Job summary persisted")
+
+
+class FlakyClient:
+    """with_raw_response.create: primeira chamada 503, depois resposta com usage"""
+
+    def __init__(self):
+        self.chat = self
+        self.completions = self
+        self.with_raw_response = self
+        self.calls = 0
+
+    def with_options(self, **_):
+        return self
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            raise type("InternalServerError", (Exception,), {"status_code": 503})("upstream")
+
+        class Raw:
+            headers = {}
+
+            def parse(self):
+                return _resp(1200, 80, cached=1024)
+
+        return Raw()
+
+
+def test_chat_completion_records_usage():
+    """chat_completion attributes tokens and retries to the current job and page"""
+    print("\n=== Testing chat_completion usage recording ===")
+    ledger = UsageLedger(path=":memory:", enabled=False, pricing=PRICING)
+    client = FlakyClient()
+    saved = (backend_module.get_client, backend_module.usage_ledger, llm_scheduler.backoff_delay)
+    backend_module.get_client = lambda: client
+    backend_module.usage_ledger = ledger
+    llm_scheduler.backoff_delay = lambda attempt, *a, **k: 0.0
+    try:
+        async def main():
+            current_job_id.set("usage-job")
+            current_page.set(3)
+            return await backend_module.chat_completion(765, kind="vision", model="gpt-5",
+                                                        messages=[{"role": "user", "content": "x"}])
+
+        asyncio.run(main())
+    finally:
+        backend_module.get_client, backend_module.usage_ledger, llm_scheduler.backoff_delay = saved
+
+    (entry,) = ledger.entries("usage-job")
+    assert entry.kind == "vision" and entry.model == "gpt-5" and entry.page == 3
+    assert entry.retries == 1, entry.retries
+    assert (entry.prompt_tokens, entry.cached_tokens, entry.completion_tokens) == (1200, 1024, 80)
+    assert entry.image_tokens == 765 and entry.latency_s >= 0
+    assert ledger.summary("usage-job")["by_page"]["3"]["calls"] == 1
+    print("✅ Tokens, page and retries recorded")
+
+
+if __name__ == "__main__":
+    try:
+        test_summary_and_cost()
+        test_finish_persists_summary()
+        test_chat_completion_records_usage()
+        print("\n✅ ALL USAGE ACCOUNTING TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
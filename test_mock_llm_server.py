@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Test the local mock LLM server and record/replay cassettes.
+
+Validates that:
+1. Request keys ignore streaming flags and change with the body
+2. Synthesized answers are plausible (items within the prompt dimensions) and
+   deterministic for a given seed
+3. The OpenAI SDK works against the mock: chat (plain and streamed) and embeddings
+4. RecordingTransport records real traffic and the mock replays it byte-identical
+5. Injected errors are deterministic and retries can succeed
+"""
+import sys
+import os
+import json
+import random
+import asyncio
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import httpx
+from openai import AsyncOpenAI
+
+from llm_cassette import CassetteStore, RecordingTransport, request_key, completion_from_sse
+from mock_llm_server import MockConfig, MockLLM, create_app, synth_content
+
+PID_PROMPT = ("Analise o P&ID.\n\nDIMENSÕES DESTA IMAGEM (página completa):\n"
+              "- Dimensões da imagem: 841.0 mm (largura X) x 594.0 mm (altura Y)\n")
+
+
+def _client(app) -> AsyncOpenAI:
+    http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://mock")
+    return AsyncOpenAI(api_key="mock", base_url="http://mock/v1", http_client=http_client, max_retries=0)
+
+
+def _messages(text=PID_PROMPT):
+    return [{"role": "user", "content": [
+        {"type": "text", "text": text},
+        {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}},
+    ]}]
+
+
+def test_request_key():
+    """The key ignores stream/stream_options and depends on everything else"""
+    print("\n=== Testing request keys ===")
+    body = {"model": "gpt-5", "messages": _messages()}
+    key = request_key("/chat/completions", body)
+    assert key == request_key("/chat/completions", {**body, "stream": True, "stream_options": {"include_usage": True}})
+    assert key != request_key("/chat/completions", {**body, "model": "gpt-4o"})
+    assert key != request_key("/embeddings", body)
+    print("✅ Keys stable across streaming flags")
+
+
+def test_synth_content_is_plausible_and_deterministic():
+    """P&ID items stay inside the page; electrical tiles return equipments + connections"""
+    print("\n=== Testing synthesized content ===")
+    items = json.loads(synth_content(PID_PROMPT, random.Random(1)))
+    assert 3 <= len(items) <= 12
+    assert all(0 <= it["x_mm"] <= 841.0 and 0 <= it["y_mm"] <= 594.0 for it in items)
+    assert all(it["tag"] and it["descricao"] for it in items)
+    assert synth_content(PID_PROMPT, random.Random(1)) == synth_content(PID_PROMPT, random.Random(1))
+
+    tile = json.loads(synth_content("ELECTRICAL SCHEMATIC TILE. This tile is 512px x 256px.", random.Random(2)))
+    assert set(tile) == {"equipments", "connections", "unresolved_endpoints"}
+    assert all(e["bbox"]["x"] + e["bbox"]["w"] <= 512 for e in tile["equipments"])
+    assert not synth_content("Descreva o processo", random.Random(3)).startswith("[")
+    print("✅ Synthesized answers follow the prompt")
+
+
+def test_sdk_against_mock():
+    """Chat completions (plain and streamed) and embeddings through the OpenAI SDK"""
+    print("\n=== Testing SDK against the mock ===")
+    app = create_app(MockConfig(latency_ms=0, latency_sigma=0, seed=7))
+
+    async def main():
+        client = _client(app)
+        plain = await client.chat.completions.create(model="gpt-5", messages=_messages())
+        stream = await client.chat.completions.create(model="gpt-5", messages=_messages(), stream=True,
+                                                      stream_options={"include_usage": True})
+        parts, usage = [], None
+        async for chunk in stream:
+            usage = chunk.usage or usage
+            parts.extend(c.delta.content or "" for c in chunk.choices)
+        emb = await client.embeddings.create(model="text-embedding-3-small", input=["Bomba", "Bomba", "Tanque"])
+        return plain, "".join(parts), usage, emb
+
+    plain, streamed, usage, emb = asyncio.run(main())
+    content = plain.choices[0].message.content
+    assert isinstance(json.loads(content), list)
+    assert streamed == content, "Streamed and plain answers must match for the same request"
+    assert usage is not None and usage.prompt_tokens > 765 and plain.usage.completion_tokens > 0
+    vectors = [d.embedding for d in emb.data]
+    assert len(vectors) == 3 and len(vectors[0]) == 1536
+    assert vectors[0] == vectors[1] and vectors[0] != vectors[2]
+    assert app.state.mock.stats()["synthesized"] == 3
+    print("✅ SDK works against the mock server")
+
+
+def test_record_and_replay():
+    """Traffic recorded by RecordingTransport replays identically from the cassette"""
+    print("\n=== Testing record/replay ===")
+    upstream = create_app(MockConfig(latency_ms=0, latency_sigma=0, seed=11))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = CassetteStore(tmp)
+
+        async def record():
+            transport = RecordingTransport(httpx.ASGITransport(app=upstream), store)
+            client = AsyncOpenAI(api_key="mock", base_url="http://mock/v1", max_retries=0,
+                                 http_client=httpx.AsyncClient(transport=transport, base_url="http://mock"))
+            plain = await client.chat.completions.create(model="gpt-5", messages=_messages("Descreva o processo"))
+            stream = await client.chat.completions.create(model="gpt-5", messages=_messages(), stream=True)
+            parts = [c.choices[0].delta.content or "" async for c in stream if c.choices]
+            return plain.choices[0].message.content, "".join(parts)
+
+        recorded_plain, recorded_stream = asyncio.run(record())
+        assert len(store) == 2 and store.recorded == 2
+
+        # Replay estrito (outra seed: a síntese daria outro conteúdo)
+        replay = create_app(MockConfig(cassette_dir=tmp, mode="replay", replay_speed=0, seed=99))
+
+        async def play():
+            client = _client(replay)
+            # Gravado com stream=True, reproduzido sem streaming (e vice-versa)
+            a = await client.chat.completions.create(model="gpt-5", messages=_messages())
+            stream = await client.chat.completions.create(model="gpt-5", messages=_messages("Descreva o processo"),
+                                                          stream=True)
+            b = "".join([c.choices[0].delta.content or "" async for c in stream if c.choices])
+            try:
+                await client.chat.completions.create(model="gpt-4o", messages=_messages())
+                missed = False
+            except Exception as e:
+                missed = getattr(e, "status_code", None) == 404
+            return a.choices[0].message.content, b, missed
+
+        replay_stream, replay_plain, missed = asyncio.run(play())
+        assert replay_stream == recorded_stream and replay_plain == recorded_plain
+        assert missed, "Strict replay must fail on unrecorded requests"
+        assert replay.state.mock.stats()["replayed"] == 2
+
+    sse = 'data: {"id":"x","created":1,"model":"m","choices":[{"index":0,"delta":{"content":"ab"},"finish_reason":null}]}\n\ndata: [DONE]\n\n'
+    assert completion_from_sse(sse)["choices"][0]["message"]["content"] == "ab"
+    print("✅ Recorded traffic replays identically")
+
+
+def test_injected_errors_are_deterministic():
+    """Error injection depends only on seed, request and attempt"""
+    print("\n=== Testing injected errors ===")
+    body = {"model": "gpt-5", "messages": _messages()}
+
+    def outcomes(seed):
+        mock = MockLLM(MockConfig(latency_ms=0, error_rate=0.5, rate_limit_rate=0.2, seed=seed))
+        return [mock.handle("/chat/completions", body).status for _ in range(20)]
+
+    first = outcomes(5)
+    assert first == outcomes(5)
+    assert 200 in first and (500 in first or 429 in first)
+    reply = MockLLM(MockConfig(rate_limit_rate=1.0)).handle("/chat/completions", body)
+    assert reply.status == 429 and "retry-after" in reply.headers
+    print("✅ Errors deterministic per seed")
+
+
+if __name__ == "__main__":
+    try:
+        test_request_key()
+        test_synth_content_is_plausible_and_deterministic()
+        test_sdk_against_mock()
+        test_record_and_replay()
+        test_injected_errors_are_deterministic()
+        print("\n✅ ALL MOCK SERVER TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
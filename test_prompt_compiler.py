@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Test compiled prompt prefixes.
+
+Validates that:
+1. The extraction prompt starts with a byte-identical static prefix for every
+   call with the same (diagram_type, scope); per-call values only in the suffix
+2. Prefixes are compiled once and memoized
+3. Prefix token counts are measured and the P&ID prefixes are large enough for
+   provider prefix caching
+4. The generation prompt keeps the process description out of the prefix
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import backend as backend_module
+from backend import build_prompt, build_generation_prompt, compile_extraction_prompt, compile_generation_prompt
+from prompt_compiler import PromptRegistry, PROMPT_CACHE_MIN_TOKENS, count_tokens
+
+
+def test_static_prefix_is_shared():
+    """Quadrants with different sizes/labels share the same prefix"""
+    print("\n=== Testing static prefix ===")
+    for diagram_type in ("pid", "electrical"):
+        compiled = compile_extraction_prompt(diagram_type, "quadrant")
+        prompts = [
+            build_prompt(396.3, 280.3, "quadrant", (0, 0), "1-1", diagram_type),
+            build_prompt(400.1, 281.0, "quadrant", (396.3, 0), "1-2", diagram_type),
+            build_prompt(200.0, 150.0, "quadrant", (0, 280.3), "2-1", diagram_type),
+        ]
+        for prompt in prompts:
+            assert prompt.startswith(compiled.prefix)
+        for value in ("396.3", "400.1", "1-2", "2-1"):
+            assert value not in compiled.prefix, f"Per-call value {value} leaked into the prefix"
+        assert "QUADRANTE 1-2" in prompts[1] and "400.1 mm (largura X)" in prompts[1]
+
+    global_prefix = compile_extraction_prompt("pid", "global").prefix
+    prompt = build_prompt(841.0, 1189.0, "global", diagram_type="pid")
+    assert prompt.startswith(global_prefix)
+    assert "Y: 0.0 (topo da página) até 841.0 (base da página)" in prompt, "Landscape swap still applies"
+    assert "{height_mm}" not in prompt and "{{" not in prompt
+    print("✅ Prefix identical across calls; dimensions only in the suffix")
+
+
+def test_memoized_and_counted():
+    """One compile per key; token count reported in stats"""
+    print("\n=== Testing memoization ===")
+    a = compile_extraction_prompt("PID", "quadrant")
+    b = compile_extraction_prompt("pid", "quadrant")
+    assert a is b, "Same (diagram_type, scope) must return the memoized prefix"
+    assert a.prefix_tokens == count_tokens(a.prefix) > 0
+    for scope in ("global", "quadrant"):
+        assert compile_extraction_prompt("pid", scope).prefix_tokens >= PROMPT_CACHE_MIN_TOKENS
+
+    stats = backend_module.prompt_registry.stats()
+    entry = stats["prefixes"]["extraction/pid/quadrant"]
+    assert entry["tokens"] == a.prefix_tokens and entry["cacheable"]
+
+    registry = PromptRegistry()
+    builds, compiled_log = [], []
+    for _ in range(3):
+        registry.compile(("k",), lambda: builds.append(1) or "static text", compiled_log.append)
+    assert len(builds) == 1 and len(compiled_log) == 1
+    assert registry.stats()["hits"] == 2
+    print(f"✅ P&ID quadrant prefix: {a.prefix_tokens} tokens ({stats['token_counter']})")
+
+
+def test_generation_prefix():
+    """The process description and sheet size go after the static instructions"""
+    print("\n=== Testing generation prompt ===")
+    compiled = compile_generation_prompt("pid")
+    p1 = build_generation_prompt("processo de clinquerização", 1189.0, 841.0, "pid")
+    p2 = build_generation_prompt("tratamento de água", 841.0, 594.0, "pid")
+    assert p1.startswith(compiled.prefix) and p2.startswith(compiled.prefix)
+    assert "clinquerização" not in compiled.prefix and "1189.0" not in compiled.prefix
+    assert '"tratamento de água"' in p2 and "X: 0-841.0, Y: 0-594.0" in p2
+    electrical = build_generation_prompt("partida estrela-triângulo", diagram_type="electrical")
+    assert electrical.startswith(compile_generation_prompt("electrical").prefix)
+    assert "420.0 mm (width/X) x 297.0 mm" in electrical
+    print("✅ Generation prompt prefix is static")
+
+
+if __name__ == "__main__":
+    try:
+        test_static_prefix_is_shared()
+        test_memoized_and_counted()
+        test_generation_prefix()
+        print("\n✅ ALL PROMPT COMPILER TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Test the per-document raster cache (render pyramid).
+
+Validates that:
+1. Each (page, dpi, colorspace) level is rasterized once and matches a direct render
+2. Crops are zero-copy, read-only views of the memory-mapped level
+3. Levels are evicted in LRU order once the byte budget is exceeded
+4. Tiles, tile counting and quadrants all reuse the same cached level
+5. /analyze removes the cache directory when the pipeline raises
+"""
+import sys
+import os
+import asyncio
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import fitz
+import numpy as np
+
+import backend as backend_module
+from backend import (
+    open_pdf_with_fallback, PageRasterCache, pixmap_to_array,
+    calculate_tile_count, iter_tiles_with_overlap, render_quadrant_from_page,
+    page_quadrants
+)
+
+
+def create_pdf(rotation: int = 0) -> bytes:
+    doc = fitz.open()
+    page = doc.new_page(width=1190, height=842)
+    page.insert_text((100, 100), "CB-101 Disjuntor trifásico")
+    page.draw_rect(fitz.Rect(200, 200, 900, 700))
+    page.draw_line(fitz.Point(0, 421), fitz.Point(1190, 421))
+    if rotation:
+        page.set_rotation(rotation)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_level_matches_direct_render():
+    """Band-rendered levels are pixel-identical to a full-page render"""
+    print("\n=== Testing level rendering ===")
+    for rotation in (0, 90):
+        doc = open_pdf_with_fallback(create_pdf(rotation), "levels.pdf")
+        page = doc[0]
+        for dpi in (100, 217):
+            for colorspace, cs in (("gray", fitz.csGRAY), ("rgb", fitz.csRGB)):
+                level = page.get_raster(dpi, colorspace=colorspace)
+                pix = page._fitz_page.get_pixmap(dpi=dpi, colorspace=cs)
+                expected = pixmap_to_array(pix)
+                assert level.shape == expected.shape, f"{level.shape} != {expected.shape}"
+                assert np.array_equal(level, expected), f"Level {dpi}/{colorspace} differs (rotation={rotation})"
+        doc.close()
+    print("✅ Cached levels match direct renders")
+
+
+def test_crops_are_zero_copy_views():
+    """Crops share memory with the cached level and cannot be modified"""
+    print("\n=== Testing zero-copy crops ===")
+    doc = open_pdf_with_fallback(create_pdf(), "views.pdf")
+    page = doc[0]
+    level = page.get_raster(144)
+    crop = page.get_raster(144, clip=fitz.Rect(72, 72, 144, 144))
+    assert crop.shape == (144, 144), f"Expected 144x144 crop, got {crop.shape}"
+    assert np.shares_memory(crop, level), "Crop should be a view of the level"
+    assert not crop.flags.writeable, "Cached rasters must be read-only"
+
+    stats = doc.raster_cache.stats()
+    assert stats["misses"] == 1 and stats["hits"] == 1, f"Unexpected stats: {stats}"
+    doc.close()
+    print("✅ Crops are read-only views of one rasterization")
+
+
+def test_lru_eviction_by_byte_budget():
+    """Levels beyond the byte budget are evicted least-recently-used first"""
+    print("\n=== Testing LRU eviction ===")
+    doc = open_pdf_with_fallback(create_pdf(), "lru.pdf")
+    level_bytes = doc[0].get_raster(100).nbytes
+    cache = PageRasterCache(doc, max_bytes=int(level_bytes * 2.2))
+
+    cache.get(0, 100)
+    cache.get(0, 90)
+    cache.get(0, 100)  # touch 100 so 90 becomes the LRU entry
+    cache.get(0, 80)
+    keys = list(cache._levels.keys())
+    assert (0, 90, "gray") not in keys, f"90 DPI should have been evicted, have {keys}"
+    assert (0, 100, "gray") in keys
+    assert cache.evictions == 1
+    assert cache.bytes_used <= cache.max_bytes
+
+    cache_dir = cache._dir
+    cache.close()
+    assert not os.path.exists(cache_dir), "close() should remove the memmap files"
+    doc.close()
+    print("✅ LRU eviction respects the byte budget")
+
+
+def test_consumers_share_one_rasterization():
+    """Tile count, tile iteration and quadrants reuse the cached level"""
+    print("\n=== Testing shared rasterization ===")
+    doc = open_pdf_with_fallback(create_pdf(), "shared.pdf")
+    page = doc[0]
+
+    total = calculate_tile_count(page, tile_px=512, overlap_ratio=0.25, dpi=150)
+    tiles = list(iter_tiles_with_overlap(page, tile_px=512, overlap_ratio=0.25, dpi=150))
+    assert total == len(tiles), f"Expected {total} tiles, got {len(tiles)}"
+
+    for gx, gy, rect in page_quadrants(page, grid_x=2, grid_y=2):
+        render_quadrant_from_page(page, rect, dpi=150)
+
+    stats = doc.raster_cache.stats()
+    assert stats["misses"] == 1, f"Page should be rasterized once at 150 DPI, stats={stats}"
+    doc.close()
+    print(f"✅ One rasterization served {stats['hits']} requests")
+
+
+class FakeUpload:
+    def __init__(self, data: bytes, filename: str):
+        self._data = data
+        self.filename = filename
+
+    async def read(self) -> bytes:
+        return self._data
+
+
+def test_analyze_failure_removes_cache_dir():
+    """A pipeline error still closes the document and its memmap directory"""
+    print("\n=== Testing cleanup on pipeline failure ===")
+    opened = []
+    cache_dirs = []
+
+    def tracking_open(data, filename):
+        doc = open_pdf_with_fallback(data, filename)
+        opened.append(doc)
+        return doc
+
+    def render_then_fail(*args, **kwargs):
+        doc = opened[-1]
+        doc.raster_cache.get(0, 72)
+        cache_dirs.append(doc.raster_cache._dir)
+        raise RuntimeError("pipeline falhou")
+
+    async def failing_pipeline(doc, **kwargs):
+        render_then_fail()
+
+    async def fake_llm_call(image_b64, prompt, prefer_model=None, mime="image/png", image_tokens=0):
+        return "fake-model", None
+
+    saved = (backend_module.OPENAI_API_KEY, backend_module.open_pdf_safely, backend_module.llm_call,
+             backend_module.assemble_pid_page, backend_module.run_electrical_pipeline)
+    backend_module.OPENAI_API_KEY = "sk-test"
+    backend_module.open_pdf_safely = tracking_open
+    backend_module.llm_call = fake_llm_call
+    backend_module.assemble_pid_page = render_then_fail
+    backend_module.run_electrical_pipeline = failing_pipeline
+    try:
+        for diagram_type in ("pid", "electrical"):
+            try:
+                asyncio.run(backend_module.analyze_pdf(
+                    FakeUpload(create_pdf(), "failing.pdf"), dpi=100, grid="1", tol_mm=10.0, use_overlap=False,
+                    use_dynamic_tolerance=True, use_ocr_validation=False, use_geometric_refinement=False,
+                    diagram_type=diagram_type, skip_blank=False, ink_threshold=0.001
+                ))
+                raise AssertionError(f"{diagram_type}: analyze_pdf should propagate the pipeline error")
+            except RuntimeError:
+                pass
+    finally:
+        (backend_module.OPENAI_API_KEY, backend_module.open_pdf_safely, backend_module.llm_call,
+         backend_module.assemble_pid_page, backend_module.run_electrical_pipeline) = saved
+
+    assert len(cache_dirs) == 2 and all(cache_dirs)
+    for path in cache_dirs:
+        assert not os.path.exists(path), f"Cache directory left on disk: {path}"
+    assert all(doc._raster_cache is None for doc in opened)
+    print("✅ Cache directory removed after failure")
+
+
+if __name__ == "__main__":
+    try:
+        test_level_matches_direct_render()
+        test_crops_are_zero_copy_views()
+        test_lru_eviction_by_byte_budget()
+        test_consumers_share_one_rasterization()
+        test_analyze_failure_removes_cache_dir()
+        print("\n✅ ALL RASTER CACHE TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Test the analytic TilePlan used for tile iteration and progress reporting.
+
+Validates that:
+1. The plan is computed from page.rect and DPI alone (no rendering)
+2. Plan dimensions match the raster that tiles are cropped from
+3. The tile count matches the original overlap tiler formula
+4. Tile cores partition the covered page area (each pixel owned by one tile)
+"""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'backend'))
+
+import fitz
+import numpy as np
+
+from backend import (
+    open_pdf_with_fallback, plan_tiles, calculate_tile_count, iter_tiles_with_overlap,
+    page_pixel_size, TilePlan
+)
+
+
+def create_pdf(width: float = 1190.0, height: float = 842.0) -> bytes:
+    doc = fitz.open()
+    page = doc.new_page(width=width, height=height)
+    page.insert_text((100, 100), "K1 Contator")
+    page.draw_rect(fitz.Rect(300, 300, 700, 600))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def legacy_tile_count(W: int, H: int, tile_px: int, overlap_ratio: float) -> int:
+    step = int(tile_px*(1.0-overlap_ratio)) or tile_px
+    ys = range(0, max(1, H-tile_px+1), step)
+    xs = range(0, max(1, W-tile_px+1), step)
+    return len(ys) * len(xs)
+
+
+def test_plan_does_not_render():
+    """Planning and counting tiles must not rasterize the page"""
+    print("\n=== Testing analytic planning ===")
+    doc = open_pdf_with_fallback(create_pdf(), "plan.pdf")
+    page = doc[0]
+    plan = plan_tiles(page, tile_px=512, overlap_ratio=0.25, dpi=200)
+    calculate_tile_count(page, tile_px=512, overlap_ratio=0.25, dpi=200)
+
+    assert isinstance(plan, TilePlan)
+    assert page._displaylist is None, "Planning should not build a DisplayList"
+    assert doc.raster_cache.stats()["misses"] == 0, "Planning should not rasterize"
+    assert plan.overlap_px == 512 - plan.step
+    doc.close()
+    print(f"✅ {plan.count} tiles planned without rendering")
+
+
+def test_plan_matches_raster_and_legacy_count():
+    """Plan size equals the cached raster size and the count matches the old tiler"""
+    print("\n=== Testing plan dimensions and count ===")
+    doc = open_pdf_with_fallback(create_pdf(2384, 1684), "a1.pdf")
+    page = doc[0]
+    for dpi, tile_px, overlap in ((150, 512, 0.25), (217, 1024, 0.37), (300, 2048, 0.20)):
+        plan = plan_tiles(page, tile_px=tile_px, overlap_ratio=overlap, dpi=dpi)
+        assert (plan.page_w_px, plan.page_h_px) == page_pixel_size(page, dpi)
+        assert plan.count == legacy_tile_count(plan.page_w_px, plan.page_h_px, tile_px, overlap)
+
+    plan = plan_tiles(page, tile_px=512, overlap_ratio=0.25, dpi=150)
+    raster = page.get_raster(150)
+    assert raster.shape == (plan.page_h_px, plan.page_w_px), f"{raster.shape} vs plan"
+
+    tiles = list(iter_tiles_with_overlap(page, plan=plan))
+    assert len(tiles) == plan.count
+    for (img, (ox, oy), (W, H), dpi), t in zip(tiles, plan):
+        assert (ox, oy) == (t.x, t.y)
+        assert img.size == (t.w, t.h)
+        assert (W, H) == (plan.page_w_px, plan.page_h_px)
+    doc.close()
+    print("✅ Plan agrees with raster dimensions and legacy tile count")
+
+
+def test_cores_partition_coverage():
+    """Every covered pixel belongs to exactly one tile core"""
+    print("\n=== Testing core regions ===")
+    doc = open_pdf_with_fallback(create_pdf(), "cores.pdf")
+    plan = plan_tiles(doc[0], tile_px=400, overlap_ratio=0.3, dpi=150)
+
+    coverage = np.zeros((plan.page_h_px, plan.page_w_px), dtype=np.int32)
+    covered = np.zeros_like(coverage, dtype=bool)
+    for t in plan:
+        cx0, cy0, cx1, cy1 = t.core
+        assert t.x <= cx0 < cx1 <= t.x + t.w and t.y <= cy0 < cy1 <= t.y + t.h
+        coverage[cy0:cy1, cx0:cx1] += 1
+        covered[t.y:t.y+t.h, t.x:t.x+t.w] = True
+        for (rx0, ry0, rx1, ry1) in t.overlap_regions():
+            assert not t.in_core(rx0, ry0)
+
+    assert coverage.max() == 1, "Cores must not overlap"
+    assert np.array_equal(coverage == 1, covered), "Cores must cover every tiled pixel"
+
+    t = plan.tiles[len(plan) // 2]
+    cx0, cy0, cx1, cy1 = t.core
+    assert plan.owner(cx0, cy0) is t
+    doc.close()
+    print(f"✅ {plan.count} tile cores partition the tiled area")
+
+
+if __name__ == "__main__":
+    try:
+        test_plan_does_not_render()
+        test_plan_matches_raster_and_legacy_count()
+        test_cores_partition_coverage()
+        print("\n✅ ALL TILE PLAN TESTS PASSED")
+        sys.exit(0)
+    except AssertionError as e:
+        print(f"\n❌ TEST FAILED: {e}")
+        sys.exit(1)